@@ -7,6 +7,7 @@ RAG 模型结果对比分析脚本
 import os
 import json
 import argparse
+import sqlite3
 from pathlib import Path
 from collections import defaultdict
 import pandas as pd
@@ -116,16 +117,31 @@ def count_json_files(directory: Path) -> dict:
         }
     # 递归读取所有子目录
     json_files = list(directory.rglob("*.json"))
-    # 失败标记兼容两种：.error.txt 或 .failed.txt
+    # 失败标记兼容两种：.error.txt 或 .failed.txt（旧版运行）
     error_files = list(directory.rglob("*.error.txt")) + list(directory.rglob("*.failed.txt"))
+    failed_papers = {f.name.split(".")[0] for f in error_files}
+    # 新版运行的失败记录在任务表 outputs/jobs.sqlite3 中（provider 即目录名）
+    failed_papers |= load_failed_jobs(directory.parent.parent / "jobs.sqlite3", directory.name)
     
     return {
-        "total": len(json_files) + len(error_files),
+        "total": len(json_files) + len(failed_papers),
         "success": len(json_files),
-        "failed": len(error_files),
+        "failed": len(failed_papers),
         "files": [f.name for f in json_files]
     }
 
+def load_failed_jobs(db_path: Path, provider: str) -> set:
+    """读取任务表中 failed 状态的论文名（不含扩展名）；任务表不存在时返回空集"""
+    if not db_path.exists():
+        return set()
+    try:
+        with sqlite3.connect(f"file:{db_path}?mode=ro", uri=True) as conn:
+            rows = conn.execute("SELECT paper FROM jobs WHERE provider = ? AND status = 'failed'", (provider,)).fetchall()
+    except sqlite3.Error as e:
+        print(f"⚠️ 读取任务表失败 {db_path}: {e}")
+        return set()
+    return {Path(r[0]).stem for r in rows}
+
 def analyze_json_content(file_path: Path) -> dict:
     """分析单个JSON文件的内容"""
     try:
@@ -7,8 +7,11 @@
 - 递归扫描抽取结果文件（支持子目录，如 priority/general）
 - Prompt 路径改为：EXP_DIR/config/prompt/prompt_eva.txt（若缺失则回退旧路径）
 - 支持 CLI 参数：--outputs-dir 覆盖 outputs 根目录；--models 指定评估模型列表
+- 评估调用经共享限流与响应缓存；--no-cache 绕过缓存（重复评估时使用）
+- --batch：离线 batch 模式，所有待评估文件一个批次经 /v1/batches 提交，完成后按原流程写回结果与日志
 """
 import os
+import sys
 import json
 import time
 import argparse
@@ -25,6 +28,15 @@ from openai import OpenAI
 # ------------------------------
 PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent  # exp01_baseline 根目录
 
+# 共享限流与调用网关（仓库根目录 src/utils）
+REPO_SRC_DIR = PROJECT_ROOT.parent.parent / "src"
+if str(REPO_SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(REPO_SRC_DIR))
+from utils.rate_limiter import get_limiter, backoff_delay, is_rate_limit_error
+from utils.hedging import chat_completion_hedged
+from utils.batch_api import BatchAPIClient, batch_base_url, run_batch_job
+from utils.http_client import get_openai_client
+
 # 评估 Prompt，优先使用用户提供的新位置；若不存在则尝试旧位置
 EVAL_PROMPT_PRIMARY = PROJECT_ROOT / "config" / "prompt" / "prompt_eva.txt"
 EVAL_PROMPT_FALLBACK = PROJECT_ROOT / "configs" / "prompts" / "prompt_eva.txt"
@@ -34,7 +46,13 @@ PAPERS_DIR = PROJECT_ROOT / "data" / "raw" / "papers"
 
 # Gemini 评估配置
 EVAL_MODEL = "gemini-2.5-pro"
+EVAL_BASE_URL = "https://hiapi.online/v1"
+EVAL_SYSTEM_PROMPT = "你是 PHM 领域的知识抽取评估专家。只输出严格的 JSON，不添加任何解释。"
 PROVIDER_NAME = "gemini_evaluator"
+# 限流按实际调用的提供商计：与 Gemini 抽取共用同一 Key 时共享配额
+RATE_LIMIT_PROVIDER = "gemini"
+# 遇到限流（429）时的最大重试次数
+RATE_LIMIT_RETRIES = 3
 
 # ------------------------------
 # 工具函数
@@ -144,24 +162,13 @@ def init_client() -> OpenAI:
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
         raise ValueError("请设置 GEMINI_API_KEY 环境变量")
-    return OpenAI(api_key=api_key, base_url="https://hiapi.online/v1")
+    return get_openai_client("gemini", api_key, EVAL_BASE_URL)
 
 # ------------------------------
 # 评估函数
 # ------------------------------
-def evaluate_extraction(client: OpenAI, eval_prompt_template: str, extraction_data: dict, paper_name: str, model_name: str) -> dict:
-    """
-    使用 Gemini 评估单个抽取结果
-    
-    Args:
-        extraction_data: 抽取的实体和关系 JSON
-        paper_name: 论文名称
-        model_name: 抽取模型名称
-    
-    Returns:
-        评估后的 JSON (添加了 evaluation 字段)
-    """
-    # 构建评估 Prompt
+def build_eval_messages(eval_prompt_template: str, extraction_data: dict, paper_name: str, model_name: str) -> list:
+    """构建评估消息：评估 Prompt + 论文/模型信息 + 待评估的抽取 JSON"""
     extraction_json = json.dumps(extraction_data, ensure_ascii=False, indent=2)
     
     eval_prompt = eval_prompt_template + f"""
@@ -177,50 +184,107 @@ def evaluate_extraction(client: OpenAI, eval_prompt_template: str, extraction_da
 
 请严格按照要求输出评估后的 JSON,为每个实体和关系添加 `evaluation` 字段。
 """
+    return [
+        {"role": "system", "content": EVAL_SYSTEM_PROMPT},
+        {"role": "user", "content": eval_prompt}
+    ]
+
+def parse_eval_response(response) -> dict:
+    """解析并校验评估响应（同步调用或 batch 结果），返回 evaluated_data/raw_response/usage/cache_hit"""
+    content = response.choices[0].message.content
+    evaluated_data = parse_json_response(content)
+    # 兼容返回值为 list 的情况（常见为单元素包裹）
+    if isinstance(evaluated_data, list):
+        if len(evaluated_data) == 1 and isinstance(evaluated_data[0], dict):
+            evaluated_data = evaluated_data[0]
+        else:
+            raise ValueError(f"返回的 JSON 类型为数组且无法解包（长度={len(evaluated_data)}）。")
+    # 验证返回格式
+    if not isinstance(evaluated_data, dict) or ("entities" not in evaluated_data or "relations" not in evaluated_data):
+        raise ValueError(f"返回的 JSON 非对象或缺少必需字段（entities/relations）。实际类型={type(evaluated_data).__name__}")
+    
+    return {
+        "evaluated_data": evaluated_data,
+        "raw_response": content,
+        "usage": {
+            "prompt_tokens": response.usage.prompt_tokens,
+            "completion_tokens": response.usage.completion_tokens,
+            "total_tokens": response.usage.total_tokens
+        } if getattr(response, 'usage', None) else None,
+        "cache_hit": bool(getattr(response, 'from_cache', False))
+    }
+
+def evaluate_extraction(client: OpenAI, eval_prompt_template: str, extraction_data: dict, paper_name: str, model_name: str) -> dict:
+    """
+    使用 Gemini 评估单个抽取结果
     
-    # 调用 Gemini API
+    Args:
+        extraction_data: 抽取的实体和关系 JSON
+        paper_name: 论文名称
+        model_name: 抽取模型名称
+    
+    Returns:
+        评估后的 JSON (添加了 evaluation 字段)
+    """
+    messages = build_eval_messages(eval_prompt_template, extraction_data, paper_name, model_name)
+    
+    # 调用 Gemini API（经共享限流器；仅对 429 按 Retry-After 重试）
+    limiter = get_limiter(RATE_LIMIT_PROVIDER, getattr(client, "api_key", None))
     try:
-        response = client.chat.completions.create(
-            model=EVAL_MODEL,
-            messages=[
-                {"role": "system", "content": "你是 PHM 领域的知识抽取评估专家。只输出严格的 JSON，不添加任何解释。"},
-                {"role": "user", "content": eval_prompt}
-            ],
-            temperature=0,
-            response_format={"type": "json_object"}
-        )
-        
-        content = response.choices[0].message.content
-        evaluated_data = parse_json_response(content)
-        # 兼容返回值为 list 的情况（常见为单元素包裹）
-        if isinstance(evaluated_data, list):
-            if len(evaluated_data) == 1 and isinstance(evaluated_data[0], dict):
-                evaluated_data = evaluated_data[0]
-            else:
-                raise ValueError(f"返回的 JSON 类型为数组且无法解包（长度={len(evaluated_data)}）。")
-        # 验证返回格式
-        if not isinstance(evaluated_data, dict) or ("entities" not in evaluated_data or "relations" not in evaluated_data):
-            raise ValueError(f"返回的 JSON 非对象或缺少必需字段（entities/relations）。实际类型={type(evaluated_data).__name__}")
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            try:
+                response = chat_completion_hedged(
+                    client, limiter,
+                    model=EVAL_MODEL,
+                    messages=messages,
+                    temperature=0,
+                    response_format={"type": "json_object"}
+                )
+                break
+            except Exception as e_call:
+                if not is_rate_limit_error(e_call) or attempt == RATE_LIMIT_RETRIES:
+                    raise
+                time.sleep(backoff_delay(attempt, e_call))
         
-        return {
-            "evaluated_data": evaluated_data,
-            "raw_response": content,
-            "usage": {
-                "prompt_tokens": response.usage.prompt_tokens,
-                "completion_tokens": response.usage.completion_tokens,
-                "total_tokens": response.usage.total_tokens
-            } if hasattr(response, 'usage') else None
-        }
+        return parse_eval_response(response)
         
     except Exception as e:
         print(f"❌ 评估失败: {e}")
         raise
 
+def batch_custom_id(model_name: str, extraction_dir: Path, json_file: Path) -> str:
+    """batch 请求的 custom_id：模型名 + 抽取结果相对路径"""
+    return f"{model_name}/{json_file.relative_to(extraction_dir).as_posix()}"
+
+def collect_batch_requests(eval_prompt_template: str, model_name: str, extraction_dir: Path, eval_output_root: Path, overwrite: bool = False) -> List[Tuple[str, dict]]:
+    """收集一个模型待评估文件的 batch 请求（已有结果或抽取 JSON 不规范的文件不提交，由逐篇流程记录）"""
+    model_eval_dir = eval_output_root / model_name.lower()
+    requests = []
+    for json_file in sorted(extraction_dir.rglob("*.json")):
+        paper_name = json_file.stem
+        if (model_eval_dir / f"{paper_name}_evaluated.json").exists() and not overwrite:
+            continue
+        try:
+            with open(json_file, 'r', encoding='utf-8') as f:
+                extraction_data = normalize_extraction_data(json.load(f))
+        except Exception:
+            continue
+        requests.append((batch_custom_id(model_name, extraction_dir, json_file), {
+            "model": EVAL_MODEL,
+            "messages": build_eval_messages(eval_prompt_template, extraction_data, paper_name, model_name),
+            "temperature": 0,
+            "response_format": {"type": "json_object"},
+        }))
+    return requests
+
 # ------------------------------
 # 批量评估
 # ------------------------------
-def evaluate_model_results(client: OpenAI, eval_prompt_template: str, model_name: str, extraction_dir: Path, eval_output_root: Path, eval_log_dir: Path, overwrite: bool = False):
-    """评估单个模型的所有抽取结果"""
+def evaluate_model_results(client: OpenAI, eval_prompt_template: str, model_name: str, extraction_dir: Path, eval_output_root: Path, eval_log_dir: Path, overwrite: bool = False, batch_responses: Optional[Dict[str, object]] = None):
+    """评估单个模型的所有抽取结果
+
+    batch_responses 非空时（--batch）不再逐篇调用 API，直接解析 batch 结果（{custom_id: 响应或异常}）
+    """
     
     print(f"\n{'='*80}")
     print(f"🔍 评估 {model_name} 模型的抽取结果")
@@ -323,7 +387,15 @@ def evaluate_model_results(client: OpenAI, eval_prompt_template: str, model_name
             tqdm.write(f"   📝 评估: {paper_name}")
             start_time = time.time()
             
-            eval_result = evaluate_extraction(client, eval_prompt_template, extraction_data, paper_name, model_name)
+            if batch_responses is not None:
+                response = batch_responses.get(batch_custom_id(model_name, extraction_dir, json_file))
+                if response is None:
+                    raise ValueError("batch 结果中缺少该文件")
+                if isinstance(response, Exception):
+                    raise response
+                eval_result = parse_eval_response(response)
+            else:
+                eval_result = evaluate_extraction(client, eval_prompt_template, extraction_data, paper_name, model_name)
             
             eval_time = time.time() - start_time
             
@@ -363,6 +435,8 @@ def evaluate_model_results(client: OpenAI, eval_prompt_template: str, model_name
                     "uncertain": len(evaluated.get('relations', [])) - relations_correct - relations_incorrect
                 },
                 "usage": eval_result.get('usage'),
+                "cache_hit": eval_result.get('cache_hit', False),
+                "batch": batch_responses is not None,
                 "output_file": str(eval_output_file)
             }
             eval_log.append(log_entry)
@@ -372,9 +446,6 @@ def evaluate_model_results(client: OpenAI, eval_prompt_template: str, model_name
             
             success_count += 1
             
-            # 避免 API 限流
-            time.sleep(1)
-            
         except Exception as e:
             tqdm.write(f"   ❌ 失败: {e}")
             
@@ -464,8 +535,21 @@ def main():
         action="store_true",
         help="如已存在评估结果，是否强制覆盖重评（默认跳过以支持断点续跑）"
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="绕过 LLM 响应缓存（等价于 LLM_CACHE_BYPASS=1），用于需要重复真实调用的评估"
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="离线 batch 模式：所有待评估文件一次提交（BATCH_BASE_URL 可覆盖 batch 端点），轮询完成后写回结果"
+    )
     args = parser.parse_args()
 
+    if args.no_cache:
+        os.environ["LLM_CACHE_BYPASS"] = "1"
+
     outputs_root = Path(args.outputs_dir).resolve()
     extractions_root = outputs_root / "extractions"
     eval_output_root = outputs_root / "evaluations"
@@ -492,6 +576,23 @@ def main():
     models = [m.strip() for m in args.models.split(',') if m.strip()]
     all_results = []
 
+    # 离线 batch 模式：先收集所有模型的待评估请求，一个批次提交
+    batch_responses = None
+    if args.batch:
+        batch_requests = []
+        for model_name in models:
+            model_dir = detect_model_dir(model_name, extractions_root)
+            if model_dir is not None:
+                batch_requests.extend(collect_batch_requests(eval_prompt_template, model_name, model_dir, eval_output_root, args.overwrite))
+        print(f"📦 离线 batch 模式：共 {len(batch_requests)} 个文件待评估")
+        batch_responses = {}
+        if batch_requests:
+            batch_client = BatchAPIClient(batch_base_url(EVAL_BASE_URL), client.api_key)
+            batch_responses = run_batch_job(
+                batch_client, batch_requests, str(eval_log_dir / "batch"),
+                name="evaluation", metadata={"task": "evaluation", "eval_model": EVAL_MODEL},
+            )
+
     for model_name in models:
         model_dir = detect_model_dir(model_name, extractions_root)
         if model_dir is None:
@@ -506,6 +607,7 @@ def main():
             eval_output_root=eval_output_root,
             eval_log_dir=eval_log_dir,
             overwrite=args.overwrite,
+            batch_responses=batch_responses,
         )
         all_results.append(result)
 
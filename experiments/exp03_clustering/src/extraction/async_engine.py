@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+异步并发抽取引擎
+为 exact_deepseek / exact_gemini / exact_kimi 提供统一的并发调度：
+- 基于 AsyncOpenAI，每个提供商可配置同时在途的请求数
+- 支持提前中止（如余额不足 402）：已在途的请求照常完成，但不再派发新论文
+- 进度条按完成顺序刷新（tqdm 优先，缺失则用简易控制台进度）
+"""
+import os
+import sys
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional
+
+# ------------------------------
+# 仓库级共享工具（<仓库根>/src/utils：限流、调用网关等）
+# ------------------------------
+REPO_SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", "src"))
+if REPO_SRC_DIR not in sys.path:
+    sys.path.insert(0, REPO_SRC_DIR)
+
+# ------------------------------
+# 进度条（tqdm 优先，缺失则用简易控制台进度）
+# ------------------------------
+try:
+    from tqdm.auto import tqdm  # type: ignore
+    HAVE_TQDM = True
+except Exception:
+    tqdm = None  # type: ignore
+    HAVE_TQDM = False
+
+# 默认每个提供商同时在途的请求数
+DEFAULT_CONCURRENCY = 4
+
+
+def resolve_concurrency(provider_name: str, default: int = DEFAULT_CONCURRENCY) -> int:
+    """解析并发数：<PROVIDER>_CONCURRENCY 优先，其次 EXTRACT_CONCURRENCY，最后取默认值。"""
+    for var in (f"{provider_name.upper()}_CONCURRENCY", "EXTRACT_CONCURRENCY"):
+        raw = os.getenv(var, "").strip()
+        if not raw:
+            continue
+        try:
+            return max(1, int(raw))
+        except ValueError:
+            print(f"⚠️  {var}={raw} 不是有效整数，已忽略")
+    return default
+
+
+class _SimpleProgress:
+    """tqdm 缺失时的简易进度（仅实现脚本中用到的 update/set_postfix/close）"""
+
+    def __init__(self, total: int, desc: str):
+        self.total = total
+        self.desc = desc
+        self.n = 0
+        self._step = max(1, total // 100)
+        self.postfix = ""
+
+    def update(self, n: int = 1):
+        self.n += n
+        if (self.n % self._step == 0) or (self.n >= self.total):
+            pct = int(self.n * 100 / self.total) if self.total else 100
+            postfix = f" [{self.postfix}]" if self.postfix else ""
+            print(f"\r{self.desc}: {self.n}/{self.total} ({pct}%){postfix}", end="", flush=True)
+
+    def set_postfix(self, **kwargs):
+        # 仅保存，随下一次进度输出一起打印（如 live= 实时指标摘要）
+        self.postfix = ", ".join(f"{k}={v}" for k, v in kwargs.items())
+
+    def close(self):
+        print()
+
+
+def make_progress(total: int, desc: str):
+    """创建进度条对象（tqdm 或简易进度）"""
+    if HAVE_TQDM:
+        return tqdm(total=total, desc=desc, unit="篇")
+    return _SimpleProgress(total, desc)
+
+
+def log_line(msg: str, progress_bar=None):
+    """输出一行日志；存在 tqdm 进度条时使用 tqdm.write 避免打乱进度条"""
+    if HAVE_TQDM and progress_bar is not None:
+        tqdm.write(msg)
+    else:
+        print(msg)
+
+
+async def run_concurrently(
+    items: List[str],
+    worker: Callable[[Any, str, Any], Awaitable[None]],
+    client: Any,
+    concurrency: int,
+    desc: str,
+    should_abort: Optional[Callable[[], bool]] = None,
+) -> int:
+    """
+    以受限并发运行 worker(client, item, progress_bar)
+
+    Args:
+        items: 待处理的论文文件名列表（顺序即派发顺序）
+        worker: 单篇处理协程
+        client: 传给 worker 的异步客户端
+        concurrency: 同时在途的最大请求数
+        desc: 进度条描述
+        should_abort: 返回 True 时停止派发新任务（在途任务不受影响）
+
+    Returns:
+        实际派发的论文数
+    """
+    if not items:
+        return 0
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    progress_bar = make_progress(len(items), desc)
+    dispatched = 0
+
+    async def _run_one(item: str):
+        nonlocal dispatched
+        async with semaphore:
+            if should_abort is not None and should_abort():
+                return
+            dispatched += 1
+            try:
+                await worker(client, item, progress_bar)
+            finally:
+                progress_bar.update(1)
+
+    try:
+        await asyncio.gather(*(_run_one(it) for it in items))
+    finally:
+        progress_bar.close()
+    return dispatched
+
+
+def run_batch(
+    items: List[str],
+    worker: Callable[[Any, str, Any], Awaitable[None]],
+    client_factory: Callable[[], Any],
+    concurrency: int,
+    desc: str,
+    should_abort: Optional[Callable[[], bool]] = None,
+) -> int:
+    """
+    在独立事件循环中运行一个批次
+
+    每个批次都新建并关闭异步客户端，使连接池与事件循环的生命周期一致；
+    批次之间的交互式询问（input）因此可以在事件循环之外进行。
+    """
+    async def _main() -> int:
+        client = client_factory()
+        try:
+            return await run_concurrently(items, worker, client, concurrency, desc, should_abort)
+        finally:
+            close = getattr(client, "close", None)
+            if close is not None:
+                await close()
+
+    return asyncio.run(_main())
@@ -3,14 +3,31 @@
 import os
 import json
 import time
+import asyncio
 from datetime import datetime, timezone
 from typing import Optional, Dict, Any
 
-# 使用 OpenAI 官方 SDK 直连 DeepSeek
-from openai import OpenAI
+# 使用 OpenAI 官方 SDK（异步客户端）直连 DeepSeek
+from openai import AsyncOpenAI
 
 # 导入日志管理器
 from log_manager import ExtractionLogger, count_entities_and_relations
+# 导入异步并发引擎
+from async_engine import log_line, resolve_concurrency, run_batch
+# 共享限流与调用网关（async_engine 已将仓库 src 加入 sys.path）
+from utils.rate_limiter import get_limiter, backoff_delay
+from utils.llm_gateway import achat_completion, achat_completion_stream
+from utils.stream_json import IncrementalExtractionParser, build_continuation_prompt, merge_extractions
+from utils.paper_chunker import DEFAULT_WINDOW_TOKENS, chunk_paper, format_window, strip_embedded_paper
+from utils.token_estimator import MaxTokensPlanner, OutputTokenPredictor, format_projection, summarize_plans, tokenizer_name
+from utils.batch_api import BatchAPIClient, batch_base_url, run_batch_job
+from utils.job_store import JobStore, format_counts, prompt_hash
+from utils.json_salvage import describe_salvage, salvage_extraction
+from utils.metrics import get_registry, record_retry, summary_line
+from utils.circuit_breaker import get_breaker, resolve_fallback
+from utils.prompt_layout import assemble_cached_prompt, cached_prompt_tokens
+from utils.schema_selector import build_schema_selector, format_schema_report
+from utils.http_client import new_async_openai_client
 
 # ------------------------------
 # 路径配置
@@ -84,6 +101,9 @@ os.makedirs(LOG_DIR, exist_ok=True)
 # 初始化日志记录器
 logger = ExtractionLogger(LOG_DIR, "deepseek")
 
+# 任务表：断点续跑、失败原因与逐篇用量（三个提供商共用 outputs/jobs.sqlite3，EXTRACT_JOB_DB 可覆盖）
+JOBS = JobStore(os.getenv("EXTRACT_JOB_DB", "").strip() or os.path.join(OUTPUTS_DIR, "jobs.sqlite3"))
+
 MODEL_NAME = "deepseek-chat"  # 可按需改为 deepseek-reasoner
 PROVIDER_NAME = "deepseek"
 
@@ -95,33 +115,51 @@ MAX_TOKENS_BASE = int(os.getenv("DEEPSEEK_MAX_TOKENS_BASE", "2048"))
 MAX_TOKENS_CAP = int(os.getenv("DEEPSEEK_MAX_TOKENS_CAP", "8192"))
 DEFAULT_TEMPERATURE = float(os.getenv("DEEPSEEK_TEMPERATURE", "0"))
 
+# 流式模式（EXTRACT_STREAM=1）：边接收边解析 entities/relations，记录首 token 延迟；
+# 输出被长度截断时保留已解析元素并发起续写请求，而不是加倍 max_tokens 整篇重来
+# - EXTRACT_STREAM_MAX_CONTINUATIONS: 单篇最多续写次数（默认 3）
+STREAM_MODE = os.getenv("EXTRACT_STREAM", "0").strip().lower() in {"1", "true", "yes", "y"}
+STREAM_MAX_CONTINUATIONS = int(os.getenv("EXTRACT_STREAM_MAX_CONTINUATIONS", "3"))
+
+# 分段模式（EXTRACT_CHUNKED=1）：超过窗口上限的长论文按章节切成多个窗口并发抽取，
+# 再按实体/关系去重键合并；单篇耗时取决于最慢的窗口而非整篇
+# - EXTRACT_CHUNK_TOKENS: 每个窗口的论文 token 上限（估算，默认 6000）
+CHUNK_MODE = os.getenv("EXTRACT_CHUNKED", "0").strip().lower() in {"1", "true", "yes", "y"}
+CHUNK_TOKENS = int(os.getenv("EXTRACT_CHUNK_TOKENS", str(DEFAULT_WINDOW_TOKENS)))
+
+# max_tokens 规划（默认开启）：提交前用本地分词器统计提示词 token，按论文长度 × 千字密度预测输出，
+# 直接选定 max_tokens（截断时再翻倍，至多 DEEPSEEK_MAX_TOKENS_CAP）；超出上下文窗口的提示词直接拒绝
+# - EXTRACT_PLAN_MAX_TOKENS=0: 恢复从 DEEPSEEK_MAX_TOKENS_BASE 起逐次翻倍的旧策略
+# - EXTRACT_PLAN_ONLY=1: 只输出整次运行的预计 token，不提交请求
+PLAN_MAX_TOKENS = os.getenv("EXTRACT_PLAN_MAX_TOKENS", "1").strip().lower() in {"1", "true", "yes", "y"}
+PLAN_ONLY = os.getenv("EXTRACT_PLAN_ONLY", "0").strip().lower() in {"1", "true", "yes", "y"}
+
+# 离线 batch 模式（EXTRACT_BATCH=1）：所有待抽取论文（分段时每个窗口）写成一个 batch JSONL，
+# 经 /v1/files + /v1/batches 一次提交，轮询完成后按 custom_id 写回按论文 JSON 与日志。
+# 无试运行确认（AUTO_CONTINUE_REST=n 时只提交第1批）；无法逐次翻倍重试，max_tokens 直接取规划上限
+# - BATCH_BASE_URL: 覆盖 batch 端点（如本地 scripts/mock_openai_server.py）
+# - BATCH_POLL_SECS: 轮询间隔（默认 30 秒）；中断后重新运行会继续轮询同一批次
+BATCH_MODE = os.getenv("EXTRACT_BATCH", "0").strip().lower() in {"1", "true", "yes", "y"}
+BATCH_LEASE_SECS = 25 * 3600
+
+# 部分恢复（默认开启）：严格解析失败时，用 json_salvage 恢复截断/损坏输出中所有完整的实体与关系，
+# 作为部分结果暂存；被长度截断时先续写补齐缺失的尾部，仍不完整则重试（还有尝试次数时），
+# 最后一次尝试仍不完整才保存部分结果（日志 partial=true，任务表记为 partial，下次运行重新认领）
+# - EXTRACT_SALVAGE=0: 关闭，恢复解析失败即重试的旧行为
+# - EXTRACT_SALVAGE_CONTINUE=0: 被长度截断时不发续写请求，直接重试
+SALVAGE_MODE = os.getenv("EXTRACT_SALVAGE", "1").strip().lower() in {"1", "true", "yes", "y"}
+SALVAGE_CONTINUE = os.getenv("EXTRACT_SALVAGE_CONTINUE", "1").strip().lower() in {"1", "true", "yes", "y"}
+
+# 提示词布局（EXTRACT_PROMPT_LAYOUT）：
+# - legacy（默认）：沿用原有占位符填充，schema / JSON 提示附在论文之后
+# - cache：固定指令、schema 与 JSON 提示在前，逐篇不同的输出示例与论文全文（只发送一次）在后，
+#   使各篇请求共享尽可能长的前缀以命中服务端前缀缓存；命中量记入日志 cached_prompt_tokens
+CACHE_LAYOUT = os.getenv("EXTRACT_PROMPT_LAYOUT", "legacy").strip().lower() == "cache"
+
 # ------------------------------
-# 进度条（tqdm 优先，缺失则用简易控制台进度）
+# 并发配置（DEEPSEEK_CONCURRENCY / EXTRACT_CONCURRENCY 覆盖，默认 4）
 # ------------------------------
-try:
-    from tqdm.auto import tqdm  # type: ignore
-    HAVE_TQDM = True
-except Exception:
-    tqdm = None  # type: ignore
-    HAVE_TQDM = False
-
-def _iter_with_progress(items, desc: str):
-    """为列表添加进度条（旧 Gemini 风格）"""
-    total = len(items)
-    if HAVE_TQDM:
-        return tqdm(items, total=total, desc=desc, unit="篇")
-    
-    # 简易进度（每 1%/末尾刷新）
-    def _gen():
-        step = max(1, total // 100)
-        for i, x in enumerate(items, 1):
-            if (i % step == 0) or (i == total):
-                pct = int(i * 100 / total)
-                print(f"\r{desc}: {i}/{total} ({pct}%)", end="", flush=True)
-            yield x
-        print()
-    return _gen()
-
+CONCURRENCY = resolve_concurrency(PROVIDER_NAME)
 
 def build_json_hint() -> str:
     """在不修改外部模板文件的前提下，为模型追加清晰的 JSON 输出指令。
@@ -290,6 +328,15 @@ def _load_schema_text() -> str:
 
 SCHEMA_TEXT = _load_schema_text()
 
+# 按论文主题裁剪 schema（EXTRACT_SCHEMA_PRUNE，默认关闭，见 utils.schema_selector）；
+# 每篇的选择结果记在 SCHEMA_CHOICES 中，用于日志中的 schema_tokens_saved 与运行前汇总
+SCHEMA_SELECTOR = build_schema_selector(SCHEMA_FILE) if SCHEMA_TEXT else None
+SCHEMA_CHOICES: Dict[str, Dict[str, Any]] = {}
+
+def _schema_saved(paper_file: str):
+    choice = SCHEMA_CHOICES.get(paper_file)
+    return choice["tokens_saved"] if choice else None
+
 # ------------------------------
 # 初始化 DeepSeek 客户端（通过 OpenAI SDK 直连）
 # ------------------------------
@@ -297,7 +344,42 @@ api_key = os.getenv("DEEPSEEK_API_KEY")
 if not api_key:
     raise ValueError("请先在环境变量中设置 DEEPSEEK_API_KEY")
 
-client = OpenAI(api_key=api_key, base_url="https://api.deepseek.com")
+# 可用 DEEPSEEK_BASE_URL 覆盖（如指向本地 scripts/mock_openai_server.py 做离线压测）
+BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "").strip() or "https://api.deepseek.com"
+
+# 同一提供商 + Key 共享的 RPM/TPM 限流器（限额见 config.yaml 的 rate_limits）
+LIMITER = get_limiter(PROVIDER_NAME, api_key)
+
+def _make_client() -> AsyncOpenAI:
+    """每个批次在自己的事件循环内新建异步客户端（连接池按提供商配置，批次内共享）"""
+    return new_async_openai_client(PROVIDER_NAME, api_key, BASE_URL)
+
+# 熔断与备用提供商（见 utils/circuit_breaker.py）：提供商连续故障后不再逐篇用满重试，
+# 配置了 <PROVIDER>_FALLBACK 时改走备用提供商，否则归还任务留待下次运行
+BREAKER = get_breaker(PROVIDER_NAME)
+FALLBACK = resolve_fallback(PROVIDER_NAME)
+FALLBACK_LIMITER = get_limiter(FALLBACK["provider"], FALLBACK["api_key"]) if FALLBACK else None
+if FALLBACK:
+    print(f"🔀 熔断期间改用备用提供商：{FALLBACK['provider']}/{FALLBACK['model']}（{FALLBACK['base_url']}）")
+
+def _fallback_route() -> dict:
+    """备用提供商的调用路由；客户端在当前事件循环内新建，用完由调用方关闭"""
+    return dict(
+        FALLBACK,
+        limiter=FALLBACK_LIMITER,
+        client=new_async_openai_client(FALLBACK["provider"], FALLBACK["api_key"], FALLBACK["base_url"]),
+    )
+
+def _route_label(route: Optional[dict]) -> Optional[str]:
+    return f"{route['provider']}/{route['model']}" if route else None
+
+# 输出 token 预测：千字密度表 + 历史抽取日志；下限取 DEEPSEEK_MAX_TOKENS_BASE，不低于旧策略首次尝试
+PLANNER = MaxTokensPlanner(
+    PROVIDER_NAME, MODEL_NAME,
+    cap=MAX_TOKENS_CAP,
+    floor=MAX_TOKENS_BASE,
+    predictor=OutputTokenPredictor.from_history(LOG_DIR, PAPERS_DIR, model=PROVIDER_NAME),
+)
 
 # ------------------------------
 # 获取所有论文文件
@@ -348,30 +430,256 @@ print(f"计划：第1批（试运行）{len(first_batch)} 篇；第2批（优先
 # 批量提交
 # ------------------------------
 success, failed, skipped = 0, 0, 0
+# 熔断期间改用备用提供商完成的篇数 / 归还留待下次运行的篇数
+rerouted, deferred = 0, 0
 aborted_for_balance = False
 
 # 设置总论文数
 logger.set_total_papers(len(papers))
 
-def _process_one(paper_file: str, target_dir: str, progress_bar=None):
-    global success, failed, skipped, aborted_for_balance  # noqa
+SYSTEM_PROMPT = "你是信息抽取助手。必须只输出严格且可解析的 JSON 对象，不要任何解释或 Markdown 代码围栏。"
+
+def _finish_reason(response) -> Optional[str]:
+    try:
+        return getattr(response.choices[0], "finish_reason", None)
+    except Exception:
+        return None
+
+async def _create(client: AsyncOpenAI, messages, max_tokens: int, on_delta=None, route: Optional[dict] = None):
+    """发送一次请求（on_delta 非空时走流式）；优先 response_format 强制 JSON，不支持则降级；route 为备用提供商路由"""
+    limiter, model = (LIMITER, MODEL_NAME) if route is None else (route["limiter"], route["model"])
+    if route is not None and route.get("max_tokens_cap"):
+        max_tokens = min(max_tokens, route["max_tokens_cap"])
+    if on_delta is not None:
+        call = lambda **kw: achat_completion_stream(client, limiter, on_delta=on_delta, **kw)
+    else:
+        call = lambda **kw: achat_completion(client, limiter, **kw)
+    try:
+        return await call(
+            model=model,
+            messages=messages,
+            temperature=DEFAULT_TEMPERATURE,
+            max_tokens=max_tokens,
+            response_format={"type": "json_object"}
+        )
+    except Exception as e_first:
+        msg_first = str(e_first)
+        if "response_format" in msg_first.lower() or "unsupported" in msg_first.lower() or "invalid_request" in msg_first.lower():
+            return await call(
+                model=model,
+                messages=messages,
+                temperature=DEFAULT_TEMPERATURE,
+                max_tokens=max_tokens
+            )
+        raise
+
+async def _stream_extract(client: AsyncOpenAI, messages, max_tokens: int, raw_file: str, route: Optional[dict] = None):
+    """
+    流式抽取：增量解析 entities/relations；finish_reason=length 时以已解析元素的紧凑标识
+    构造续写请求，只补充剩余部分，最后按去重键合并。
+
+    Returns:
+        (data, 各轮响应列表, 最后一轮 finish_reason, 是否为部分恢复结果)
+    """
+    parts = []
+    responses = []
+    convo = list(messages)
+    finish_reason = None
+    for _round in range(STREAM_MAX_CONTINUATIONS + 1):
+        parser = IncrementalExtractionParser()
+        response = await _create(client, convo, max_tokens, on_delta=parser.feed, route=route)
+        responses.append(response)
+        finish_reason = _finish_reason(response)
+        content = response.choices[0].message.content or ""
+        try:
+            part = parse_strict_json(content)
+            strict_ok = True
+        except Exception as parse_err:
+            # 截断或格式异常：保留已完整解析的元素；一个都没有时保存原始输出便于排查
+            part = parser.result()
+            strict_ok = False
+            if not parser.item_count:
+                with open(raw_file, "w", encoding="utf-8") as rf:
+                    rf.write(content)
+                if str(finish_reason).lower() != "length":
+                    raise ValueError(f"JSON 解析失败: {parse_err}. 原始输出已保存到 {raw_file}")
+        parts.append(part)
+        if str(finish_reason).lower() != "length":
+            break
+        convo = list(messages) + [{"role": "user", "content": build_continuation_prompt(merge_extractions(parts))}]
+
+    # 单轮且完整：保留模型输出的原始结构；否则按去重键合并各轮
+    if len(parts) == 1 and strict_ok:
+        return parts[0], responses, finish_reason, False
+    data = merge_extractions([p for p in parts if isinstance(p, dict)])
+    if not (data["entities"] or data["relations"]):
+        raise ValueError("流式输出被截断且未解析到任何完整的实体或关系，将重试。")
+    # 续写用尽仍被截断，或最后一轮格式异常：结果缺少尾部
+    return data, responses, finish_reason, not strict_ok or str(finish_reason).lower() == "length"
+
+async def _single_extract(client: AsyncOpenAI, messages, max_tokens: int, raw_file: str, route: Optional[dict] = None):
+    """非流式抽取一次；返回 (data, 响应列表, finish_reason, 是否为部分恢复结果)"""
+    response = await _create(client, messages, max_tokens, route=route)
     
-    # 构造相对路径（priority/xxx.md 或 general/xxx.md）
-    if paper_file in priority_files:
-        paper_rel_path = f"priority/{paper_file}"
-        paper_path = os.path.join(PRIORITY_DIR, paper_file)
+    # 记录 finish_reason 便于判断是否被长度截断
+    finish_reason = _finish_reason(response)
+
+    content = response.choices[0].message.content if response and response.choices and response.choices[0].message else ""
+
+    # 处理空 content（DeepSeek 官方提示：偶发空返回，可通过调整 prompt 或重试缓解）
+    if not content or not str(content).strip():
+        raise ValueError("API 返回空 content —— 将在下一次尝试中重试（可能原因：服务端空响应或提示词触发）。")
+    
+    try:
+        data = parse_strict_json(content)
+    except Exception as parse_err:
+        with open(raw_file, "w", encoding="utf-8") as rf:
+            rf.write(content)
+        salvaged = salvage_extraction(content) if SALVAGE_MODE else None
+        if salvaged is None:
+            # 若 finish_reason 显示为被长度截断，抛出的错误信息中加入提示，下一次将自动提高 max_tokens
+            hint = "；疑似输出被长度截断（finish_reason=length），下一次将提高 max_tokens 重试" if str(finish_reason).lower() == "length" else ""
+            raise ValueError(f"JSON 解析失败: {parse_err}{hint}. 原始输出已保存到 {raw_file}")
+        log_line(f"⚠️ {describe_salvage(salvaged)}，原始输出已保存到 {raw_file}")
+        data = salvaged["data"]
+        responses = [response]
+        if SALVAGE_CONTINUE and str(finish_reason).lower() == "length":
+            # 只请求缺失的尾部：以已恢复元素的紧凑标识构造续写请求，再按去重键合并
+            convo = list(messages) + [{"role": "user", "content": build_continuation_prompt(data)}]
+            tail_response = await _create(client, convo, max_tokens, route=route)
+            responses.append(tail_response)
+            finish_reason = _finish_reason(tail_response)
+            tail_content = tail_response.choices[0].message.content or ""
+            try:
+                tail, partial = parse_strict_json(tail_content), False
+            except Exception:
+                tail_salvaged = salvage_extraction(tail_content)
+                tail, partial = (tail_salvaged["data"] if tail_salvaged else {}), True
+            data = merge_extractions([data, tail])
+            return data, responses, finish_reason, partial
+        return data, responses, finish_reason, True
+    return data, [response], finish_reason, False
+
+def _fill_prompt(prompt_template: str, paper_text: str, schema_text: Optional[str] = None) -> str:
+    """填充 prompt（占位符替换；注入 schema，如无占位符则追加在末尾；若缺少全文占位符则追加在末尾）"""
+    schema_text = SCHEMA_TEXT if schema_text is None else schema_text
+    if CACHE_LAYOUT:
+        return assemble_cached_prompt(prompt_template, paper_text, schema_text or "", build_json_hint())
+    prompt_filled = (
+        prompt_template
+        .replace("{schema_placeholder}", schema_text or "")
+        .replace("{schema_json_placeholder}", schema_text or "")
+    )
+    if "{full_text_placeholder}" in prompt_template:
+        prompt_filled = prompt_filled.replace("{full_text_placeholder}", paper_text)
     else:
-        paper_rel_path = f"general/{paper_file}"
-        paper_path = os.path.join(GENERAL_DIR, paper_file)
+        prompt_filled = prompt_filled + "\n\n【全文】\n" + paper_text
+    if schema_text and "{schema_placeholder}" not in prompt_template and "{schema_json_placeholder}" not in prompt_template:
+        prompt_filled = prompt_filled + "\n\n【Schema】\n" + schema_text
+    # 针对 DeepSeek 附加 JSON 输出提示
+    return prompt_filled + build_json_hint()
+
+def _build_prompts(prompt_template: str, paper_text: str, schema_text: Optional[str] = None) -> list:
+    """
+    整篇模式返回单个 prompt；分段模式下长论文每个窗口一个 prompt（去掉模板内嵌的全文）
+
+    Returns:
+        [(prompt, 该 prompt 对应的论文文本), ...]
+    """
+    if CHUNK_MODE:
+        windows = chunk_paper(paper_text, CHUNK_TOKENS)
+        if len(windows) > 1:
+            instructions = strip_embedded_paper(prompt_template)
+            return [(_fill_prompt(instructions, format_window(w, i, len(windows)), schema_text), w) for i, w in enumerate(windows)]
+    return [(_fill_prompt(prompt_template, paper_text, schema_text), paper_text)]
+
+def _messages(prompt: str) -> list:
+    return [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
+
+def _paper_location(paper_file: str) -> tuple[str, str]:
+    """返回 (相对路径 priority/xxx.md 或 general/xxx.md, 绝对路径)"""
+    if paper_file in priority_files:
+        return f"priority/{paper_file}", os.path.join(PRIORITY_DIR, paper_file)
+    return f"general/{paper_file}", os.path.join(GENERAL_DIR, paper_file)
+
+def _prepare_paper(paper_file: str):
+    """读取论文、选择模板并构造 prompt，同时为每个 prompt 规划 max_tokens
+
+    Returns:
+        (prompts, plans, prompt_source)
+    """
+    paper_rel_path, paper_path = _paper_location(paper_file)
+    with open(paper_path, "r", encoding="utf-8") as f:
+        paper_text = f.read()
+
+    # 为该论文选择并加载模板
+    is_priority = (paper_file in priority_files)
+    prompt_template, prompt_source = _load_prompt_template_for(paper_file, is_priority)
+
+    schema_text = None
+    if SCHEMA_SELECTOR is not None:
+        SCHEMA_CHOICES[paper_file] = SCHEMA_SELECTOR.select(paper_file, paper_text)
+        schema_text = SCHEMA_CHOICES[paper_file]["text"]
+
+    pairs = _build_prompts(prompt_template, paper_text, schema_text)
+    prompts = [p for p, _ in pairs]
+    plans = [PLANNER.plan(_messages(p), text, paper=paper_rel_path) for p, text in pairs]
+    return prompts, plans, prompt_source
+
+# _project_run 已构造的 (prompts, plans, prompt_source)，提交时取出复用，不再重复读论文、分词与规划
+PREPARED: dict = {}
+
+def _take_prepared(paper_file: str):
+    """取出预估阶段构造好的 prompt 与规划（取出即释放）；没有时现场构造"""
+    prepared = PREPARED.pop(paper_file, None)
+    return prepared if prepared is not None else _prepare_paper(paper_file)
+
+def _sum_usage(responses) -> dict:
+    """
+    累加各响应的 token 用量；本地响应缓存命中未实际消耗 token，本次记 0，原始用量另存 cached_total_tokens；
+    服务端前缀缓存命中的提示词 token（计费更低）另记 cached_prompt_tokens
+    """
+    prompt_tokens = completion_tokens = total_tokens = 0
+    cached_total_tokens = cached_prompt = 0
+    for resp in responses:
+        usage = getattr(resp, "usage", None)
+        resp_total = getattr(usage, "total_tokens", 0) if usage else 0
+        if getattr(resp, "from_cache", False):
+            cached_total_tokens += resp_total or 0
+            continue
+        prompt_tokens += getattr(usage, "prompt_tokens", 0) if usage else 0
+        cached_prompt += cached_prompt_tokens(usage)
+        completion_tokens += getattr(usage, "completion_tokens", 0) if usage else 0
+        total_tokens += resp_total or 0
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": total_tokens,
+        "cached_prompt_tokens": cached_prompt,
+        "cache_hit": all(getattr(resp, "from_cache", False) for resp in responses),
+        "cached_total_tokens": cached_total_tokens or None,
+    }
+
+def _update_postfix(progress_bar):
+    if progress_bar is not None:
+        live = summary_line(PROVIDER_NAME)
+        if live:
+            progress_bar.set_postfix(success=success, failed=failed, skipped=skipped, live=live)
+        else:
+            progress_bar.set_postfix(success=success, failed=failed, skipped=skipped)
+
+async def _process_one(client: AsyncOpenAI, paper_file: str, target_dir: str, progress_bar=None):
+    global success, failed, skipped, aborted_for_balance, rerouted, deferred  # noqa
+    
+    # 构造相对路径（priority/xxx.md 或 general/xxx.md）
+    paper_rel_path, _ = _paper_location(paper_file)
     
     # 输出文件路径（支持断点续跑）
     output_file = os.path.join(target_dir, paper_file.replace(".md", ".json"))
     
-    if os.path.exists(output_file):
-        if HAVE_TQDM and progress_bar:
-            tqdm.write(f"已存在结果，跳过：{paper_file}")
-        else:
-            print(f"已存在结果，跳过：{paper_file}")
+    # 认领任务：已完成或正被其他 worker 处理的论文跳过
+    if JOBS.claim(PROVIDER_NAME, paper_rel_path) is None:
+        log_line(f"已完成或处理中，跳过：{paper_file}", progress_bar)
         # 跳过的也记录（duration=0）
         logger.add_log_entry(
             paper=paper_rel_path,
@@ -385,98 +693,116 @@ def _process_one(paper_file: str, target_dir: str, progress_bar=None):
             skipped=True
         )
         skipped += 1
-        if HAVE_TQDM and progress_bar:
-            progress_bar.set_postfix(success=success, failed=failed, skipped=skipped)
+        _update_postfix(progress_bar)
         return
 
-    # 读取论文
-    with open(paper_path, "r", encoding="utf-8") as f:
-        paper_text = f.read()
-
-    # 为该论文选择并加载模板
-    is_priority = (paper_file in priority_files)
-    prompt_template, prompt_source = _load_prompt_template_for(paper_file, is_priority)
-
-    # 填充 prompt（占位符替换；注入 schema，如无占位符则追加在末尾；若缺少全文占位符则追加在末尾）
-    prompt_filled = (
-        prompt_template
-        .replace("{schema_placeholder}", SCHEMA_TEXT or "")
-        .replace("{schema_json_placeholder}", SCHEMA_TEXT or "")
-    )
-    if "{full_text_placeholder}" in prompt_template:
-        prompt_filled = prompt_filled.replace("{full_text_placeholder}", paper_text)
-    else:
-        prompt_filled = prompt_filled + "\n\n【全文】\n" + paper_text
-    if SCHEMA_TEXT and "{schema_placeholder}" not in prompt_template and "{schema_json_placeholder}" not in prompt_template:
-        prompt_filled = prompt_filled + "\n\n【Schema】\n" + SCHEMA_TEXT
-    # 针对 DeepSeek 附加 JSON 输出提示
-    prompt_filled = prompt_filled + build_json_hint()
-
-    if HAVE_TQDM and progress_bar:
-        tqdm.write(f"提交论文：{paper_file} ...")
-    else:
-        print(f"提交论文：{paper_file} ...")
+    # 读取论文、构造 prompt 并规划 max_tokens
+    prompts, plans, prompt_source = _take_prepared(paper_file)
+    prompts_hash = prompt_hash(prompts)
     start_ts = time.time()
     attempts = 0
+
+    # 超出上下文窗口：不提交，直接记为失败
+    try:
+        for plan in plans:
+            PLANNER.check(plan)
+    except ValueError as e:
+        msg = str(e)
+        log_line(f"拒绝提交：{paper_file}：{msg}", progress_bar)
+        JOBS.fail(PROVIDER_NAME, paper_rel_path, msg, prompt_hash=prompts_hash)
+        logger.add_log_entry(
+            paper=paper_rel_path,
+            success=False,
+            duration_seconds=0,
+            error=msg,
+            attempts=0,
+            prompt_source=prompt_source,
+            prompt_tokens_planned=max(p["prompt_tokens"] for p in plans)
+        )
+        failed += 1
+        _update_postfix(progress_bar)
+        return
+
+    log_line(f"提交论文：{paper_file}{f'（分 {len(prompts)} 段）' if len(prompts) > 1 else ''} ...", progress_bar)
     
     # 轻量重试
     max_retries = 3
+    # 之前尝试恢复出的部分结果（各窗口抽取结果）：最后一次尝试失败时作为最终结果
+    partial_fallback = None
     for attempt in range(max_retries):
+        if aborted_for_balance:
+            # 其他并发任务已触发余额不足，不再继续重试；归还任务，下次运行再处理
+            JOBS.release(PROVIDER_NAME, paper_rel_path)
+            break
+        # 熔断中：改走备用提供商；未配置备用时等待冷却与半开探测（不消耗重试次数），
+        # 故障持续超过 CIRCUIT_BREAKER_MAX_OUTAGE 才归还任务
+        route = None
+        if not BREAKER.allow():
+            if FALLBACK is None:
+                if not await BREAKER.wait_ready():
+                    log_line(
+                        f"⚡ {PROVIDER_NAME} 熔断中，任务已归还（故障超过 {BREAKER.max_outage:.0f}s，下次运行继续）：{paper_file}",
+                        progress_bar,
+                    )
+                    JOBS.release(PROVIDER_NAME, paper_rel_path)
+                    deferred += 1
+                    break
+                if aborted_for_balance:
+                    JOBS.release(PROVIDER_NAME, paper_rel_path)
+                    break
+            else:
+                route = _fallback_route()
+                log_line(f"🔀 {PROVIDER_NAME} 熔断中，改用 {_route_label(route)}：{paper_file}", progress_bar)
         attempts += 1
         try:
-            # 针对每次尝试动态提升 max_tokens，缓解长输出被截断
-            curr_max_tokens = min(MAX_TOKENS_BASE * (2 ** attempt), MAX_TOKENS_CAP)
-            
-            # 优先尝试 response_format 强制 JSON，不支持则降级
+            if STREAM_MODE:
+                # 流式：直接使用上限（受上下文窗口约束），截断部分通过续写补齐
+                window_max_tokens = [plan["max_allowed"] for plan in plans]
+                extract = _stream_extract
+            elif PLAN_MAX_TOKENS:
+                # 首次使用规划值，之后每次翻倍，缓解预测偏小导致的截断
+                window_max_tokens = [min(plan["max_tokens"] * (2 ** attempt), plan["max_allowed"]) for plan in plans]
+                extract = _single_extract
+            else:
+                # 针对每次尝试动态提升 max_tokens，缓解长输出被截断
+                window_max_tokens = [min(MAX_TOKENS_BASE * (2 ** attempt), plan["max_allowed"]) for plan in plans]
+                extract = _single_extract
+            curr_max_tokens = max(window_max_tokens)
+            # 各窗口并发抽取（整篇模式只有一个）；重试时已成功的窗口命中响应缓存，不会重复计费
             try:
-                response = client.chat.completions.create(
-                    model=MODEL_NAME,
-                    messages=[
-                        {"role": "system", "content": "你是信息抽取助手。必须只输出严格且可解析的 JSON 对象，不要任何解释或 Markdown 代码围栏。"},
-                        {"role": "user", "content": prompt_filled}
-                    ],
-                    temperature=DEFAULT_TEMPERATURE,
-                    max_tokens=curr_max_tokens,
-                    response_format={"type": "json_object"}
-                )
-            except Exception as e_first:
-                msg_first = str(e_first)
-                if "response_format" in msg_first.lower() or "unsupported" in msg_first.lower() or "invalid_request" in msg_first.lower():
-                    response = client.chat.completions.create(
-                        model=MODEL_NAME,
-                        messages=[
-                            {"role": "system", "content": "你是信息抽取助手。必须只输出严格且可解析的 JSON 对象，不要任何解释或 Markdown 代码围栏。"},
-                            {"role": "user", "content": prompt_filled}
-                        ],
-                        temperature=DEFAULT_TEMPERATURE,
-                        max_tokens=curr_max_tokens
+                results = await asyncio.gather(*[
+                    extract(
+                        route["client"] if route else client,
+                        _messages(prompt),
+                        window_max_tokens[i],
+                        output_file.replace(".json", f".part{i + 1}.raw.txt" if len(prompts) > 1 else ".raw.txt"),
+                        route=route,
                     )
-                else:
+                    for i, prompt in enumerate(prompts)
+                ])
+            except Exception as e:
+                # 最后一次尝试失败：之前的尝试恢复出过部分结果时，以其作为最终结果（任务表记为 partial）
+                balance = "402" in str(e) or "insufficient balance" in str(e).lower()
+                if partial_fallback is None or attempt < max_retries - 1 or balance:
                     raise
-            
-            # 记录 finish_reason 便于判断是否被长度截断
-            finish_reason = None
-            try:
-                finish_reason = getattr(response.choices[0], "finish_reason", None)
-            except Exception:
-                finish_reason = None
+                log_line(f"⚠️ 最后一次尝试失败（{e}），改用之前恢复的部分结果：{paper_file}", progress_bar)
+                results = partial_fallback
+            if len(results) == 1:
+                data, responses, finish_reason, partial = results[0]
+            else:
+                # reduce：按实体/关系去重键合并各窗口结果
+                data = merge_extractions([r[0] for r in results if isinstance(r[0], dict)])
+                responses = [resp for r in results for resp in r[1]]
+                reasons = [r[2] for r in results]
+                finish_reason = next((fr for fr in reasons if str(fr).lower() == "length"), reasons[0])
+                partial = any(r[3] for r in results)
 
-            content = response.choices[0].message.content if response and response.choices and response.choices[0].message else ""
+            # 输出仍不完整（截断 / 损坏后部分恢复）且还有尝试次数：暂存恢复结果并重试；
+            # 最后一次仍不完整时才保存部分结果
+            if partial and attempt < max_retries - 1:
+                partial_fallback = results
+                raise ValueError("输出不完整，已暂存恢复出的部分结果，重试以获取完整输出")
 
-            # 处理空 content（DeepSeek 官方提示：偶发空返回，可通过调整 prompt 或重试缓解）
-            if not content or not str(content).strip():
-                raise ValueError("API 返回空 content —— 将在下一次尝试中重试（可能原因：服务端空响应或提示词触发）。")
-            
-            try:
-                data = parse_strict_json(content)
-            except Exception as parse_err:
-                raw_file = output_file.replace(".json", ".raw.txt")
-                with open(raw_file, "w", encoding="utf-8") as rf:
-                    rf.write(content)
-                # 若 finish_reason 显示为被长度截断，抛出的错误信息中加入提示，下一次将自动提高 max_tokens
-                hint = "；疑似输出被长度截断（finish_reason=length），下一次将提高 max_tokens 重试" if str(finish_reason).lower() == "length" else ""
-                raise ValueError(f"JSON 解析失败: {parse_err}{hint}. 原始输出已保存到 {raw_file}")
-            
             # 保存结果
             with open(output_file, "w", encoding="utf-8") as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
@@ -484,12 +810,9 @@ def _process_one(paper_file: str, target_dir: str, progress_bar=None):
             # 统计实体和关系数量
             entity_count, relation_count = count_entities_and_relations(data)
             
-            # 提取 token 使用量
-            usage = getattr(response, "usage", None)
-            prompt_tokens = getattr(usage, "prompt_tokens", 0) if usage else 0
-            completion_tokens = getattr(usage, "completion_tokens", 0) if usage else 0
-            total_tokens = getattr(usage, "total_tokens", 0) if usage else 0
-            
+            # token 使用量在流式续写时累加各轮
+            usage = _sum_usage(responses)
+
             # 记录成功日志
             logger.add_log_entry(
                 paper=paper_rel_path,
@@ -497,32 +820,51 @@ def _process_one(paper_file: str, target_dir: str, progress_bar=None):
                 duration_seconds=time.time() - start_ts,
                 entity_count=entity_count,
                 relation_count=relation_count,
-                prompt_tokens=prompt_tokens,
-                completion_tokens=completion_tokens,
-                total_tokens=total_tokens,
                 attempts=attempts,
                 max_tokens_used=curr_max_tokens,
+                prompt_tokens_planned=sum(p["prompt_tokens"] for p in plans),
+                predicted_output_tokens=sum(p["predicted_output_tokens"] for p in plans),
                 finish_reason=str(finish_reason) if finish_reason else None,
-                prompt_source=prompt_source
+                prompt_source=prompt_source,
+                schema_tokens_saved=_schema_saved(paper_file),
+                stream=STREAM_MODE,
+                time_to_first_token=(
+                    round(responses[0].time_to_first_token, 3)
+                    if STREAM_MODE and getattr(responses[0], "time_to_first_token", None) is not None else None
+                ),
+                continuations=len(responses) - len(prompts) if STREAM_MODE else None,
+                chunks=len(prompts) if CHUNK_MODE else None,
+                partial=partial or None,
+                rerouted=_route_label(route),
+                **usage
+            )
+            JOBS.complete(
+                PROVIDER_NAME, paper_rel_path,
+                partial=partial,
+                reason="输出不完整，已保存部分恢复结果",
+                output_path=output_file,
+                prompt_hash=prompts_hash,
+                prompt_tokens=usage["prompt_tokens"],
+                completion_tokens=usage["completion_tokens"],
+                total_tokens=usage["total_tokens"],
+                entity_count=entity_count,
+                relation_count=relation_count,
+                duration_seconds=time.time() - start_ts,
             )
 
-            if HAVE_TQDM and progress_bar:
-                tqdm.write(f"结果已保存到 {output_file}")
-            else:
-                print(f"结果已保存到 {output_file}")
+            if partial:
+                log_line(f"⚠️ 输出仍不完整，已保存部分结果（任务记为 partial，下次运行重新抽取）：{paper_file}", progress_bar)
+            log_line(f"结果已保存到 {output_file}", progress_bar)
             success += 1
-            if HAVE_TQDM and progress_bar:
-                progress_bar.set_postfix(success=success, failed=failed, skipped=skipped)
+            rerouted += 1 if route else 0
+            _update_postfix(progress_bar)
             break  # 成功则跳出重试
             
         except Exception as e:
             msg = str(e)
             # 余额不足：HTTP 402 或错误信息包含关键词，直接中止后续任务
             if ("402" in msg) or ("Insufficient Balance" in msg) or ("insufficient balance" in msg.lower()):
-                if HAVE_TQDM and progress_bar:
-                    tqdm.write(f"余额不足，终止后续任务：{msg}")
-                else:
-                    print(f"余额不足，终止后续任务：{msg}")
+                log_line(f"余额不足，终止后续任务：{msg}", progress_bar)
                 logger.add_log_entry(
                     paper=paper_rel_path,
                     success=False,
@@ -531,110 +873,332 @@ def _process_one(paper_file: str, target_dir: str, progress_bar=None):
                     attempts=attempts,
                     prompt_source=prompt_source
                 )
+                JOBS.release(PROVIDER_NAME, paper_rel_path)
                 aborted_for_balance = True
                 break
             
             is_last = (attempt == max_retries - 1)
-            if HAVE_TQDM and progress_bar:
-                tqdm.write(f"第 {attempt+1}/{max_retries} 次尝试失败：{msg}{'（已放弃）' if is_last else '，重试中…'}")
-            else:
-                print(f"第 {attempt+1}/{max_retries} 次尝试失败：{msg}{'（已放弃）' if is_last else '，重试中…'}")
+            log_line(f"第 {attempt+1}/{max_retries} 次尝试失败：{msg}{'（已放弃）' if is_last else '，重试中…'}", progress_bar)
             
             if is_last:
-                # 失败也保留错误记录，便于复现
-                fail_flag = output_file.replace(".json", ".failed.txt")
-                with open(fail_flag, "w", encoding="utf-8") as ff:
-                    ff.write(f"失败时间: {now_iso()}\n异常: {msg}\n")
-                
+                # 失败原因记入任务表，下次运行会重新认领
+                JOBS.fail(PROVIDER_NAME, paper_rel_path, msg, prompt_hash=prompts_hash, duration_seconds=time.time() - start_ts)
+
                 logger.add_log_entry(
                     paper=paper_rel_path,
                     success=False,
                     duration_seconds=time.time() - start_ts,
                     error=msg,
                     attempts=attempts,
-                    fail_flag=fail_flag,
-                    prompt_source=prompt_source
+                    prompt_source=prompt_source,
+                    rerouted=_route_label(route)
                 )
                 failed += 1
-                if HAVE_TQDM and progress_bar:
-                    progress_bar.set_postfix(success=success, failed=failed, skipped=skipped)
+                _update_postfix(progress_bar)
             else:
-                # 指数退避
-                time.sleep(2 ** attempt)
+                # 退避：优先遵循 Retry-After，否则指数退避加抖动（仅让出当前协程）
+                record_retry(PROVIDER_NAME, MODEL_NAME)
+                await asyncio.sleep(backoff_delay(attempt, e))
+        finally:
+            if route is not None:
+                await route["client"].close()
 
-# ------------------------------
-# 第1批：试运行（前 10 篇）
-# ------------------------------
-if first_batch:
-    print(f"\n{'='*70}")
-    print(f"开始第1批处理（试运行）：{len(first_batch)} 篇")
-    print(f"{'='*70}")
-    
-    progress_bar_1 = _iter_with_progress(first_batch, desc="DeepSeek [1/3] 试运行")
-    for pf in progress_bar_1:
-        _process_one(pf, IN_SCOPE_DIR, progress_bar_1 if HAVE_TQDM else None)
-        if aborted_for_balance:
-            break
-        time.sleep(1)
-    
-    if not aborted_for_balance:
-        print(f"\n第1批完成：成功 {success} 篇，失败 {failed} 篇，跳过 {skipped} 篇")
-        
-        # 询问是否继续
-        if second_batch or third_batch:
-            proceed = None
-            if AUTO_CONTINUE_REST in {"y", "yes"}:
-                proceed = True
-                print("→ 自动继续（AUTO_CONTINUE_REST=y）")
-            elif AUTO_CONTINUE_REST in {"n", "no"}:
-                proceed = False
-                print("→ 自动停止（AUTO_CONTINUE_REST=n）")
-            else:
+def _run_batch(batch, target_dir: str, desc: str):
+    """以 CONCURRENCY 个在途请求并发处理一个批次"""
+    return run_batch(
+        batch,
+        lambda client, pf, bar: _process_one(client, pf, target_dir, bar),
+        client_factory=_make_client,
+        concurrency=CONCURRENCY,
+        desc=desc,
+        should_abort=lambda: aborted_for_balance,
+    )
+
+def _enqueue_jobs(batches) -> None:
+    """把各批次论文登记到任务表；输出文件已存在的记为完成，已删除输出的完成记录重置为待处理"""
+    jobs = []
+    for batch, target_dir in batches:
+        for pf in batch:
+            output_file = os.path.join(target_dir, pf.replace(".md", ".json"))
+            jobs.append({"paper": _paper_location(pf)[0], "output_path": output_file, "done": os.path.exists(output_file)})
+    JOBS.enqueue(PROVIDER_NAME, jobs)
+    # 本机上次运行崩溃遗留的 running 任务立即归还（batch 模式租约长达 25h，否则无法续跑同一批次）
+    reclaimed = JOBS.reclaim_dead(PROVIDER_NAME)
+    if reclaimed:
+        print(f"♻️  已归还本机已退出进程持有的 {reclaimed} 篇任务")
+
+def _project_run(batches) -> None:
+    """提交前汇总整次运行的预计 token（任务表中已完成、将被跳过的论文不计入）"""
+    statuses = JOBS.statuses(PROVIDER_NAME)
+    plans = []
+    for batch, _ in batches:
+        for pf in batch:
+            if statuses.get(_paper_location(pf)[0]) == "done":
+                continue
+            PREPARED[pf] = _prepare_paper(pf)
+            plans.extend(PREPARED[pf][1])
+    summary = summarize_plans(plans)
+    print(format_projection(summary, f"DeepSeek（分词器 {tokenizer_name()}，输出预测 {PLANNER.predictor.source}）"))
+    for paper in summary["rejected_papers"]:
+        print(f"   ⛔ 超出上下文窗口，将拒绝提交：{paper}")
+    if SCHEMA_CHOICES:
+        print(f"📉 Schema 裁剪：{format_schema_report(list(SCHEMA_CHOICES.values()))}")
+        report_file = os.path.join(LOG_DIR, "schema_pruning.json")
+        with open(report_file, "w", encoding="utf-8") as f:
+            json.dump({pf: {k: v for k, v in c.items() if k != "text"} for pf, c in SCHEMA_CHOICES.items()},
+                      f, ensure_ascii=False, indent=2)
+        print(f"   逐篇明细：{report_file}")
+    print(format_counts(JOBS.counts(PROVIDER_NAME), "DeepSeek"))
+
+def _run_offline_batch(batches) -> None:
+    """
+    离线 batch 模式：每篇论文（分段时每个窗口）一条请求，整次运行合并为一个批次提交；
+    任务表中已完成的论文跳过，超出上下文窗口的论文拒绝提交，批次完成后按论文写回结果、日志与任务表
+    """
+    global success, failed, skipped  # noqa
+    jobs = []
+    requests = []
+    for batch, target_dir in batches:
+        for pf in batch:
+            paper_rel_path, _ = _paper_location(pf)
+            output_file = os.path.join(target_dir, pf.replace(".md", ".json"))
+            # batch 完成窗口为 24h，租约相应加长，避免轮询期间被其他 worker 重新认领
+            if JOBS.claim(PROVIDER_NAME, paper_rel_path, lease_secs=BATCH_LEASE_SECS) is None:
+                print(f"已完成或处理中，跳过：{pf}")
+                logger.add_log_entry(
+                    paper=paper_rel_path,
+                    success=True,
+                    duration_seconds=0,
+                    entity_count=0,
+                    relation_count=0,
+                    prompt_tokens=0,
+                    completion_tokens=0,
+                    total_tokens=0,
+                    skipped=True
+                )
+                skipped += 1
+                continue
+
+            prompts, plans, prompt_source = _take_prepared(pf)
+            prompts_hash = prompt_hash(prompts)
+            try:
+                for plan in plans:
+                    PLANNER.check(plan)
+            except ValueError as e:
+                msg = str(e)
+                print(f"拒绝提交：{pf}：{msg}")
+                JOBS.fail(PROVIDER_NAME, paper_rel_path, msg, prompt_hash=prompts_hash)
+                logger.add_log_entry(
+                    paper=paper_rel_path,
+                    success=False,
+                    duration_seconds=0,
+                    error=msg,
+                    attempts=0,
+                    prompt_source=prompt_source,
+                    prompt_tokens_planned=max(p["prompt_tokens"] for p in plans)
+                )
+                failed += 1
+                continue
+
+            custom_ids = [f"{pf}#{i}" for i in range(len(prompts))]
+            for custom_id, prompt, plan in zip(custom_ids, prompts, plans):
+                requests.append((custom_id, {
+                    "model": MODEL_NAME,
+                    "messages": _messages(prompt),
+                    "temperature": DEFAULT_TEMPERATURE,
+                    "max_tokens": plan["max_allowed"],
+                    "response_format": {"type": "json_object"},
+                }))
+            jobs.append((pf, paper_rel_path, output_file, custom_ids, plans, prompt_source, prompts_hash))
+
+    if not requests:
+        print("→ 没有需要提交的论文。")
+        return
+
+    start_ts = time.time()
+    client = BatchAPIClient(batch_base_url(BASE_URL), api_key)
+    try:
+        results = run_batch_job(
+            client, requests, os.path.join(LOG_DIR, "batch"),
+            name=PROVIDER_NAME, metadata={"experiment": "exp03", "provider": PROVIDER_NAME},
+        )
+    except BaseException:
+        # 提交或轮询出错：归还已认领的任务；批次状态文件保留，重新运行会继续轮询同一批次
+        JOBS.release_worker(PROVIDER_NAME)
+        raise
+    # 批次内各请求没有单独耗时：统一记为提交到取回结果的总耗时
+    elapsed = time.time() - start_ts
+
+    for pf, paper_rel_path, output_file, custom_ids, plans, prompt_source, prompts_hash in jobs:
+        responses = [results[cid] for cid in custom_ids]
+        try:
+            parts = []
+            partial = False
+            for i, resp in enumerate(responses):
+                if isinstance(resp, Exception):
+                    raise resp
+                content = resp.choices[0].message.content if resp.choices else ""
+                if not content or not str(content).strip():
+                    raise ValueError("API 返回空 content")
                 try:
-                    remaining_count = len(second_batch) + len(third_batch)
-                    ans = input(f"\n是否继续处理剩余 {remaining_count} 篇？(y/n): ").strip().lower()
-                    proceed = ans in {"y", "yes"}
-                except (EOFError, KeyboardInterrupt):
-                    proceed = False
+                    parts.append(parse_strict_json(content))
+                except Exception as parse_err:
+                    raw_file = output_file.replace(".json", f".part{i + 1}.raw.txt" if len(custom_ids) > 1 else ".raw.txt")
+                    with open(raw_file, "w", encoding="utf-8") as rf:
+                        rf.write(content)
+                    # 离线批次无法续写：能恢复出完整元素时作为部分结果保存
+                    salvaged = salvage_extraction(content) if SALVAGE_MODE else None
+                    if salvaged is None:
+                        raise ValueError(f"JSON 解析失败: {parse_err}. 原始输出已保存到 {raw_file}")
+                    print(f"⚠️ {pf}：{describe_salvage(salvaged)}，原始输出已保存到 {raw_file}")
+                    parts.append(salvaged["data"])
+                    partial = True
+            data = parts[0] if len(parts) == 1 else merge_extractions([p for p in parts if isinstance(p, dict)])
+        except Exception as e:
+            msg = str(e)
+            print(f"❌ {pf}：{msg}")
+            JOBS.fail(PROVIDER_NAME, paper_rel_path, msg, prompt_hash=prompts_hash, duration_seconds=elapsed)
+            logger.add_log_entry(
+                paper=paper_rel_path,
+                success=False,
+                duration_seconds=elapsed,
+                error=msg,
+                attempts=1,
+                prompt_source=prompt_source,
+                batch=True
+            )
+            failed += 1
+            continue
+
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        entity_count, relation_count = count_entities_and_relations(data)
+        reasons = [_finish_reason(resp) for resp in responses]
+        finish_reason = next((fr for fr in reasons if str(fr).lower() == "length"), reasons[0])
+        usage = _sum_usage(responses)
+        logger.add_log_entry(
+            paper=paper_rel_path,
+            success=True,
+            duration_seconds=elapsed,
+            entity_count=entity_count,
+            relation_count=relation_count,
+            attempts=1,
+            max_tokens_used=max(p["max_allowed"] for p in plans),
+            prompt_tokens_planned=sum(p["prompt_tokens"] for p in plans),
+            predicted_output_tokens=sum(p["predicted_output_tokens"] for p in plans),
+            finish_reason=str(finish_reason) if finish_reason else None,
+            prompt_source=prompt_source,
+            schema_tokens_saved=_schema_saved(pf),
+            batch=True,
+            batch_id=next((getattr(resp, "batch_id", None) for resp in responses if getattr(resp, "batch_id", None)), None),
+            chunks=len(custom_ids) if CHUNK_MODE else None,
+            partial=partial or None,
+            **usage
+        )
+        # 离线批次无法重试：部分结果记为 partial，下次运行重新认领提交
+        JOBS.complete(
+            PROVIDER_NAME, paper_rel_path,
+            partial=partial,
+            reason="输出不完整，已保存部分恢复结果",
+            output_path=output_file,
+            prompt_hash=prompts_hash,
+            prompt_tokens=usage["prompt_tokens"],
+            completion_tokens=usage["completion_tokens"],
+            total_tokens=usage["total_tokens"],
+            entity_count=entity_count,
+            relation_count=relation_count,
+            duration_seconds=elapsed,
+        )
+        print(f"结果已保存到 {output_file}")
+        success += 1
+
+_enqueue_jobs([(first_batch, IN_SCOPE_DIR), (second_batch, IN_SCOPE_DIR), (third_batch, OUT_SCOPE_DIR)])
+_project_run([(first_batch, IN_SCOPE_DIR), (second_batch, IN_SCOPE_DIR), (third_batch, OUT_SCOPE_DIR)])
+if PLAN_ONLY:
+    print("→ EXTRACT_PLAN_ONLY=1：仅输出预计 token，不提交请求。")
+    raise SystemExit(0)
+
+proceed = None
+interrupted = False
+try:
+    # ------------------------------
+    # 离线 batch 模式：全部论文一次提交
+    # ------------------------------
+    if BATCH_MODE:
+        offline_batches = [(first_batch, IN_SCOPE_DIR)]
+        if AUTO_CONTINUE_REST not in {"n", "no"}:
+            offline_batches += [(second_batch, IN_SCOPE_DIR), (third_batch, OUT_SCOPE_DIR)]
+        print(f"\n{'='*70}")
+        print(f"开始离线 batch 处理：{sum(len(b) for b, _ in offline_batches)} 篇（EXTRACT_BATCH=1）")
+        print(f"{'='*70}")
+
+        _run_offline_batch(offline_batches)
+
+        print(f"\nbatch 处理完成：成功 {success} 篇，失败 {failed} 篇，跳过 {skipped} 篇")
+
+    # ------------------------------
+    # 第1批：试运行（前 10 篇）
+    # ------------------------------
+    if first_batch and not BATCH_MODE:
+        print(f"\n{'='*70}")
+        print(f"开始第1批处理（试运行）：{len(first_batch)} 篇（并发 {CONCURRENCY}）")
+        print(f"{'='*70}")
+        
+        _run_batch(first_batch, IN_SCOPE_DIR, "DeepSeek [1/3] 试运行")
+        
+        if not aborted_for_balance:
+            print(f"\n第1批完成：成功 {success} 篇，失败 {failed} 篇，跳过 {skipped} 篇")
             
-            if not proceed:
-                print("→ 用户选择停止，剩余论文未抽取。")
+            # 询问是否继续
+            if second_batch or third_batch:
+                if AUTO_CONTINUE_REST in {"y", "yes"}:
+                    proceed = True
+                    print("→ 自动继续（AUTO_CONTINUE_REST=y）")
+                elif AUTO_CONTINUE_REST in {"n", "no"}:
+                    proceed = False
+                    print("→ 自动停止（AUTO_CONTINUE_REST=n）")
+                else:
+                    try:
+                        remaining_count = len(second_batch) + len(third_batch)
+                        ans = input(f"\n是否继续处理剩余 {remaining_count} 篇？(y/n): ").strip().lower()
+                        proceed = ans in {"y", "yes"}
+                    except (EOFError, KeyboardInterrupt):
+                        proceed = False
+                
+                if not proceed:
+                    print("→ 用户选择停止，剩余论文未抽取。")
 
-# ------------------------------
-# 第2批：优先论文剩余部分
-# ------------------------------
-if not aborted_for_balance and second_batch and (AUTO_CONTINUE_REST in {"y", "yes"} or proceed):
-    print(f"\n{'='*70}")
-    print(f"开始第2批处理（优先论文）：{len(second_batch)} 篇")
-    print(f"{'='*70}")
-    
-    progress_bar_2 = _iter_with_progress(second_batch, desc="DeepSeek [2/3] 优先论文")
-    for pf in progress_bar_2:
-        _process_one(pf, IN_SCOPE_DIR, progress_bar_2 if HAVE_TQDM else None)
-        if aborted_for_balance:
-            break
-        time.sleep(1)
-    
-    if not aborted_for_balance:
-        print(f"\n第2批完成：当前总计成功 {success} 篇，失败 {failed} 篇，跳过 {skipped} 篇")
+    # ------------------------------
+    # 第2批：优先论文剩余部分
+    # ------------------------------
+    if not BATCH_MODE and not aborted_for_balance and second_batch and (AUTO_CONTINUE_REST in {"y", "yes"} or proceed):
+        print(f"\n{'='*70}")
+        print(f"开始第2批处理（优先论文）：{len(second_batch)} 篇（并发 {CONCURRENCY}）")
+        print(f"{'='*70}")
+        
+        _run_batch(second_batch, IN_SCOPE_DIR, "DeepSeek [2/3] 优先论文")
+        
+        if not aborted_for_balance:
+            print(f"\n第2批完成：当前总计成功 {success} 篇，失败 {failed} 篇，跳过 {skipped} 篇")
 
-# ------------------------------
-# 第3批：普通论文
-# ------------------------------
-if not aborted_for_balance and third_batch and (AUTO_CONTINUE_REST in {"y", "yes"} or proceed):
-    print(f"\n{'='*70}")
-    print(f"开始第3批处理（普通论文）：{len(third_batch)} 篇")
-    print(f"{'='*70}")
-    
-    progress_bar_3 = _iter_with_progress(third_batch, desc="DeepSeek [3/3] 普通论文")
-    for pf in progress_bar_3:
-        _process_one(pf, OUT_SCOPE_DIR, progress_bar_3 if HAVE_TQDM else None)
-        if aborted_for_balance:
-            break
-        time.sleep(1)
-    
-    if not aborted_for_balance:
-        print(f"\n第3批完成：当前总计成功 {success} 篇，失败 {failed} 篇，跳过 {skipped} 篇")
+    # ------------------------------
+    # 第3批：普通论文
+    # ------------------------------
+    if not BATCH_MODE and not aborted_for_balance and third_batch and (AUTO_CONTINUE_REST in {"y", "yes"} or proceed):
+        print(f"\n{'='*70}")
+        print(f"开始第3批处理（普通论文）：{len(third_batch)} 篇（并发 {CONCURRENCY}）")
+        print(f"{'='*70}")
+        
+        _run_batch(third_batch, OUT_SCOPE_DIR, "DeepSeek [3/3] 普通论文")
+        
+        if not aborted_for_balance:
+            print(f"\n第3批完成：当前总计成功 {success} 篇，失败 {failed} 篇，跳过 {skipped} 篇")
+except KeyboardInterrupt:
+    # Ctrl+C：在途请求被取消，已完成论文的日志仍会保存
+    interrupted = True
+    print("\n⚠️  用户中断，正在保存已完成论文的日志…")
+    # 本进程认领但未完成的任务归还为待处理（进程被强杀时由租约过期兜底）
+    JOBS.release_worker(PROVIDER_NAME)
 
 # ------------------------------
 # 最终总结
@@ -644,9 +1208,16 @@ print(f"DeepSeek 处理结束")
 print(f"{'='*70}")
 print(f"成功: {success} 篇")
 print(f"失败: {failed} 篇")
-print(f"状态: {'因余额不足提前终止' if aborted_for_balance else '正常完成'}")
+print(f"前缀缓存: 命中 {logger.cached_prompt_tokens} / {logger.prompt_tokens} prompt tokens（{logger.get_summary()['prompt_cache_hit_rate']}%）")
+_metrics_summary = summary_line(PROVIDER_NAME)
+if _metrics_summary:
+    print(f"请求指标: {_metrics_summary}（Prometheus 快照: {get_registry().export()}）")
+if BREAKER.times_opened or rerouted or deferred:
+    print(f"熔断: 打开 {BREAKER.times_opened} 次；改用备用提供商完成 {rerouted} 篇；归还待下次运行 {deferred} 篇")
+print(f"状态: {'因余额不足提前终止' if aborted_for_balance else ('用户中断' if interrupted else '正常完成')}")
+print(format_counts(JOBS.counts(PROVIDER_NAME), "DeepSeek"))
 print(f"{'='*70}")
 
 # 保存详细抽取日志
 logger.save()
-print(f"{'='*70}")
\ No newline at end of file
+print(f"{'='*70}")
@@ -2,15 +2,129 @@
 """
 统一的日志管理模块
 用于保存详细的抽取日志，格式参考 RAG 脚本
+
+日志以 NDJSON 流式追加（每条记录一行）：
+- 每条记录立即写入操作系统缓冲区，按时间间隔 fsync，进程崩溃或 Ctrl-C 最多丢失最后一条；
+- 第一条记录写入时才创建分段，没有记录的运行（如 EXTRACT_PLAN_ONLY=1 只做预估）不留下文件；
+- 单个分段超过大小上限时切换到新分段（extraction_log_<时间戳>.000.ndjson、.001.ndjson ...）；
+- save() 时把各分段压缩成原有的汇总文件 extraction_log_<时间戳>.json 并删除分段，
+  analyze_extraction_time.py 等读取汇总文件的脚本无需修改；
+- 运行中断留下的分段可手动压缩为汇总文件（不会自动压缩，以免误处理仍在运行的其他进程）：
+      python log_manager.py compact <日志目录> [extraction_log_<时间戳>]
+
+可配参数（环境变量）：
+- EXTRACT_LOG_MAX_MB: 单个分段大小上限（默认 64）
+- EXTRACT_LOG_FSYNC_SECS: fsync 间隔秒数（默认 5；0 表示每条都 fsync）
 """
 import os
+import re
+import sys
 import json
+import glob
+import time
+import atexit
 from datetime import datetime, timezone
-from typing import List, Dict, Any, Optional
+from typing import Dict, Any, Iterator, List, Optional
+
+SEGMENT_RE = re.compile(r"^(extraction_log_\d{8}_\d{6})\.(\d{3})\.ndjson$")
+
+
+def _segments(log_dir: str, stem: str) -> List[str]:
+    """按序号返回某次运行的全部 NDJSON 分段"""
+    paths = glob.glob(os.path.join(log_dir, f"{glob.escape(stem)}.[0-9][0-9][0-9].ndjson"))
+    return sorted(paths)
+
+
+def iter_ndjson(paths: List[str]) -> Iterator[Dict[str, Any]]:
+    """依次读取各分段的记录；崩溃时写了一半的行直接跳过"""
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def compact_log(log_dir: str, stem: str, remove_segments: bool = True) -> Optional[str]:
+    """
+    把一次运行的 NDJSON 分段压缩为汇总文件 <stem>.json（原有格式），返回其路径
+
+    汇总字段由记录重新统计，与中途是否崩溃无关；记录逐条写出，不整体载入内存。
+    """
+    paths = _segments(log_dir, stem)
+    if not paths:
+        return None
+    out_file = os.path.join(log_dir, f"{stem}.json")
+    tmp_file = out_file + ".tmp"
+
+    # 第一遍：统计汇总字段（汇总字段在前，与原格式一致）
+    total_papers = 0
+    successful = failed = prompt_tokens = cached_prompt_tokens = 0
+    for record in iter_ndjson(paths):
+        if "_meta" in record:
+            total_papers = record["_meta"].get("total_papers", total_papers)
+        elif record.get("success"):
+            successful += 1
+        else:
+            failed += 1
+        prompt_tokens += record.get("prompt_tokens") or 0
+        cached_prompt_tokens += record.get("cached_prompt_tokens") or 0
+    if not successful and not failed:
+        # 只有 _meta、没有任何记录的分段：直接删除，不生成空的汇总文件
+        if remove_segments:
+            for path in paths:
+                os.remove(path)
+        return None
+    summary = {
+        "total_papers": total_papers,
+        "successful_extractions": successful,
+        "failed_extractions": failed,
+        "prompt_tokens": prompt_tokens,
+        "cached_prompt_tokens": cached_prompt_tokens,
+        "prompt_cache_hit_rate": round(cached_prompt_tokens / prompt_tokens * 100, 2) if prompt_tokens else 0,
+    }
+
+    # 第二遍：逐条写出 logs
+    with open(tmp_file, "w", encoding="utf-8") as out:
+        out.write("{\n")
+        for key, value in summary.items():
+            out.write(f'  "{key}": {json.dumps(value)},\n')
+        out.write('  "logs": [')
+        first = True
+        for record in iter_ndjson(paths):
+            if "_meta" in record:
+                continue
+            body = json.dumps(record, ensure_ascii=False, indent=2).replace("\n", "\n    ")
+            out.write(("\n    " if first else ",\n    ") + body)
+            first = False
+        out.write("]\n}\n" if first else "\n  ]\n}\n")
+    os.replace(tmp_file, out_file)
+    if remove_segments:
+        for path in paths:
+            os.remove(path)
+    return out_file
+
+
+def compact_orphans(log_dir: str, stem: Optional[str] = None) -> List[str]:
+    """
+    压缩目录中遗留的（运行中断、未执行 save 的）NDJSON 分段；指定 stem 时只压缩该次运行
+
+    注意：仍在运行的进程的分段也会被匹配，请在确认相应进程已退出后再执行。
+    """
+    stems = set()
+    for name in os.listdir(log_dir):
+        m = SEGMENT_RE.match(name)
+        if m and (stem is None or m.group(1) == stem):
+            stems.add(m.group(1))
+    return [p for p in (compact_log(log_dir, s) for s in sorted(stems)) if p]
 
 
 class ExtractionLogger:
-    """抽取过程日志记录器"""
+    """抽取过程日志记录器（NDJSON 流式追加，save 时压缩为汇总文件）"""
     
     def __init__(self, log_dir: str, provider_name: str):
         """
@@ -26,13 +140,61 @@ class ExtractionLogger:
         
         # 生成带时间戳的日志文件名
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.log_file = os.path.join(log_dir, f"extraction_log_{timestamp}.json")
-        
-        # 初始化日志结构
-        self.logs: List[Dict[str, Any]] = []
+        self.stem = f"extraction_log_{timestamp}"
+        self.log_file = os.path.join(log_dir, f"{self.stem}.json")
+
+        self.max_bytes = int(float(os.getenv("EXTRACT_LOG_MAX_MB", "64")) * 1024 * 1024)
+        self.fsync_secs = float(os.getenv("EXTRACT_LOG_FSYNC_SECS", "5"))
+        self._segment = -1
+        self._fh = None
+        self._closed = False
+        self._meta: Optional[Dict[str, Any]] = None  # 分段创建前暂存的 _meta 行
+        self._last_fsync = time.time()
+        atexit.register(self.close)
+
+        # 运行统计（记录本身不在内存中保留）
         self.total_papers = 0
         self.successful_extractions = 0
         self.failed_extractions = 0
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+
+    def _open_next_segment(self):
+        if self._fh is not None:
+            self._sync()
+            self._fh.close()
+        self._segment += 1
+        self.segment_file = os.path.join(self.log_dir, f"{self.stem}.{self._segment:03d}.ndjson")
+        self._fh = open(self.segment_file, "a", encoding="utf-8")
+
+    def _sync(self):
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._last_fsync = time.time()
+
+    def _append(self, record: Dict[str, Any]):
+        """追加一行；第一条记录时创建分段（先补写暂存的 _meta），超过大小上限时切换分段，按间隔 fsync"""
+        if self._closed:
+            return
+        if self._fh is None:
+            self._open_next_segment()
+            if self._meta is not None and record is not self._meta:
+                self._fh.write(json.dumps(self._meta, ensure_ascii=False) + "\n")
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        if self._fh.tell() and self._fh.tell() + len(line.encode("utf-8")) > self.max_bytes:
+            self._open_next_segment()
+        self._fh.write(line)
+        self._fh.flush()
+        if time.time() - self._last_fsync >= self.fsync_secs:
+            self._sync()
+
+    def close(self):
+        """刷新并关闭当前分段（进程退出时自动调用）"""
+        self._closed = True
+        if self._fh is not None:
+            self._sync()
+            self._fh.close()
+            self._fh = None
     
     def add_log_entry(
         self,
@@ -44,6 +206,7 @@ class ExtractionLogger:
         prompt_tokens: int = 0,
         completion_tokens: int = 0,
         total_tokens: int = 0,
+        cached_prompt_tokens: int = 0,
         error: Optional[str] = None,
         **kwargs  # 额外的字段
     ):
@@ -59,6 +222,7 @@ class ExtractionLogger:
             prompt_tokens: prompt token 数
             completion_tokens: completion token 数
             total_tokens: 总 token 数
+            cached_prompt_tokens: 命中服务端前缀缓存的 prompt token 数（包含在 prompt_tokens 内）
             error: 错误信息（如果失败）
             **kwargs: 其他额外字段
         """
@@ -71,6 +235,7 @@ class ExtractionLogger:
             "prompt_tokens": prompt_tokens,
             "completion_tokens": completion_tokens,
             "total_tokens": total_tokens,
+            "cached_prompt_tokens": cached_prompt_tokens,
             "success": success
         }
         
@@ -81,9 +246,11 @@ class ExtractionLogger:
         # 添加额外字段
         log_entry.update(kwargs)
         
-        self.logs.append(log_entry)
+        self._append(log_entry)
         
         # 更新统计
+        self.prompt_tokens += prompt_tokens or 0
+        self.cached_prompt_tokens += cached_prompt_tokens or 0
         if success:
             self.successful_extractions += 1
         else:
@@ -92,28 +259,34 @@ class ExtractionLogger:
     def set_total_papers(self, total: int):
         """设置总论文数"""
         self.total_papers = total
+        self._meta = {"_meta": {"provider": self.provider_name, "total_papers": total}}
+        # 分段尚未创建时只暂存，随第一条记录一起写入
+        if self._fh is not None:
+            self._append(self._meta)
     
     def save(self):
-        """保存日志到文件"""
-        log_data = {
-            "total_papers": self.total_papers,
-            "successful_extractions": self.successful_extractions,
-            "failed_extractions": self.failed_extractions,
-            "logs": self.logs
-        }
-        
-        with open(self.log_file, "w", encoding="utf-8") as f:
-            json.dump(log_data, f, ensure_ascii=False, indent=2)
-        
+        """关闭 NDJSON 分段并压缩为汇总日志文件"""
+        self.close()
+        if compact_log(self.log_dir, self.stem) is None:
+            print("\n本次运行没有日志记录，未生成日志文件")
+            return None
+
         print(f"\n日志已保存到: {self.log_file}")
         return self.log_file
     
+    def _cache_hit_rate(self) -> float:
+        """服务端前缀缓存命中的 prompt token 占比（%）"""
+        if not self.prompt_tokens:
+            return 0
+        return round(self.cached_prompt_tokens / self.prompt_tokens * 100, 2)
+
     def get_summary(self) -> Dict[str, Any]:
         """获取统计摘要"""
         return {
             "total_papers": self.total_papers,
             "successful": self.successful_extractions,
             "failed": self.failed_extractions,
+            "prompt_cache_hit_rate": self._cache_hit_rate(),
             "success_rate": (
                 round(self.successful_extractions / self.total_papers * 100, 2)
                 if self.total_papers > 0 else 0
@@ -153,3 +326,15 @@ def count_entities_and_relations(json_data: Dict[str, Any]) -> tuple[int, int]:
             relation_count = sum(len(v) if isinstance(v, list) else 1 for v in relations.values())
     
     return entity_count, relation_count
+
+
+if __name__ == "__main__":
+    # 手动压缩中断运行留下的 NDJSON 分段：python log_manager.py compact <日志目录> [stem]
+    if len(sys.argv) not in (3, 4) or sys.argv[1] != "compact":
+        print("用法: python log_manager.py compact <日志目录> [extraction_log_<时间戳>]")
+        sys.exit(1)
+    compacted = compact_orphans(sys.argv[2], sys.argv[3] if len(sys.argv) == 4 else None)
+    for path in compacted:
+        print(f"已压缩: {path}")
+    if not compacted:
+        print("没有需要压缩的 NDJSON 分段")
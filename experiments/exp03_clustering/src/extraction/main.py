@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 """
 实体提取主入口
-支持运行 DeepSeek、Gemini、Kimi 三种提取器
+支持运行 DeepSeek、Gemini、Kimi 三种提取器（默认依次运行，--parallel 同时运行）
 """
 import os
+import re
 import sys
+import time
 import argparse
+import threading
 import subprocess
 from datetime import datetime
 from pathlib import Path
@@ -21,19 +24,19 @@ EXTRACTORS = {
         "script": SCRIPT_DIR / "exact_deepseek.py",
         "name": "DeepSeek",
         "env_vars": ["DEEPSEEK_API_KEY"],
-        "optional_vars": ["DEEPSEEK_MAX_TOKENS_BASE", "DEEPSEEK_MAX_TOKENS_CAP", "DEEPSEEK_TEMPERATURE"]
+        "optional_vars": ["DEEPSEEK_MAX_TOKENS_BASE", "DEEPSEEK_MAX_TOKENS_CAP", "DEEPSEEK_TEMPERATURE", "EXTRACT_STREAM", "EXTRACT_CHUNKED", "EXTRACT_PLAN_ONLY", "EXTRACT_BATCH", "EXTRACT_PROMPT_LAYOUT", "LLM_METRICS_FILE", "LLM_HEDGE", "DEEPSEEK_FALLBACK", "EXTRACT_SCHEMA_PRUNE"]
     },
     "gemini": {
         "script": SCRIPT_DIR / "exact_gemini.py",
         "name": "Gemini",
         "env_vars": ["HIAPI_API_KEY", "GEMINI_API_KEY"],  # 任一即可
-        "optional_vars": ["HIAPI_BASE_URL", "EXTRACT_SLEEP_SECS", "EXTRACT_MAX_RETRIES"]
+        "optional_vars": ["HIAPI_BASE_URL", "EXTRACT_SLEEP_SECS", "EXTRACT_MAX_RETRIES", "EXTRACT_CHUNKED", "EXTRACT_PLAN_ONLY", "EXTRACT_BATCH", "EXTRACT_PROMPT_LAYOUT", "LLM_METRICS_FILE", "LLM_HEDGE", "GEMINI_FALLBACK", "EXTRACT_SCHEMA_PRUNE"]
     },
     "kimi": {
         "script": SCRIPT_DIR / "exact_kimi.py",
         "name": "Kimi",
         "env_vars": ["KIMI_API_KEY", "MOONSHOT_API_KEY"],  # 任一即可
-        "optional_vars": []
+        "optional_vars": ["KIMI_MAX_TOKENS_CAP", "EXTRACT_CHUNKED", "EXTRACT_PLAN_ONLY", "EXTRACT_BATCH", "EXTRACT_PROMPT_LAYOUT", "LLM_METRICS_FILE", "LLM_HEDGE", "KIMI_FALLBACK", "EXTRACT_SCHEMA_PRUNE"]
     }
 }
 
@@ -184,33 +187,282 @@ def run_extractor(extractor_key, dry_run=False):
         print(f"[DRY RUN] 将执行: python {script_path}")
         return True
     
+    # 关键修复：不要用管道捕获输出，直接继承父进程的 TTY
+    # 这样子进程中的 tqdm 能检测到控制台并进行单行刷新，避免多行重复输出
+    env = os.environ.copy()
+    env["PYTHONUNBUFFERED"] = "1"  # 确保子进程即时输出
+
     try:
-        # 关键修复：不要用管道捕获输出，直接继承父进程的 TTY
-        # 这样子进程中的 tqdm 能检测到控制台并进行单行刷新，避免多行重复输出
-        env = os.environ.copy()
-        env["PYTHONUNBUFFERED"] = "1"  # 确保子进程即时输出
-
-        result = subprocess.run(
-            [sys.executable, str(script_path)],
-            env=env,
-            check=False
-        )
-
-        if result.returncode == 0:
-            print(f"\n✅ {config['name']} 提取完成")
-            return True
-        else:
-            print(f"\n❌ {config['name']} 提取失败 (退出码: {result.returncode})")
-            return False
-            
-    except KeyboardInterrupt:
-        print(f"\n⚠️  用户中断 {config['name']} 提取")
-        # 使用 subprocess.run 后没有进程句柄可终止，这里仅返回 False
-        return False
+        proc = subprocess.Popen([sys.executable, str(script_path)], env=env)
     except Exception as e:
         print(f"\n❌ 运行 {config['name']} 时出错: {e}")
         return False
 
+    try:
+        returncode = proc.wait()
+    except KeyboardInterrupt:
+        print(f"\n⚠️  用户中断 {config['name']} 提取，等待其保存日志…")
+        _stop_process(proc, config['name'])
+        # 中断整个运行，不再启动后续提取器
+        raise
+
+    if returncode == 0:
+        print(f"\n✅ {config['name']} 提取完成")
+        return True
+    print(f"\n❌ {config['name']} 提取失败 (退出码: {returncode})")
+    return False
+
+
+def _stop_process(proc, name, grace_secs=10.0):
+    """停止子进程：先等待其自行处理 Ctrl+C（保存日志），超时后 terminate，再超时则 kill"""
+    if proc.poll() is not None:
+        return
+    try:
+        proc.wait(timeout=grace_secs)
+        return
+    except subprocess.TimeoutExpired:
+        pass
+    print(f"⚠️  {name} 未在 {grace_secs:.0f}s 内退出，发送终止信号")
+    proc.terminate()
+    try:
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        print(f"⚠️  {name} 仍未退出，强制结束")
+        proc.kill()
+        proc.wait()
+
+
+# ------------------------------
+# 并行模式：同时运行多个提取器
+# ------------------------------
+try:
+    from tqdm.auto import tqdm  # type: ignore
+    HAVE_TQDM = True
+except Exception:
+    tqdm = None  # type: ignore
+    HAVE_TQDM = False
+
+# 子进程输出中用于推断进度的关键行（与 exact_*.py 的输出保持一致）
+PLAN_PATTERN = re.compile(r"计划：第1批（试运行）(\d+) 篇；第2批（优先）(\d+) 篇；第3批（普通）(\d+) 篇")
+LINE_SUCCESS = "结果已保存到"
+LINE_SKIPPED = "已完成或处理中，跳过："
+LINE_FAILED = "（已放弃）"
+LINE_ABORTED = "余额不足，终止后续任务"
+LINE_DEFERRED = "熔断中，任务已归还"
+# 超出上下文窗口被拒绝提交（行首匹配，不与预估报告中的“将拒绝提交”混淆）与 batch 模式的逐篇失败
+REJECTED_PATTERN = re.compile(r"^拒绝提交：")
+BATCH_FAILED_PATTERN = re.compile(r"^❌ .+?\.md：")
+# 批次汇总行，用于校正计数（batch 模式与各批结束时输出）
+SUMMARY_PATTERN = re.compile(r"(?:batch 处理完成|第\d批完成)：(?:当前总计)?成功 (\d+) 篇，失败 (\d+) 篇，跳过 (\d+) 篇")
+
+
+class _ProviderRun:
+    """单个提取器子进程的运行状态"""
+
+    def __init__(self, key, position):
+        self.key = key
+        self.name = EXTRACTORS[key]["name"]
+        self.position = position
+        self.proc = None
+        self.reader = None
+        self.log_path = None
+        self.total = None
+        self.success = 0
+        self.failed = 0
+        self.skipped = 0
+        self.deferred = 0
+        self.aborted = False
+        self.start_ts = None
+        self.end_ts = None
+        self.bar = None
+
+    @property
+    def done(self):
+        return self.success + self.failed + self.skipped + self.deferred
+
+    @property
+    def wall_secs(self):
+        if self.start_ts is None:
+            return 0.0
+        return (self.end_ts or time.time()) - self.start_ts
+
+
+def _consume_output(run, lock):
+    """读取子进程输出：写入控制台日志文件，并根据关键行刷新进度"""
+    with open(run.log_path, "w", encoding="utf-8") as log_f:
+        for line in run.proc.stdout:
+            log_f.write(line)
+            log_f.flush()
+            text = line.rstrip("\n")
+            with lock:
+                m = PLAN_PATTERN.search(text)
+                if m:
+                    run.total = sum(int(x) for x in m.groups())
+                    if run.bar is not None:
+                        run.bar.total = run.total
+                        run.bar.refresh()
+                    continue
+                step = 0
+                m = SUMMARY_PATTERN.search(text)
+                if m:
+                    # 以提取器自己的汇总为准，校正逐行推断的计数
+                    before = run.done
+                    run.success, run.failed, run.skipped = (int(x) for x in m.groups())
+                    step = run.done - before
+                elif LINE_SUCCESS in text:
+                    run.success += 1
+                    step = 1
+                elif LINE_SKIPPED in text:
+                    run.skipped += 1
+                    step = 1
+                elif LINE_FAILED in text or REJECTED_PATTERN.search(text) or BATCH_FAILED_PATTERN.search(text):
+                    run.failed += 1
+                    step = 1
+                    _echo(run, text)
+                elif LINE_DEFERRED in text:
+                    run.deferred += 1
+                    step = 1
+                    _echo(run, text)
+                elif LINE_ABORTED in text:
+                    run.aborted = True
+                    _echo(run, text)
+                elif "Traceback" in text or text.startswith(("❌", "预检失败")):
+                    _echo(run, text)
+                if step:
+                    if run.bar is not None:
+                        run.bar.update(step)
+                        run.bar.set_postfix(success=run.success, failed=run.failed, skipped=run.skipped, deferred=run.deferred)
+                    else:
+                        total = run.total if run.total is not None else "?"
+                        print(f"[{run.name}] {run.done}/{total}（成功 {run.success} / 失败 {run.failed} / 跳过 {run.skipped} / 归还 {run.deferred}）")
+
+
+def _echo(run, text):
+    """在进度条上方输出子进程的重要信息"""
+    msg = f"[{run.name}] {text}"
+    if HAVE_TQDM:
+        tqdm.write(msg)
+    else:
+        print(msg)
+
+
+def run_extractors_parallel(extractor_keys, dry_run=False):
+    """
+    同时运行多个提取器
+
+    - 子进程输出重定向到 outputs/logs/<provider>/console_<时间戳>.log
+    - 父进程根据输出关键行绘制多进度条
+    - Ctrl+C 时等待子进程保存日志，超时后 terminate / kill
+
+    Returns:
+        ({provider: 是否成功}, {provider: _ProviderRun})
+    """
+    runs = []
+    for key in extractor_keys:
+        script_path = EXTRACTORS[key]["script"]
+        if not script_path.exists():
+            print(f"❌ 脚本不存在: {script_path}")
+            continue
+        runs.append(_ProviderRun(key, len(runs)))
+
+    if dry_run:
+        for run in runs:
+            print(f"[DRY RUN] 将并行执行: python {EXTRACTORS[run.key]['script']}")
+        return {run.key: True for run in runs}, {}
+
+    if not runs:
+        return {}, {}
+
+    # 子进程无法交互，未显式设置时默认自动继续剩余批次
+    env = os.environ.copy()
+    env["PYTHONUNBUFFERED"] = "1"
+    env["PYTHONIOENCODING"] = "utf-8"
+    env.setdefault("AUTO_CONTINUE_REST", "y")
+    # 子进程的 tqdm 输出到管道无意义，由父进程统一绘制
+    env["TQDM_DISABLE"] = "1"
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    lock = threading.Lock()
+
+    print("\n" + "=" * 70)
+    print(f"🚀 并行启动 {len(runs)} 个提取器: {', '.join(run.name for run in runs)}")
+    print(f"   AUTO_CONTINUE_REST={env['AUTO_CONTINUE_REST']}")
+    print("=" * 70)
+
+    interrupted = False
+    try:
+        for run in runs:
+            log_dir = EXP_DIR / "outputs" / "logs" / run.key
+            log_dir.mkdir(parents=True, exist_ok=True)
+            run.log_path = log_dir / f"console_{timestamp}.log"
+            print(f"   {run.name:10s} 控制台输出 → {run.log_path}")
+        print()
+
+        for run in runs:
+            if HAVE_TQDM:
+                run.bar = tqdm(total=None, desc=f"{run.name:10s}", unit="篇", position=run.position, leave=True)
+            run.start_ts = time.time()
+            run.proc = subprocess.Popen(
+                [sys.executable, str(EXTRACTORS[run.key]["script"])],
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                encoding="utf-8",
+                errors="replace",
+                bufsize=1,
+            )
+            run.reader = threading.Thread(target=_consume_output, args=(run, lock), daemon=True)
+            run.reader.start()
+
+        # 轮询等待（而非阻塞 wait），以便及时响应 Ctrl+C
+        pending = list(runs)
+        while pending:
+            for run in list(pending):
+                if run.proc.poll() is not None:
+                    run.end_ts = time.time()
+                    pending.remove(run)
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        interrupted = True
+        print("\n⚠️  用户中断，等待各提取器保存日志后退出…")
+        for run in runs:
+            if run.proc is not None:
+                _stop_process(run.proc, run.name)
+                run.end_ts = run.end_ts or time.time()
+    finally:
+        for run in runs:
+            if run.reader is not None:
+                run.reader.join(timeout=5)
+            if run.bar is not None:
+                run.bar.close()
+
+    results = {}
+    for run in runs:
+        ok = (run.proc is not None and run.proc.returncode == 0 and not interrupted)
+        results[run.key] = ok
+    return results, {run.key: run for run in runs}
+
+
+def print_parallel_summary(runs, total_wall_secs):
+    """打印并行运行的耗时与吞吐汇总"""
+    print("\n" + "=" * 70)
+    print(" " * 22 + "并行执行耗时与吞吐")
+    print("=" * 70)
+    print(f"{'提取器':10s} {'墙钟(s)':>9s} {'成功':>6s} {'失败':>6s} {'跳过':>6s} {'归还':>6s} {'篇/分钟':>9s}  退出码")
+    for run in runs.values():
+        processed = run.success + run.failed
+        minutes = run.wall_secs / 60.0
+        rate = processed / minutes if minutes > 0 else 0.0
+        code = run.proc.returncode if run.proc is not None else "-"
+        flag = "（余额不足中止）" if run.aborted else ""
+        print(f"{run.name:10s} {run.wall_secs:9.1f} {run.success:6d} {run.failed:6d} {run.skipped:6d} {run.deferred:6d} {rate:9.2f}  {code}{flag}")
+    sequential = sum(run.wall_secs for run in runs.values())
+    print("-" * 70)
+    print(f"总墙钟: {total_wall_secs:.1f}s（串行估计 {sequential:.1f}s）")
+    print("=" * 70)
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -224,6 +476,9 @@ def main():
   # 运行指定提取器
   python main.py --extractors deepseek gemini
   
+  # 同时运行所有提取器（多进度条，输出写入 outputs/logs/<provider>/console_*.log）
+  python main.py --all --parallel
+  
   # 检查环境但不运行
   python main.py --check-only
   
@@ -264,6 +519,12 @@ def main():
         help="模拟运行，不实际执行提取"
     )
     
+    parser.add_argument(
+        "-p", "--parallel",
+        action="store_true",
+        help="同时运行所选提取器（未设置 AUTO_CONTINUE_REST 时默认自动继续）"
+    )
+    
     parser.add_argument(
         "--skip-data-check",
         action="store_true",
@@ -330,9 +591,18 @@ def main():
     
     # 运行提取器
     results = {}
-    for i, extractor_key in enumerate(valid_extractors, 1):
-        print(f"\n[{i}/{len(valid_extractors)}] 处理 {EXTRACTORS[extractor_key]['name']}")
-        results[extractor_key] = run_extractor(extractor_key, dry_run=args.dry_run)
+    wall_secs = {}
+    parallel_runs = {}
+    run_start = time.time()
+    if args.parallel and len(valid_extractors) > 1:
+        results, parallel_runs = run_extractors_parallel(valid_extractors, dry_run=args.dry_run)
+    else:
+        for i, extractor_key in enumerate(valid_extractors, 1):
+            print(f"\n[{i}/{len(valid_extractors)}] 处理 {EXTRACTORS[extractor_key]['name']}")
+            t0 = time.time()
+            results[extractor_key] = run_extractor(extractor_key, dry_run=args.dry_run)
+            wall_secs[extractor_key] = time.time() - t0
+    total_wall = time.time() - run_start
     
     # 打印总结
     print("\n" + "=" * 70)
@@ -341,10 +611,14 @@ def main():
     
     for extractor_key, success in results.items():
         status = "✅ 成功" if success else "❌ 失败"
-        print(f"{EXTRACTORS[extractor_key]['name']:15s} - {status}")
+        elapsed = parallel_runs[extractor_key].wall_secs if extractor_key in parallel_runs else wall_secs.get(extractor_key, 0.0)
+        print(f"{EXTRACTORS[extractor_key]['name']:15s} - {status}（{elapsed:.1f}s）")
     
     print("=" * 70)
     
+    if parallel_runs:
+        print_parallel_summary(parallel_runs, total_wall)
+    
     # 显示输出位置
     outputs_dir = EXP_DIR / "outputs" / "extractions"
     print(f"\n📁 提取结果保存在: {outputs_dir}")
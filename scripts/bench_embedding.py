@@ -0,0 +1,72 @@
+"""
+段落嵌入吞吐基准
+
+在真实论文段落上比较 EmbeddingEngine（src/clustering/embedding_engine.py）不同批大小下的吞吐：
+batch=1 相当于原 第一步构建词向量库.py 的逐段嵌入。段落切分方式与第一步相同（空行分段、长度 > 10）。
+
+用法：
+    python scripts/bench_embedding.py
+    python scripts/bench_embedding.py --root experiments/exp03_clustering/data/raw/papers --limit 512 \\
+        --batch-sizes 1,8,16,32,64 --threads 8 --check
+"""
+import argparse
+import random
+import sys
+from pathlib import Path
+from typing import List
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT / "src" / "clustering"))
+
+from embedding_engine import EmbeddingEngine, benchmark  # noqa: E402
+
+
+def load_paragraphs(root: Path, limit: int, seed: int = 0) -> List[str]:
+    paragraphs = []
+    for path in sorted(root.rglob("*.md")):
+        content = path.read_text(encoding="utf-8", errors="ignore")
+        paragraphs.extend(p.strip() for p in content.split("\n\n") if len(p.strip()) > 10)
+    # 随机抽样，保持长短段落混合（排序后的连续段落长度分布不具代表性）
+    random.Random(seed).shuffle(paragraphs)
+    return paragraphs[:limit] if limit > 0 else paragraphs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="段落嵌入吞吐基准（段落/秒 vs 批大小）")
+    parser.add_argument("--root", default=str(PROJECT_ROOT / "experiments" / "exp03_clustering" / "data" / "raw" / "papers"))
+    parser.add_argument("--limit", type=int, default=256, help="参与测试的段落数（默认 256；0 表示全部）")
+    parser.add_argument("--batch-sizes", default="1,4,8,16,32,64", help="逗号分隔的批大小")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op 线程数（默认 EMBED_THREADS 或 CPU 核数）")
+    parser.add_argument("--device", default=None, help="cpu / cuda")
+    parser.add_argument("--repeats", type=int, default=1, help="每个批大小重复次数（取最快）")
+    parser.add_argument("--check", action="store_true", help="检查批量结果与逐段结果的最大差异")
+    args = parser.parse_args()
+
+    texts = load_paragraphs(Path(args.root), args.limit)
+    if not texts:
+        print(f"未在 {args.root} 下找到段落")
+        return
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",") if b.strip()]
+    engine = EmbeddingEngine(device=args.device, threads=args.threads).load()
+    lengths = sorted(len(t) for t in texts)
+    print(f"段落 {len(texts)} 个（字符数中位数 {lengths[len(lengths) // 2]}，最长 {lengths[-1]}），"
+          f"设备 {engine.device}" + (f"，线程 {engine.threads}" if engine.device.type == "cpu" else ""))
+
+    results = benchmark(engine, texts, batch_sizes, args.repeats)
+    base = results[0]["paragraphs_per_sec"] if results else None
+    print(f"{'batch':>6} {'秒':>9} {'段落/秒':>10} {'加速比':>8}")
+    for r in results:
+        speedup = r["paragraphs_per_sec"] / base if base else 0.0
+        print(f"{r['batch_size']:>6} {r['seconds']:>9.2f} {r['paragraphs_per_sec']:>10.2f} {speedup:>7.2f}x")
+
+    if args.check:
+        import numpy as np
+
+        sample = texts[:32]
+        single = np.stack([engine.embed_one(t) for t in sample])
+        batched = engine.embed(sample, batch_size=max(batch_sizes))
+        print(f"一致性：批量与逐段结果最大绝对差 {float(np.abs(single - batched).max()):.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+抽取吞吐基准（离线）
+
+在本地 mock 服务（scripts/mock_openai_server.py）上运行真实的 exp03 抽取脚本，测量：
+- papers/min：成功写出的抽取结果数 / 墙钟时间
+- 每请求 CPU 毫秒：子进程 user+sys CPU 时间 / mock 收到的请求数（含注入的错误）；
+  CPU 时间由子进程退出时自行读取 os.times() 写回（Windows 与 POSIX 通用）
+- 请求状态分布、响应来源（回放 / 评估 / 合成）与输出 token 数（来自 mock 统计）
+
+为避免污染真实 outputs/，每次运行都在临时工作区中进行：src、config、实验 config/data 与
+抽取脚本目录复制到 <tmp> 下的相同相对位置（脚本按自身路径定位目录，因此输出落在临时工作区；
+复制而非符号链接，Windows 下无需管理员权限）。LLM 缓存被绕过，预检缓存与指标快照也写在临时目录。
+
+用法：
+    python scripts/bench_extraction.py --provider deepseek --papers 20 --concurrency 8
+    python scripts/bench_extraction.py --provider deepseek --provider kimi --papers 50 \\
+        --ttft 2 --latency-sigma 0.8 --tokens-per-sec 60 --error-429 0.05 --truncate 0.05 \\
+        --replay-dir experiments/exp03_clustering/outputs/extractions --json bench.json
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from mock_openai_server import add_profile_arguments, make_server, profile_from_args  # noqa: E402
+
+PROVIDERS = {
+    "deepseek": {"script": "exact_deepseek.py", "env": {"DEEPSEEK_API_KEY": "sk-bench", "DEEPSEEK_BASE_URL": "{url}"}},
+    "gemini": {"script": "exact_gemini.py", "env": {"HIAPI_API_KEY": "sk-bench", "HIAPI_BASE_URL": "{url}"}},
+    "kimi": {"script": "exact_kimi.py", "env": {"KIMI_API_KEY": "sk-bench", "KIMI_BASE_URL": "{url}"}},
+}
+
+
+# 子进程入口：运行抽取脚本，退出时把本进程（含其子进程）的 CPU 时间写入文件
+CHILD_WRAPPER = """
+import atexit, json, os, runpy, sys
+script, cpu_file = sys.argv[1], sys.argv[2]
+
+def _dump_cpu():
+    t = os.times()
+    with open(cpu_file, "w", encoding="utf-8") as f:
+        json.dump({"cpu_secs": t.user + t.system + t.children_user + t.children_system}, f)
+
+atexit.register(_dump_cpu)
+sys.argv = [script]
+sys.path.insert(0, os.path.dirname(script))
+runpy.run_path(script, run_name="__main__")
+"""
+
+_COPY_IGNORE = shutil.ignore_patterns("__pycache__", "*.pyc")
+
+
+def build_workspace(root: Path, experiment: str) -> Path:
+    """构建临时工作区（复制所需目录），返回其中的抽取脚本目录"""
+    exp_src = PROJECT_ROOT / "experiments" / experiment
+    exp_tmp = root / "experiments" / experiment
+    extraction_tmp = exp_tmp / "src" / "extraction"
+    shutil.copytree(PROJECT_ROOT / "src", root / "src", ignore=_COPY_IGNORE)
+    if (PROJECT_ROOT / "config").is_dir():
+        shutil.copytree(PROJECT_ROOT / "config", root / "config", ignore=_COPY_IGNORE)
+    for name in ("config", "data"):
+        if (exp_src / name).is_dir():
+            shutil.copytree(exp_src / name, exp_tmp / name, ignore=_COPY_IGNORE)
+    shutil.copytree(exp_src / "src" / "extraction", extraction_tmp, ignore=_COPY_IGNORE)
+    return extraction_tmp
+
+
+def read_child_cpu(cpu_file: Path) -> Optional[float]:
+    """子进程写回的 CPU 秒数；子进程异常终止未写出时返回 None"""
+    try:
+        return float(json.loads(cpu_file.read_text(encoding="utf-8"))["cpu_secs"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def fetch_stats(url: str) -> Dict[str, Any]:
+    with urllib.request.urlopen(f"{url.rsplit('/v1', 1)[0]}/mock/stats", timeout=10) as r:
+        return json.loads(r.read().decode("utf-8"))
+
+
+def count_outputs(outputs_dir: Path) -> int:
+    extractions = outputs_dir / "extractions"
+    if not extractions.is_dir():
+        return 0
+    return sum(1 for p in extractions.rglob("*.json") if not p.name.endswith(".raw.json"))
+
+
+def run_provider(provider: str, args: argparse.Namespace, url: str) -> Dict[str, Any]:
+    """在新工作区中运行一次抽取脚本并汇总指标"""
+    root = Path(tempfile.mkdtemp(prefix=f"bench_{provider}_"))
+    try:
+        extraction_dir = build_workspace(root, args.experiment)
+        env = dict(os.environ)
+        env.update({k: v.format(url=url) for k, v in PROVIDERS[provider]["env"].items()})
+        env.update({
+            "FIRST_BATCH_SIZE": str(args.papers),
+            "IN_SCOPE_LIMIT": str(args.papers),
+            "AUTO_CONTINUE_REST": "n",
+            f"{provider.upper()}_CONCURRENCY": str(args.concurrency),
+            "LLM_CACHE_BYPASS": "1",
+            "PREFLIGHT_CACHE_FILE": str(root / "preflight.json"),
+            "LLM_METRICS_FILE": str(root / f"{provider}.prom"),
+            "PYTHONUNBUFFERED": "1",
+        })
+        cpu_file = root / "child_cpu.json"
+        before_stats = fetch_stats(url)
+        started = time.time()
+        proc = subprocess.run(
+            [sys.executable, "-c", CHILD_WRAPPER, str(extraction_dir / PROVIDERS[provider]["script"]), str(cpu_file)],
+            cwd=str(extraction_dir),
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=None if args.verbose else subprocess.DEVNULL,
+            stderr=None if args.verbose else subprocess.PIPE,
+            text=True,
+        )
+        wall = time.time() - started
+        after_stats = fetch_stats(url)
+        cpu = read_child_cpu(cpu_file)
+        requests = after_stats["requests"] - before_stats["requests"]
+        status = {
+            k: v - before_stats["status"].get(k, 0)
+            for k, v in after_stats["status"].items()
+            if v - before_stats["status"].get(k, 0)
+        }
+        sources = {
+            k: v - before_stats.get("sources", {}).get(k, 0)
+            for k, v in after_stats.get("sources", {}).items()
+            if v - before_stats.get("sources", {}).get(k, 0)
+        }
+        papers = count_outputs(root / "experiments" / args.experiment / "outputs")
+        result = {
+            "provider": provider,
+            "returncode": proc.returncode,
+            "papers": papers,
+            "wall_secs": round(wall, 2),
+            "papers_per_min": round(papers / wall * 60, 2) if wall > 0 else 0.0,
+            "requests": requests,
+            "status": status,
+            "sources": sources,
+            "completion_tokens": after_stats["completion_tokens"] - before_stats["completion_tokens"],
+            "cpu_secs": round(cpu, 3) if cpu is not None else None,
+            "cpu_ms_per_request": round(cpu * 1000 / requests, 1) if requests and cpu is not None else None,
+            "workspace": str(root) if args.keep else None,
+        }
+        if proc.returncode != 0 and not args.verbose and proc.stderr:
+            print(f"⚠️  {provider} 退出码 {proc.returncode}，stderr 末尾：\n{proc.stderr[-2000:]}")
+        if args.replay_dir and sources and not sources.get("replay"):
+            print(f"⚠️  {provider}：指定了 --replay-dir 但没有请求得到回放内容（来源 {sources}），吞吐结果不代表真实输出")
+        return result
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线抽取吞吐基准（本地 mock 服务 + 真实抽取脚本）")
+    parser.add_argument("--provider", action="append", choices=sorted(PROVIDERS), help="可重复；默认 deepseek")
+    parser.add_argument("--papers", type=int, default=20, help="抽取的优先论文篇数（默认 20）")
+    parser.add_argument("--concurrency", type=int, default=4, help="抽取并发数（默认 4）")
+    parser.add_argument("--experiment", default="exp03_clustering", help="实验目录名（默认 exp03_clustering）")
+    parser.add_argument("--keep", action="store_true", help="保留临时工作区（输出、日志、指标快照）")
+    parser.add_argument("--verbose", action="store_true", help="显示抽取脚本输出")
+    parser.add_argument("--json", default=None, help="把结果写入该 JSON 文件")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    server = make_server("127.0.0.1", 0, 1.0, profile_from_args(args), args.replay_dir, args.seed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    print(f"🧪 Mock 服务：{url}（回放语料 {len(server.store.corpus)} 份）")
+
+    results = []
+    try:
+        for provider in args.provider or ["deepseek"]:
+            print(f"▶️  {provider}：{args.papers} 篇，并发 {args.concurrency} ...")
+            r = run_provider(provider, args, url)
+            results.append(r)
+            cpu_ms = f"{r['cpu_ms_per_request']}ms" if r["cpu_ms_per_request"] is not None else "-"
+            print(
+                f"📊 {provider}: {r['papers']} 篇 / {r['wall_secs']}s = {r['papers_per_min']} papers/min | "
+                f"请求 {r['requests']} {r['status']} 来源 {r['sources']} | CPU {r['cpu_secs']}s（{cpu_ms}/请求）"
+                + (f" | 工作区 {r['workspace']}" if r["workspace"] else "")
+            )
+    finally:
+        server.shutdown()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"profile": profile_from_args(args), "papers": args.papers,
+                       "concurrency": args.concurrency, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已写入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+部分 JSON 恢复基准
+
+在已保存的 .raw.txt（解析失败时落盘的模型原始输出）上比较：
+- strict：json.loads（现有 parse_strict_json 的主路径，截断时整体失败）
+- incremental：stream_json.IncrementalExtractionParser 一次性 feed 整段文本（逐字符扫描）
+- salvage：json_salvage.salvage_extraction（raw_decode 逐元素解码）
+
+.raw.txt 样本较少时，可用 --synthetic N 从已有抽取结果 JSON 随机截断生成 N 个样本。
+
+用法：
+    python scripts/bench_json_salvage.py
+    python scripts/bench_json_salvage.py --root experiments/exp03_clustering/outputs --synthetic 200
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT / "src"))
+
+from utils.json_salvage import salvage_extraction  # noqa: E402
+from utils.stream_json import IncrementalExtractionParser  # noqa: E402
+
+
+def load_raw_samples(roots: List[Path]) -> List[Tuple[str, str]]:
+    samples = []
+    for root in roots:
+        for path in sorted(root.rglob("*.raw.txt")):
+            samples.append((str(path.relative_to(PROJECT_ROOT) if path.is_relative_to(PROJECT_ROOT) else path),
+                            path.read_text(encoding="utf-8")))
+    return samples
+
+
+def make_synthetic_samples(roots: List[Path], n: int, seed: int = 0) -> List[Tuple[str, str]]:
+    """把已有的抽取结果 JSON 重新缩进后，在 30%~99% 长度之间随机截断"""
+    rng = random.Random(seed)
+    sources = []
+    for root in roots:
+        for path in root.rglob("*.json"):
+            try:
+                data = json.loads(path.read_text(encoding="utf-8"))
+            except (ValueError, UnicodeDecodeError):
+                continue
+            if isinstance(data, dict) and isinstance(data.get("entities"), list) and data["entities"]:
+                sources.append((path.name, json.dumps(data, ensure_ascii=False, indent=2)))
+    if not sources:
+        return []
+    samples = []
+    for i in range(n):
+        name, text = rng.choice(sources)
+        cut = int(len(text) * rng.uniform(0.3, 0.99))
+        samples.append((f"synthetic#{i}:{name}", text[:cut]))
+    return samples
+
+
+def _strict(text: str) -> int:
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return 0
+    return len(data.get("entities") or []) + len(data.get("relations") or [])
+
+
+def _incremental(text: str) -> int:
+    parser = IncrementalExtractionParser()
+    parser.feed(text)
+    return parser.item_count
+
+
+def _salvage(text: str) -> int:
+    result = salvage_extraction(text)
+    return result["items"] if result else 0
+
+
+METHODS: List[Tuple[str, Callable[[str], int]]] = [
+    ("strict", _strict),
+    ("incremental", _incremental),
+    ("salvage", _salvage),
+]
+
+
+def bench(samples: List[Tuple[str, str]], repeat: int) -> None:
+    total_bytes = sum(len(text.encode("utf-8")) for _, text in samples)
+    print(f"样本 {len(samples)} 个，共 {total_bytes / 1024:.1f} KB，每个样本重复 {repeat} 次\n")
+    print(f"{'方法':<12}{'恢复元素':>10}{'成功样本':>10}{'平均(ms)':>12}{'P95(ms)':>12}{'吞吐(MB/s)':>14}")
+    for name, fn in METHODS:
+        times = []
+        items = 0
+        recovered = 0
+        for _, text in samples:
+            best = float("inf")
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                count = fn(text)
+                best = min(best, time.perf_counter() - t0)
+            times.append(best)
+            items += count
+            recovered += 1 if count else 0
+        mean_ms = statistics.mean(times) * 1000
+        p95_ms = sorted(times)[max(0, int(len(times) * 0.95) - 1)] * 1000
+        throughput = total_bytes / sum(times) / 1e6 if sum(times) else 0.0
+        print(f"{name:<12}{items:>10}{recovered:>10}{mean_ms:>12.3f}{p95_ms:>12.3f}{throughput:>14.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="部分 JSON 恢复基准")
+    parser.add_argument("--root", action="append", type=Path,
+                        help="搜索 .raw.txt / 抽取结果的目录（可重复，默认 experiments/）")
+    parser.add_argument("--synthetic", type=int, default=0, help="额外生成的随机截断样本数（默认 0）")
+    parser.add_argument("--repeat", type=int, default=20, help="每个样本的重复次数，取最快一次（默认 20）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    roots = [p.resolve() for p in (args.root or [PROJECT_ROOT / "experiments"])]
+    samples = load_raw_samples(roots)
+    print(f"📄 找到 .raw.txt 样本 {len(samples)} 个")
+    if args.synthetic:
+        synthetic = make_synthetic_samples(roots, args.synthetic, args.seed)
+        print(f"🧪 生成随机截断样本 {len(synthetic)} 个")
+        samples += synthetic
+    if not samples:
+        print("⚠️ 没有可用样本：请指定 --root 或使用 --synthetic")
+        return
+    bench(samples, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
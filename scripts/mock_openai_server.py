@@ -0,0 +1,581 @@
+"""
+本地 OpenAI 兼容 API 替身服务
+
+用于在无网络、不花 token 的情况下测试 batch 提交模式与压测抽取流程，实现：
+- POST /v1/chat/completions       同步与流式（stream=true，SSE）对话补全
+- GET  /v1/models                 模型列表（供启动预检）
+- POST /v1/files                  上传 batch 输入 JSONL（multipart）
+- GET  /v1/files/{id}/content     下载输出 / 错误文件
+- POST /v1/batches                创建批次（后台线程处理，--delay 秒后完成）
+- GET  /v1/batches/{id}           查询批次状态与 request_counts
+- POST /v1/batches/{id}/cancel    取消批次
+- GET  /mock/stats                请求统计（按状态计数、输出 token 数、按响应来源计数）
+
+模拟响应：
+- 评估请求（系统消息为评估专家 EVAL_SYSTEM_PROMPT，或提示词要求添加 `evaluation` 字段）：
+  回显最后一个含 entities/relations 的 ```json 代码块，并为每个实体、关系加上 evaluation="正确"
+- 否则（抽取请求；抽取提示词中的 ```json 输出格式示例不算）：指定 --replay-dir 时按提示词哈希
+  从已有抽取结果 JSON 中选一份回放，未指定时返回由提示词中 "# 标题" 行生成的少量实体与关系
+- --self-check：用 exp03 的真实抽取提示词与评估提示词检查上述分类（抽取提示词必须得到回放内容）
+- usage 按字符数粗略估算
+
+chat/completions 的延迟与故障可配置（见 DEFAULT_PROFILE）：首 token 延迟服从对数正态分布
+（--ttft 为中位数，--latency-sigma 控制长尾），生成耗时按 --tokens-per-sec 计算；
+按比例注入 429 / 500 / 402 错误、长度截断（finish_reason=length）与格式损坏的 JSON。
+
+用法：
+    python scripts/mock_openai_server.py --port 8765 --delay 2
+    $env:BATCH_BASE_URL = "http://127.0.0.1:8765/v1" ; $env:EXTRACT_BATCH = "1"
+
+    python scripts/mock_openai_server.py --port 8766 --replay-dir experiments/exp03_clustering/outputs/extractions \
+        --ttft 1.5 --tokens-per-sec 80 --error-429 0.05 --truncate 0.05
+    $env:DEEPSEEK_BASE_URL = "http://127.0.0.1:8766/v1"
+
+    python scripts/mock_openai_server.py --self-check
+"""
+import re
+import json
+import math
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import sys
+import threading
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+JSON_BLOCK_RE = re.compile(r"```json\s*([\s\S]*?)```")
+HEADING_RE = re.compile(r"^#{1,6}\s+(.+?)\s*$", re.MULTILINE)
+
+# 评估请求的标记：系统消息（evaluate_extractions.EVAL_SYSTEM_PROMPT）与评估提示词结尾的要求；抽取提示词不含
+EVAL_SYSTEM_MARKER = "评估专家"
+EVAL_USER_MARKER = "`evaluation` 字段"
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+
+# ------------------------------
+# 模拟模型输出
+# ------------------------------
+def _last_user_content(messages: List[Dict[str, Any]]) -> str:
+    for msg in reversed(messages or []):
+        if msg.get("role") == "user" and isinstance(msg.get("content"), str):
+            return msg["content"]
+    return ""
+
+
+def _is_evaluation_request(messages: List[Dict[str, Any]]) -> bool:
+    """评估请求：系统消息为评估专家，或最后一条 user 消息要求添加 `evaluation` 字段"""
+    for msg in messages or []:
+        if msg.get("role") == "system" and EVAL_SYSTEM_MARKER in str(msg.get("content") or ""):
+            return True
+    return EVAL_USER_MARKER in _last_user_content(messages)
+
+
+def mock_completion_content(messages: List[Dict[str, Any]]) -> str:
+    """根据请求内容生成确定性的 JSON 输出"""
+    content = _last_user_content(messages)
+    blocks = JSON_BLOCK_RE.findall(content) if _is_evaluation_request(messages) else []
+    for block in reversed(blocks):
+        try:
+            data = json.loads(block)
+        except ValueError:
+            continue
+        if isinstance(data, dict) and ("entities" in data or "relations" in data):
+            for key in ("entities", "relations"):
+                data[key] = [dict(x, evaluation="正确") if isinstance(x, dict) else x for x in data.get(key) or []]
+            return json.dumps(data, ensure_ascii=False)
+
+    headings = [h for h in HEADING_RE.findall(content) if len(h) <= 40][-6:]
+    entities = [{"name": h, "type": "章节主题"} for h in headings]
+    relations = [
+        {"head": a["name"], "relation": "先于", "tail": b["name"]}
+        for a, b in zip(entities, entities[1:])
+    ]
+    return json.dumps({"entities": entities, "relations": relations}, ensure_ascii=False)
+
+
+def load_replay_corpus(replay_dir: Optional[str]) -> List[str]:
+    """从已有抽取结果目录递归读取 {"entities": [...], "relations": [...]} JSON，序列化后作为回放语料"""
+    if not replay_dir:
+        return []
+    corpus = []
+    for path in sorted(Path(replay_dir).rglob("*.json")):
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (ValueError, UnicodeDecodeError, OSError):
+            continue
+        if isinstance(data, dict) and isinstance(data.get("entities"), list) and data["entities"]:
+            corpus.append(json.dumps(data, ensure_ascii=False))
+    return corpus
+
+
+def response_source(messages: List[Dict[str, Any]], corpus: List[str]) -> str:
+    """响应来源："evaluation"（评估回显）、"replay"（回放语料）或 "synthetic"（由标题生成）"""
+    if _is_evaluation_request(messages):
+        return "evaluation"
+    return "replay" if corpus else "synthetic"
+
+
+def replay_content(messages: List[Dict[str, Any]], corpus: List[str]) -> str:
+    """按提示词哈希确定性地选取回放内容（同一篇论文每次得到相同输出）；评估请求与无语料时退回 mock_completion_content"""
+    if response_source(messages, corpus) != "replay":
+        return mock_completion_content(messages)
+    digest = hashlib.sha1(_last_user_content(messages).encode("utf-8")).hexdigest()
+    return corpus[int(digest[:8], 16) % len(corpus)]
+
+
+def mock_chat_completion(body: Dict[str, Any], content: Optional[str] = None, finish_reason: str = "stop") -> Dict[str, Any]:
+    """生成 chat.completion 响应体（content 为空时按请求内容生成）"""
+    messages = body.get("messages") or []
+    if content is None:
+        content = mock_completion_content(messages)
+    prompt_tokens = sum(len(m.get("content") or "") for m in messages if isinstance(m, dict)) // 2 + 1
+    completion_tokens = len(content) // 2 + 1
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock-model"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": finish_reason,
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+# ------------------------------
+# 延迟与故障注入
+# ------------------------------
+DEFAULT_PROFILE = {
+    "ttft": 0.5,              # 首 token 延迟中位数（秒）
+    "latency_sigma": 0.5,     # 首 token 延迟的对数正态 sigma（越大长尾越重；0 表示固定）
+    "tokens_per_sec": 200.0,  # 输出生成速率（0 表示不模拟生成耗时）
+    "time_scale": 1.0,        # 所有延迟乘以该系数，便于快速压测
+    "error_429": 0.0,         # 返回 429（带 Retry-After: 1）的比例
+    "error_500": 0.0,         # 返回 500 的比例
+    "error_402": 0.0,         # 返回 402 余额不足的比例
+    "truncate": 0.0,          # 在 40%~90% 处截断并返回 finish_reason=length 的比例
+    "malformed": 0.0,         # 返回格式损坏 JSON 的比例
+}
+
+
+def plan_response(profile: Dict[str, Any], rng: random.Random, body: Dict[str, Any], content: str) -> Dict[str, Any]:
+    """
+    决定一次 chat/completions 的结果
+
+    Returns:
+        {"error": (状态码, 消息) 或 None, "content", "finish_reason", "ttft", "gen_secs"}
+    """
+    scale = float(profile["time_scale"])
+    sigma = float(profile["latency_sigma"])
+    ttft = float(profile["ttft"]) * (math.exp(rng.gauss(0.0, sigma)) if sigma > 0 else 1.0) * scale
+    roll = rng.random()
+    for status, key, message in (
+        (429, "error_429", "Rate limit reached for requests"),
+        (500, "error_500", "The server had an error while processing your request"),
+        (402, "error_402", "Insufficient Balance"),
+    ):
+        rate = float(profile[key])
+        if roll < rate:
+            return {"error": (status, message), "content": "", "finish_reason": None, "ttft": ttft, "gen_secs": 0.0}
+        roll -= rate
+    finish_reason = "stop"
+    max_tokens = body.get("max_tokens")
+    if max_tokens and len(content) // 2 + 1 > int(max_tokens):
+        content, finish_reason = content[:int(max_tokens) * 2], "length"
+    elif rng.random() < float(profile["truncate"]):
+        content, finish_reason = content[:int(len(content) * rng.uniform(0.4, 0.9))], "length"
+    elif rng.random() < float(profile["malformed"]):
+        broken = content.replace('", "', '" "', 1)
+        content = broken if broken != content else content[:-1] + ",,}"
+    tps = float(profile["tokens_per_sec"])
+    gen_secs = (len(content) // 2 + 1) / tps * scale if tps > 0 else 0.0
+    return {"error": None, "content": content, "finish_reason": finish_reason, "ttft": ttft, "gen_secs": gen_secs}
+
+
+# ------------------------------
+# 内存存储
+# ------------------------------
+class MockStore:
+    def __init__(self, delay: float, profile: Optional[Dict[str, Any]] = None,
+                 corpus: Optional[List[str]] = None, seed: Optional[int] = None):
+        self.delay = delay
+        self.profile = dict(DEFAULT_PROFILE, **(profile or {}))
+        self.corpus = corpus or []
+        self.rng = random.Random(seed)
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.stats: Dict[str, Any] = {"requests": 0, "status": {}, "completion_tokens": 0, "streamed": 0, "sources": {}}
+        self.lock = threading.Lock()
+
+    def content_for(self, body: Dict[str, Any]) -> str:
+        """生成响应内容，并按来源（evaluation / replay / synthetic）计数"""
+        messages = body.get("messages") or []
+        source = response_source(messages, self.corpus)
+        with self.lock:
+            self.stats["sources"][source] = self.stats["sources"].get(source, 0) + 1
+        return replay_content(messages, self.corpus)
+
+    def plan(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        content = self.content_for(body)
+        with self.lock:
+            return plan_response(self.profile, self.rng, body, content)
+
+    def count(self, status: int, completion_tokens: int = 0, streamed: bool = False):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["status"][str(status)] = self.stats["status"].get(str(status), 0) + 1
+            self.stats["completion_tokens"] += completion_tokens
+            self.stats["streamed"] += 1 if streamed else 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return json.loads(json.dumps(self.stats))
+
+    def add_file(self, content: bytes, filename: str, purpose: str) -> Dict[str, Any]:
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        meta = {
+            "id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+            "filename": filename, "purpose": purpose,
+        }
+        with self.lock:
+            self.files[file_id] = {"meta": meta, "content": content}
+        return meta
+
+    def create_batch(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        input_id = payload.get("input_file_id")
+        with self.lock:
+            if input_id not in self.files:
+                raise KeyError(f"input_file_id 不存在: {input_id}")
+            lines = self.files[input_id]["content"].decode("utf-8").splitlines()
+        total = sum(1 for line in lines if line.strip())
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:24]}", "object": "batch",
+            "endpoint": payload.get("endpoint", "/v1/chat/completions"),
+            "input_file_id": input_id, "completion_window": payload.get("completion_window", "24h"),
+            "status": "validating", "output_file_id": None, "error_file_id": None,
+            "created_at": int(time.time()), "metadata": payload.get("metadata"),
+            "request_counts": {"total": total, "completed": 0, "failed": 0},
+        }
+        with self.lock:
+            self.batches[batch["id"]] = batch
+        threading.Thread(target=self._process, args=(batch["id"], lines), daemon=True).start()
+        return batch
+
+    def _process(self, batch_id: str, lines: List[str]):
+        with self.lock:
+            self.batches[batch_id]["status"] = "in_progress"
+        time.sleep(self.delay)
+        outputs, errors = [], []
+        for line in lines:
+            if not line.strip():
+                continue
+            with self.lock:
+                if self.batches[batch_id]["status"] == "cancelling":
+                    break
+            try:
+                item = json.loads(line)
+                request_body = item.get("body") or {}
+                body = mock_chat_completion(request_body, self.content_for(request_body))
+                outputs.append({
+                    "id": f"batch_req_{uuid.uuid4().hex[:16]}", "custom_id": item.get("custom_id"),
+                    "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": body}, "error": None,
+                })
+            except Exception as e:
+                errors.append({"id": f"batch_req_{uuid.uuid4().hex[:16]}", "custom_id": None,
+                               "response": None, "error": {"code": "invalid_request", "message": str(e)}})
+        out_meta = self.add_file("".join(json.dumps(o, ensure_ascii=False) + "\n" for o in outputs).encode("utf-8"),
+                                 f"{batch_id}_output.jsonl", "batch_output")
+        err_meta = None
+        if errors:
+            err_meta = self.add_file("".join(json.dumps(o, ensure_ascii=False) + "\n" for o in errors).encode("utf-8"),
+                                     f"{batch_id}_error.jsonl", "batch_output")
+        with self.lock:
+            batch = self.batches[batch_id]
+            batch["status"] = "cancelled" if batch["status"] == "cancelling" else "completed"
+            batch["output_file_id"] = out_meta["id"]
+            batch["error_file_id"] = err_meta["id"] if err_meta else None
+            batch["completed_at"] = int(time.time())
+            batch["request_counts"].update(completed=len(outputs), failed=len(errors))
+
+
+# ------------------------------
+# HTTP 处理
+# ------------------------------
+def _parse_multipart(body: bytes, content_type: str) -> Dict[str, Any]:
+    """解析 multipart/form-data，返回 {字段名: bytes}，文件字段另含 filename"""
+    m = re.search(r"boundary=([^;]+)", content_type or "")
+    if not m:
+        raise ValueError("缺少 multipart boundary")
+    boundary = m.group(1).strip().strip('"').encode()
+    fields: Dict[str, Any] = {}
+    for part in body.split(b"--" + boundary):
+        part = part.strip(b"\r\n")
+        if not part or part == b"--":
+            continue
+        header, _, value = part.partition(b"\r\n\r\n")
+        header_text = header.decode("utf-8", errors="replace")
+        name = re.search(r'name="([^"]+)"', header_text)
+        if not name:
+            continue
+        fields[name.group(1)] = value
+        filename = re.search(r'filename="([^"]*)"', header_text)
+        if filename:
+            fields["filename"] = filename.group(1)
+    return fields
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    store: MockStore = None  # 由 make_server 注入
+    routes = [
+        ("POST", re.compile(r"^/v1/chat/completions$"), "chat_completions"),
+        ("GET", re.compile(r"^/v1/models$"), "list_models"),
+        ("GET", re.compile(r"^/mock/stats$"), "mock_stats"),
+        ("POST", re.compile(r"^/v1/files$"), "upload_file"),
+        ("GET", re.compile(r"^/v1/files/(?P<file_id>[^/]+)/content$"), "file_content"),
+        ("POST", re.compile(r"^/v1/batches$"), "create_batch"),
+        ("GET", re.compile(r"^/v1/batches/(?P<batch_id>[^/]+)$"), "retrieve_batch"),
+        ("POST", re.compile(r"^/v1/batches/(?P<batch_id>[^/]+)/cancel$"), "cancel_batch"),
+    ]
+
+    def log_message(self, fmt, *args):  # 保持控制台安静
+        pass
+
+    def _send_json(self, status: int, payload: Any):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        error_type = {404: "not_found_error", 429: "rate_limit_error", 500: "server_error"}.get(status, "invalid_request_error")
+        data = json.dumps({"error": {"message": message, "type": error_type, "code": status}}, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _dispatch(self, method: str):
+        path = self.path.split("?", 1)[0]
+        for m, pattern, handler in self.routes:
+            match = pattern.match(path)
+            if m == method and match:
+                try:
+                    return getattr(self, handler)(**match.groupdict())
+                except KeyError as e:
+                    return self._error(404, str(e))
+                except Exception as e:
+                    return self._error(400, str(e))
+        self._error(404, f"未实现的接口: {method} {path}")
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    # ---------- 接口 ----------
+    def chat_completions(self):
+        body = json.loads(self._body().decode("utf-8") or "{}")
+        plan = self.store.plan(body)
+        time.sleep(plan["ttft"])
+        if plan["error"] is not None:
+            status, message = plan["error"]
+            self.store.count(status)
+            return self._error(status, message, {"Retry-After": "1"} if status == 429 else None)
+        response = mock_chat_completion(body, plan["content"], plan["finish_reason"])
+        completion_tokens = response["usage"]["completion_tokens"]
+        if body.get("stream"):
+            self.store.count(200, completion_tokens, streamed=True)
+            return self._stream(body, response, plan["gen_secs"])
+        time.sleep(plan["gen_secs"])
+        self.store.count(200, completion_tokens)
+        self._send_json(200, response)
+
+    def _stream(self, body: Dict[str, Any], response: Dict[str, Any], gen_secs: float):
+        """以 SSE 分块发送（HTTP/1.0，发送完毕即关闭连接）"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        content = response["choices"][0]["message"]["content"]
+        pieces = [content[i:i + 64] for i in range(0, len(content), 64)] or [""]
+        base = {"id": response["id"], "object": "chat.completion.chunk", "created": response["created"], "model": response["model"]}
+
+        def _send(payload):
+            self.wfile.write(b"data: " + json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n\n")
+            self.wfile.flush()
+
+        for i, piece in enumerate(pieces):
+            last = i == len(pieces) - 1
+            _send(dict(base, choices=[{
+                "index": 0,
+                "delta": {"role": "assistant", "content": piece} if i == 0 else {"content": piece},
+                "finish_reason": response["choices"][0]["finish_reason"] if last else None,
+            }]))
+            time.sleep(gen_secs / len(pieces))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            _send(dict(base, choices=[], usage=response["usage"]))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def list_models(self):
+        models = ["deepseek-chat", "deepseek-reasoner", "gemini-2.5-pro", "moonshot-v1-128k"]
+        self._send_json(200, {"object": "list", "data": [
+            {"id": m, "object": "model", "created": 0, "owned_by": "mock"} for m in models
+        ]})
+
+    def mock_stats(self):
+        self._send_json(200, self.store.snapshot())
+
+    def upload_file(self):
+        fields = _parse_multipart(self._body(), self.headers.get("Content-Type", ""))
+        if "file" not in fields:
+            raise ValueError("缺少 file 字段")
+        purpose = fields.get("purpose", b"batch").decode("utf-8")
+        self._send_json(200, self.store.add_file(fields["file"], fields.get("filename", "input.jsonl"), purpose))
+
+    def file_content(self, file_id: str):
+        with self.store.lock:
+            item = self.store.files.get(file_id)
+        if item is None:
+            raise KeyError(f"文件不存在: {file_id}")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/jsonl")
+        self.send_header("Content-Length", str(len(item["content"])))
+        self.end_headers()
+        self.wfile.write(item["content"])
+
+    def create_batch(self):
+        payload = json.loads(self._body().decode("utf-8") or "{}")
+        self._send_json(200, self.store.create_batch(payload))
+
+    def retrieve_batch(self, batch_id: str):
+        with self.store.lock:
+            batch = self.store.batches.get(batch_id)
+            batch = dict(batch) if batch else None
+        if batch is None:
+            raise KeyError(f"批次不存在: {batch_id}")
+        self._send_json(200, batch)
+
+    def cancel_batch(self, batch_id: str):
+        with self.store.lock:
+            batch = self.store.batches.get(batch_id)
+            if batch is None:
+                raise KeyError(f"批次不存在: {batch_id}")
+            if batch["status"] not in {"completed", "failed", "expired", "cancelled"}:
+                batch["status"] = "cancelling"
+            batch = dict(batch)
+        self._send_json(200, batch)
+
+
+def make_server(
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    delay: float = 2.0,
+    profile: Optional[Dict[str, Any]] = None,
+    replay_dir: Optional[str] = None,
+    seed: Optional[int] = None,
+) -> ThreadingHTTPServer:
+    """创建服务实例（测试/压测中可在线程内 serve_forever；统计见 server.store）"""
+    store = MockStore(delay, profile, load_replay_corpus(replay_dir), seed)
+    handler = type("BoundMockHandler", (MockHandler,), {"store": store})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.store = store
+    return server
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser) -> None:
+    """延迟与故障注入参数（bench_extraction.py 复用）"""
+    parser.add_argument("--ttft", type=float, default=DEFAULT_PROFILE["ttft"], help="首 token 延迟中位数（秒）")
+    parser.add_argument("--latency-sigma", type=float, default=DEFAULT_PROFILE["latency_sigma"], help="首 token 延迟对数正态 sigma")
+    parser.add_argument("--tokens-per-sec", type=float, default=DEFAULT_PROFILE["tokens_per_sec"], help="输出生成速率（0 不模拟）")
+    parser.add_argument("--time-scale", type=float, default=DEFAULT_PROFILE["time_scale"], help="所有延迟乘以该系数")
+    parser.add_argument("--error-429", type=float, default=0.0, help="429 比例")
+    parser.add_argument("--error-500", type=float, default=0.0, help="500 比例")
+    parser.add_argument("--error-402", type=float, default=0.0, help="402 余额不足比例")
+    parser.add_argument("--truncate", type=float, default=0.0, help="长度截断比例")
+    parser.add_argument("--malformed", type=float, default=0.0, help="JSON 格式损坏比例")
+    parser.add_argument("--replay-dir", default=None, help="回放的抽取结果目录（如 experiments/exp03_clustering/outputs/extractions）")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子（故障注入与延迟可复现）")
+
+
+def profile_from_args(args: argparse.Namespace) -> Dict[str, Any]:
+    return {key: getattr(args, key) for key in DEFAULT_PROFILE}
+
+
+def self_check(prompt_dir: Path) -> bool:
+    """
+    用真实提示词检查请求分类：每个抽取提示词（prompt_<论文>.txt，含 ```json 输出格式示例）都应得到回放内容，
+    评估提示词（prompt_eva.txt + 待评估 JSON）应按评估回显
+    """
+    extraction_system = "你是信息抽取助手。必须只输出严格且可解析的 JSON 对象，不要任何解释或 Markdown 代码围栏。"
+    eval_system = "你是 PHM 领域的知识抽取评估专家。只输出严格的 JSON，不添加任何解释。"
+    corpus = [json.dumps({"entities": [{"name": "回放", "type": "测试"}], "relations": []}, ensure_ascii=False)]
+    ok = True
+    prompts = sorted(p for p in prompt_dir.glob("prompt_*.txt") if p.name != "prompt_eva.txt")
+    for path in prompts:
+        messages = [{"role": "system", "content": extraction_system},
+                    {"role": "user", "content": path.read_text(encoding="utf-8")}]
+        if replay_content(messages, corpus) != corpus[0]:
+            print(f"❌ 抽取提示词未得到回放内容：{path.name}")
+            ok = False
+    eva = prompt_dir / "prompt_eva.txt"
+    if eva.exists():
+        sample = {"entities": [{"name": "样例", "type": "测试"}], "relations": []}
+        user = (eva.read_text(encoding="utf-8") + "\n\n## 待评估的抽取结果\n\n```json\n"
+                + json.dumps(sample, ensure_ascii=False, indent=2)
+                + "\n```\n\n请严格按照要求输出评估后的 JSON,为每个实体和关系添加 `evaluation` 字段。\n")
+        data = json.loads(replay_content([{"role": "system", "content": eval_system},
+                                          {"role": "user", "content": user}], corpus))
+        if [e.get("evaluation") for e in data.get("entities", [])] != ["正确"]:
+            print("❌ 评估请求未按评估回显")
+            ok = False
+    print(f"{'✅' if ok else '❌'} 自检：抽取提示词 {len(prompts)} 个，评估提示词 {'1' if eva.exists() else '0'} 个")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容 API 替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=2.0, help="批次从提交到完成的模拟耗时（秒）")
+    parser.add_argument("--self-check", nargs="?", const=str(PROJECT_ROOT / "experiments" / "exp03_clustering" / "config" / "prompt"),
+                        default=None, metavar="PROMPT_DIR", help="用真实提示词检查请求分类后退出（默认 exp03 的 config/prompt）")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    if args.self_check:
+        sys.exit(0 if self_check(Path(args.self_check)) else 1)
+
+    server = make_server(args.host, args.port, args.delay, profile_from_args(args), args.replay_dir, args.seed)
+    print(f"🧪 Mock API 已启动：http://{args.host}:{args.port}/v1（批次耗时 {args.delay}s，回放语料 {len(server.store.corpus)} 份，Ctrl+C 退出）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,13 @@
 import os
+import sys
 import json
 import re
-import requests
+
+# 共享 HTTP 客户端（仓库 src/utils）：长连接 Session + 显式超时，各篇论文复用同一连接
+SRC_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SRC_ROOT not in sys.path:
+    sys.path.insert(0, SRC_ROOT)
+from utils.http_client import get_requests_session, request_timeout
 
 # ========== 配置路径 ==========
 BASE_DIR = os.path.dirname(__file__)
@@ -45,7 +51,7 @@ def call_deepseek(api_key: str, prompt: str):
     }
 
     try:
-        resp = requests.post(url, headers=headers, json=payload)
+        resp = get_requests_session("deepseek").post(url, headers=headers, json=payload, timeout=request_timeout("deepseek"))
         resp.raise_for_status()
         content = resp.json()["choices"][0]["message"]["content"]
 
@@ -6,6 +6,8 @@
 import json
 from pathlib import Path
 
+from embedding_store import EmbeddingStore
+
 # 路径配置
 CODE_DIR = Path(__file__).parent
 BASE_DIR = CODE_DIR.parent
@@ -31,23 +33,21 @@ def check_data_structure():
     else:
         print("聚类结果文件不存在")
     
-    # 检查向量文件
-    vector_file = DATA_DIR / "embedding_vectors.json"
-    print(f"检查文件: {vector_file}")
+    # 检查向量库（embedding_vectors.npy + embedding_vectors.meta.json）
+    vector_base = DATA_DIR / "embedding_vectors"
+    print(f"检查向量库: {vector_base}.npy")
     
-    if vector_file.exists():
-        with open(vector_file, 'r', encoding='utf-8') as f:
-            vector_data = json.load(f)
-        
-        print(f"向量数据长度: {len(vector_data)}")
-        print(f"前3个样本的键:")
-        for i, item in enumerate(vector_data[:3]):
-            print(f"  样本 {i+1}: {list(item.keys())}")
-            if 'embedding' in item:
-                print(f"  样本 {i+1} 向量维度: {len(item['embedding'])}")
-            print()
-    else:
+    try:
+        store = EmbeddingStore.open(vector_base)
+    except FileNotFoundError:
         print("向量文件不存在")
+        return
+    
+    print(f"向量数据长度: {len(store)}，维度: {store.dim}，类型: {store.vectors.dtype}，模型: {store.meta.get('model')}")
+    print(f"元数据列: {list(store.columns.keys())}")
+    for i, item in enumerate(store.records()[:3]):
+        print(f"  样本 {i+1}: {item['file']} 段落 {item['paragraph_index']}，文本预览: {item['text'][:50]}...")
+    print()
 
 if __name__ == "__main__":
     check_data_structure()
\ No newline at end of file
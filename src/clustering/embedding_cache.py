@@ -0,0 +1,236 @@
+"""
+段落嵌入增量缓存
+
+第一步每次都重新嵌入全部论文的全部段落，向 有标注原文 新增一篇论文也要整体重跑。
+EmbeddingCache 按 (模型名, max_length, 规范化段落哈希) 缓存向量，只嵌入新增或改动的段落：
+- 段落哈希：NFC 规范化、连续空白合并为一个空格、去掉首尾空白后的 sha256（前 32 位）
+- 每个 (模型名, max_length) 一个命名空间，对应缓存目录下的两个文件：
+  <命名空间>.npy（float32，N × D）与 <命名空间>.index.json（第 i 行向量的段落哈希 keys[i]）
+- 垃圾回收：保存时只保留本次语料中仍存在的段落（论文删除、段落改动后旧向量被清除）
+- 同一段落在语料中出现多次时只嵌入一次
+
+环境变量：
+- EMBED_CACHE: 0 关闭缓存（默认开启）
+- EMBED_CACHE_DIR: 缓存目录（默认 向量库所在目录/embedding_cache）
+- EMBED_CACHE_GC: 0 保存时不清理语料中已不存在的段落（多个语料共用缓存目录时使用）
+"""
+import hashlib
+import json
+import os
+import re
+import unicodedata
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from embedding_store import _atomic_write_bytes
+
+CACHE_VERSION = 1
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _truthy_env(name: str, default: bool) -> bool:
+    raw = os.getenv(name, "").strip().lower()
+    if not raw:
+        return default
+    return raw not in {"0", "false", "no", "n"}
+
+
+def normalize_paragraph(text: str) -> str:
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text or "")).strip()
+
+
+def paragraph_key(text: str) -> str:
+    """规范化段落文本的 sha256（前 32 位十六进制）"""
+    return hashlib.sha256(normalize_paragraph(text).encode("utf-8")).hexdigest()[:32]
+
+
+def cache_namespace(model_name: str, max_length: int) -> str:
+    raw = f"{CACHE_VERSION}|{model_name}|{max_length}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class EmbeddingCache:
+    """
+    按段落哈希缓存嵌入向量（单进程使用）
+
+    Args:
+        cache_dir: 缓存目录
+        model_name: 嵌入模型名
+        max_length: 截断长度（不同截断长度的向量不可混用）
+    """
+
+    def __init__(self, cache_dir: Union[str, Path], model_name: str, max_length: int):
+        self.cache_dir = Path(cache_dir)
+        self.model_name = model_name
+        self.max_length = max_length
+        name = cache_namespace(model_name, max_length)
+        self.vectors_path = self.cache_dir / f"{name}.npy"
+        self.index_path = self.cache_dir / f"{name}.index.json"
+        self._rows: Dict[str, int] = {}
+        self._vectors: Optional[np.ndarray] = None
+        self._pending: Dict[str, np.ndarray] = {}
+        self._loaded = False
+
+    def load(self) -> "EmbeddingCache":
+        if self._loaded:
+            return self
+        self._loaded = True
+        if not (self.vectors_path.exists() and self.index_path.exists()):
+            return self
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            # 不用 mmap：保存时要原子替换同一文件（Windows 下无法替换仍被映射的文件）
+            vectors = np.load(self.vectors_path)
+            keys = index.get("keys", [])
+            if index.get("version") != CACHE_VERSION or len(keys) != len(vectors):
+                raise ValueError(f"索引 {len(keys)} 行，向量 {len(vectors)} 行")
+        except (OSError, ValueError) as e:
+            print(f"⚠️  嵌入缓存无法读取，将重新建立：{e}")
+            return self
+        self._vectors = vectors
+        self._rows = {k: i for i, k in enumerate(keys)}
+        return self
+
+    def __len__(self) -> int:
+        self.load()
+        return len(self._rows) + sum(1 for k in self._pending if k not in self._rows)
+
+    @property
+    def dim(self) -> Optional[int]:
+        self.load()
+        if self._vectors is not None and self._vectors.ndim == 2:
+            return int(self._vectors.shape[1])
+        for vec in self._pending.values():
+            return int(vec.shape[0])
+        return None
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        self.load()
+        if key in self._pending:
+            return self._pending[key]
+        row = self._rows.get(key)
+        return None if row is None else np.asarray(self._vectors[row], dtype=np.float32)
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        self.load()
+        self._pending[key] = np.asarray(vector, dtype=np.float32)
+
+    def save(self, keep: Optional[Iterable[str]] = None) -> int:
+        """
+        写回缓存（原子替换）
+
+        Args:
+            keep: 只保留这些键（None 表示全部保留）
+
+        Returns:
+            被清理的条目数
+        """
+        self.load()
+        all_keys = list(self._rows) + [k for k in self._pending if k not in self._rows]
+        keep_set = set(keep) if keep is not None else None
+        keys = [k for k in all_keys if keep_set is None or k in keep_set]
+        removed = len(all_keys) - len(keys)
+        if not self._pending and not removed and self.index_path.exists():
+            return 0
+        dim = self.dim or 0
+        vectors = np.zeros((len(keys), dim), dtype=np.float32)
+        for i, k in enumerate(keys):
+            vectors[i] = self.get(k)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        index = {
+            "version": CACHE_VERSION,
+            "model": self.model_name,
+            "max_length": self.max_length,
+            "dim": dim,
+            "keys": keys,
+        }
+        # 先写向量再写索引；读取时两者行数不一致视为损坏并重建
+        _atomic_write_bytes(self.vectors_path, lambda f: np.save(f, vectors))
+        _atomic_write_bytes(self.index_path, lambda f: f.write(json.dumps(index).encode("utf-8")))
+        self._vectors = vectors
+        self._rows = {k: i for i, k in enumerate(keys)}
+        self._pending = {}
+        return removed
+
+
+def default_cache(engine: Any, store_path: Union[str, Path]) -> Optional[EmbeddingCache]:
+    """按环境变量为 engine 创建缓存；EMBED_CACHE=0 时返回 None"""
+    if not _truthy_env("EMBED_CACHE", True):
+        return None
+    cache_dir = os.getenv("EMBED_CACHE_DIR", "").strip() or str(Path(store_path).parent / "embedding_cache")
+    return EmbeddingCache(cache_dir, engine.model_name, engine.max_length)
+
+
+def embed_with_cache(
+    engine: Any,
+    texts: Sequence[str],
+    cache: Optional[EmbeddingCache],
+    progress_factory: Optional[Callable[[int], Any]] = None,
+    gc: Optional[bool] = None,
+) -> Tuple[np.ndarray, Dict[str, int]]:
+    """
+    嵌入一组段落，命中缓存的直接复用
+
+    Args:
+        engine: EmbeddingEngine
+        texts: 段落文本
+        cache: EmbeddingCache（None 时全部重新嵌入）
+        progress_factory: progress_factory(未命中段落数) 返回带 update 方法的进度条（如 tqdm）
+        gc: 保存时清理语料中已不存在的段落（默认取 EMBED_CACHE_GC，开启）
+
+    Returns:
+        (float32 向量 len(texts) × D, {"paragraphs", "hits", "misses", "embedded", "evicted", "entries"})
+    """
+    keys = [paragraph_key(t) for t in texts]
+    found: Dict[str, np.ndarray] = {}
+    if cache is not None:
+        for k in set(keys):
+            vec = cache.get(k)
+            if vec is not None:
+                found[k] = vec
+    # 未命中的段落按哈希去重，同一段落只嵌入一次
+    missing: Dict[str, int] = {}
+    for i, k in enumerate(keys):
+        if k not in found and k not in missing:
+            missing[k] = i
+    hits = sum(1 for k in keys if k in found)
+    stats = {"paragraphs": len(texts), "hits": hits, "misses": len(texts) - hits,
+             "embedded": len(missing), "evicted": 0, "entries": 0}
+
+    if missing:
+        bar = progress_factory(len(missing)) if progress_factory else None
+        try:
+            new = engine.embed([texts[i] for i in missing.values()], progress=bar.update if bar else None)
+        finally:
+            if bar is not None and hasattr(bar, "close"):
+                bar.close()
+        for k, vec in zip(missing, new):
+            found[k] = vec
+            if cache is not None:
+                cache.put(k, vec)
+
+    dim = next(iter(found.values())).shape[0] if found else (engine.dim if texts else 0)
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    for i, k in enumerate(keys):
+        out[i] = found[k]
+
+    if cache is not None:
+        if gc is None:
+            gc = _truthy_env("EMBED_CACHE_GC", True)
+        stats["evicted"] = cache.save(keep=keys if gc else None)
+        stats["entries"] = len(cache)
+    return out, stats
+
+
+def format_cache_report(stats: Dict[str, int]) -> str:
+    total = stats.get("paragraphs", 0)
+    rate = stats.get("hits", 0) / total * 100 if total else 0.0
+    return (
+        f"嵌入缓存：命中 {stats.get('hits', 0)}/{total}（{rate:.1f}%），"
+        f"未命中 {stats.get('misses', 0)}（实际嵌入 {stats.get('embedded', 0)} 段），"
+        f"清理 {stats.get('evicted', 0)} 条，缓存共 {stats.get('entries', 0)} 条"
+    )
@@ -0,0 +1,202 @@
+"""
+批量段落嵌入引擎（bge-large-zh-v1.5，取 CLS 向量）
+
+原 第一步构建词向量库.py 逐段调用模型（batch=1），每段单独分词、单独前向，CPU 上是整个聚类流程最慢的一步。
+EmbeddingEngine 的做法：
+- 先对全部段落只分词不填充，按 token 长度排序后切成批次（长度桶），每批只填充到批内最长，
+  避免短段落被填充到 512
+- 批次大小受 batch_size 与 max_batch_tokens（批内最长长度 × 条数）共同限制，长段落自动用小批次
+- CPU 上设置 torch 线程数（intra-op 默认取 CPU 核数，inter-op 为 1），inference_mode 下前向
+- 直接返回 float32 numpy 数组（N × D），按输入顺序排列，不再逐条 .tolist()
+
+与原实现一致：文本前加 "[CLS] "、截断到 512 token、取 last_hidden_state[:, 0]，不做归一化；
+动态填充配合 attention_mask 不改变结果（浮点误差范围内）。
+
+环境变量：
+- EMBED_MODEL: 模型名或本地路径（默认 BAAI/bge-large-zh-v1.5）
+- EMBED_BATCH_SIZE: 每批最多条数（默认 32）
+- EMBED_MAX_BATCH_TOKENS: 每批最多 token（批内最长长度 × 条数，默认 16384）
+- EMBED_THREADS: torch intra-op 线程数（默认 CPU 核数）
+- EMBED_DEVICE: cpu / cuda（默认有 GPU 时用 cuda）
+"""
+import os
+import time
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+DEFAULT_MODEL = "BAAI/bge-large-zh-v1.5"
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_MAX_BATCH_TOKENS = 16384
+MAX_LENGTH = 512
+TEXT_PREFIX = "[CLS] "  # bge 模型建议在文本前添加 "[CLS]"（沿用原实现）
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = os.getenv(name, "").strip()
+    try:
+        return int(raw) if raw else default
+    except ValueError:
+        print(f"⚠️  {name}={raw} 不是有效整数，已使用默认值 {default}")
+        return default
+
+
+def configure_torch_threads(threads: Optional[int] = None) -> int:
+    """设置 torch CPU 线程数，返回实际使用的 intra-op 线程数"""
+    import torch
+
+    threads = threads or _env_int("EMBED_THREADS", 0) or os.cpu_count() or 1
+    torch.set_num_threads(threads)
+    try:
+        # 只能在首次并行运算前设置；已设置过时忽略
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    return threads
+
+
+def length_buckets(lengths: Sequence[int], batch_size: int, max_batch_tokens: int) -> List[List[int]]:
+    """
+    按长度升序把下标切成批次
+
+    每批条数不超过 batch_size，且 批内最长长度 × 条数 不超过 max_batch_tokens（至少 1 条）。
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches, current = [], []
+    for i in order:
+        # 升序排列，新加入的一条就是批内最长
+        if current and (len(current) >= batch_size or lengths[i] * (len(current) + 1) > max_batch_tokens):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+class EmbeddingEngine:
+    """
+    批量嵌入引擎（模型在首次使用时加载）
+
+    Args:
+        model_name: 模型名或本地路径
+        device: "cpu" / "cuda"；None 时自动选择
+        batch_size: 每批最多条数
+        max_batch_tokens: 每批最多 token（批内最长长度 × 条数）
+        threads: CPU intra-op 线程数；None 时取 EMBED_THREADS 或 CPU 核数
+    """
+
+    def __init__(
+        self,
+        model_name: Optional[str] = None,
+        device: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        max_batch_tokens: Optional[int] = None,
+        threads: Optional[int] = None,
+        max_length: int = MAX_LENGTH,
+    ):
+        self.model_name = model_name or os.getenv("EMBED_MODEL", "").strip() or DEFAULT_MODEL
+        self.device_name = device or os.getenv("EMBED_DEVICE", "").strip() or None
+        self.batch_size = batch_size or _env_int("EMBED_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+        self.max_batch_tokens = max_batch_tokens or _env_int("EMBED_MAX_BATCH_TOKENS", DEFAULT_MAX_BATCH_TOKENS)
+        self.threads = threads
+        self.max_length = max_length
+        self.tokenizer = None
+        self.model = None
+        self.device = None
+
+    def load(self) -> "EmbeddingEngine":
+        if self.model is not None:
+            return self
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self.device = torch.device(self.device_name or ("cuda" if torch.cuda.is_available() else "cpu"))
+        if self.device.type == "cpu":
+            self.threads = configure_torch_threads(self.threads)
+        print(f"🔄 正在加载模型 {self.model_name}（{self.device}"
+              + (f"，{self.threads} 线程" if self.device.type == "cpu" else "") + "），请稍候...")
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self.model = AutoModel.from_pretrained(self.model_name).to(self.device).eval()
+        print("✅ 模型加载完成！")
+        return self
+
+    @property
+    def dim(self) -> int:
+        self.load()
+        return int(self.model.config.hidden_size)
+
+    def embed(
+        self,
+        texts: Sequence[str],
+        batch_size: Optional[int] = None,
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> np.ndarray:
+        """
+        嵌入一组文本
+
+        Args:
+            texts: 文本列表
+            batch_size: 覆盖每批最多条数
+            progress: 每完成一批调用 progress(本批条数)，可传 tqdm.update
+
+        Returns:
+            float32 数组（len(texts) × dim），行顺序与输入一致
+        """
+        import torch
+
+        self.load()
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        if not texts:
+            return out
+        encoded = self.tokenizer(
+            [TEXT_PREFIX + t for t in texts],
+            truncation=True,
+            max_length=self.max_length,
+            padding=False,
+        )
+        input_ids = encoded["input_ids"]
+        lengths = [len(ids) for ids in input_ids]
+        for batch in length_buckets(lengths, batch_size or self.batch_size, self.max_batch_tokens):
+            features = self.tokenizer.pad(
+                {k: [encoded[k][i] for i in batch] for k in encoded.keys()},
+                padding=True,
+                return_tensors="pt",
+            )
+            features = {k: v.to(self.device) for k, v in features.items()}
+            with torch.inference_mode():
+                hidden = self.model(**features).last_hidden_state[:, 0]
+            out[batch] = hidden.float().cpu().numpy()
+            if progress is not None:
+                progress(len(batch))
+        return out
+
+    def embed_one(self, text: str) -> np.ndarray:
+        """嵌入单条文本，返回 float32 向量（dim,）"""
+        return self.embed([text])[0]
+
+
+def benchmark(engine: EmbeddingEngine, texts: Sequence[str], batch_sizes: Sequence[int], repeats: int = 1) -> List[dict]:
+    """
+    测量不同批大小下的吞吐（段落/秒）
+
+    Returns:
+        [{"batch_size", "paragraphs", "seconds", "paragraphs_per_sec"}, ...]
+    """
+    engine.load()
+    engine.embed(list(texts[:min(len(texts), 8)]))  # 预热
+    results = []
+    for bs in batch_sizes:
+        best = None
+        for _ in range(max(1, repeats)):
+            start = time.perf_counter()
+            engine.embed(texts, batch_size=bs)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results.append({
+            "batch_size": bs,
+            "paragraphs": len(texts),
+            "seconds": round(best, 3),
+            "paragraphs_per_sec": round(len(texts) / best, 2) if best > 0 else None,
+        })
+    return results
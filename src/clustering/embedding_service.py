@@ -0,0 +1,344 @@
+"""
+常驻本地嵌入服务（localhost HTTP）与客户端
+
+第一步与第三步各自从头加载 bge-large-zh-v1.5（冷启动数十秒、内存 1 GB 以上）。
+嵌入服务只加载一次模型并常驻，各阶段脚本与 notebook 通过 HTTP 调用，共享同一个热模型：
+- MicroBatcher：单个工作线程独占模型；并发请求进入队列，从第一个请求到达起最多等待
+  max_wait_ms，把已到达的请求合并为一个微批次（累计不超过 max_batch 条文本，单个大请求独占一批），
+  交给 EmbeddingEngine.embed（批内再按长度分桶），结果按请求拆分返回
+- 只监听本机地址（默认 127.0.0.1:8799）；Windows 下没有 unix socket，统一用 localhost HTTP
+
+接口：
+- POST /embed   {"texts": [...], "encoding": "base64" | "float"}
+                → {"model", "dim", "count", "encoding", "embeddings"}
+                base64 为 float32 小端字节（count × dim）的 base64；float 为嵌套列表（便于 curl / 调试）
+- GET  /health  → {"status", "model", "dim", "max_length", "device", "stats"}
+
+启动服务：
+    python src/clustering/embedding_service.py --port 8799 --max-wait-ms 10 --max-batch 64
+
+在脚本 / notebook 中调用：
+    sys.path.insert(0, "src/clustering")
+    from embedding_service import RemoteEmbeddingEngine
+    engine = RemoteEmbeddingEngine("http://127.0.0.1:8799").load()
+    vectors = engine.embed(["段落一", "段落二"])   # float32 ndarray，与 EmbeddingEngine 接口一致
+
+环境变量：
+- EMBED_SERVICE_URL: 设置后 default_engine() 优先使用该服务（不可用时回落到本地加载模型）
+- EMBED_SERVICE_MAX_WAIT_MS（默认 10）/ EMBED_SERVICE_MAX_BATCH（默认 64）: 服务端微批参数
+- EMBED_MODEL / EMBED_DEVICE / EMBED_THREADS 等同 embedding_engine.py（服务端使用）
+"""
+import argparse
+import base64
+import json
+import os
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from embedding_engine import EmbeddingEngine, _env_int
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8799
+DEFAULT_MAX_WAIT_MS = 10
+DEFAULT_MAX_BATCH = 64
+CLIENT_CHUNK = 256  # 客户端每个请求的文本数（大语料分块发送，便于进度显示与服务端合批）
+
+
+def encode_vectors(vectors: np.ndarray) -> str:
+    return base64.b64encode(np.ascontiguousarray(vectors, dtype="<f4").tobytes()).decode("ascii")
+
+
+def decode_vectors(data: str, count: int, dim: int) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype="<f4").reshape(count, dim).astype(np.float32)
+
+
+# ------------------------------
+# 服务端
+# ------------------------------
+class MicroBatcher:
+    """
+    合并并发请求的微批调度器（模型只在工作线程中调用）
+
+    Args:
+        engine: 已加载的 EmbeddingEngine
+        max_batch: 每个微批次最多文本数
+        max_wait_ms: 第一个请求到达后等待后续请求的最长时间（毫秒）
+    """
+
+    def __init__(self, engine: EmbeddingEngine, max_batch: int = DEFAULT_MAX_BATCH, max_wait_ms: float = DEFAULT_MAX_WAIT_MS):
+        self.engine = engine
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.queue: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "texts": 0, "batches": 0, "max_batch_texts": 0, "embed_seconds": 0.0}
+        self._thread = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: List[str]) -> np.ndarray:
+        """提交一组文本并等待结果（在 HTTP 处理线程中调用）"""
+        job = {"texts": texts, "done": threading.Event(), "result": None, "error": None}
+        self.queue.put(job)
+        job["done"].wait()
+        if job["error"] is not None:
+            raise job["error"]
+        return job["result"]
+
+    def _collect(self) -> List[Dict[str, Any]]:
+        jobs = [self.queue.get()]
+        count = len(jobs[0]["texts"])
+        deadline = time.monotonic() + self.max_wait
+        while count < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            jobs.append(job)
+            count += len(job["texts"])
+        return jobs
+
+    def _run(self):
+        while True:
+            jobs = self._collect()
+            texts = [t for job in jobs for t in job["texts"]]
+            start = time.perf_counter()
+            try:
+                vectors = self.engine.embed(texts)
+            except Exception as e:  # 模型出错时让本批所有请求返回错误，服务继续运行
+                for job in jobs:
+                    job["error"] = e
+                    job["done"].set()
+                continue
+            elapsed = time.perf_counter() - start
+            offset = 0
+            for job in jobs:
+                n = len(job["texts"])
+                job["result"] = vectors[offset:offset + n]
+                offset += n
+                job["done"].set()
+            with self.lock:
+                self.stats["requests"] += len(jobs)
+                self.stats["texts"] += len(texts)
+                self.stats["batches"] += 1
+                self.stats["max_batch_texts"] = max(self.stats["max_batch_texts"], len(texts))
+                self.stats["embed_seconds"] += elapsed
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            stats = dict(self.stats)
+        stats["embed_seconds"] = round(stats["embed_seconds"], 3)
+        stats["avg_batch_texts"] = round(stats["texts"] / stats["batches"], 2) if stats["batches"] else 0.0
+        stats["queued"] = self.queue.qsize()
+        return stats
+
+
+class EmbeddingHandler(BaseHTTPRequestHandler):
+    batcher: MicroBatcher = None  # 由 make_server 注入
+    protocol_version = "HTTP/1.1"  # 客户端可复用连接
+
+    def log_message(self, fmt, *args):  # 保持控制台安静
+        pass
+
+    def _send_json(self, status: int, payload: Any):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/health":
+            self._send_json(404, {"error": f"未知路径: {self.path}"})
+            return
+        engine = self.batcher.engine
+        self._send_json(200, {
+            "status": "ok",
+            "model": engine.model_name,
+            "dim": engine.dim,
+            "max_length": engine.max_length,
+            "device": str(engine.device),
+            "stats": self.batcher.snapshot(),
+        })
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/embed":
+            self._send_json(404, {"error": f"未知路径: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            texts = body.get("texts") if isinstance(body, dict) else None
+            if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                raise ValueError("texts 必须是字符串列表")
+            encoding = body.get("encoding", "base64")
+            if encoding not in {"base64", "float"}:
+                raise ValueError(f"encoding 只能为 base64 / float：{encoding}")
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        try:
+            vectors = self.batcher.submit(texts) if texts else np.zeros((0, self.batcher.engine.dim), dtype=np.float32)
+        except Exception as e:
+            self._send_json(500, {"error": f"嵌入失败: {e}"})
+            return
+        self._send_json(200, {
+            "model": self.batcher.engine.model_name,
+            "dim": int(vectors.shape[1]),
+            "count": int(vectors.shape[0]),
+            "encoding": encoding,
+            "embeddings": encode_vectors(vectors) if encoding == "base64" else vectors.tolist(),
+        })
+
+
+def make_server(
+    engine: EmbeddingEngine,
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    max_batch: int = DEFAULT_MAX_BATCH,
+    max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+) -> ThreadingHTTPServer:
+    """创建服务实例（可在线程内 serve_forever；调度统计见 server.batcher）"""
+    batcher = MicroBatcher(engine.load(), max_batch, max_wait_ms)
+    handler = type("BoundEmbeddingHandler", (EmbeddingHandler,), {"batcher": batcher})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.batcher = batcher
+    return server
+
+
+# ------------------------------
+# 客户端
+# ------------------------------
+class RemoteEmbeddingEngine:
+    """
+    嵌入服务客户端，接口与 EmbeddingEngine 一致（load / dim / embed / embed_one）
+
+    Args:
+        url: 服务地址（默认 EMBED_SERVICE_URL 或 http://127.0.0.1:8799）
+        timeout: 单个请求超时（秒）
+        chunk_size: 每个请求最多文本数
+    """
+
+    def __init__(self, url: Optional[str] = None, timeout: float = 600.0, chunk_size: int = CLIENT_CHUNK):
+        self.url = (url or os.getenv("EMBED_SERVICE_URL", "").strip() or f"http://{DEFAULT_HOST}:{DEFAULT_PORT}").rstrip("/")
+        self.timeout = timeout
+        self.chunk_size = max(1, chunk_size)
+        self.info: Optional[Dict[str, Any]] = None
+
+    def _request(self, path: str, payload: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else None
+        req = urllib.request.Request(self.url + path, data=data, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=timeout or self.timeout) as resp:
+                return json.loads(resp.read())
+        except urllib.error.HTTPError as e:
+            detail = e.read().decode("utf-8", errors="replace")
+            raise ValueError(f"嵌入服务返回 {e.code}: {detail}") from None
+
+    def health(self, timeout: float = 3.0) -> Dict[str, Any]:
+        return self._request("/health", timeout=timeout)
+
+    def load(self) -> "RemoteEmbeddingEngine":
+        if self.info is None:
+            self.info = self.health()
+        return self
+
+    @property
+    def model_name(self) -> str:
+        return self.load().info["model"]
+
+    @property
+    def max_length(self) -> int:
+        return int(self.load().info["max_length"])
+
+    @property
+    def dim(self) -> int:
+        return int(self.load().info["dim"])
+
+    @property
+    def device(self) -> str:
+        return f"{self.url}（{self.load().info.get('device')}）"
+
+    def embed(
+        self,
+        texts: Sequence[str],
+        batch_size: Optional[int] = None,
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> np.ndarray:
+        """嵌入一组文本（batch_size 由服务端决定，此处忽略；progress 每完成一个请求调用一次）"""
+        self.load()
+        chunks = []
+        for start in range(0, len(texts), self.chunk_size):
+            chunk = list(texts[start:start + self.chunk_size])
+            result = self._request("/embed", {"texts": chunk})
+            chunks.append(decode_vectors(result["embeddings"], result["count"], result["dim"]))
+            if progress is not None:
+                progress(len(chunk))
+        if not chunks:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.concatenate(chunks)
+
+    def embed_one(self, text: str) -> np.ndarray:
+        return self.embed([text])[0]
+
+
+def default_engine(**kwargs):
+    """
+    各阶段脚本使用的嵌入引擎
+
+    设置了 EMBED_SERVICE_URL 且服务可用时返回 RemoteEmbeddingEngine，否则返回本地 EmbeddingEngine(**kwargs)。
+    """
+    url = os.getenv("EMBED_SERVICE_URL", "").strip()
+    if url:
+        try:
+            remote = RemoteEmbeddingEngine(url).load()
+            local_model = os.getenv("EMBED_MODEL", "").strip()
+            if local_model and local_model != remote.model_name:
+                print(f"⚠️  EMBED_MODEL={local_model} 与嵌入服务的模型 {remote.model_name} 不一致，以服务为准")
+            print(f"🔌 使用嵌入服务 {remote.url}（{remote.model_name}）")
+            return remote
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️  嵌入服务 {url} 不可用，改为本地加载模型：{e}")
+    return EmbeddingEngine(**kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常驻本地嵌入服务（模型只加载一次，并发请求合并为微批次）")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--model", default=None, help="模型名或本地路径（默认 EMBED_MODEL 或 bge-large-zh-v1.5）")
+    parser.add_argument("--device", default=None, help="cpu / cuda")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op 线程数")
+    parser.add_argument("--max-batch", type=int, default=_env_int("EMBED_SERVICE_MAX_BATCH", DEFAULT_MAX_BATCH),
+                        help="每个微批次最多文本数")
+    parser.add_argument("--max-wait-ms", type=float, default=_env_int("EMBED_SERVICE_MAX_WAIT_MS", DEFAULT_MAX_WAIT_MS),
+                        help="合并并发请求的最长等待（毫秒）")
+    args = parser.parse_args()
+
+    engine = EmbeddingEngine(model_name=args.model, device=args.device, threads=args.threads).load()
+    engine.embed(["预热"])  # 在开始服务前完成首次前向
+    server = make_server(engine, args.host, args.port, args.max_batch, args.max_wait_ms)
+    print(f"🧮 嵌入服务已启动：http://{args.host}:{args.port}（{engine.model_name}，{engine.device}，"
+          f"微批 ≤{args.max_batch} 条 / 等待 ≤{args.max_wait_ms:g}ms，Ctrl+C 退出）")
+    print(f"   其他阶段设置 EMBED_SERVICE_URL=http://{args.host}:{args.port} 即可共享此模型")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+段落向量库：float32 .npy + 列式元数据表
+
+原 embedding_vectors.json 把每个 1024 维向量写成缩进的 Python float 列表，并与段落原文混在一起，
+第二步、第三步及各可视化脚本每次都要 json.load 整个文件（解析慢、内存峰值是向量本身的十几倍）。
+向量库改为两个文件（base 为不带扩展名的路径，如 数据结果/embedding_vectors）：
+- <base>.npy: float32 矩阵（N × D），读取时 np.load(mmap_mode="r")，按需分页，不整体读入内存
+- <base>.meta.json: 列式元数据 {"version", "count", "dim", "model", "columns": {"file": [...],
+  "paragraph_index": [...], "text": [...]}}，第 i 行对应 .npy 的第 i 行
+
+聚类结果（embedding_clusters_with_paragraph_annots.json）中的段落只记录行号 "row"，
+不再内嵌向量；vectors_for 按行号从向量库取向量，并兼容内嵌 "embedding" 的旧文件。
+
+只有旧的 embedding_vectors.json 时，EmbeddingStore.open 会自动转换一次（原文件保留）。
+"""
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+
+STORE_VERSION = 1
+META_COLUMNS = ("file", "paragraph_index", "text")
+
+PathLike = Union[str, Path]
+
+
+def store_base(path: PathLike) -> Path:
+    """把 xxx / xxx.npy / xxx.meta.json / xxx.json 统一为不带扩展名的 base 路径"""
+    p = Path(path)
+    name = p.name
+    for suffix in (".meta.json", ".npy", ".json"):
+        if name.endswith(suffix):
+            return p.with_name(name[: -len(suffix)])
+    return p
+
+
+def _atomic_write_bytes(path: Path, writer) -> None:
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        writer(f)
+    os.replace(tmp, path)
+
+
+def save_store(
+    path: PathLike,
+    vectors: np.ndarray,
+    records: Sequence[Dict[str, Any]],
+    model: Optional[str] = None,
+) -> Path:
+    """
+    写出向量库
+
+    Args:
+        path: base 路径（扩展名会被忽略）
+        vectors: N × D 向量（转为 float32）
+        records: 每行的元数据（至少含 file / paragraph_index / text）
+        model: 嵌入模型名（记录在元数据中）
+
+    Returns:
+        base 路径
+    """
+    base = store_base(path)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if vectors.ndim != 2 or len(vectors) != len(records):
+        raise ValueError(f"向量形状 {vectors.shape} 与元数据行数 {len(records)} 不一致")
+    base.parent.mkdir(parents=True, exist_ok=True)
+    columns = {c: [r.get(c) for r in records] for c in META_COLUMNS}
+    meta = {
+        "version": STORE_VERSION,
+        "count": int(vectors.shape[0]),
+        "dim": int(vectors.shape[1]) if vectors.shape[0] else 0,
+        "model": model,
+        "columns": columns,
+    }
+    _atomic_write_bytes(base.with_name(base.name + ".npy"), lambda f: np.save(f, vectors))
+    _atomic_write_bytes(
+        base.with_name(base.name + ".meta.json"),
+        lambda f: f.write(json.dumps(meta, ensure_ascii=False).encode("utf-8")),
+    )
+    return base
+
+
+def migrate_json(json_path: PathLike, base: Optional[PathLike] = None) -> Path:
+    """把旧的 embedding_vectors.json（[{file, paragraph_index, text, embedding}, ...]）转换为向量库"""
+    json_path = Path(json_path)
+    with open(json_path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    items = [it for it in items if it.get("embedding") is not None]
+    dim = len(items[0]["embedding"]) if items else 0
+    vectors = np.zeros((len(items), dim), dtype=np.float32)
+    for i, it in enumerate(items):
+        vectors[i] = it["embedding"]
+    records = [{c: it.get(c) for c in META_COLUMNS} for it in items]
+    return save_store(base or store_base(json_path), vectors, records)
+
+
+class EmbeddingStore:
+    """
+    只读向量库
+
+    Attributes:
+        vectors: N × D float32（mmap 模式下为 np.memmap）
+        columns: 列式元数据
+    """
+
+    def __init__(self, base: Path, vectors: np.ndarray, meta: Dict[str, Any]):
+        self.base = base
+        self.vectors = vectors
+        self.meta = meta
+        self.columns: Dict[str, List[Any]] = meta.get("columns", {})
+        self._file_rows: Optional[Dict[str, List[int]]] = None
+
+    @classmethod
+    def open(cls, path: PathLike, mmap: bool = True, migrate: bool = True) -> "EmbeddingStore":
+        """
+        打开向量库
+
+        Args:
+            path: base 路径或 .npy / .meta.json / 旧 .json 路径
+            mmap: 以 mmap_mode="r" 打开 .npy
+            migrate: 向量库不存在但有旧 JSON 时自动转换
+
+        Raises:
+            FileNotFoundError: 向量库与旧 JSON 都不存在
+        """
+        base = store_base(path)
+        npy, meta_path, legacy = (base.with_name(base.name + s) for s in (".npy", ".meta.json", ".json"))
+        if not (npy.exists() and meta_path.exists()):
+            if migrate and legacy.exists():
+                print(f"🔄 首次使用：将 {legacy.name} 转换为 {npy.name} + {meta_path.name}（原文件保留）")
+                migrate_json(legacy, base)
+            else:
+                raise FileNotFoundError(f"未找到向量库：{npy}（及 {meta_path.name}）")
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        vectors = np.load(npy, mmap_mode="r" if mmap else None)
+        if len(vectors) != meta.get("count", len(vectors)):
+            raise ValueError(f"向量库损坏：{npy.name} 有 {len(vectors)} 行，元数据记录 {meta.get('count')} 行")
+        return cls(base, vectors, meta)
+
+    def __len__(self) -> int:
+        return int(self.vectors.shape[0])
+
+    @property
+    def dim(self) -> int:
+        return int(self.vectors.shape[1]) if self.vectors.ndim == 2 else 0
+
+    def records(self) -> List[Dict[str, Any]]:
+        """逐行元数据（不含向量），每行带 "row" 行号"""
+        files = self.columns.get("file", [])
+        indices = self.columns.get("paragraph_index", [])
+        texts = self.columns.get("text", [])
+        return [
+            {"file": files[i], "paragraph_index": indices[i], "text": texts[i], "row": i}
+            for i in range(len(self))
+        ]
+
+    def rows_for_file(self, filename: str) -> List[int]:
+        """某篇文档的全部段落行号"""
+        if self._file_rows is None:
+            self._file_rows = {}
+            for i, name in enumerate(self.columns.get("file", [])):
+                self._file_rows.setdefault(name, []).append(i)
+        return self._file_rows.get(filename, [])
+
+    def file_vectors(self) -> Dict[str, np.ndarray]:
+        """每篇文档的段落平均向量（float32）"""
+        self.rows_for_file("")
+        return {
+            name: np.asarray(self.vectors[rows], dtype=np.float32).mean(axis=0)
+            for name, rows in self._file_rows.items()
+        }
+
+
+def vectors_for(items: Iterable[Dict[str, Any]], store: Optional[EmbeddingStore] = None) -> np.ndarray:
+    """
+    取聚类结果中各段落的向量（按 items 顺序）
+
+    有 "row" 时从向量库取；旧文件中内嵌 "embedding" 时直接使用。
+    """
+    items = list(items)
+    if items and all("row" in it for it in items):
+        if store is None:
+            raise ValueError("聚类结果只记录了行号，需要传入向量库")
+        return np.asarray(store.vectors[[it["row"] for it in items]], dtype=np.float32)
+    return np.asarray([it["embedding"] for it in items], dtype=np.float32)
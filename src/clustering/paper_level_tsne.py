@@ -12,6 +12,8 @@ from sklearn.manifold import TSNE
 from pathlib import Path
 from collections import defaultdict
 
+from embedding_store import EmbeddingStore, vectors_for
+
 # 设置中文字体
 plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei']
 plt.rcParams['axes.unicode_minus'] = False
@@ -33,17 +35,21 @@ def main():
     
     print(f"加载了 {len(paragraph_data)} 个段落级别的数据项")
     
+    # 段落向量：按 "row" 从向量库（mmap）取；旧版聚类结果内嵌 "embedding" 时直接使用
+    store = EmbeddingStore.open(data_dir / "embedding_vectors") if paragraph_data and 'row' in paragraph_data[0] else None
+    vectors = vectors_for(paragraph_data, store)
+    
     # 聚合到论文级别
     paper_data = defaultdict(list)
     
-    for item in paragraph_data:
+    for item, vector in zip(paragraph_data, vectors):
         filename = item['file']
         if filename.endswith('.md'):
             filename = filename[:-3]
         
         paper_data[filename].append({
             'cluster': item['cluster'],
-            'embedding': np.array(item['embedding'])
+            'embedding': vector
         })
     
     print(f"聚合为 {len(paper_data)} 篇论文的数据")
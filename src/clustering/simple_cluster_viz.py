@@ -14,6 +14,8 @@ from pathlib import Path
 import warnings
 warnings.filterwarnings('ignore')
 
+from embedding_store import EmbeddingStore, vectors_for
+
 # Set global font to Times New Roman (English)
 plt.rcParams['font.family'] = 'serif'
 plt.rcParams['font.serif'] = ['Times New Roman', 'Times', 'DejaVu Serif']
@@ -36,28 +38,28 @@ def load_cluster_data():
     with open(cluster_file, 'r', encoding='utf-8') as f:
         cluster_data = json.load(f)
     
-    # Load embedding vectors
-    vector_file = DATA_DIR / "embedding_vectors.json"
-    if not vector_file.exists():
-        raise FileNotFoundError(f"Embedding vector file not found: {vector_file}")
-    
-    with open(vector_file, 'r', encoding='utf-8') as f:
-        vector_data = json.load(f)
+    # Open embedding store (float32 .npy via mmap; raises FileNotFoundError if missing)
+    store = EmbeddingStore.open(DATA_DIR / "embedding_vectors")
     
-    print(f"Loaded: {len(cluster_data)} clustered samples")
-    return cluster_data, vector_data
+    print(f"Loaded: {len(cluster_data)} clustered samples, store {len(store)} x {store.dim}")
+    return cluster_data, store
 
-def prepare_dataframe(cluster_data, vector_data):
+def prepare_dataframe(cluster_data, store):
     """Prepare DataFrame for visualization"""
     print("Preparing dataframe...")
     
+    # Vectors are looked up by "row"; legacy cluster files embed them inline
+    if cluster_data and 'row' in cluster_data[0]:
+        vectors = vectors_for(cluster_data, store)
+    else:
+        vectors = [item.get('embedding', None) for item in cluster_data]
+    
     # Extract required fields
     data_list = []
-    for item in cluster_data:
+    for item, embedding in zip(cluster_data, vectors):
         paper_name = item.get('file', 'Unknown paper')
         cluster_id = item.get('cluster', -1)
         paragraph_text = item.get('text', '')
-        embedding = item.get('embedding', None)
         
         if embedding is not None:
             data_list.append({
@@ -297,8 +299,8 @@ def main():
     
     try:
         # Load data
-        cluster_data, vector_data = load_cluster_data()
-        df = prepare_dataframe(cluster_data, vector_data)
+        cluster_data, store = load_cluster_data()
+        df = prepare_dataframe(cluster_data, store)
         
         if len(df) == 0:
             print("Error: no valid cluster data found")
@@ -11,6 +11,8 @@ import matplotlib.pyplot as plt
 from sklearn.manifold import TSNE
 from pathlib import Path
 
+from embedding_store import EmbeddingStore
+
 # 设置中文字体
 plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei']
 plt.rcParams['axes.unicode_minus'] = False
@@ -30,20 +32,18 @@ def main():
     with open(cluster_file, 'r', encoding='utf-8') as f:
         cluster_data = json.load(f)
     
-    # 加载词向量
-    vector_file = data_dir / "embedding_vectors.json"
-    with open(vector_file, 'r', encoding='utf-8') as f:
-        vector_data = json.load(f)
+    # 加载词向量（mmap 打开，只读取用到的行）
+    store = EmbeddingStore.open(data_dir / "embedding_vectors")
     
-    print(f"加载了 {len(cluster_data)} 个聚类项，{len(vector_data)} 个向量")
+    print(f"加载了 {len(cluster_data)} 个聚类项，{len(store)} 个向量")
     
-    # 创建文件名到向量的映射
+    # 创建文件名到向量的映射（同一文件取最后一个段落，与原实现一致）
     file_to_vector = {}
-    for item in vector_data:
-        filename = item['file']  # 字段名是 'file' 不是 'filename'
+    for filename in set(store.columns['file']):
+        rows = store.rows_for_file(filename)
         if filename.endswith('.md'):
             filename = filename[:-3]
-        file_to_vector[filename] = np.array(item['embedding'])
+        file_to_vector[filename] = np.asarray(store.vectors[rows[-1]], dtype=np.float32)
     
     # 准备数据
     data_rows = []
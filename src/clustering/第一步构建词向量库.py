@@ -1,33 +1,26 @@
 import os
-import json
-import torch
-from transformers import AutoTokenizer, AutoModel
 from tqdm import tqdm
 
+# 批量嵌入引擎（按长度分桶 + 动态填充，见 embedding_engine.py）；
+# 设置 EMBED_SERVICE_URL 时改用常驻嵌入服务（见 embedding_service.py），不再重复加载模型
+from embedding_service import default_engine
+# 向量库（float32 .npy + 列式元数据，见 embedding_store.py）
+from embedding_store import save_store
+# 增量缓存（按段落内容哈希复用已有向量，见 embedding_cache.py）
+from embedding_cache import default_cache, embed_with_cache, format_cache_report
+
 # =============================
-# 设置模型（bge-large-zh-v1.5）
+# 设置模型（bge-large-zh-v1.5；EMBED_MODEL / EMBED_BATCH_SIZE / EMBED_THREADS 等可覆盖）
 # =============================
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model_name = "BAAI/bge-large-zh-v1.5"
-
-print("🔄 正在加载模型，请稍候...")
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModel.from_pretrained(model_name).to(device).eval()
-print("✅ 模型加载完成！")
+engine = default_engine()
 
 # =============================
 # 嵌入函数（取 CLS 向量）
 # =============================
 def embed_text(text: str):
+    """嵌入单段文本，返回 float32 向量；批量处理请直接用 engine.embed"""
     try:
-        # bge模型建议在文本前添加 "[CLS]" 以提升效果
-        text = "[CLS] " + text
-        inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=512).to(device)
-        with torch.no_grad():
-            outputs = model(**inputs)
-        # CLS token 表征
-        embedding = outputs.last_hidden_state[:, 0].squeeze().cpu().numpy()
-        return embedding.tolist()
+        return engine.embed_one(text)
     except Exception as e:
         print(f"[⚠️ 错误] 嵌入失败：{e}")
         return None
@@ -36,10 +29,11 @@ def embed_text(text: str):
 # 主处理函数
 # =============================
 def process_markdown_files(md_folder: str, output_path: str):
-    all_embeddings = []
+    records = []
     md_files = [f for f in os.listdir(md_folder) if f.endswith(".md")]
     
-    for filename in tqdm(md_files, desc="📄 正在处理文档"):
+    # 先切分全部文档，再整体按长度分桶批量嵌入
+    for filename in md_files:
         filepath = os.path.join(md_folder, filename)
         try:
             with open(filepath, "r", encoding="utf-8") as f:
@@ -48,22 +42,25 @@ def process_markdown_files(md_folder: str, output_path: str):
             # 按段落切分（以空行为段落分界）
             paragraphs = [p.strip() for p in content.split("\n\n") if len(p.strip()) > 10]
             for idx, para in enumerate(paragraphs):
-                vector = embed_text(para)
-                if vector:
-                    all_embeddings.append({
-                        "file": filename,
-                        "paragraph_index": idx,
-                        "text": para,
-                        "embedding": vector
-                    })
+                records.append({"file": filename, "paragraph_index": idx, "text": para})
         except Exception as e:
             print(f"[⚠️ 错误] 无法处理 {filename}：{e}")
 
-    # 保存
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(all_embeddings, f, indent=2, ensure_ascii=False)
-    print(f"✅ 向量库已保存到：{output_path}")
+    print(f"📄 {len(md_files)} 篇文档，共 {len(records)} 个段落")
+    # 只嵌入新增或改动的段落；已删除论文的缓存条目在保存时清理（EMBED_CACHE=0 关闭缓存）
+    cache = default_cache(engine, output_path)
+    vectors, stats = embed_with_cache(
+        engine,
+        [r["text"] for r in records],
+        cache,
+        progress_factory=lambda n: tqdm(total=n, desc="🧮 正在嵌入段落"),
+    )
+    if cache is not None:
+        print(f"🗃️  {format_cache_report(stats)}")
+
+    # 保存为 <base>.npy + <base>.meta.json（output_path 的扩展名会被忽略）
+    base = save_store(output_path, vectors, records, model=engine.model_name)
+    print(f"✅ 向量库已保存到：{base}.npy（{vectors.shape[0]} × {vectors.shape[1]}，元数据 {base.name}.meta.json）")
 
 # =============================
 # 执行主程序
@@ -71,5 +68,5 @@ def process_markdown_files(md_folder: str, output_path: str):
 if __name__ == "__main__":
     input_folder = r"E:\知识图谱构建\9.15之前的实验\EXP-4\主题聚类\有标注原文"
     # 保存到主题聚类目录下的 数据结果 文件夹（使用绝对路径，便于在不同工作目录运行）
-    output_file = r"E:\知识图谱构建\9.15之前的实验\EXP-4\主题聚类\数据结果\embedding_vectors.json"
+    output_file = r"E:\知识图谱构建\9.15之前的实验\EXP-4\主题聚类\数据结果\embedding_vectors"
     process_markdown_files(input_folder, output_file)
@@ -3,21 +3,24 @@ import json  # <-- 1. 引入 json 库
 from pathlib import Path
 import joblib
 import numpy as np
-import torch
-from transformers import AutoTokenizer, AutoModel
 from sklearn.metrics.pairwise import cosine_similarity
 
+# 与第一步相同的嵌入引擎；设置 EMBED_SERVICE_URL 时使用常驻嵌入服务（见 embedding_service.py）
+from embedding_service import default_engine
+
 # ─── 配置 ─────────────────────────────────────────────────────
 # 将路径固定为相对于脚本上级目录（主题聚类根目录）的绝对路径，避免因运行位置不同导致找不到文件
 ROOT_DIR = Path(__file__).resolve().parent.parent
 DATA_SOURCE_DIR = str((ROOT_DIR / "无标注原文").resolve())
 CLUSTERS_PATH   = str((ROOT_DIR / "数据结果" / "embedding_clusters_with_paragraph_annots.json").resolve())
 UMAP_MODEL_PATH = str((ROOT_DIR / "数据结果" / "umap_model.joblib").resolve())
-MODEL_NAME      = "BAAI/bge-large-zh-v1.5"
 OUTPUT_DIR      = str((ROOT_DIR / "数据结果" / "s_modules").resolve())
+# 每篇文档的主题簇及该簇标注中出现的实体/关系类型，供抽取时裁剪 schema（EXTRACT_SCHEMA_CLUSTERS）
+PAPER_CLUSTERS_PATH = str((ROOT_DIR / "数据结果" / "paper_clusters.json").resolve())
 TOP_K           = 3      # 每篇文档的示例数
-
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+# 批量检索（默认开启）：全部文档一次嵌入、一次 UMAP 降维、一次矩阵乘法算相似度；
+# FEWSHOT_BATCH=0 时回到逐篇 embed + transform（用于核对结果）
+BATCH_MODE      = os.getenv("FEWSHOT_BATCH", "1").strip().lower() not in {"0", "false", "no", "n"}
 
 # ─── 路径存在性检查与打印 ─────────────────────────────────
 print("[路径解析] ROOT_DIR:", ROOT_DIR)
@@ -39,16 +42,11 @@ with open(CLUSTERS_PATH, "r", encoding="utf-8") as f:
     library = json.load(f)
 umap_model = joblib.load(UMAP_MODEL_PATH)
 
-# ─── 加载文本嵌入模型 ──────────────────────────────────────────
-tokenizer   = AutoTokenizer.from_pretrained(MODEL_NAME)
-embed_model = AutoModel.from_pretrained(MODEL_NAME).to(device).eval()
+# ─── 文本嵌入模型（bge-large-zh-v1.5，"[CLS] " 前缀、截断 512、取 CLS 向量）────────────
+engine = default_engine()
 
 def embed(text: str) -> np.ndarray:
-    inputs = tokenizer("[CLS] " + text, return_tensors="pt",
-                       truncation=True, max_length=512).to(device)
-    with torch.no_grad():
-        out = embed_model(**inputs)
-    return out.last_hidden_state[:, 0].squeeze().cpu().numpy()
+    return engine.embed_one(text)
 
 def to_5d(vec: np.ndarray) -> np.ndarray:
     return umap_model.transform([vec])[0]
@@ -101,56 +99,86 @@ def split_annotations(annotations) -> tuple[list, list]:
 lib_vecs_5d  = np.array([e["embedding_5d"] for e in library])
 lib_clusters = np.array([e["cluster"]     for e in library])
 
+# 每个示例是否同时具备实体与关系（只有这样的示例才会被选中），预先算好避免逐候选重复 split_annotations
+lib_valid = np.array([
+    all(map(bool, split_annotations(e.get("annotations")))) for e in library
+], dtype=bool)
+
+def top_candidates(candidates: np.ndarray, scores: np.ndarray, n: int) -> list:
+    """
+    按相似度从高到低取前 n 个候选下标
+
+    用 argpartition 只对前 n 名（含与第 n 名同分者）排序；同分时下标大的在前，
+    与原实现 np.argsort(...)[::-1] 的倒序遍历一致。
+    """
+    if n <= 0 or len(candidates) == 0:
+        return []
+    cand_scores = scores[candidates]
+    if len(candidates) > n:
+        kth = cand_scores[np.argpartition(-cand_scores, n - 1)[n - 1]]
+        keep = cand_scores >= kth
+        candidates, cand_scores = candidates[keep], cand_scores[keep]
+    order = np.lexsort((-candidates, -cand_scores))
+    return [int(i) for i in candidates[order][:n]]
+
+def select_examples(sims: np.ndarray, primary_cluster) -> list:
+    """优先同簇、再全库，按相似度选 TOP_K 个同时具备实体与关系的示例下标"""
+    selected = top_candidates(np.flatnonzero((lib_clusters == primary_cluster) & lib_valid), sims, TOP_K)
+    if len(selected) < TOP_K:
+        # 同簇内的有效示例已全部入选，从全库其余有效示例中补足
+        rest = np.flatnonzero(lib_valid)
+        rest = rest[~np.isin(rest, selected)]
+        selected += top_candidates(rest, sims, TOP_K - len(selected))
+    return selected
+
+_cluster_types_cache: dict = {}
+
+def cluster_types(cluster_id) -> dict:
+    """该簇所有段落标注中出现过的实体类型与关系类型"""
+    key = int(cluster_id)
+    if key not in _cluster_types_cache:
+        ent_types, rel_types = set(), set()
+        for idx in np.where(lib_clusters == cluster_id)[0]:
+            entities, relations = split_annotations(library[idx].get("annotations"))
+            ent_types.update(e["type"] for e in entities if e["type"])
+            rel_types.update(r["type"] for r in relations if r["type"])
+        _cluster_types_cache[key] = {
+            "cluster": key,
+            "entity_types": sorted(ent_types),
+            "relation_types": sorted(rel_types),
+        }
+    return _cluster_types_cache[key]
+
 # ─── 生成 S 模块 ─────────────────────────────────────────────
 os.makedirs(OUTPUT_DIR, exist_ok=True)
+paper_clusters: dict = {}
 
+# 1) 读取全文用于向量化（示例选取）
+doc_names, doc_texts = [], []
 for fn in sorted(os.listdir(DATA_SOURCE_DIR)):
     if not fn.endswith(".md"):
         continue
-
-    # 1) 读取全文用于向量化（示例选取）
     path = os.path.join(DATA_SOURCE_DIR, fn)
     with open(path, "r", encoding="utf-8") as f:
-        full_text = f.read().strip()
-
-    # 2) 嵌入 + 降维 + 相似度
-    vec    = embed(full_text)
-    vec5d  = to_5d(vec)
-    sims   = cosine_similarity([vec5d], lib_vecs_5d)[0]
+        doc_names.append(fn)
+        doc_texts.append(f.read().strip())
+
+# 2) 嵌入 + 降维 + 相似度（文档数 × 示例库）
+if not doc_names:
+    sims_matrix = np.zeros((0, len(library)))
+elif BATCH_MODE:
+    print(f"[批量检索] {len(doc_names)} 篇文档：批量嵌入 → UMAP 降维 → 相似度矩阵")
+    doc_vecs_5d = umap_model.transform(engine.embed(doc_texts))
+    sims_matrix = cosine_similarity(doc_vecs_5d, lib_vecs_5d)
+else:
+    sims_matrix = np.vstack([cosine_similarity([to_5d(embed(text))], lib_vecs_5d)[0] for text in doc_texts])
+
+for fn, sims in zip(doc_names, sims_matrix):
     primary_cluster = lib_clusters[sims.argmax()]
-    idxs_in_cluster = np.where(lib_clusters == primary_cluster)[0]
-    sims_in_cluster = sims[idxs_in_cluster]
-    
-    # 按相似度排序（同簇内），仅筛选同时具备实体与关系的示例
-    sorted_idxs = idxs_in_cluster[np.argsort(sims_in_cluster)[::-1]]
-    def has_entities_and_relations(ann_list) -> bool:
-        ents, rels = split_annotations(ann_list)
-        return bool(ents) and bool(rels)
-
-    selected: list[dict] = []
-    used_idx: set[int] = set()
-
-    # 优先从同簇内选择既有实体又有关系的示例
-    for idx in sorted_idxs:
-        if len(selected) >= TOP_K:
-            break
-        candidate = library[idx]
-        if has_entities_and_relations(candidate.get("annotations")):
-            selected.append(candidate)
-            used_idx.add(idx)
-
-    # 如果同簇内不足，从全库按相似度补足，仍然要求实体与关系同时存在
-    if len(selected) < TOP_K:
-        all_sorted_idxs = np.argsort(sims)[::-1]
-        for idx in all_sorted_idxs:
-            if len(selected) >= TOP_K:
-                break
-            if idx in used_idx:
-                continue
-            candidate = library[idx]
-            if has_entities_and_relations(candidate.get("annotations")):
-                selected.append(candidate)
-                used_idx.add(idx)
+    paper_clusters[fn] = cluster_types(primary_cluster)
+
+    # 同簇内按相似度选既有实体又有关系的示例，不足时从全库补足
+    selected: list[dict] = [library[idx] for idx in select_examples(sims, primary_cluster)]
 
     # 3) 拼接 S 模块内容  <-- 2. 此处为核心修改区域
     if len(selected) < TOP_K:
@@ -181,4 +209,8 @@ for fn in sorted(os.listdir(DATA_SOURCE_DIR)):
     with open(out_fp, "w", encoding="utf-8") as fo:
         fo.write("\n".join(lines))
 
-    print(f"✔ 已生成 S 模块：{out_fp}")
\ No newline at end of file
+    print(f"✔ 已生成 S 模块：{out_fp}")
+
+with open(PAPER_CLUSTERS_PATH, "w", encoding="utf-8") as fo:
+    json.dump(paper_clusters, fo, ensure_ascii=False, indent=2)
+print(f"✔ 已保存文档主题簇：{PAPER_CLUSTERS_PATH}")
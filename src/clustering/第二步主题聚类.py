@@ -5,17 +5,20 @@ import umap
 import hdbscan
 import joblib
 
+from embedding_store import EmbeddingStore
+
 # ─── 路径配置 ─────────────────────────────────────────────────────
 BASE_DIR = r"E:\知识图谱构建\9.15之前的实验\EXP-4\主题聚类"
-EMBEDDING_PATH      = os.path.join(BASE_DIR, "数据结果", "embedding_vectors.json")
+EMBEDDING_PATH      = os.path.join(BASE_DIR, "数据结果", "embedding_vectors")  # .npy + .meta.json
 ANNOTATIONS_DIR     = os.path.join(BASE_DIR, "聚类论文标注结果")
 OUTPUT_PATH         = os.path.join(BASE_DIR, "数据结果", "embedding_clusters_with_paragraph_annots.json")
 UMAP_MODEL_PATH     = os.path.join(BASE_DIR, "数据结果", "umap_model.joblib")
 
 # ─── 1. 读取第一步生成的向量库 ─────────────────────────────────────────
-with open(EMBEDDING_PATH, "r", encoding="utf-8") as f:
-    paragraphs = json.load(f)
-# paragraphs 是列表，每项包含 "file", "paragraph_index", "text", "embedding"
+# 向量以 mmap 方式打开；只有旧的 embedding_vectors.json 时会自动转换一次
+store = EmbeddingStore.open(EMBEDDING_PATH)
+paragraphs = store.records()
+# paragraphs 是列表，每项包含 "file", "paragraph_index", "text", "row"（向量库行号）
 
 # ─── 2. 加载并扁平化标注文件 ───────────────────────────────────────────
 annotations_map = {}
@@ -31,7 +34,7 @@ for fname in os.listdir(ANNOTATIONS_DIR):
     annotations_map[md_name] = ents + rels
 
 # ─── 3. 提取向量用于降维 ────────────────────────────────────────────
-embeddings = np.array([p["embedding"] for p in paragraphs])
+embeddings = np.asarray(store.vectors, dtype=np.float32)
 
 # ─── 4. UMAP 降维 ───────────────────────────────────────────────────
 print("UMAP 降维中...")
@@ -81,7 +84,7 @@ for idx, para in enumerate(paragraphs):
 
     para["annotations"] = unique_anns
 
-# ─── 7. 保存结果 ─────────────────────────────────────────────────────
+# ─── 7. 保存结果（不再内嵌 1024 维向量，按 "row" 回查向量库）────────────────
 os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
 with open(OUTPUT_PATH, "w", encoding="utf-8") as fo:
     json.dump(paragraphs, fo, indent=2, ensure_ascii=False)
@@ -1,5 +1,12 @@
 import os
-import json
+import sys
+
+# 组装逻辑在 utils.prompt_renderer 中，抽取脚本提交时直接在内存中组装，无需先运行本脚本；
+# 本脚本仅用于把完整 prompt 落盘查看（调试/审计），结果与抽取时提交的内容逐字相同
+SRC_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SRC_ROOT not in sys.path:
+    sys.path.insert(0, SRC_ROOT)
+from utils.prompt_renderer import compose_prompt, extract_examples
 
 # ─── 路径配置（基于脚本所在的“主题聚类”目录） ─────────────────────────────
 # 本脚本位于 主题聚类/code 下，数据与模板位于其父级目录 主题聚类 下
@@ -28,20 +35,7 @@ def read_prompt_template():
 def extract_examples_from_s_module(s_module_path):
     """从S模块中提取示例内容，去掉标题和说明文字"""
     with open(s_module_path, "r", encoding="utf-8") as f:
-        content = f.read()
-    
-    # 跳过标题部分，从第一个"示例"开始
-    lines = content.split('\n')
-    examples_lines = []
-    start_extracting = False
-    
-    for line in lines:
-        if line.strip().startswith("示例"):
-            start_extracting = True
-        if start_extracting:
-            examples_lines.append(line)
-    
-    return '\n'.join(examples_lines).strip()
+        return extract_examples(f.read())
 
 def read_document_content(doc_path):
     """读取文档内容"""
@@ -49,41 +43,8 @@ def read_document_content(doc_path):
         return f.read().strip()
 
 def generate_complete_prompt(template, examples, document_content):
-    """生成完整的prompt"""
-    # 找到"## 输出格式"的位置
-    output_format_marker = "## 输出格式\n请严格按照以下JSON格式输出结果："
-    
-    if output_format_marker in template:
-        # 在输出格式前插入示例
-        before_output = template.split(output_format_marker)[0]
-        after_output = output_format_marker + template.split(output_format_marker)[1]
-        
-        # 构建完整prompt
-        complete_prompt = before_output.strip() + "\n\n"
-        
-        # 添加Few-Shot示例部分
-        if examples:
-            complete_prompt += "## Few-Shot示例\n"
-            complete_prompt += "以下是相关领域的标注示例，请参考这些示例的标注风格和粒度：\n\n"
-            complete_prompt += examples + "\n\n"
-        
-        # 添加输出格式部分
-        complete_prompt += after_output
-        
-        # 替换文档内容占位符
-        complete_prompt = complete_prompt.replace("{full_text_placeholder}", document_content)
-        
-        return complete_prompt
-    else:
-        # 如果没找到标记，直接在末尾添加
-        complete_prompt = template
-        if examples:
-            complete_prompt += "\n\n## Few-Shot示例\n"
-            complete_prompt += "以下是相关领域的标注示例，请参考这些示例的标注风格和粒度：\n\n"
-            complete_prompt += examples
-        
-        complete_prompt = complete_prompt.replace("{full_text_placeholder}", document_content)
-        return complete_prompt
+    """生成完整的prompt（组装规则见 utils.prompt_renderer.compose_prompt）"""
+    return compose_prompt(template, examples, document_content)
 
 def main():
     """主函数"""
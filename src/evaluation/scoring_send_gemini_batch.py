@@ -27,19 +27,31 @@
     --max            每个模型最多处理文件数（默认 50）
     --overwrite      已存在结果是否覆盖
     --force-json-output  尝试使用 response_format 强制 JSON（不支持自动降级）
+    --no-cache       绕过 LLM 响应缓存（等价于 LLM_CACHE_BYPASS=1），用于需要重复真实调用的场景
+    --batch          离线 batch 模式：所有待打分文件写成一个 batch JSONL 经 /v1/batches 一次提交，
+                     轮询完成后写回 .response.json 与日志（BATCH_BASE_URL 可指向本地 mock 服务）
 
 示例（PowerShell）：
     $env:HIAPI_API_KEY = "sk-xxxxx" ; python ./code/抽取脚本/send_gemini_batch.py --models deepseek,gemini,kimi --max 999 --remote-model gemini-2.5-pro
 """
 
 import os
+import sys
 import json
 import time
 import argparse
 from datetime import datetime, timezone
 from typing import List
 
-from openai import OpenAI
+# 共享限流与调用网关（仓库 src/utils）
+SRC_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SRC_ROOT not in sys.path:
+    sys.path.insert(0, SRC_ROOT)
+from utils.rate_limiter import get_limiter, backoff_delay
+from utils.hedging import chat_completion_hedged
+from utils.batch_api import BatchAPIClient, batch_base_url, run_batch_job
+from utils.http_client import get_openai_client
+from utils.preflight import cached_preflight
 
 
 # ------------------------------
@@ -172,6 +184,112 @@ def parse_models_arg(raw: str) -> List[str]:
     return valid_sequence
 
 
+def run_batch_scoring(args, target_models: List[str], prompt_text: str, base_url: str, api_key: str):
+    """离线 batch 模式：收集全部待打分文件，一个批次提交，完成后按文件写回结果与日志"""
+    jobs = []
+    requests = []
+    for model_name in target_models:
+        extraction_dir = os.path.join(EXTRACTION_BASE, f"提取结果_by_{model_name}", "in_scope")
+        if not os.path.isdir(extraction_dir):
+            print(f"[WARN] 模型 {model_name} 跳过：未找到目录 {extraction_dir}")
+            continue
+        output_dir = os.path.join(SCORING_OUTPUT_BASE, model_name)
+        os.makedirs(output_dir, exist_ok=True)
+        all_files = [
+            f for f in sorted(os.listdir(extraction_dir))
+            if f.lower().endswith('.json') and os.path.isfile(os.path.join(extraction_dir, f))
+        ]
+        for json_name in all_files[: max(args.max, 0)]:
+            stem = os.path.splitext(json_name)[0]
+            output_file = os.path.join(output_dir, stem + ".response.json")
+            if os.path.exists(output_file) and not args.overwrite:
+                append_run_log({
+                    "time": now_iso(),
+                    "file": json_name,
+                    "model_scored": model_name,
+                    "status": "skipped",
+                    "reason": "exists",
+                    "output": output_file,
+                })
+                continue
+            with open(os.path.join(extraction_dir, json_name), 'r', encoding='utf-8') as jf:
+                json_text = jf.read()
+            body = {
+                "model": args.remote_model,
+                "messages": build_messages(prompt_text, json_text, model_name),
+                "temperature": 0,
+            }
+            if args.force_json_output:
+                body["response_format"] = {"type": "json_object"}
+            custom_id = f"{model_name}/{json_name}"
+            requests.append((custom_id, body))
+            jobs.append((custom_id, model_name, json_name, output_dir, output_file))
+
+    if not requests:
+        print("没有需要打分的文件。")
+        return
+
+    print(f"离线 batch 模式：共 {len(requests)} 个文件待打分")
+    start_ts = time.time()
+    client = BatchAPIClient(batch_base_url(base_url), api_key)
+    results = run_batch_job(
+        client, requests, os.path.join(LOG_DIR, "batch"),
+        name="scoring", metadata={"task": "scoring", "remote_model": args.remote_model},
+    )
+    elapsed = round(time.time() - start_ts, 3)
+
+    success, failed = 0, 0
+    for custom_id, model_name, json_name, output_dir, output_file in jobs:
+        resp = results[custom_id]
+        status = "success"
+        record = {}
+        if isinstance(resp, Exception):
+            status = "failed"
+            msg = str(resp)
+            fail_flag = os.path.join(output_dir, os.path.splitext(json_name)[0] + ".failed.txt")
+            with open(fail_flag, 'w', encoding='utf-8') as ff:
+                ff.write(f"失败时间: {now_iso()}\n异常: {msg}\n")
+            record = {"error": msg, "fail_flag": fail_flag}
+            failed += 1
+        else:
+            content = resp.choices[0].message.content
+            try:
+                data = parse_strict_json(content)
+            except Exception:
+                data = {"raw_text": content}
+            with open(output_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            record = {
+                "output": output_file,
+                "usage": _usage_to_dict(getattr(resp, 'usage', None)),
+                "cache_hit": bool(getattr(resp, 'from_cache', False)),
+                "batch_id": getattr(resp, 'batch_id', None),
+            }
+            success += 1
+        append_run_log({
+            "time": now_iso(),
+            "file": json_name,
+            "model_scored": model_name,
+            "status": status,
+            "remote_model": args.remote_model,
+            "batch": True,
+            **record,
+        })
+        append_timing({
+            "time": now_iso(),
+            "file": json_name,
+            "provider": PROVIDER_NAME,
+            "model_remote": args.remote_model,
+            "model_scored": model_name,
+            "status": status,
+            "duration_seconds": elapsed,
+            "attempts": 1,
+            "batch": True,
+            **record,
+        })
+    print(f"batch 打分结束：成功 {success}，失败 {failed}（批次总耗时 {elapsed}s）")
+
+
 def main():
     parser = argparse.ArgumentParser(description="批量对三个抽取模型的 in_scope 结果进行 LLM 打分")
     parser.add_argument("--models", default="deepseek,gemini,kimi", help="要处理的抽取模型列表，逗号分隔（默认 deepseek,gemini,kimi）")
@@ -179,8 +297,13 @@ def main():
     parser.add_argument("--remote-model", default=DEFAULT_REMOTE_MODEL, help="用于评分的远程 LLM 模型名称")
     parser.add_argument("--force-json-output", action="store_true", help="尝试使用 response_format 强制 JSON 输出（如不支持将自动降级）")
     parser.add_argument("--overwrite", action="store_true", help="存在结果时是否覆盖")
+    parser.add_argument("--no-cache", action="store_true", help="绕过 LLM 响应缓存（重复打分时使用）")
+    parser.add_argument("--batch", action="store_true", help="离线 batch 模式：一次提交全部请求，轮询完成后写回结果")
     args = parser.parse_args()
 
+    if args.no_cache:
+        os.environ["LLM_CACHE_BYPASS"] = "1"
+
     target_models = parse_models_arg(args.models)
     if not target_models:
         raise ValueError("--models 解析为空，请提供至少一个模型名称")
@@ -218,14 +341,16 @@ def main():
             "请到 hiapi 后台复制以 sk- 开头的密钥，并设置到 HIAPI_API_KEY。"
         )
 
-    client = OpenAI(api_key=api_key, base_url=base_url)
+    client = get_openai_client(PROVIDER_NAME, api_key, base_url)
+    # 同一提供商 + Key 共享的 RPM/TPM 限流器（限额见 config.yaml 的 rate_limits）
+    limiter = get_limiter(PROVIDER_NAME, api_key)
 
-    # 预检
+    # 预检（通过结果按 base_url + Key 指纹缓存，见 utils.preflight）
     try:
-        models_res = client.models.list()
-        models_cnt = len(getattr(models_res, "data", []) or [])
+        preflight = cached_preflight(client, base_url, api_key)
         print(
-            f"预检通过：已连接 {base_url}（模型数≈{models_cnt}）。Key 来源={api_key_source}，Key 掩码={_mask_key(api_key)}"
+            f"预检通过{'（缓存）' if preflight['cached'] else ''}：已连接 {base_url}（模型数≈{preflight['models']}）。"
+            f"Key 来源={api_key_source}，Key 掩码={_mask_key(api_key)}"
         )
     except Exception as _e:
         _msg = str(_e)
@@ -236,6 +361,10 @@ def main():
         else:
             print("预检警告：/models 不可用或返回非 401 错误，将继续执行。详情：" + _msg)
 
+    if args.batch:
+        run_batch_scoring(args, target_models, prompt_text, base_url, api_key)
+        return
+
     grand_success, grand_failed = 0, 0
     aborted_for_balance = False
 
@@ -304,14 +433,16 @@ def main():
                     use_response_format = bool(args.force_json_output)
                     try:
                         if use_response_format:
-                            resp = client.chat.completions.create(
+                            resp = chat_completion_hedged(
+                                client, limiter,
                                 model=args.remote_model,
                                 messages=messages,
                                 temperature=0,
                                 response_format={"type": "json_object"},
                             )
                         else:
-                            resp = client.chat.completions.create(
+                            resp = chat_completion_hedged(
+                                client, limiter,
                                 model=args.remote_model,
                                 messages=messages,
                                 temperature=0,
@@ -320,7 +451,8 @@ def main():
                         msg_first = str(e_first)
                         if use_response_format and ("response_format" in msg_first.lower() or "unsupported" in msg_first.lower()):
                             # 自动降级
-                            resp = client.chat.completions.create(
+                            resp = chat_completion_hedged(
+                                client, limiter,
                                 model=args.remote_model,
                                 messages=messages,
                                 temperature=0,
@@ -344,6 +476,7 @@ def main():
                         "output": output_file,
                         "remote_model": args.remote_model,
                         "usage": _usage_to_dict(getattr(resp, 'usage', None)),
+                        "cache_hit": bool(getattr(resp, 'from_cache', False)),
                     })
                     append_timing({
                         "time": now_iso(),
@@ -356,6 +489,7 @@ def main():
                         "attempts": attempts,
                         "output": output_file,
                         "usage": _usage_to_dict(getattr(resp, 'usage', None)),
+                        "cache_hit": bool(getattr(resp, 'from_cache', False)),
                     })
                     print(f"  完成 -> {output_file}")
                     success += 1
@@ -413,11 +547,10 @@ def main():
                         })
                         failed += 1
                     else:
-                        time.sleep(2 ** attempt)
+                        time.sleep(backoff_delay(attempt, e))
 
             if aborted_for_balance:
                 break
-            time.sleep(1)  # 轻限速
 
         grand_success += success
         grand_failed += failed
@@ -1,12 +1,24 @@
 # -*- coding: utf-8 -*-
 # 文件：code/提取脚本.py
 import os
+import sys
 import json
 import time
 from datetime import datetime, timezone
 
-# 通过 OpenAI SDK 直连 hiapi.online（Gemini OpenAI 兼容端点）
-from openai import OpenAI
+# 通过 OpenAI SDK 直连 hiapi.online（Gemini OpenAI 兼容端点）；客户端与连接池由共享的 utils.http_client 创建
+
+# 共享限流与调用网关（仓库 src/utils）
+SRC_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SRC_ROOT not in sys.path:
+    sys.path.insert(0, SRC_ROOT)
+from utils.rate_limiter import get_limiter, backoff_delay
+from utils.llm_gateway import chat_completion
+from utils.http_client import get_openai_client
+from utils.job_store import prompt_hash
+from utils.prompt_renderer import default_renderer
+from utils.preflight import cached_preflight
+from utils.metrics import record_retry, summary_line
 
 # ------------------------------
 # 路径配置
@@ -22,10 +34,6 @@ LOG_DIR = os.path.join(DATA_RESULT_DIR, "log")              # 日志文件存放
 MAIN_LOG_FILE = os.path.join(LOG_DIR, "extraction_log.ndjson")  # 总日志文件
 TIMING_FILE = os.path.join(LOG_DIR, "timings.ndjson")           # 耗时统计
 
-os.makedirs(DATA_RESULT_DIR, exist_ok=True)
-os.makedirs(EXTRACT_RESULT_DIR, exist_ok=True)
-os.makedirs(LOG_DIR, exist_ok=True)
-
 # 默认使用 Gemini 模型（hiapi.online 支持的模型名，见站点教程）
 # 可按需改为："gemini-2.5-pro-preview-06-05"、"gemini-2.5-pro"、"gpt-5" 等
 MODEL_NAME = "gemini-2.5-pro"
@@ -34,14 +42,14 @@ PROVIDER_NAME = "gemini"
 # ------------------------------
 # 速度/鲁棒性参数（可通过环境变量覆盖）
 # ------------------------------
-# 每篇结束后等待秒数（默认 1.0；置 0 可更快，但更易触发限流）
-SLEEP_SECS = float(os.getenv("EXTRACT_SLEEP_SECS", "1"))
+# 每篇固定等待（EXTRACT_SLEEP_SECS）已由共享限流器取代：按 GEMINI_RPM / GEMINI_TPM 自适应限速
 # 最大重试次数（默认 3；可通过 EXTRACT_MAX_RETRIES 调整）
 try:
     MAX_RETRIES = int(os.getenv("EXTRACT_MAX_RETRIES", "3"))
 except Exception:
     MAX_RETRIES = 3
-# 跳过 /models 预检（默认否；设 EXTRACT_SKIP_PREFLIGHT=1 可跳过，减少启动耗时）
+# 跳过 /models 预检（默认否；设 EXTRACT_SKIP_PREFLIGHT=1 可跳过）。
+# 预检通过的结果按 (base_url, Key 指纹) 缓存 EXTRACT_PREFLIGHT_TTL 秒（默认 6 小时），有效期内启动不发请求
 SKIP_PREFLIGHT = os.getenv("EXTRACT_SKIP_PREFLIGHT", "0") in {"1", "true", "TRUE"}
 
 # ------------------------------
@@ -124,12 +132,13 @@ def append_timing(item: dict):
     with open(TIMING_FILE, "a", encoding="utf-8") as f:
         f.write(json.dumps(item, ensure_ascii=False) + "\n")
 
-def save_prompt(paper_file: str, prompt_text: str) -> str:
+def save_prompt(paper_file: str, prompt_text: str, prompt_digest: str = "") -> str:
     """保存单篇论文的 prompt 到日志，并写入总日志，返回 prompt 内容"""
     log_item = {
         "time": now_iso(),
         "paper": paper_file,
         "prompt_length": len(prompt_text),
+        "prompt_hash": prompt_digest,
         "action": "prompt_generated"
     }
     with open(MAIN_LOG_FILE, "a", encoding="utf-8") as logf:
@@ -137,16 +146,45 @@ def save_prompt(paper_file: str, prompt_text: str) -> str:
 
     return prompt_text  # 返回 prompt 内容而不是文件路径
 
-def get_prompt_for_paper(paper_file: str) -> str:
-    """根据论文文件名获取对应的完整prompt文件内容
+# 提示词在提交时于内存中组装（模板 + S 模块示例 + schema + 论文全文，见 utils.prompt_renderer），
+# 不再依赖预先生成的完整prompt文件；模板缺失或 PROMPT_RENDER=0 时回退读取 完整prompt/prompt_<论文>.txt，
+# 论文缺少 S 模块示例时仍发送组装结果，告警并在运行日志中记录 has_examples=false
+PROMPT_RENDERER = default_renderer(BASE_DIR)
+USE_PROMPT_RENDERER = os.getenv("PROMPT_RENDER", "1").strip().lower() in {"1", "true", "yes", "y"}
+
+def get_prompt_for_paper(paper_file: str, paper_text: str = "") -> tuple:
+    """获取论文对应的完整prompt
     
     Args:
         paper_file: 论文文件名，如 '飞机操纵面故障的多参数预测模型_MinerU__20250913053608.md'
+        paper_text: 论文全文（内存组装时使用）
     
     Returns:
-        对应的完整prompt文件内容
+        (完整prompt内容, 内容哈希)；找不到或读取失败时返回 ("", "")
     """
-    # 从论文文件名生成对应的prompt文件名
+    if USE_PROMPT_RENDERER and PROMPT_RENDERER.available():
+        try:
+            rendered = PROMPT_RENDERER.render(paper_file, paper_text)
+        except Exception as e:
+            print(f"组装prompt失败：{paper_file}，错误：{e}")
+            return "", ""
+        if rendered["has_examples"]:
+            return rendered["prompt"], rendered["hash"]
+        # S 模块缺失或不含示例：仍发送组装结果（不回退到可能过期的预生成文件），告警并记入运行日志
+        s_module = PROMPT_RENDERER.s_module_path(paper_file)
+        print(f"⚠️  缺少 S 模块示例（{s_module}），提示词将不含 Few-Shot 示例：{paper_file}")
+        append_run_log({
+            "time": now_iso(),
+            "paper": paper_file,
+            "status": "warning",
+            "reason": "no_few_shot_examples",
+            "has_examples": False,
+            "s_module": s_module,
+            "prompt_hash": rendered["hash"]
+        })
+        return rendered["prompt"], rendered["hash"]
+
+    # 回退（仅 PROMPT_RENDER=0 或模板缺失时）：读取预先生成的完整prompt文件
     # 论文文件：飞机操纵面故障的多参数预测模型_MinerU__20250913053608.md
     # 对应prompt：prompt_飞机操纵面故障的多参数预测模型_MinerU__20250913053608.txt
     if paper_file.endswith('.md'):
@@ -159,17 +197,19 @@ def get_prompt_for_paper(paper_file: str) -> str:
     if not os.path.exists(prompt_path):
         # 如果找不到对应的prompt文件，记录错误并返回空字符串
         print(f"警告：找不到对应的prompt文件：{prompt_path}")
-        return ""
+        return "", ""
     
     try:
         with open(prompt_path, "r", encoding="utf-8") as f:
-            return f.read()
+            content = f.read()
+        return content, prompt_hash([content])
     except Exception as e:
         print(f"读取prompt文件失败：{prompt_path}，错误：{e}")
-        return ""
+        return "", ""
 
 # ------------------------------
 # 初始化 Gemini 客户端（通过 hiapi.online 的 OpenAI 兼容接口）
+# 延迟到 main() 中执行：导入本模块不读取环境变量、不发网络请求、不创建目录
 # ------------------------------
 
 def _mask_key(k: str) -> str:
@@ -177,53 +217,64 @@ def _mask_key(k: str) -> str:
         return "***"
     return f"{k[:6]}...{k[-4:]}"
 
-# 支持多种环境变量名，按优先级获取，并记录来源
-api_key_source = None
-for _var in ("HIAPI_API_KEY", "GEMINI_API_KEY", "OPENAI_API_KEY", "API_KEY"):
-    _v = os.getenv(_var)
-    if _v:
-        api_key = _v.strip()
-        api_key_source = _var
-        break
-else:
-    api_key = None
-
-if not api_key:
+def resolve_api_key() -> tuple:
+    """按优先级读取 API Key，返回 (key, 来源变量名)；未设置时抛出 ValueError"""
+    for var in ("HIAPI_API_KEY", "GEMINI_API_KEY", "OPENAI_API_KEY", "API_KEY"):
+        value = os.getenv(var)
+        if value:
+            return value.strip(), var
     raise ValueError(
         "未检测到 API Key。请在环境变量中设置 HIAPI_API_KEY（或 GEMINI_API_KEY/OPENAI_API_KEY/API_KEY）。"
     )
 
-# 允许通过 HIAPI_BASE_URL 覆盖（默认 https://hiapi.online/v1）
-_base_env = os.getenv("HIAPI_BASE_URL")
-if _base_env:
-    _base_clean = _base_env.rstrip("/")
-    BASE_URL = _base_clean if _base_clean.endswith("/v1") else _base_clean + "/v1"
-else:
-    BASE_URL = "https://hiapi.online/v1"
+def resolve_base_url() -> str:
+    """允许通过 HIAPI_BASE_URL 覆盖（默认 https://hiapi.online/v1）"""
+    base_env = os.getenv("HIAPI_BASE_URL")
+    if base_env:
+        base_clean = base_env.rstrip("/")
+        return base_clean if base_clean.endswith("/v1") else base_clean + "/v1"
+    return "https://hiapi.online/v1"
 
-# 若当前目标是 hiapi.online，通常使用 sk- 开头的密钥
-if "hiapi.online" in (BASE_URL or "") and not api_key.lower().startswith("sk-"):
-    raise ValueError(
-        f"当前 base_url={BASE_URL} 指向 hiapi.online，但从 {api_key_source} 读取到的 Key 看起来不是 sk- 开头：{_mask_key(api_key)}。\n"
-        "请到 hiapi 后台复制以 sk- 开头的密钥，并设置到 HIAPI_API_KEY（重开终端或重新加载会话）。"
-    )
+_RUNTIME = None
 
-client = OpenAI(api_key=api_key, base_url=BASE_URL)
+def init_client():
+    """
+    首次调用时解析 Key 与 base_url，创建共享客户端与限流器；之后直接返回同一组对象
 
-# 启动预检：尝试 /models 以提前发现 401 或 URL 配置问题
-if not SKIP_PREFLIGHT:
+    Returns:
+        (client, limiter, base_url, api_key, api_key_source)
+    """
+    global _RUNTIME
+    if _RUNTIME is None:
+        api_key, api_key_source = resolve_api_key()
+        base_url = resolve_base_url()
+        # 若当前目标是 hiapi.online，通常使用 sk- 开头的密钥
+        if "hiapi.online" in base_url and not api_key.lower().startswith("sk-"):
+            raise ValueError(
+                f"当前 base_url={base_url} 指向 hiapi.online，但从 {api_key_source} 读取到的 Key 看起来不是 sk- 开头：{_mask_key(api_key)}。\n"
+                "请到 hiapi 后台复制以 sk- 开头的密钥，并设置到 HIAPI_API_KEY（重开终端或重新加载会话）。"
+            )
+        client = get_openai_client(PROVIDER_NAME, api_key, base_url)
+        # 同一提供商 + Key 共享的 RPM/TPM 限流器（限额见 config.yaml 的 rate_limits）
+        limiter = get_limiter(PROVIDER_NAME, api_key)
+        _RUNTIME = (client, limiter, base_url, api_key, api_key_source)
+    return _RUNTIME
+
+def preflight() -> None:
+    """启动预检：尝试 /models 以提前发现 401 或 URL 配置问题（通过结果按 TTL 缓存）"""
+    client, _, base_url, api_key, api_key_source = init_client()
     try:
-        models_res = client.models.list()
-        models_cnt = len(getattr(models_res, "data", []) or [])
+        result = cached_preflight(client, base_url, api_key)
         print(
-            f"预检通过：已连接 {BASE_URL}（模型数≈{models_cnt}）。Key 来源={api_key_source}，Key 掩码={_mask_key(api_key)}"
+            f"预检通过{'（缓存）' if result['cached'] else ''}：已连接 {base_url}（模型数≈{result['models']}）。"
+            f"Key 来源={api_key_source}，Key 掩码={_mask_key(api_key)}"
         )
     except Exception as _e:
         _msg = str(_e)
         if "401" in _msg or "unauthorized" in _msg.lower() or "invalid" in _msg.lower():
             raise RuntimeError(
                 "预检失败：鉴权未通过(401)。请确认：\n"
-                f"- base_url 是否为 {BASE_URL}\n"
+                f"- base_url 是否为 {base_url}\n"
                 f"- 当前会话是否已加载 {api_key_source}（Key 掩码：{_mask_key(api_key)}）\n"
                 "- Key 是否为 hiapi 后台颁发、且未被撤销/未超额\n"
                 "- 如刚设置环境变量，请重开 PowerShell 或在同一会话中重新设置 `$env:HIAPI_API_KEY` 后重试"
@@ -231,201 +282,226 @@ if not SKIP_PREFLIGHT:
         else:
             print("预检警告：/models 接口不可用或返回非 401 错误，将继续执行。详情：" + _msg)
 
-# ------------------------------
-# 获取所有论文文件
-# ------------------------------
-papers = sorted(f for f in os.listdir(PAPERS_DIR) if f.endswith(".md"))
-print(f"找到 {len(papers)} 篇论文：{papers}")
+def list_papers() -> list:
+    """论文目录下的全部 .md 文件（按文件名排序）"""
+    return sorted(f for f in os.listdir(PAPERS_DIR) if f.endswith(".md"))
 
 # ------------------------------
-# 批量提交
+# 主流程
 # ------------------------------
-success, failed = 0, 0
-aborted_for_balance = False
-
-# 包装带进度的迭代器
-paper_iter = _iter_with_progress(papers, desc="Gemini抽取")
-
-for paper_file in paper_iter:
-    # 输出文件路径（支持断点续跑）
-    output_file = os.path.join(EXTRACT_RESULT_DIR, paper_file.replace(".md", ".json"))
-    if os.path.exists(output_file):
-        print(f"已存在结果，跳过：{paper_file}")
-        append_run_log({
-            "time": now_iso(),
-            "paper": paper_file,
-            "status": "skipped",
-            "reason": "exists",
-            "output": output_file
-        })
-        append_timing({
-            "time": now_iso(),
-            "paper": paper_file,
-            "provider": PROVIDER_NAME,
-            "model": MODEL_NAME,
-            "status": "skipped",
-            "duration_seconds": 0,
-            "attempts": 0,
-            "output": output_file
-        })
-        # 进度更新
-        if HAVE_TQDM:
-            if hasattr(paper_iter, "set_postfix"):
-                paper_iter.set_postfix(success=success, failed=failed, skipped=True)
-        continue
-
-    paper_path = os.path.join(PAPERS_DIR, paper_file)
-    with open(paper_path, "r", encoding="utf-8") as f:
-        paper_text = f.read()
-
-    # 获取对应的完整prompt内容
-    prompt_content = get_prompt_for_paper(paper_file)
-    if not prompt_content:
-        print(f"跳过论文（无对应prompt）：{paper_file}")
-        append_run_log({
-            "time": now_iso(),
-            "paper": paper_file,
-            "status": "skipped",
-            "reason": "no_prompt_found"
-        })
-        continue
-
-    # 使用完整的prompt内容（已包含论文内容，无需再填充占位符）
-    prompt_filled = prompt_content
-
-    # 记录 prompt
-    save_prompt(paper_file, prompt_filled)
-
-    print(f"提交论文：{paper_file} ...")
-    start_ts = time.time()
-    attempts = 0
-
-    # 轻量重试
-    max_retries = MAX_RETRIES
-    for attempt in range(max_retries):
-        attempts += 1
-        try:
-            # 默认尝试使用 response_format 强制 JSON；若服务端不支持将捕获后降级
-            use_response_format = True
-            try:
-                resp = client.chat.completions.create(
-                    model=MODEL_NAME,
-                    messages=[
-                        {"role": "system", "content": "你是信息抽取助手，只输出严格的 JSON，不要添加多余文本。"},
-                        {"role": "user", "content": prompt_filled}
-                    ],
-                    temperature=0,
-                    response_format={"type": "json_object"}
-                )
-            except Exception as e_first:
-                msg_first = str(e_first)
-                # 兼容部分网关不支持 response_format 的情况
-                if "response_format" in msg_first.lower() or "unsupported" in msg_first.lower():
-                    use_response_format = False
-                    resp = client.chat.completions.create(
-                        model=MODEL_NAME,
-                        messages=[
-                            {"role": "system", "content": "你是信息抽取助手，只输出严格的 JSON，不要添加多余文本。"},
-                            {"role": "user", "content": prompt_filled}
-                        ],
-                        temperature=0
-                    )
-                else:
-                    raise
-            content = resp.choices[0].message.content
-            data = parse_strict_json(content)
-            with open(output_file, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-
-            # 日志：成功与用量
+def main():
+    os.makedirs(DATA_RESULT_DIR, exist_ok=True)
+    os.makedirs(EXTRACT_RESULT_DIR, exist_ok=True)
+    os.makedirs(LOG_DIR, exist_ok=True)
+    if os.getenv("EXTRACT_SLEEP_SECS"):
+        print("⚠️  EXTRACT_SLEEP_SECS 已废弃，请改用 GEMINI_RPM / GEMINI_TPM 配置限流")
+
+    client, limiter, _, _, _ = init_client()
+    if not SKIP_PREFLIGHT:
+        preflight()
+
+    # 获取所有论文文件
+    papers = list_papers()
+    print(f"找到 {len(papers)} 篇论文：{papers}")
+
+    # ------------------------------
+    # 批量提交
+    # ------------------------------
+    success, failed = 0, 0
+    aborted_for_balance = False
+
+    # 包装带进度的迭代器
+    paper_iter = _iter_with_progress(papers, desc="Gemini抽取")
+
+    for paper_file in paper_iter:
+        # 输出文件路径（支持断点续跑）
+        output_file = os.path.join(EXTRACT_RESULT_DIR, paper_file.replace(".md", ".json"))
+        if os.path.exists(output_file):
+            print(f"已存在结果，跳过：{paper_file}")
             append_run_log({
                 "time": now_iso(),
                 "paper": paper_file,
-                "status": "success",
-                "output": output_file,
-                "model": MODEL_NAME,
-                "usage": _usage_to_dict(getattr(resp, "usage", None))
+                "status": "skipped",
+                "reason": "exists",
+                "output": output_file
             })
             append_timing({
                 "time": now_iso(),
                 "paper": paper_file,
                 "provider": PROVIDER_NAME,
                 "model": MODEL_NAME,
-                "status": "success",
-                "duration_seconds": round(time.time() - start_ts, 3),
-                "attempts": attempts,
-                "output": output_file,
-                "usage": _usage_to_dict(getattr(resp, "usage", None))
+                "status": "skipped",
+                "duration_seconds": 0,
+                "attempts": 0,
+                "output": output_file
+            })
+            # 进度更新
+            if HAVE_TQDM:
+                if hasattr(paper_iter, "set_postfix"):
+                    paper_iter.set_postfix(success=success, failed=failed, skipped=True)
+            continue
+
+        paper_path = os.path.join(PAPERS_DIR, paper_file)
+        with open(paper_path, "r", encoding="utf-8") as f:
+            paper_text = f.read()
+
+        # 获取对应的完整prompt内容
+        prompt_content, prompt_digest = get_prompt_for_paper(paper_file, paper_text)
+        if not prompt_content:
+            print(f"跳过论文（无对应prompt）：{paper_file}")
+            append_run_log({
+                "time": now_iso(),
+                "paper": paper_file,
+                "status": "skipped",
+                "reason": "no_prompt_found"
             })
+            continue
 
-            print(f"结果已保存到 {output_file}")
-            success += 1
-            if HAVE_TQDM and hasattr(paper_iter, "set_postfix"):
-                paper_iter.set_postfix(success=success, failed=failed)
-            break  # 成功则跳出重试
-        except Exception as e:
-            msg = str(e)
-            # 余额不足：HTTP 402 或错误信息包含关键词，直接中止后续任务
-            if ("402" in msg) or ("Insufficient Balance" in msg) or ("insufficient balance" in msg.lower()):
-                print(f"余额不足，终止后续任务：{msg}")
+        # 使用完整的prompt内容（已包含论文内容，无需再填充占位符）
+        prompt_filled = prompt_content
+
+        # 记录 prompt
+        save_prompt(paper_file, prompt_filled, prompt_digest)
+
+        print(f"提交论文：{paper_file} ...")
+        start_ts = time.time()
+        attempts = 0
+
+        # 轻量重试
+        max_retries = MAX_RETRIES
+        for attempt in range(max_retries):
+            attempts += 1
+            try:
+                # 默认尝试使用 response_format 强制 JSON；若服务端不支持将捕获后降级
+                use_response_format = True
+                try:
+                    resp = chat_completion(
+                        client, limiter,
+                        model=MODEL_NAME,
+                        messages=[
+                            {"role": "system", "content": "你是信息抽取助手，只输出严格的 JSON，不要添加多余文本。"},
+                            {"role": "user", "content": prompt_filled}
+                        ],
+                        temperature=0,
+                        response_format={"type": "json_object"}
+                    )
+                except Exception as e_first:
+                    msg_first = str(e_first)
+                    # 兼容部分网关不支持 response_format 的情况
+                    if "response_format" in msg_first.lower() or "unsupported" in msg_first.lower():
+                        use_response_format = False
+                        print(f"⚠️  服务端不支持 response_format，降级为普通请求：{paper_file}")
+                        resp = chat_completion(
+                            client, limiter,
+                            model=MODEL_NAME,
+                            messages=[
+                                {"role": "system", "content": "你是信息抽取助手，只输出严格的 JSON，不要添加多余文本。"},
+                                {"role": "user", "content": prompt_filled}
+                            ],
+                            temperature=0
+                        )
+                    else:
+                        raise
+                content = resp.choices[0].message.content
+                data = parse_strict_json(content)
+                with open(output_file, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+
+                # 日志：成功与用量
                 append_run_log({
                     "time": now_iso(),
                     "paper": paper_file,
-                    "status": "aborted_balance",
-                    "error": msg
-                })
-                append_timing({
-                    "time": now_iso(),
-                    "paper": paper_file,
-                    "provider": PROVIDER_NAME,
+                    "status": "success",
+                    "output": output_file,
                     "model": MODEL_NAME,
-                    "status": "aborted_balance",
-                    "duration_seconds": round(time.time() - start_ts, 3),
-                    "attempts": attempts,
-                    "error": msg
-                })
-                aborted_for_balance = True
-                break
-            is_last = (attempt == max_retries - 1)
-            print(f"第 {attempt+1}/{max_retries} 次尝试失败：{msg}{'（已放弃）' if is_last else '，重试中…'}")
-            if is_last:
-                # 失败也保留错误记录，便于复现
-                fail_flag = output_file.replace(".json", ".failed.txt")
-                with open(fail_flag, "w", encoding="utf-8") as ff:
-                    ff.write(f"失败时间: {now_iso()}\n异常: {msg}\n")
-                append_run_log({
-                    "time": now_iso(),
-                    "paper": paper_file,
-                    "status": "failed",
-                    "error": msg,
-                    "fail_flag": fail_flag
+                    "usage": _usage_to_dict(getattr(resp, "usage", None)),
+                    "cache_hit": bool(getattr(resp, "from_cache", False)),
+                    "response_format": "json_object" if use_response_format else "none"
                 })
                 append_timing({
                     "time": now_iso(),
                     "paper": paper_file,
                     "provider": PROVIDER_NAME,
                     "model": MODEL_NAME,
-                    "status": "failed",
+                    "status": "success",
                     "duration_seconds": round(time.time() - start_ts, 3),
                     "attempts": attempts,
-                    "error": msg,
-                    "fail_flag": fail_flag
+                    "output": output_file,
+                    "usage": _usage_to_dict(getattr(resp, "usage", None)),
+                    "cache_hit": bool(getattr(resp, "from_cache", False))
                 })
-                failed += 1
+
+                print(f"结果已保存到 {output_file}")
+                success += 1
                 if HAVE_TQDM and hasattr(paper_iter, "set_postfix"):
-                    paper_iter.set_postfix(success=success, failed=failed)
-            else:
-                # 指数退避
-                time.sleep(2 ** attempt)
-
-    if aborted_for_balance:
-        # 若使用 tqdm，主动关闭
-        if HAVE_TQDM and hasattr(paper_iter, "close"):
-            paper_iter.close()
-        break
-
-    # 轻限速（可按需调整或移除）
-    if SLEEP_SECS > 0:
-        time.sleep(SLEEP_SECS)
-
-print(f"\n批量提交完成。成功: {success}，失败: {failed}，{'因余额不足提前终止' if aborted_for_balance else '全部处理完成'}。")
\ No newline at end of file
+                    paper_iter.set_postfix(success=success, failed=failed, live=summary_line(PROVIDER_NAME) or "-")
+                break  # 成功则跳出重试
+            except Exception as e:
+                msg = str(e)
+                # 余额不足：HTTP 402 或错误信息包含关键词，直接中止后续任务
+                if ("402" in msg) or ("Insufficient Balance" in msg) or ("insufficient balance" in msg.lower()):
+                    print(f"余额不足，终止后续任务：{msg}")
+                    append_run_log({
+                        "time": now_iso(),
+                        "paper": paper_file,
+                        "status": "aborted_balance",
+                        "error": msg
+                    })
+                    append_timing({
+                        "time": now_iso(),
+                        "paper": paper_file,
+                        "provider": PROVIDER_NAME,
+                        "model": MODEL_NAME,
+                        "status": "aborted_balance",
+                        "duration_seconds": round(time.time() - start_ts, 3),
+                        "attempts": attempts,
+                        "error": msg
+                    })
+                    aborted_for_balance = True
+                    break
+                is_last = (attempt == max_retries - 1)
+                print(f"第 {attempt+1}/{max_retries} 次尝试失败：{msg}{'（已放弃）' if is_last else '，重试中…'}")
+                if is_last:
+                    # 失败也保留错误记录，便于复现
+                    fail_flag = output_file.replace(".json", ".failed.txt")
+                    with open(fail_flag, "w", encoding="utf-8") as ff:
+                        ff.write(f"失败时间: {now_iso()}\n异常: {msg}\n")
+                    append_run_log({
+                        "time": now_iso(),
+                        "paper": paper_file,
+                        "status": "failed",
+                        "error": msg,
+                        "fail_flag": fail_flag
+                    })
+                    append_timing({
+                        "time": now_iso(),
+                        "paper": paper_file,
+                        "provider": PROVIDER_NAME,
+                        "model": MODEL_NAME,
+                        "status": "failed",
+                        "duration_seconds": round(time.time() - start_ts, 3),
+                        "attempts": attempts,
+                        "error": msg,
+                        "fail_flag": fail_flag
+                    })
+                    failed += 1
+                    if HAVE_TQDM and hasattr(paper_iter, "set_postfix"):
+                        paper_iter.set_postfix(success=success, failed=failed, live=summary_line(PROVIDER_NAME) or "-")
+                else:
+                    # 退避：优先遵循 Retry-After，否则指数退避加抖动
+                    record_retry(PROVIDER_NAME, MODEL_NAME)
+                    time.sleep(backoff_delay(attempt, e))
+
+        if aborted_for_balance:
+            # 若使用 tqdm，主动关闭
+            if HAVE_TQDM and hasattr(paper_iter, "close"):
+                paper_iter.close()
+            break
+
+    print(f"\n批量提交完成。成功: {success}，失败: {failed}，{'因余额不足提前终止' if aborted_for_balance else '全部处理完成'}。")
+    if summary_line(PROVIDER_NAME):
+        print(f"请求指标: {summary_line(PROVIDER_NAME)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,18 @@
 # -*- coding: utf-8 -*-
 # 文件：code/提取脚本.py
 import os
+import sys
 import json
 import time
 from datetime import datetime, timezone
 
-# 使用 OpenAI 官方 SDK 直连 Kimi（Moonshot OpenAI 兼容接口）
-from openai import OpenAI
+# 使用 OpenAI 官方 SDK 直连 Kimi（Moonshot OpenAI 兼容接口）；客户端与连接池由共享的 utils.http_client 创建
+SRC_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SRC_ROOT not in sys.path:
+    sys.path.insert(0, SRC_ROOT)
+from utils.http_client import get_openai_client
+from utils.job_store import prompt_hash
+from utils.prompt_renderer import default_renderer
 
 # ------------------------------
 # 路径配置
@@ -135,12 +141,13 @@ def append_timing(item: dict):
     with open(TIMING_FILE, "a", encoding="utf-8") as f:
         f.write(json.dumps(item, ensure_ascii=False) + "\n")
 
-def save_prompt(paper_file: str, prompt_text: str) -> str:
+def save_prompt(paper_file: str, prompt_text: str, prompt_digest: str = "") -> str:
     """保存单篇论文的 prompt 到日志，并写入总日志，返回 prompt 内容"""
     log_item = {
         "time": now_iso(),
         "paper": paper_file,
         "prompt_length": len(prompt_text),
+        "prompt_hash": prompt_digest,
         "action": "prompt_generated"
     }
     with open(MAIN_LOG_FILE, "a", encoding="utf-8") as logf:
@@ -148,16 +155,45 @@ def save_prompt(paper_file: str, prompt_text: str) -> str:
 
     return prompt_text  # 返回 prompt 内容而不是文件路径
 
-def get_prompt_for_paper(paper_file: str) -> str:
-    """根据论文文件名获取对应的完整prompt文件内容
+# 提示词在提交时于内存中组装（模板 + S 模块示例 + schema + 论文全文，见 utils.prompt_renderer），
+# 不再依赖预先生成的完整prompt文件；模板缺失或 PROMPT_RENDER=0 时回退读取 完整prompt/prompt_<论文>.txt，
+# 论文缺少 S 模块示例时仍发送组装结果，告警并在运行日志中记录 has_examples=false
+PROMPT_RENDERER = default_renderer(BASE_DIR)
+USE_PROMPT_RENDERER = os.getenv("PROMPT_RENDER", "1").strip().lower() in {"1", "true", "yes", "y"}
+
+def get_prompt_for_paper(paper_file: str, paper_text: str = "") -> tuple:
+    """获取论文对应的完整prompt
     
     Args:
         paper_file: 论文文件名，如 '飞机操纵面故障的多参数预测模型_MinerU__20250913053608.md'
+        paper_text: 论文全文（内存组装时使用）
     
     Returns:
-        对应的完整prompt文件内容
+        (完整prompt内容, 内容哈希)；找不到或读取失败时返回 ("", "")
     """
-    # 从论文文件名生成对应的prompt文件名
+    if USE_PROMPT_RENDERER and PROMPT_RENDERER.available():
+        try:
+            rendered = PROMPT_RENDERER.render(paper_file, paper_text)
+        except Exception as e:
+            print(f"组装prompt失败：{paper_file}，错误：{e}")
+            return "", ""
+        if rendered["has_examples"]:
+            return rendered["prompt"], rendered["hash"]
+        # S 模块缺失或不含示例：仍发送组装结果（不回退到可能过期的预生成文件），告警并记入运行日志
+        s_module = PROMPT_RENDERER.s_module_path(paper_file)
+        print(f"⚠️  缺少 S 模块示例（{s_module}），提示词将不含 Few-Shot 示例：{paper_file}")
+        append_run_log({
+            "time": now_iso(),
+            "paper": paper_file,
+            "status": "warning",
+            "reason": "no_few_shot_examples",
+            "has_examples": False,
+            "s_module": s_module,
+            "prompt_hash": rendered["hash"]
+        })
+        return rendered["prompt"], rendered["hash"]
+
+    # 回退（仅 PROMPT_RENDER=0 或模板缺失时）：读取预先生成的完整prompt文件
     # 论文文件：飞机操纵面故障的多参数预测模型_MinerU__20250913053608.md
     # 对应prompt：prompt_飞机操纵面故障的多参数预测模型_MinerU__20250913053608.txt
     if paper_file.endswith('.md'):
@@ -170,14 +206,15 @@ def get_prompt_for_paper(paper_file: str) -> str:
     if not os.path.exists(prompt_path):
         # 如果找不到对应的prompt文件，记录错误并返回空字符串
         print(f"警告：找不到对应的prompt文件：{prompt_path}")
-        return ""
+        return "", ""
     
     try:
         with open(prompt_path, "r", encoding="utf-8") as f:
-            return f.read()
+            content = f.read()
+        return content, prompt_hash([content])
     except Exception as e:
         print(f"读取prompt文件失败：{prompt_path}，错误：{e}")
-        return ""
+        return "", ""
 
 # ------------------------------
 # 初始化 Kimi 客户端（通过 OpenAI SDK 直连）
@@ -188,7 +225,7 @@ if not api_key:
     raise ValueError("请先在环境变量中设置 KIMI_API_KEY（或 MOONSHOT_API_KEY）")
 
 # Moonshot(Kimi) 的 OpenAI 兼容端点
-client = OpenAI(api_key=api_key, base_url="https://api.moonshot.cn/v1")
+client = get_openai_client(PROVIDER_NAME, api_key, "https://api.moonshot.cn/v1")
 
 # ------------------------------
 # 获取所有论文文件
@@ -231,7 +268,7 @@ for paper_file in papers:
         paper_text = f.read()
 
     # 获取对应的完整prompt内容
-    prompt_content = get_prompt_for_paper(paper_file)
+    prompt_content, prompt_digest = get_prompt_for_paper(paper_file, paper_text)
     if not prompt_content:
         print(f"跳过论文（无对应prompt）：{paper_file}")
         append_run_log({
@@ -246,7 +283,7 @@ for paper_file in papers:
     prompt_filled = prompt_content
 
     # 记录 prompt
-    save_prompt(paper_file, prompt_filled)
+    save_prompt(paper_file, prompt_filled, prompt_digest)
 
     print(f"提交论文：{paper_file} ...")
     start_ts = time.time()
@@ -7,6 +7,8 @@
 from .file_utils import read_json, write_json, read_markdown
 from .config_loader import load_config
 from .logger import setup_logger
+from .rate_limiter import get_limiter, backoff_delay
+from .llm_gateway import chat_completion, achat_completion
 
 __all__ = [
     "read_json",
@@ -14,4 +16,8 @@ __all__ = [
     "read_markdown",
     "load_config",
     "setup_logger",
+    "get_limiter",
+    "backoff_delay",
+    "chat_completion",
+    "achat_completion",
 ]
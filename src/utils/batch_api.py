@@ -0,0 +1,302 @@
+"""
+OpenAI 兼容 Batch API 提交（/v1/files + /v1/batches）
+
+大规模离线运行时，把所有请求写成 batch JSONL 一次性提交，轮询至完成后
+按 custom_id 取回结果，由调用方写回原有的按论文 JSON 与日志：
+
+    >>> client = BatchAPIClient(base_url, api_key)
+    >>> results = run_batch_job(client, [(custom_id, body), ...], work_dir, name="deepseek")
+    >>> results[custom_id]   # 与 chat.completions 响应同构的对象，失败时为 Exception
+
+- 已在响应缓存中的请求不提交，直接返回缓存结果（from_cache=True）
+- 批次状态写入 work_dir/<name>_<输入哈希>.state.json：中断后重新运行会继续轮询同一批次，不重复提交
+- 成功结果写回响应缓存（按 batch 端点的 base_url 计键，不与同步调用的缓存混用；
+  与同步调用相同，只写入 finish_reason == "stop" 且通过 cache_validate 的结果）
+
+环境变量：
+- BATCH_BASE_URL: 覆盖 batch 端点（如本地 scripts/mock_openai_server.py）
+- BATCH_POLL_SECS: 轮询间隔（默认 30 秒）
+- BATCH_MAX_REQUESTS: 单个批次的最大请求数（默认 50000，超出自动拆分）
+
+仅依赖标准库（urllib），不要求 openai SDK 支持 batches。
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+import urllib.error
+import urllib.request
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .llm_cache import get_default_cache, make_cache_key, response_has_json
+
+CHAT_ENDPOINT = "/v1/chat/completions"
+# 终态
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+DEFAULT_POLL_SECS = 30.0
+DEFAULT_MAX_REQUESTS = 50000
+
+
+class BatchAPIClient:
+    """最小化的 /v1/files 与 /v1/batches 客户端"""
+
+    def __init__(self, base_url: str, api_key: Optional[str] = None, timeout: float = 120.0):
+        base = (base_url or "").rstrip("/")
+        self.base_url = base if base.endswith("/v1") else base + "/v1"
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, data: Optional[bytes] = None, content_type: Optional[str] = None) -> bytes:
+        req = urllib.request.Request(self.base_url + path, data=data, method=method)
+        if self.api_key:
+            req.add_header("Authorization", f"Bearer {self.api_key}")
+        if content_type:
+            req.add_header("Content-Type", content_type)
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                return resp.read()
+        except urllib.error.HTTPError as e:
+            body = e.read().decode("utf-8", errors="replace")
+            raise RuntimeError(f"Batch API {method} {path} 失败: HTTP {e.code} {body[:500]}") from e
+
+    def _json(self, method: str, path: str, payload: Optional[dict] = None) -> dict:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else None
+        raw = self._request(method, path, data, "application/json" if data is not None else None)
+        return json.loads(raw.decode("utf-8"))
+
+    def upload_file(self, path: str, purpose: str = "batch") -> str:
+        """multipart 上传 JSONL，返回 file_id"""
+        boundary = uuid.uuid4().hex
+        with open(path, "rb") as f:
+            content = f.read()
+        filename = os.path.basename(path)
+        body = b"".join([
+            f"--{boundary}\r\n".encode(),
+            b'Content-Disposition: form-data; name="purpose"\r\n\r\n',
+            purpose.encode(), b"\r\n",
+            f"--{boundary}\r\n".encode(),
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'.encode("utf-8"),
+            b"Content-Type: application/jsonl\r\n\r\n",
+            content, b"\r\n",
+            f"--{boundary}--\r\n".encode(),
+        ])
+        raw = self._request("POST", "/files", body, f"multipart/form-data; boundary={boundary}")
+        return json.loads(raw.decode("utf-8"))["id"]
+
+    def create_batch(self, input_file_id: str, endpoint: str = CHAT_ENDPOINT,
+                     completion_window: str = "24h", metadata: Optional[dict] = None) -> dict:
+        payload = {"input_file_id": input_file_id, "endpoint": endpoint, "completion_window": completion_window}
+        if metadata:
+            payload["metadata"] = metadata
+        return self._json("POST", "/batches", payload)
+
+    def retrieve_batch(self, batch_id: str) -> dict:
+        return self._json("GET", f"/batches/{batch_id}")
+
+    def cancel_batch(self, batch_id: str) -> dict:
+        return self._json("POST", f"/batches/{batch_id}/cancel", {})
+
+    def file_content(self, file_id: str) -> str:
+        return self._request("GET", f"/files/{file_id}/content").decode("utf-8")
+
+
+# ------------------------------
+# JSONL 读写
+# ------------------------------
+def build_batch_line(custom_id: str, body: Dict[str, Any], url: str = CHAT_ENDPOINT) -> Dict[str, Any]:
+    return {"custom_id": custom_id, "method": "POST", "url": url, "body": body}
+
+
+def write_batch_jsonl(requests: Iterable[Tuple[str, Dict[str, Any]]], path: str) -> int:
+    """写出 batch 输入文件，返回行数"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    n = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for custom_id, body in requests:
+            f.write(json.dumps(build_batch_line(custom_id, body), ensure_ascii=False) + "\n")
+            n += 1
+    return n
+
+
+def _to_namespace(value: Any) -> Any:
+    if isinstance(value, dict):
+        return SimpleNamespace(**{k: _to_namespace(v) for k, v in value.items()})
+    return value
+
+
+def response_from_body(body: Dict[str, Any], batch_id: Optional[str] = None) -> SimpleNamespace:
+    """把 batch 输出中的 chat.completion 响应体还原为与 SDK 响应同构的对象"""
+    choices = []
+    for i, choice in enumerate(body.get("choices") or []):
+        msg = choice.get("message") or {}
+        message = SimpleNamespace(role=msg.get("role", "assistant"), content=msg.get("content"))
+        choices.append(SimpleNamespace(index=choice.get("index", i), message=message, finish_reason=choice.get("finish_reason")))
+    return SimpleNamespace(
+        id=body.get("id"),
+        model=body.get("model"),
+        choices=choices,
+        usage=_to_namespace(body.get("usage")),
+        from_batch=True,
+        batch_id=batch_id,
+    )
+
+
+def parse_batch_output(text: str, batch_id: Optional[str] = None) -> Dict[str, Any]:
+    """解析 batch 输出/错误文件：{custom_id: 响应对象 或 Exception}"""
+    results: Dict[str, Any] = {}
+    for line in (text or "").splitlines():
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            continue
+        custom_id = item.get("custom_id")
+        if custom_id is None:
+            continue
+        response = item.get("response") or {}
+        error = item.get("error")
+        status = response.get("status_code", 200 if response.get("body") else None)
+        if error or status != 200:
+            detail = error or (response.get("body") or {}).get("error") or response
+            results[custom_id] = RuntimeError(f"batch 请求失败（status={status}）: {json.dumps(detail, ensure_ascii=False)[:500]}")
+        else:
+            results[custom_id] = response_from_body(response.get("body") or {}, batch_id)
+    return results
+
+
+# ------------------------------
+# 提交与轮询
+# ------------------------------
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+def _load_state(path: str) -> Optional[dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_state(path: str, state: dict) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _submit_and_wait(client: BatchAPIClient, requests: List[Tuple[str, Dict[str, Any]]], work_dir: str,
+                     name: str, poll_secs: float, metadata: Optional[dict]) -> Dict[str, Any]:
+    input_path_tmp = os.path.join(work_dir, f"{name}_pending.jsonl")
+    write_batch_jsonl(requests, input_path_tmp)
+    with open(input_path_tmp, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    input_path = os.path.join(work_dir, f"{name}_{digest}.jsonl")
+    os.replace(input_path_tmp, input_path)
+    state_path = os.path.join(work_dir, f"{name}_{digest}.state.json")
+
+    state = _load_state(state_path)
+    if state and state.get("status") in TERMINAL_STATUSES - {"completed"}:
+        print(f"⚠️  上次批次 {state.get('batch_id')} 以 {state['status']} 结束，重新提交")
+        state = None
+    if state and state.get("batch_id"):
+        print(f"🔁 继续轮询已提交的批次 {state['batch_id']}（{len(requests)} 条请求）")
+    else:
+        file_id = client.upload_file(input_path)
+        batch = client.create_batch(file_id, metadata=metadata)
+        state = {"batch_id": batch["id"], "input_file_id": file_id, "input_file": input_path,
+                 "requests": len(requests), "created_at": time.time()}
+        _save_state(state_path, state)
+        print(f"📦 已提交批次 {batch['id']}（{len(requests)} 条请求，输入 {input_path}）")
+
+    batch_id = state["batch_id"]
+    last_line = None
+    while True:
+        batch = client.retrieve_batch(batch_id)
+        status = batch.get("status")
+        counts = batch.get("request_counts") or {}
+        line = f"⏳ 批次 {batch_id} 状态 {status}：完成 {counts.get('completed', 0)}/{counts.get('total', len(requests))}，失败 {counts.get('failed', 0)}"
+        if line != last_line:
+            print(line)
+            last_line = line
+        if status in TERMINAL_STATUSES:
+            break
+        time.sleep(poll_secs)
+
+    results: Dict[str, Any] = {}
+    for key in ("output_file_id", "error_file_id"):
+        file_id = batch.get(key)
+        if file_id:
+            results.update(parse_batch_output(client.file_content(file_id), batch_id))
+    missing = [cid for cid, _ in requests if cid not in results]
+    for cid in missing:
+        results[cid] = RuntimeError(f"批次 {batch_id} 结束（{status}）但未返回该请求的结果")
+    state.update({"status": status, "finished_at": time.time()})
+    _save_state(state_path, state)
+    return results
+
+
+def run_batch_job(
+    client: BatchAPIClient,
+    requests: List[Tuple[str, Dict[str, Any]]],
+    work_dir: str,
+    name: str = "batch",
+    use_cache: bool = True,
+    metadata: Optional[dict] = None,
+    cache_validate: Optional[Callable[[Any], bool]] = response_has_json,
+) -> Dict[str, Any]:
+    """
+    以 batch 方式执行一组 chat.completions 请求
+
+    Args:
+        client: BatchAPIClient
+        requests: [(custom_id, 请求体), ...]；请求体即 chat.completions.create 的参数（需含 model）
+        work_dir: 存放输入 JSONL 与批次状态文件的目录
+        name: 文件名前缀（如 deepseek / scoring）
+        use_cache: 是否先查、后写响应缓存
+        cache_validate: 写入/复用缓存前的校验（默认 response_has_json；非 JSON 输出传 None）
+
+    Returns:
+        {custom_id: 响应对象（choices/usage，带 from_batch 或 from_cache 标记）或 Exception}
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    poll_secs = _env_float("BATCH_POLL_SECS", DEFAULT_POLL_SECS)
+    max_requests = int(_env_float("BATCH_MAX_REQUESTS", DEFAULT_MAX_REQUESTS))
+
+    cache = get_default_cache() if use_cache else None
+    results: Dict[str, Any] = {}
+    pending: List[Tuple[str, Dict[str, Any]]] = []
+    keys: Dict[str, str] = {}
+    for custom_id, body in requests:
+        if cache is not None:
+            key = make_cache_key(client.base_url, body)
+            keys[custom_id] = key
+            cached = cache.get(key, cache_validate)
+            if cached is not None:
+                results[custom_id] = cached
+                continue
+        pending.append((custom_id, body))
+    if results:
+        print(f"💾 {len(results)} 条请求命中响应缓存，不再提交")
+
+    for start in range(0, len(pending), max_requests):
+        part = pending[start:start + max_requests]
+        part_results = _submit_and_wait(client, part, work_dir, name, poll_secs, metadata)
+        for custom_id, response in part_results.items():
+            if cache is not None and not isinstance(response, Exception) and custom_id in keys:
+                cache.put(keys[custom_id], response, cache_validate)
+        results.update(part_results)
+    return results
+
+
+def batch_base_url(default: str) -> str:
+    """batch 端点：BATCH_BASE_URL 优先，否则使用提供商默认地址"""
+    return (os.getenv("BATCH_BASE_URL") or "").strip() or default
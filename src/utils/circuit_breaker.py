@@ -0,0 +1,246 @@
+"""
+按提供商的熔断器与备用提供商
+
+提供商整体故障（超时、连接失败、5xx）时，抽取脚本原本会对剩下的每篇论文都用满
+max_retries 次尝试并指数退避，一个坏端点能把一夜的运行拖成几天。熔断器按提供商统计
+连续失败（由 llm_gateway 在每次请求结束时反馈）：
+- closed：正常放行；连续失败达到阈值后转为 open
+- open：拒绝放行，调用方改走备用提供商，或等待冷却与半开探测（wait_ready）；冷却期过后转为 half_open
+- half_open：只放行一个探测请求；成功则恢复 closed，失败则重新 open 且冷却期翻倍（有上限）
+
+429 由限流器处理，4xx（参数错误、鉴权失败等）与具体论文相关，均不计入失败。
+
+环境变量（<PROVIDER> 为 DEEPSEEK / GEMINI / KIMI 等，提供商级变量优先）：
+- CIRCUIT_BREAKER_THRESHOLD / <PROVIDER>_BREAKER_THRESHOLD: 连续失败阈值（默认 5；0 关闭熔断）
+- CIRCUIT_BREAKER_COOLDOWN: 首次冷却时间（秒，默认 60）
+- CIRCUIT_BREAKER_MAX_COOLDOWN: 冷却时间上限（秒，默认 900）
+- CIRCUIT_BREAKER_MAX_OUTAGE: 无备用提供商时最多等待故障恢复的总时长（秒，默认 1200，
+  应小于任务租约 EXTRACT_JOB_LEASE_SECS）；超过后调用方归还任务，留待下次运行
+- <PROVIDER>_FALLBACK: 熔断期间改用的备用提供商与模型，如 "deepseek" 或 "deepseek:deepseek-chat"
+- <PROVIDER>_FALLBACK_BASE_URL: 覆盖备用提供商的 base_url
+"""
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from .rate_limiter import is_rate_limit_error
+
+DEFAULT_THRESHOLD = 5
+DEFAULT_COOLDOWN = 60.0
+DEFAULT_MAX_COOLDOWN = 900.0
+DEFAULT_MAX_OUTAGE = 1200.0
+
+# 备用提供商的默认端点、Key 环境变量（依次尝试）、默认模型与单次输出上限
+PROVIDER_ENDPOINTS: Dict[str, Dict[str, Any]] = {
+    "deepseek": {
+        "base_url": "https://api.deepseek.com",
+        "base_url_env": "DEEPSEEK_BASE_URL",
+        "key_envs": ("DEEPSEEK_API_KEY",),
+        "model": "deepseek-chat",
+        "max_tokens_cap": 8192,
+    },
+    "kimi": {
+        "base_url": "https://api.moonshot.cn/v1",
+        "base_url_env": "KIMI_BASE_URL",
+        "key_envs": ("KIMI_API_KEY", "MOONSHOT_API_KEY"),
+        "model": "moonshot-v1-128k",
+        "max_tokens_cap": None,
+    },
+    "gemini": {
+        "base_url": "https://hiapi.online/v1",
+        "base_url_env": "HIAPI_BASE_URL",
+        "key_envs": ("HIAPI_API_KEY", "GEMINI_API_KEY"),
+        "model": "gemini-2.5-pro",
+        "max_tokens_cap": None,
+    },
+}
+
+
+def _env_number(names, default: float) -> float:
+    for name in names:
+        raw = os.getenv(name, "").strip()
+        if not raw:
+            continue
+        try:
+            return float(raw)
+        except ValueError:
+            print(f"⚠️  {name}={raw} 不是有效数字，已忽略")
+    return default
+
+
+def is_breaker_failure(exc: BaseException) -> bool:
+    """是否计入熔断：超时、连接错误与 5xx；429 与其他 4xx 不计"""
+    if is_rate_limit_error(exc):
+        return False
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    if status is not None:
+        return int(status) >= 500
+    name = type(exc).__name__.lower()
+    return any(k in name for k in ("timeout", "connection", "connect", "network", "remoteprotocol"))
+
+
+class CircuitBreaker:
+    """单个提供商的熔断器（线程安全）"""
+
+    def __init__(self, name: str, threshold: int, cooldown: float, max_cooldown: float,
+                 max_outage: float = DEFAULT_MAX_OUTAGE):
+        self.name = name
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.max_outage = max_outage
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.outage_started: Optional[float] = None
+        self.probe_started: Optional[float] = None
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        本次请求是否走该提供商
+
+        half_open 时只放行一个探测；探测超过一个冷却期仍无结果（如请求挂起）时再放行一个。
+        """
+        if self.threshold <= 0:
+            return True
+        with self._lock:
+            now = time.time()
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                if now - self.opened_at < self.cooldown:
+                    return False
+                self.state = "half_open"
+                self.probe_started = None
+            if self.probe_started is None or now - self.probe_started >= self.cooldown:
+                self.probe_started = now
+                print(f"🔎 熔断器半开：{self.name} 放行一个探测请求")
+                return True
+            return False
+
+    async def wait_ready(self, max_outage: Optional[float] = None) -> bool:
+        """
+        等待熔断器放行（冷却期结束后的半开探测，或其他请求的探测成功后恢复 closed）
+
+        Args:
+            max_outage: 本次故障（自熔断器首次打开起）最多等待的总时长，默认取 CIRCUIT_BREAKER_MAX_OUTAGE
+
+        Returns:
+            放行返回 True；故障持续超过 max_outage 仍未恢复时返回 False
+        """
+        limit = self.max_outage if max_outage is None else max_outage
+        while True:
+            if self.allow():
+                return True
+            with self._lock:
+                now = time.time()
+                started = self.outage_started if self.outage_started is not None else now
+                remaining = self.cooldown - (now - self.opened_at) if self.state == "open" else 0.0
+            if now - started >= limit:
+                return False
+            # 冷却剩余时间内不必轮询；半开探测进行中时短间隔等待其结果
+            await asyncio.sleep(min(max(remaining, 0.5), 5.0, max(limit - (now - started), 0.5)))
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                print(f"✅ 熔断器恢复：{self.name} 探测成功，恢复正常调用")
+            self.state = "closed"
+            self.failures = 0
+            self.cooldown = self.base_cooldown
+            self.probe_started = None
+            self.outage_started = None
+
+    def record_failure(self):
+        if self.threshold <= 0:
+            return
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open":
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            elif self.state != "closed" or self.failures < self.threshold:
+                return
+            self.state = "open"
+            self.opened_at = time.time()
+            if self.outage_started is None:
+                self.outage_started = self.opened_at
+            self.probe_started = None
+            self.times_opened += 1
+            print(f"⚡ 熔断器打开：{self.name} 连续失败 {self.failures} 次，{self.cooldown:.0f}s 后半开探测")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "name": self.name,
+                "state": self.state,
+                "failures": self.failures,
+                "cooldown": self.cooldown,
+                "times_opened": self.times_opened,
+            }
+
+
+_BREAKERS: Dict[str, CircuitBreaker] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    """获取提供商共享的熔断器"""
+    key = provider.lower()
+    with _REGISTRY_LOCK:
+        breaker = _BREAKERS.get(key)
+        if breaker is None:
+            threshold = _env_number((f"{provider.upper()}_BREAKER_THRESHOLD", "CIRCUIT_BREAKER_THRESHOLD"), DEFAULT_THRESHOLD)
+            cooldown = _env_number(("CIRCUIT_BREAKER_COOLDOWN",), DEFAULT_COOLDOWN)
+            max_cooldown = _env_number(("CIRCUIT_BREAKER_MAX_COOLDOWN",), DEFAULT_MAX_COOLDOWN)
+            max_outage = _env_number(("CIRCUIT_BREAKER_MAX_OUTAGE",), DEFAULT_MAX_OUTAGE)
+            breaker = CircuitBreaker(key, int(threshold), cooldown, max(cooldown, max_cooldown), max_outage)
+            _BREAKERS[key] = breaker
+        return breaker
+
+
+def resolve_fallback(provider: str) -> Optional[Dict[str, Any]]:
+    """
+    解析 <PROVIDER>_FALLBACK 指定的备用提供商
+
+    Returns:
+        未配置时返回 None；否则返回 {"provider", "model", "base_url", "api_key", "max_tokens_cap"}
+
+    Raises:
+        ValueError: 备用提供商未知且未给出 base_url，或缺少其 API Key
+    """
+    spec = os.getenv(f"{provider.upper()}_FALLBACK", "").strip()
+    if not spec:
+        return None
+    fb_provider, _, fb_model = spec.partition(":")
+    fb_provider = fb_provider.strip().lower()
+    if fb_provider == provider.lower():
+        raise ValueError(f"{provider.upper()}_FALLBACK 不能指向提供商自身：{spec}")
+    endpoint = PROVIDER_ENDPOINTS.get(fb_provider, {})
+    base_url = (
+        os.getenv(f"{provider.upper()}_FALLBACK_BASE_URL", "").strip()
+        or (os.getenv(endpoint["base_url_env"], "").strip() if endpoint.get("base_url_env") else "")
+        or endpoint.get("base_url")
+    )
+    if not base_url:
+        raise ValueError(f"未知的备用提供商 {fb_provider}，请设置 {provider.upper()}_FALLBACK_BASE_URL")
+    key_envs = endpoint.get("key_envs") or (f"{fb_provider.upper()}_API_KEY",)
+    api_key = next((os.getenv(name).strip() for name in key_envs if os.getenv(name, "").strip()), None)
+    if not api_key:
+        raise ValueError(f"备用提供商 {fb_provider} 缺少 API Key（{' / '.join(key_envs)}）")
+    model = fb_model.strip() or endpoint.get("model")
+    if not model:
+        raise ValueError(f"请在 {provider.upper()}_FALLBACK 中指定模型，如 {fb_provider}:<model>")
+    return {
+        "provider": fb_provider,
+        "model": model,
+        "base_url": base_url,
+        "api_key": api_key,
+        "max_tokens_cap": endpoint.get("max_tokens_cap"),
+    }
@@ -4,9 +4,13 @@
 import os
 import yaml
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 from string import Template
 
+# 仓库根目录下的全局配置（可用环境变量 KG_CONFIG_PATH 覆盖）
+PROJECT_CONFIG_PATH = Path(__file__).resolve().parents[2] / "config" / "config.yaml"
+_PROJECT_CONFIG: Optional[Dict[str, Any]] = None
+
 
 def load_config(config_path: str = "config/config.yaml") -> Dict[str, Any]:
     """
@@ -35,6 +39,22 @@ def load_config(config_path: str = "config/config.yaml") -> Dict[str, Any]:
     return config
 
 
+def get_project_config() -> Dict[str, Any]:
+    """
+    加载并缓存仓库全局配置；文件缺失或解析失败时返回空字典
+    
+    与 load_config 不同，此函数不依赖当前工作目录，供共享工具模块使用。
+    """
+    global _PROJECT_CONFIG
+    if _PROJECT_CONFIG is None:
+        config_path = os.getenv("KG_CONFIG_PATH", str(PROJECT_CONFIG_PATH))
+        try:
+            _PROJECT_CONFIG = load_config(config_path) or {}
+        except Exception:
+            _PROJECT_CONFIG = {}
+    return _PROJECT_CONFIG
+
+
 def _substitute_env_vars(content: str) -> str:
     """
     替换字符串中的环境变量
@@ -0,0 +1,236 @@
+"""
+对冲请求（hedged requests）：控制长尾延迟
+
+个别 Gemini / Kimi 请求耗时是中位数的数倍，整批进度被它拖住。开启对冲后，请求超过该提供商
+实时延迟直方图（见 metrics）的指定分位数仍未返回时，向同一或备用端点再发一份相同请求：
+先返回合法 JSON 的一方胜出，另一方被取消。两者都不合法时返回先到的响应，交由调用方的
+解析/恢复/重试逻辑处理；两者都失败时抛出原请求的异常。
+
+对冲请求同样经过限流器与指标记录；对冲次数与落败一方消耗的 token 记入
+llm_hedges_total / llm_hedge_tokens_total，并出现在 summary_line() 中。
+
+环境变量（<PROVIDER> 为 GEMINI / KIMI 等，提供商级变量优先）：
+- LLM_HEDGE / <PROVIDER>_HEDGE: 设为 1 开启（默认关闭）
+- LLM_HEDGE_PERCENTILE: 触发对冲的延迟分位数（默认 0.95）
+- LLM_HEDGE_MIN_SAMPLES: 直方图样本数不足时不对冲（默认 20）
+- LLM_HEDGE_MIN_DELAY: 对冲等待时间下限（秒，默认 5）
+- LLM_HEDGE_MAX_RATIO: 对冲请求占已发请求的比例上限（默认 0.1），防止服务整体变慢时请求量翻倍
+- <PROVIDER>_HEDGE_BASE_URL: 对冲请求发往的备用端点（使用同一 Key；默认与原请求相同）
+
+同步版本（chat_completion_hedged）在线程中发送请求，落败请求无法中途取消，
+会在后台完成后被丢弃，其 token 在完成时计入对冲消耗。
+"""
+import asyncio
+import concurrent.futures
+import os
+from typing import Any, Callable, Dict, Optional
+
+from .llm_cache import response_has_json
+from .llm_gateway import _cache_lookup, _provider_of, achat_completion, chat_completion
+from .metrics import counter_ratio, latency_quantile, record_hedge, record_hedge_tokens
+from .rate_limiter import RateLimiter, estimate_messages_tokens
+
+DEFAULT_PERCENTILE = 0.95
+DEFAULT_MIN_SAMPLES = 20
+DEFAULT_MIN_DELAY = 5.0
+DEFAULT_MAX_RATIO = 0.1
+
+_EXECUTOR: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+
+def _env_float(name: str, default: float) -> float:
+    raw = os.getenv(name, "").strip()
+    try:
+        return float(raw) if raw else default
+    except ValueError:
+        print(f"⚠️  {name}={raw} 不是有效数字，已使用默认值 {default}")
+        return default
+
+
+def resolve_hedge(provider: str) -> Dict[str, Any]:
+    """解析提供商的对冲设置"""
+    flag = os.getenv(f"{provider.upper()}_HEDGE", "").strip() or os.getenv("LLM_HEDGE", "0").strip()
+    return {
+        "enabled": flag.lower() in {"1", "true", "yes", "y"},
+        "percentile": min(max(_env_float("LLM_HEDGE_PERCENTILE", DEFAULT_PERCENTILE), 0.5), 0.999),
+        "min_samples": int(_env_float("LLM_HEDGE_MIN_SAMPLES", DEFAULT_MIN_SAMPLES)),
+        "min_delay": _env_float("LLM_HEDGE_MIN_DELAY", DEFAULT_MIN_DELAY),
+        "max_ratio": _env_float("LLM_HEDGE_MAX_RATIO", DEFAULT_MAX_RATIO),
+        "base_url": os.getenv(f"{provider.upper()}_HEDGE_BASE_URL", "").strip() or None,
+    }
+
+
+def hedge_delay(provider: str, model: Optional[str], settings: Dict[str, Any]) -> Optional[float]:
+    """
+    返回本次请求的对冲等待时间（秒）；不应对冲时返回 None
+
+    不对冲的情况：未开启、延迟样本不足、对冲比例已达上限。
+    """
+    if not settings["enabled"]:
+        return None
+    delay, samples = latency_quantile(provider, settings["percentile"], model)
+    if delay is None or samples < settings["min_samples"]:
+        return None
+    if counter_ratio("llm_hedges_total", "llm_requests_total", provider) >= settings["max_ratio"]:
+        return None
+    return max(delay, settings["min_delay"])
+
+
+def _hedge_client(client: Any, settings: Dict[str, Any]) -> Any:
+    """备用端点客户端：OpenAI SDK 的 with_options 复制配置并共享连接池"""
+    if settings["base_url"] and hasattr(client, "with_options"):
+        return client.with_options(base_url=settings["base_url"])
+    return client
+
+
+def _response_tokens(response: Any, kwargs: dict) -> int:
+    usage = getattr(response, "usage", None)
+    total = getattr(usage, "total_tokens", None) if usage is not None else None
+    return int(total) if total else estimate_messages_tokens(kwargs.get("messages") or [])
+
+
+def _mark(response: Any, outcome: str, wasted_tokens: int) -> Any:
+    # 附在响应上供抽取脚本写入日志（hedged / hedge_tokens）；对象不允许新增属性时忽略
+    try:
+        response.hedge = {"outcome": outcome, "wasted_tokens": wasted_tokens}
+    except (AttributeError, TypeError, ValueError):
+        pass
+    return response
+
+
+def _put_cache(client: Any, use_cache: bool, kwargs: dict, response: Any, validate: Callable[[Any], bool]):
+    cache, key, _ = _cache_lookup(client, use_cache, kwargs, validate)
+    if cache is not None:
+        cache.put(key, response, validate)
+
+
+async def achat_completion_hedged(
+    client: Any,
+    limiter: Optional[RateLimiter],
+    use_cache: bool = True,
+    validate: Callable[[Any], bool] = response_has_json,
+    **kwargs,
+) -> Any:
+    """
+    带对冲的 achat_completion；未开启对冲或样本不足时与 achat_completion 完全相同
+
+    Args:
+        validate: 判断响应是否可用（默认 response_has_json），同时作为写入/复用响应缓存的校验
+        其余参数同 achat_completion
+    """
+    provider = _provider_of(limiter)
+    model = kwargs.get("model")
+    settings = resolve_hedge(provider)
+    delay = hedge_delay(provider, model, settings)
+    if delay is None:
+        return await achat_completion(client, limiter, use_cache, validate, **kwargs)
+
+    primary = asyncio.ensure_future(achat_completion(client, limiter, use_cache, validate, **kwargs))
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done:
+        return primary.result()
+
+    hedge = asyncio.ensure_future(achat_completion(_hedge_client(client, settings), limiter, False, validate, **kwargs))
+    pending = {primary, hedge}
+    winner = fallback = None
+    while pending and winner is None:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in sorted(done, key=lambda t: t is not primary):
+            if task.exception() is not None:
+                continue
+            if validate(task.result()):
+                winner = task
+                break
+            fallback = fallback or task
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    chosen = winner or fallback
+    if chosen is None:
+        record_hedge(provider, model, "failed")
+        record_hedge_tokens(provider, model, estimate_messages_tokens(kwargs.get("messages") or []))
+        raise primary.exception()
+    loser = hedge if chosen is primary else primary
+    if loser.cancelled() or loser.exception() is not None:
+        wasted = estimate_messages_tokens(kwargs.get("messages") or [])
+    else:
+        wasted = _response_tokens(loser.result(), kwargs)
+    outcome = ("won" if chosen is hedge else "lost") if winner is not None else "failed"
+    record_hedge(provider, model, outcome)
+    record_hedge_tokens(provider, model, wasted)
+    response = chosen.result()
+    if chosen is hedge:
+        _put_cache(client, use_cache, kwargs, response, validate)
+    return _mark(response, outcome, wasted)
+
+
+def _executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-hedge")
+    return _EXECUTOR
+
+
+def chat_completion_hedged(
+    client: Any,
+    limiter: Optional[RateLimiter],
+    use_cache: bool = True,
+    validate: Callable[[Any], bool] = response_has_json,
+    **kwargs,
+) -> Any:
+    """achat_completion_hedged 的同步版本（见模块说明：落败请求无法取消，完成后丢弃）"""
+    provider = _provider_of(limiter)
+    model = kwargs.get("model")
+    settings = resolve_hedge(provider)
+    delay = hedge_delay(provider, model, settings)
+    if delay is None:
+        return chat_completion(client, limiter, use_cache, validate, **kwargs)
+
+    pool = _executor()
+    primary = pool.submit(chat_completion, client, limiter, use_cache, validate, **kwargs)
+    try:
+        return primary.result(timeout=delay)
+    except concurrent.futures.TimeoutError:
+        pass
+
+    hedge = pool.submit(chat_completion, _hedge_client(client, settings), limiter, False, validate, **kwargs)
+    pending = {primary, hedge}
+    winner = fallback = None
+    while pending and winner is None:
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for fut in sorted(done, key=lambda f: f is not primary):
+            if fut.exception() is not None:
+                continue
+            if validate(fut.result()):
+                winner = fut
+                break
+            fallback = fallback or fut
+
+    chosen = winner or fallback
+    if chosen is None:
+        record_hedge(provider, model, "failed")
+        record_hedge_tokens(provider, model, estimate_messages_tokens(kwargs.get("messages") or []))
+        raise primary.exception()
+    loser = hedge if chosen is primary else primary
+
+    def _account(fut):
+        if fut.cancelled() or fut.exception() is not None:
+            record_hedge_tokens(provider, model, estimate_messages_tokens(kwargs.get("messages") or []))
+        else:
+            record_hedge_tokens(provider, model, _response_tokens(fut.result(), kwargs))
+
+    # 落败请求仍在运行时，完成后再计入消耗
+    loser.add_done_callback(_account)
+    outcome = ("won" if chosen is hedge else "lost") if winner is not None else "failed"
+    record_hedge(provider, model, outcome)
+    response = chosen.result()
+    if chosen is hedge:
+        _put_cache(client, use_cache, kwargs, response, validate)
+    # 落败请求尚未完成时，日志中的对冲消耗按提示词估算
+    if loser.done() and loser.exception() is None:
+        wasted = _response_tokens(loser.result(), kwargs)
+    else:
+        wasted = estimate_messages_tokens(kwargs.get("messages") or [])
+    return _mark(response, outcome, wasted)
@@ -0,0 +1,160 @@
+"""
+共享的 HTTP 客户端工厂
+
+所有 LLM / API 调用统一从这里取客户端，而不是各脚本各自 new：
+- 连接池按提供商共享并保持长连接（keep-alive），同一进程内的后续请求不再重复 TCP + TLS 握手
+- 安装了 h2 时启用 HTTP/2（服务端不支持时 httpx 自动回落 HTTP/1.1）
+- 连接/读取超时显式设置：读取超时取 config.yaml 的 api.timeout，连接超时取 api.connect_timeout
+- 连接池大小按提供商配置（api.pools.<provider>），可用环境变量 <PROVIDER>_HTTP_POOL 覆盖
+
+OpenAI SDK 客户端用 get_openai_client / new_async_openai_client，直接发 HTTP 请求的脚本
+用 get_requests_session + request_timeout（requests）。
+
+注意：OpenAI 客户端的 close() / with 语句会关闭底层连接池；共享客户端不要关闭。
+"""
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import httpx
+    HAVE_HTTPX = True
+except ImportError:  # pragma: no cover - openai 依赖 httpx，通常已安装
+    httpx = None
+    HAVE_HTTPX = False
+
+try:
+    import h2  # noqa: F401  HTTP/2 支持（pip install h2 或 httpx[http2]）
+    HAVE_H2 = True
+except ImportError:
+    HAVE_H2 = False
+
+from .config_loader import get_config_value, get_project_config
+
+DEFAULT_READ_TIMEOUT = 120.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_POOL = {"max_connections": 10, "max_keepalive": 5}
+
+_SYNC_CLIENTS: Dict[str, Any] = {}
+_OPENAI_CLIENTS: Dict[Tuple[str, str, str], Any] = {}
+_SESSIONS: Dict[str, Any] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def resolve_http_settings(provider: str) -> Dict[str, Any]:
+    """解析提供商的超时、HTTP/2 与连接池设置"""
+    config = get_project_config()
+    default_pool = get_config_value(config, "api.pools.default", {}) or {}
+    specific_pool = get_config_value(config, f"api.pools.{provider.lower()}", {}) or {}
+    max_connections = int(specific_pool.get("max_connections", default_pool.get("max_connections", DEFAULT_POOL["max_connections"])))
+    max_keepalive = int(specific_pool.get("max_keepalive", default_pool.get("max_keepalive", DEFAULT_POOL["max_keepalive"])))
+    env_pool = os.getenv(f"{provider.upper()}_HTTP_POOL", "").strip()
+    if env_pool:
+        try:
+            max_connections = int(env_pool)
+            max_keepalive = min(max_keepalive, max_connections)
+        except ValueError:
+            print(f"⚠️  {provider.upper()}_HTTP_POOL={env_pool} 不是有效整数，已忽略")
+    http2 = bool(get_config_value(config, "api.http2", True))
+    if os.getenv("HTTP2", "").strip().lower() in {"0", "false", "no", "n"}:
+        http2 = False
+    return {
+        "read_timeout": float(get_config_value(config, "api.timeout", DEFAULT_READ_TIMEOUT) or DEFAULT_READ_TIMEOUT),
+        "connect_timeout": float(get_config_value(config, "api.connect_timeout", DEFAULT_CONNECT_TIMEOUT) or DEFAULT_CONNECT_TIMEOUT),
+        "http2": http2 and HAVE_H2,
+        "max_connections": max_connections,
+        "max_keepalive": max_keepalive,
+    }
+
+
+def _httpx_kwargs(provider: str) -> Dict[str, Any]:
+    s = resolve_http_settings(provider)
+    return {
+        "timeout": httpx.Timeout(s["read_timeout"], connect=s["connect_timeout"]),
+        "limits": httpx.Limits(max_connections=s["max_connections"], max_keepalive_connections=s["max_keepalive"]),
+        "http2": s["http2"],
+    }
+
+
+def get_http_client(provider: str):
+    """进程内按提供商共享的同步 httpx.Client（线程安全）"""
+    if not HAVE_HTTPX:
+        raise ImportError("需要 httpx：pip install httpx")
+    key = provider.lower()
+    with _REGISTRY_LOCK:
+        client = _SYNC_CLIENTS.get(key)
+        if client is None or client.is_closed:
+            client = httpx.Client(**_httpx_kwargs(provider))
+            _SYNC_CLIENTS[key] = client
+        return client
+
+
+def new_async_http_client(provider: str):
+    """
+    新建 httpx.AsyncClient
+
+    异步连接池绑定创建时的事件循环，不能跨 asyncio.run 复用，因此每个事件循环（每个批次）新建一个，
+    同一批次内的并发请求共享该连接池。
+    """
+    if not HAVE_HTTPX:
+        raise ImportError("需要 httpx：pip install httpx")
+    return httpx.AsyncClient(**_httpx_kwargs(provider))
+
+
+def get_openai_client(provider: str, api_key: str, base_url: Optional[str] = None, **kwargs):
+    """按 (提供商, Key, base_url) 共享的同步 OpenAI 客户端，底层使用共享连接池"""
+    from openai import OpenAI
+
+    key = (provider.lower(), api_key or "", base_url or "")
+    with _REGISTRY_LOCK:
+        client = _OPENAI_CLIENTS.get(key)
+    if client is not None:
+        return client
+    s = resolve_http_settings(provider)
+    client = OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        timeout=httpx.Timeout(s["read_timeout"], connect=s["connect_timeout"]) if HAVE_HTTPX else s["read_timeout"],
+        http_client=get_http_client(provider) if HAVE_HTTPX else None,
+        **kwargs,
+    )
+    with _REGISTRY_LOCK:
+        return _OPENAI_CLIENTS.setdefault(key, client)
+
+
+def new_async_openai_client(provider: str, api_key: str, base_url: Optional[str] = None, **kwargs):
+    """在当前事件循环内新建 AsyncOpenAI 客户端（连接池见 new_async_http_client）"""
+    from openai import AsyncOpenAI
+
+    s = resolve_http_settings(provider)
+    return AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        timeout=httpx.Timeout(s["read_timeout"], connect=s["connect_timeout"]) if HAVE_HTTPX else s["read_timeout"],
+        http_client=new_async_http_client(provider) if HAVE_HTTPX else None,
+        **kwargs,
+    )
+
+
+def request_timeout(provider: str) -> Tuple[float, float]:
+    """requests 使用的 (连接超时, 读取超时)"""
+    s = resolve_http_settings(provider)
+    return (s["connect_timeout"], s["read_timeout"])
+
+
+def get_requests_session(provider: str):
+    """按提供商共享的 requests.Session（长连接，连接池大小同 httpx 配置；requests 不支持 HTTP/2）"""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    key = provider.lower()
+    with _REGISTRY_LOCK:
+        session = _SESSIONS.get(key)
+        if session is None:
+            s = resolve_http_settings(provider)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=s["max_connections"])
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _SESSIONS[key] = session
+        return session
@@ -0,0 +1,385 @@
+"""
+抽取任务表（SQLite）
+
+取代 os.path.exists(输出文件) 判断断点续跑、散落的 .failed.txt 记录失败的做法：
+每篇论文在任务表中一行（provider + paper 为主键），记录状态、尝试次数、提示词哈希、
+token 用量、耗时与输出路径，每次状态变化立即落盘，进程崩溃后可直接续跑。
+
+状态流转：
+    pending ──claim──> running ──complete──> done
+                          │
+                          ├──complete(partial=True)──> partial（输出不完整，已保存部分结果；下次运行可再次 claim）
+                          ├──fail──> failed（下次运行可再次 claim）
+                          └──release / 租约过期──> pending
+
+- claim 为单条条件 UPDATE，多进程 / 多 worker 并发认领同一篇时只有一个成功
+- running 状态带租约（lease_until），持有者崩溃后租约过期即可被其他 worker 重新认领；
+  同一主机上持有者进程已退出时（worker 为 主机名:进程号），reclaim_dead 立即归还，不必等租约过期
+  （batch 模式租约长达 25h，崩溃后重新运行需要靠它重新认领并继续轮询同一批次）
+- 各状态计数由触发器维护在 job_counts 表中，"还剩多少" 查询为 O(1)，无需扫描目录
+- 数据库使用 WAL 模式与 busy_timeout，多个抽取进程（main.py --parallel）可共用一个文件
+
+用法：
+    >>> store = JobStore("outputs/jobs.sqlite3")
+    >>> store.enqueue("deepseek", [{"paper": "priority/a.md", "output_path": ".../a.json", "done": False}])
+    >>> job = store.claim("deepseek", "priority/a.md")
+    >>> store.complete("deepseek", "priority/a.md", total_tokens=1234, duration_seconds=12.5)
+    >>> store.counts("deepseek")
+    {'pending': 0, 'running': 0, 'done': 1, 'failed': 0, 'partial': 0}
+"""
+import os
+import time
+import socket
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+STATUSES = ("pending", "running", "done", "failed", "partial")
+
+# running 租约默认时长（秒）：超过后视为持有者已崩溃
+DEFAULT_LEASE_SECS = 1800.0
+
+# complete / fail 可写入的指标列
+METRIC_COLUMNS = (
+    "output_path", "prompt_hash", "prompt_tokens", "completion_tokens", "total_tokens",
+    "entity_count", "relation_count", "duration_seconds", "raw_output_path",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    provider          TEXT NOT NULL,
+    paper             TEXT NOT NULL,
+    status            TEXT NOT NULL DEFAULT 'pending',
+    attempts          INTEGER NOT NULL DEFAULT 0,
+    prompt_hash       TEXT,
+    worker            TEXT,
+    lease_until       REAL,
+    output_path       TEXT,
+    raw_output_path   TEXT,
+    prompt_tokens     INTEGER,
+    completion_tokens INTEGER,
+    total_tokens      INTEGER,
+    entity_count      INTEGER,
+    relation_count    INTEGER,
+    duration_seconds  REAL,
+    error             TEXT,
+    created_at        REAL NOT NULL,
+    started_at        REAL,
+    finished_at       REAL,
+    updated_at        REAL NOT NULL,
+    PRIMARY KEY (provider, paper)
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (provider, status);
+
+CREATE TABLE IF NOT EXISTS job_counts (
+    provider TEXT NOT NULL,
+    status   TEXT NOT NULL,
+    n        INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (provider, status)
+);
+
+CREATE TRIGGER IF NOT EXISTS jobs_count_insert AFTER INSERT ON jobs
+BEGIN
+    INSERT INTO job_counts (provider, status, n) VALUES (NEW.provider, NEW.status, 1)
+        ON CONFLICT (provider, status) DO UPDATE SET n = n + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS jobs_count_update AFTER UPDATE OF status ON jobs
+WHEN OLD.status <> NEW.status
+BEGIN
+    UPDATE job_counts SET n = n - 1 WHERE provider = OLD.provider AND status = OLD.status;
+    INSERT INTO job_counts (provider, status, n) VALUES (NEW.provider, NEW.status, 1)
+        ON CONFLICT (provider, status) DO UPDATE SET n = n + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS jobs_count_delete AFTER DELETE ON jobs
+BEGIN
+    UPDATE job_counts SET n = n - 1 WHERE provider = OLD.provider AND status = OLD.status;
+END;
+"""
+
+
+def default_worker_id() -> str:
+    """worker 标识：主机名:进程号"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _pid_alive(pid: int) -> bool:
+    """本机进程是否仍在运行（无法确定时按仍在运行处理）"""
+    if pid <= 0:
+        return False
+    if os.name == "nt":
+        # Windows 下 os.kill(pid, 0) 会结束目标进程，改用 OpenProcess + GetExitCodeProcess
+        import ctypes
+        from ctypes import wintypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return kernel32.GetLastError() == 5  # ERROR_ACCESS_DENIED：进程存在但无权访问
+        try:
+            code = wintypes.DWORD()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)):
+                return True
+            return code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def prompt_hash(prompts: Iterable[str]) -> str:
+    """提示词（分段时为全部窗口）的短哈希，用于判断结果是否出自同一版提示词"""
+    h = hashlib.sha256()
+    for p in prompts:
+        h.update((p or "").encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()[:16]
+
+
+class JobStore:
+    """抽取任务表；同一进程内的协程 / 线程共用一个连接（加锁串行化）"""
+
+    def __init__(self, db_path: str, lease_secs: Optional[float] = None, worker: Optional[str] = None):
+        self.db_path = db_path
+        self.lease_secs = float(lease_secs if lease_secs is not None else os.getenv("EXTRACT_JOB_LEASE_SECS", "") or DEFAULT_LEASE_SECS)
+        self.worker = worker or default_worker_id()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # isolation_level=None：自动提交，每条语句即一个事务；多语句事务显式 BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=30000")
+        with self._lock:
+            self._conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ------------------------------
+    # 登记
+    # ------------------------------
+    def enqueue(self, provider: str, jobs: Iterable[Dict[str, Any]]) -> int:
+        """
+        登记论文（已存在的行不重复插入），并与磁盘上的输出文件对齐：
+
+        - done=True（输出文件已存在）且当前不是 done：记为 done（兼容旧的按文件断点续跑）
+        - done=False 且当前为 done：输出文件已被删除，重置为 pending 以便重跑
+
+        Args:
+            jobs: [{"paper": 相对路径, "output_path": 输出文件, "done": 输出是否已存在}, ...]
+
+        Returns:
+            新插入的行数
+        """
+        now = time.time()
+        inserted = 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for job in jobs:
+                    status = "done" if job.get("done") else "pending"
+                    cur = self._conn.execute(
+                        "INSERT OR IGNORE INTO jobs (provider, paper, status, output_path, created_at, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (provider, job["paper"], status, job.get("output_path"), now, now),
+                    )
+                    if cur.rowcount:
+                        inserted += 1
+                        continue
+                    # partial 的输出文件虽存在但不完整，不因此记为 done
+                    if job.get("done"):
+                        self._conn.execute(
+                            "UPDATE jobs SET status = 'done', output_path = COALESCE(?, output_path), updated_at = ? "
+                            "WHERE provider = ? AND paper = ? AND status IN ('pending', 'failed')",
+                            (job.get("output_path"), now, provider, job["paper"]),
+                        )
+                    else:
+                        self._conn.execute(
+                            "UPDATE jobs SET status = 'pending', updated_at = ? "
+                            "WHERE provider = ? AND paper = ? AND status IN ('done', 'partial')",
+                            (now, provider, job["paper"]),
+                        )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return inserted
+
+    # ------------------------------
+    # 认领与状态变更
+    # ------------------------------
+    def claim(self, provider: str, paper: str, worker: Optional[str] = None,
+              lease_secs: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        原子认领一篇论文：pending / failed / partial / 租约已过期的 running 才能认领
+
+        Args:
+            lease_secs: 本次租约时长，默认取 EXTRACT_JOB_LEASE_SECS（batch 等长耗时任务需加长）
+
+        Returns:
+            认领成功返回该行（attempts 已加 1）；已完成或正被其他 worker 处理时返回 None
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, lease_until = ?, "
+                "started_at = ?, error = NULL, updated_at = ? "
+                "WHERE provider = ? AND paper = ? "
+                "AND (status IN ('pending', 'failed', 'partial') OR (status = 'running' AND lease_until < ?)) "
+                "RETURNING *",
+                (worker or self.worker, now + (lease_secs or self.lease_secs), now, now, provider, paper, now),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def claim_next(self, provider: str, worker: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """认领下一篇可处理的论文（拉取式 worker 使用）；没有剩余时返回 None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, lease_until = ?, "
+                "started_at = ?, error = NULL, updated_at = ? "
+                "WHERE rowid = ("
+                "  SELECT rowid FROM jobs WHERE provider = ? "
+                "  AND (status IN ('pending', 'failed', 'partial') OR (status = 'running' AND lease_until < ?)) "
+                "  ORDER BY status IN ('failed', 'partial'), created_at, paper LIMIT 1"
+                ") RETURNING *",
+                (worker or self.worker, now + self.lease_secs, now, now, provider, now),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def _finish(self, provider: str, paper: str, status: str, error: Optional[str], metrics: Dict[str, Any]) -> None:
+        unknown = set(metrics) - set(METRIC_COLUMNS)
+        if unknown:
+            raise ValueError(f"未知的任务字段: {sorted(unknown)}")
+        now = time.time()
+        cols = {k: v for k, v in metrics.items() if v is not None}
+        assignments = "".join(f", {k} = ?" for k in cols)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET status = ?, error = ?, worker = NULL, lease_until = NULL, "
+                f"finished_at = ?, updated_at = ?{assignments} WHERE provider = ? AND paper = ?",
+                (status, error, now, now, *cols.values(), provider, paper),
+            )
+
+    def complete(self, provider: str, paper: str, partial: bool = False, reason: Optional[str] = None, **metrics) -> None:
+        """
+        标记完成并写入指标（output_path / prompt_hash / *_tokens / entity_count / duration_seconds 等）
+
+        Args:
+            partial: 输出不完整（截断 / 损坏后部分恢复）：记为 partial 而非 done，下次运行会重新认领
+            reason: partial 时记入 error 的说明
+        """
+        if partial:
+            self._finish(provider, paper, "partial", reason or "部分结果", metrics)
+        else:
+            self._finish(provider, paper, "done", None, metrics)
+
+    def fail(self, provider: str, paper: str, error: str, **metrics) -> None:
+        """标记失败并记录错误信息（取代 .failed.txt）；下次运行会重新认领"""
+        self._finish(provider, paper, "failed", error, metrics)
+
+    def release(self, provider: str, paper: str) -> None:
+        """放弃认领（如余额不足中止），回到 pending，不计入失败"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = MAX(attempts - 1, 0), worker = NULL, "
+                "lease_until = NULL, updated_at = ? WHERE provider = ? AND paper = ? AND status = 'running'",
+                (now, provider, paper),
+            )
+
+    def release_worker(self, provider: str, worker: Optional[str] = None) -> int:
+        """释放某个 worker 持有的全部 running 任务（中断退出时调用），返回释放数"""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = MAX(attempts - 1, 0), worker = NULL, "
+                "lease_until = NULL, updated_at = ? WHERE provider = ? AND worker = ? AND status = 'running'",
+                (now, provider, worker or self.worker),
+            )
+        return cur.rowcount
+
+    def reclaim_dead(self, provider: str) -> int:
+        """
+        归还本机已退出进程持有的 running 任务（崩溃 / 被杀后重新运行时调用），返回归还数
+
+        只处理 worker 主机名与本机相同、进程号不是当前进程且已不存在的行；
+        其他主机的任务无法判断存活，仍按租约过期处理。
+        """
+        host = socket.gethostname()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT paper, worker FROM jobs WHERE provider = ? AND status = 'running' AND worker LIKE ?",
+                (provider, f"{host}:%"),
+            ).fetchall()
+        dead = set()
+        for row in rows:
+            pid = row["worker"][len(host) + 1:]
+            if pid.isdigit() and int(pid) != os.getpid() and not _pid_alive(int(pid)):
+                dead.add(row["worker"])
+        reclaimed = 0
+        for worker in sorted(dead):
+            reclaimed += self.release_worker(provider, worker)
+        return reclaimed
+
+    # ------------------------------
+    # 查询
+    # ------------------------------
+    def counts(self, provider: str) -> Dict[str, int]:
+        """各状态计数（读触发器维护的计数表，O(1)）"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, n FROM job_counts WHERE provider = ?", (provider,)).fetchall()
+        result = {s: 0 for s in STATUSES}
+        result.update({r["status"]: r["n"] for r in rows})
+        return result
+
+    def remaining(self, provider: str) -> int:
+        """尚未完成的论文数（pending + running + failed + partial）"""
+        c = self.counts(provider)
+        return c["pending"] + c["running"] + c["failed"] + c["partial"]
+
+    def statuses(self, provider: str) -> Dict[str, str]:
+        """{paper: status}"""
+        with self._lock:
+            rows = self._conn.execute("SELECT paper, status FROM jobs WHERE provider = ?", (provider,)).fetchall()
+        return {r["paper"]: r["status"] for r in rows}
+
+    def get(self, provider: str, paper: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE provider = ? AND paper = ?", (provider, paper)).fetchone()
+        return dict(row) if row else None
+
+    def list_jobs(self, provider: str, status: Optional[str] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """按状态列出任务（走 (provider, status) 索引）"""
+        sql = "SELECT * FROM jobs WHERE provider = ?"
+        params: List[Any] = [provider]
+        if status:
+            sql += " AND status = ?"
+            params.append(status)
+        sql += " ORDER BY paper"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(r) for r in rows]
+
+
+def format_counts(counts: Dict[str, int], name: str = "") -> str:
+    """一行汇总：📋 <name> 任务表：完成 x，待处理 y，进行中 z，失败 w，部分结果 v"""
+    prefix = f"{name} " if name else ""
+    return (
+        f"📋 {prefix}任务表：完成 {counts.get('done', 0)}，待处理 {counts.get('pending', 0)}，"
+        f"进行中 {counts.get('running', 0)}，失败 {counts.get('failed', 0)}，部分结果 {counts.get('partial', 0)}"
+    )
@@ -0,0 +1,125 @@
+"""
+截断/格式异常的抽取输出的部分恢复
+
+模型输出 {"entities": [...], "relations": [...]} 被长度截断或中途格式出错时，
+严格解析（json.loads / extract_first_json）整体失败，已完整输出的元素也随之丢弃。
+这里按顶层结构逐个解码：顶层键、非数组值与数组中的每个元素都交给
+json.JSONDecoder.raw_decode（C 实现）整体解码，遇到第一个不完整/非法的位置即停止，
+返回此前所有完整的元素。相比逐字符扫描的 IncrementalExtractionParser，
+一次性处理整段文本时快近一个数量级，可在每次解析失败时内联调用。
+
+Example:
+    >>> r = salvage_extraction('{"entities": [{"name": "轴承"}, {"na')
+    >>> r["data"], r["truncated_key"]
+    ({'entities': [{'name': '轴承'}], 'relations': []}, 'entities')
+"""
+import json
+import re
+from typing import Any, Dict, Optional, Tuple
+
+from .stream_json import DEFAULT_ARRAY_KEYS
+
+_DECODER = json.JSONDecoder()
+_WS_RE = re.compile(r"\s*")
+_SEP_RE = re.compile(r"\s*,?\s*")
+
+
+def _skip(pattern, s: str, pos: int) -> int:
+    return pattern.match(s, pos).end()
+
+
+def _scan_array(s: str, pos: int, items: list) -> Tuple[int, bool]:
+    """从 '[' 之后开始逐个解码元素追加到 items；返回 (结束位置, 数组是否闭合)"""
+    n = len(s)
+    while True:
+        pos = _skip(_SEP_RE, s, pos)
+        if pos >= n:
+            return pos, False
+        if s[pos] == "]":
+            return pos + 1, True
+        try:
+            obj, pos = _DECODER.raw_decode(s, pos)
+        except ValueError:
+            return pos, False
+        items.append(obj)
+
+
+def salvage_extraction(text: str, array_keys: Tuple[str, ...] = DEFAULT_ARRAY_KEYS) -> Optional[Dict[str, Any]]:
+    """
+    从截断或局部损坏的文本中恢复顶层对象里所有完整的键值与数组元素
+
+    Args:
+        text: 模型原始输出（可带代码围栏或前后缀说明）
+        array_keys: 需要逐元素恢复的顶层数组键
+
+    Returns:
+        未恢复出任何数组元素时返回 None；否则返回
+        {
+            "data": {entities: [...], relations: [...], 以及其他已完整的顶层键},
+            "items": 恢复的数组元素总数,
+            "closed_keys": 已完整闭合的数组键,
+            "truncated_key": 中断时所在的数组键（中断不在数组内时为 None）,
+            "stop_pos": 停止解析的位置（即待补充尾部的起点）,
+        }
+    """
+    if not isinstance(text, str):
+        return None
+    start = text.find("{")
+    if start < 0:
+        return None
+    s = text
+    n = len(s)
+    data: Dict[str, Any] = {k: [] for k in array_keys}
+    closed = []
+    truncated_key = None
+    pos = start + 1
+    while True:
+        pos = _skip(_SEP_RE, s, pos)
+        if pos >= n or s[pos] == "}":
+            break
+        # 键
+        try:
+            key, pos = _DECODER.raw_decode(s, pos)
+        except ValueError:
+            break
+        if not isinstance(key, str):
+            break
+        pos = _skip(_WS_RE, s, pos)
+        if pos >= n or s[pos] != ":":
+            break
+        pos = _skip(_WS_RE, s, pos + 1)
+        if pos >= n:
+            break
+        # 值：目标数组逐元素恢复，其他值整体解码
+        if key in data and s[pos] == "[":
+            pos, ok = _scan_array(s, pos + 1, data[key])
+            if not ok:
+                truncated_key = key
+                break
+            closed.append(key)
+            continue
+        try:
+            value, pos = _DECODER.raw_decode(s, pos)
+        except ValueError:
+            break
+        data[key] = value
+    items = sum(len(data[k]) for k in array_keys if isinstance(data.get(k), list))
+    if not items:
+        return None
+    return {
+        "data": data,
+        "items": items,
+        "closed_keys": closed,
+        "truncated_key": truncated_key,
+        "stop_pos": pos,
+    }
+
+
+def describe_salvage(result: Dict[str, Any]) -> str:
+    """恢复结果的一行摘要，用于进度与日志"""
+    data = result["data"]
+    where = f"截断于 {result['truncated_key']}" if result["truncated_key"] else "尾部格式异常"
+    return (
+        f"部分恢复 {len(data.get('entities') or [])} 个实体、"
+        f"{len(data.get('relations') or [])} 条关系（{where}）"
+    )
@@ -0,0 +1,262 @@
+"""
+LLM 响应磁盘缓存（内容寻址）
+
+缓存键为以下请求参数的 sha256：
+    (base_url, model, messages, temperature, max_tokens, response_format)
+
+缓存值保存原始 content、finish_reason 与 usage；命中时返回与 SDK 响应
+结构一致的对象（choices[0].message.content / usage.*），并带 from_cache=True。
+
+只缓存可复用的响应：finish_reason == "stop" 且通过调用方的校验（默认 response_has_json）。
+截断（finish_reason == "length"）或格式损坏的输出不写入；读取时不满足同样条件的旧条目
+视为未命中并删除，重试会真正重新请求，而不是以零成本拿回同一份坏结果。
+
+配置（config/config.yaml）：
+- extraction.use_cache: 是否启用缓存
+- extraction.cache_max_mb: 缓存目录容量上限（MB），超出后按最近使用时间（LRU）淘汰
+- paths.cache: 缓存根目录（相对仓库根目录），响应缓存位于其下的 llm/ 子目录
+
+环境变量：
+- LLM_CACHE_BYPASS=1: 本次运行不读也不写缓存（用于一致性评估等需要重复真实调用的场景）
+- LLM_CACHE_DIR: 覆盖缓存目录
+"""
+import os
+import re
+import json
+import hashlib
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+from .config_loader import get_config_value, get_project_config
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+
+DEFAULT_MAX_MB = 512
+# 淘汰时清理到上限的该比例，避免每次写入都触发扫描
+EVICT_TARGET_RATIO = 0.9
+
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+
+
+def _truthy(value: Optional[str]) -> bool:
+    return (value or "").strip().lower() in {"1", "true", "yes", "y"}
+
+
+def make_cache_key(base_url: str, params: Dict[str, Any]) -> str:
+    """根据 base_url 与请求参数计算缓存键"""
+    payload = {
+        "base_url": str(base_url or "").rstrip("/"),
+        "model": params.get("model"),
+        "messages": params.get("messages"),
+        "temperature": params.get("temperature"),
+        "max_tokens": params.get("max_tokens"),
+        "response_format": params.get("response_format"),
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def response_has_json(response: Any) -> bool:
+    """默认的合法性判断：content 去掉代码围栏后，首个 { 到最后一个 } 之间可被 json.loads 解析"""
+    try:
+        content = response.choices[0].message.content or ""
+    except (AttributeError, IndexError, TypeError):
+        return False
+    text = _FENCE_RE.sub("", content.strip())
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        return False
+    try:
+        json.loads(text[start:end + 1])
+        return True
+    except ValueError:
+        return False
+
+
+def is_cacheable(response: Any, validate: Optional[Callable[[Any], bool]] = None) -> bool:
+    """响应是否可以缓存/复用：content 非空、finish_reason == "stop"，且通过 validate（若提供）"""
+    try:
+        choice = response.choices[0]
+        content = choice.message.content
+    except (AttributeError, IndexError, TypeError):
+        return False
+    if not content or not str(content).strip():
+        return False
+    if getattr(choice, "finish_reason", None) != "stop":
+        return False
+    return validate is None or bool(validate(response))
+
+
+def _usage_dict(usage: Any) -> Optional[Dict[str, Any]]:
+    if usage is None:
+        return None
+    if hasattr(usage, "model_dump"):
+        return usage.model_dump()
+    if isinstance(usage, dict):
+        return usage
+    keys = ("prompt_tokens", "completion_tokens", "total_tokens")
+    return {k: getattr(usage, k) for k in keys if hasattr(usage, k)}
+
+
+def _to_namespace(value: Any) -> Any:
+    if isinstance(value, dict):
+        return SimpleNamespace(**{k: _to_namespace(v) for k, v in value.items()})
+    return value
+
+
+def response_from_record(record: Dict[str, Any]) -> SimpleNamespace:
+    """把缓存记录还原为与 SDK 响应同构的对象"""
+    message = SimpleNamespace(role="assistant", content=record.get("content"))
+    choice = SimpleNamespace(index=0, message=message, finish_reason=record.get("finish_reason"))
+    return SimpleNamespace(
+        id=record.get("id"),
+        model=record.get("model"),
+        choices=[choice],
+        usage=_to_namespace(record.get("usage")),
+        from_cache=True,
+    )
+
+
+class LLMCache:
+    """基于文件的 LLM 响应缓存（<cache_dir>/<键前两位>/<键>.json）"""
+
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str, validate: Optional[Callable[[Any], bool]] = None) -> Optional[SimpleNamespace]:
+        """读取缓存；命中时刷新 mtime 以维护 LRU 顺序。不可复用的条目（见 is_cacheable）删除并视为未命中"""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        response = response_from_record(record)
+        if not is_cacheable(response, validate):
+            self.delete(key)
+            self.misses += 1
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return response
+
+    def delete(self, key: str) -> None:
+        """删除单个条目（不存在时忽略）"""
+        path = self._path(key)
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except OSError:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size = max(0, self._size - size)
+
+    def put(self, key: str, response: Any, validate: Optional[Callable[[Any], bool]] = None) -> None:
+        """写入缓存（仅缓存 is_cacheable 的响应，原子替换）"""
+        if not is_cacheable(response, validate):
+            return
+        choice = response.choices[0]
+        content = choice.message.content
+        record = {
+            "id": getattr(response, "id", None),
+            "model": getattr(response, "model", None),
+            "content": content,
+            "finish_reason": getattr(choice, "finish_reason", None),
+            "usage": _usage_dict(getattr(response, "usage", None)),
+        }
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = json.dumps(record, ensure_ascii=False).encode("utf-8")
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self) -> List[Path]:
+        return list(self.cache_dir.glob("*/*.json"))
+
+    def _scan_size(self) -> int:
+        total = 0
+        for p in self._entries():
+            try:
+                total += p.stat().st_size
+            except OSError:
+                pass
+        return total
+
+    def _evict(self) -> None:
+        """按 mtime 从旧到新删除，直到低于上限的 EVICT_TARGET_RATIO"""
+        stats = []
+        for p in self._entries():
+            try:
+                st = p.stat()
+                stats.append((st.st_mtime, st.st_size, p))
+            except OSError:
+                pass
+        stats.sort()
+        total = sum(s for _, s, _ in stats)
+        target = int(self.max_bytes * EVICT_TARGET_RATIO)
+        for _, size, p in stats:
+            if total <= target:
+                break
+            try:
+                p.unlink()
+                total -= size
+            except OSError:
+                pass
+        self._size = total
+
+
+_DEFAULT_CACHE: Optional[LLMCache] = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def cache_bypassed() -> bool:
+    """是否通过 LLM_CACHE_BYPASS 显式绕过缓存"""
+    return _truthy(os.getenv("LLM_CACHE_BYPASS"))
+
+
+def get_default_cache() -> Optional[LLMCache]:
+    """
+    按配置返回进程级共享缓存；禁用或被绕过时返回 None
+    """
+    global _DEFAULT_CACHE
+    if cache_bypassed():
+        return None
+    config = get_project_config()
+    if not get_config_value(config, "extraction.use_cache", True):
+        return None
+    with _DEFAULT_LOCK:
+        if _DEFAULT_CACHE is None:
+            cache_dir = os.getenv("LLM_CACHE_DIR")
+            if not cache_dir:
+                cache_root = Path(get_config_value(config, "paths.cache", "cache"))
+                if not cache_root.is_absolute():
+                    cache_root = REPO_ROOT / cache_root
+                cache_dir = str(cache_root / "llm")
+            max_mb = float(get_config_value(config, "extraction.cache_max_mb", DEFAULT_MAX_MB) or DEFAULT_MAX_MB)
+            _DEFAULT_CACHE = LLMCache(cache_dir, int(max_mb * 1024 * 1024))
+        return _DEFAULT_CACHE
@@ -0,0 +1,230 @@
+"""
+LLM 调用网关
+
+所有 chat.completions 调用统一经过这里：
+- 先查内容寻址的响应缓存（见 llm_cache），命中则不发请求、不占限流配额
+- 调用前按估算 token 数从共享限流器预占配额
+- 调用后用 usage 修正 token 预占，并反馈成功/限流以自适应调整速率
+- 成功响应写回缓存（仅 finish_reason == "stop" 且通过 cache_validate 的响应，默认要求合法 JSON）
+- 每次请求的状态、耗时与 token 用量记入进程内指标（见 metrics），成功/故障反馈给提供商熔断器（见 circuit_breaker）
+
+同步客户端使用 chat_completion，AsyncOpenAI 客户端使用 achat_completion；
+流式调用（stream=True）使用 achat_completion_stream，边接收边交给增量解析器。
+"""
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Optional
+
+from .circuit_breaker import get_breaker, is_breaker_failure
+from .llm_cache import get_default_cache, make_cache_key, response_has_json
+from .metrics import record_request
+from .prompt_layout import cached_prompt_tokens
+from .rate_limiter import RateLimiter, estimate_messages_tokens, is_rate_limit_error, retry_after_seconds
+
+# 未指定 max_tokens 时，为输出预留的估算 token 数
+DEFAULT_OUTPUT_RESERVE = 2048
+
+
+def _estimate_request_tokens(kwargs: dict) -> int:
+    prompt = estimate_messages_tokens(kwargs.get("messages") or [])
+    return prompt + int(kwargs.get("max_tokens") or DEFAULT_OUTPUT_RESERVE)
+
+
+def _actual_total_tokens(response: Any) -> Optional[int]:
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage is not None else None
+
+
+def _provider_of(limiter: Optional[RateLimiter]) -> str:
+    # 限流器名称形如 "deepseek:<key 指纹>"
+    return limiter.name.split(":", 1)[0] if limiter is not None else "unknown"
+
+
+def _record(limiter, kwargs: dict, status: str, start: Optional[float] = None, response: Any = None, ttft=None):
+    if status == "ok" and limiter is not None:
+        get_breaker(_provider_of(limiter)).record_success()
+    usage = getattr(response, "usage", None)
+    record_request(
+        _provider_of(limiter),
+        kwargs.get("model"),
+        status,
+        latency=(time.time() - start) if start is not None else None,
+        usage=usage,
+        ttft=ttft,
+        cached_prompt_tokens=cached_prompt_tokens(usage),
+    )
+
+
+def _record_error(limiter, kwargs: dict, start: float, e: BaseException):
+    if limiter is not None and is_breaker_failure(e):
+        get_breaker(_provider_of(limiter)).record_failure()
+    _record(limiter, kwargs, "rate_limited" if is_rate_limit_error(e) else "error", start)
+
+
+def _cache_lookup(client: Any, use_cache: bool, kwargs: dict, validate: Optional[Callable[[Any], bool]] = None):
+    """返回 (cache, key, 命中的响应)；未启用缓存时 cache 为 None"""
+    cache = get_default_cache() if use_cache else None
+    if cache is None:
+        return None, None, None
+    key = make_cache_key(str(getattr(client, "base_url", "")), kwargs)
+    return cache, key, cache.get(key, validate)
+
+
+def chat_completion(
+    client: Any,
+    limiter: Optional[RateLimiter],
+    use_cache: bool = True,
+    cache_validate: Optional[Callable[[Any], bool]] = response_has_json,
+    **kwargs,
+) -> Any:
+    """
+    同步调用 client.chat.completions.create(**kwargs)，受 limiter 限流
+
+    Args:
+        client: OpenAI 兼容的同步客户端
+        limiter: get_limiter() 返回的限流器；为 None 时不限流
+        use_cache: 是否使用响应缓存（另受 extraction.use_cache 与 LLM_CACHE_BYPASS 控制）
+        cache_validate: 响应写入/复用缓存前的校验（默认 response_has_json；非 JSON 输出传 None）
+        **kwargs: 透传给 chat.completions.create 的参数
+
+    Returns:
+        原始响应对象；缓存命中时为同构对象且 from_cache=True
+    """
+    cache, key, cached = _cache_lookup(client, use_cache, kwargs, cache_validate)
+    if cached is not None:
+        _record(limiter, kwargs, "cache_hit")
+        return cached
+    estimated = _estimate_request_tokens(kwargs)
+    if limiter is not None:
+        limiter.acquire(estimated)
+    start = time.time()
+    try:
+        response = client.chat.completions.create(**kwargs)
+    except Exception as e:
+        _record_error(limiter, kwargs, start, e)
+        if limiter is not None and is_rate_limit_error(e):
+            limiter.on_rate_limited(retry_after_seconds(e))
+        raise
+    _record(limiter, kwargs, "ok", start, response)
+    if limiter is not None:
+        limiter.record_usage(estimated, _actual_total_tokens(response))
+        limiter.on_success()
+    if cache is not None:
+        cache.put(key, response, cache_validate)
+    return response
+
+
+async def achat_completion(
+    client: Any,
+    limiter: Optional[RateLimiter],
+    use_cache: bool = True,
+    cache_validate: Optional[Callable[[Any], bool]] = response_has_json,
+    **kwargs,
+) -> Any:
+    """chat_completion 的异步版本（client 为 AsyncOpenAI）"""
+    cache, key, cached = _cache_lookup(client, use_cache, kwargs, cache_validate)
+    if cached is not None:
+        _record(limiter, kwargs, "cache_hit")
+        return cached
+    estimated = _estimate_request_tokens(kwargs)
+    if limiter is not None:
+        await limiter.aacquire(estimated)
+    start = time.time()
+    try:
+        response = await client.chat.completions.create(**kwargs)
+    except Exception as e:
+        _record_error(limiter, kwargs, start, e)
+        if limiter is not None and is_rate_limit_error(e):
+            limiter.on_rate_limited(retry_after_seconds(e))
+        raise
+    _record(limiter, kwargs, "ok", start, response)
+    if limiter is not None:
+        limiter.record_usage(estimated, _actual_total_tokens(response))
+        limiter.on_success()
+    if cache is not None:
+        cache.put(key, response, cache_validate)
+    return response
+
+
+async def achat_completion_stream(
+    client: Any,
+    limiter: Optional[RateLimiter],
+    on_delta: Optional[Callable[[str], Any]] = None,
+    use_cache: bool = True,
+    include_usage: bool = True,
+    cache_validate: Optional[Callable[[Any], bool]] = response_has_json,
+    **kwargs,
+) -> Any:
+    """
+    以 stream=True 调用并聚合为与非流式响应同构的对象
+
+    Args:
+        on_delta: 每收到一段 content 时回调（如 IncrementalExtractionParser.feed）
+        include_usage: 是否请求末尾 usage 块（stream_options.include_usage，部分网关不支持）
+        其余参数同 achat_completion
+
+    Returns:
+        SimpleNamespace：choices[0].message.content / finish_reason / usage，
+        另含 time_to_first_token（秒，缓存命中时为 0）
+    """
+    kwargs.pop("stream", None)
+    cache, key, cached = _cache_lookup(client, use_cache, kwargs, cache_validate)
+    if cached is not None:
+        if on_delta is not None:
+            on_delta(cached.choices[0].message.content or "")
+        cached.time_to_first_token = 0.0
+        _record(limiter, kwargs, "cache_hit")
+        return cached
+    estimated = _estimate_request_tokens(kwargs)
+    if limiter is not None:
+        await limiter.aacquire(estimated)
+
+    start = time.time()
+    ttft = None
+    parts = []
+    finish_reason = None
+    usage = None
+    model = None
+    resp_id = None
+    try:
+        if include_usage:
+            kwargs["stream_options"] = {"include_usage": True}
+        stream = await client.chat.completions.create(stream=True, **kwargs)
+        async for chunk in stream:
+            resp_id = resp_id or getattr(chunk, "id", None)
+            model = model or getattr(chunk, "model", None)
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if not getattr(chunk, "choices", None):
+                continue
+            choice = chunk.choices[0]
+            delta = getattr(getattr(choice, "delta", None), "content", None)
+            if delta:
+                if ttft is None:
+                    ttft = time.time() - start
+                parts.append(delta)
+                if on_delta is not None:
+                    on_delta(delta)
+            if getattr(choice, "finish_reason", None):
+                finish_reason = choice.finish_reason
+    except Exception as e:
+        _record_error(limiter, kwargs, start, e)
+        if limiter is not None and is_rate_limit_error(e):
+            limiter.on_rate_limited(retry_after_seconds(e))
+        raise
+
+    message = SimpleNamespace(role="assistant", content="".join(parts))
+    response = SimpleNamespace(
+        id=resp_id,
+        model=model,
+        choices=[SimpleNamespace(index=0, message=message, finish_reason=finish_reason)],
+        usage=usage,
+        time_to_first_token=ttft,
+    )
+    _record(limiter, kwargs, "ok", start, response, ttft=ttft)
+    if limiter is not None:
+        limiter.record_usage(estimated, _actual_total_tokens(response))
+        limiter.on_success()
+    if cache is not None:
+        cache.put(key, response, cache_validate)
+    return response
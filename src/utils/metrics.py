@@ -0,0 +1,392 @@
+"""
+进程内 LLM 调用指标
+
+analyze_extraction_time.py 只能在运行结束后读取日志；长时间运行时需要实时看到各提供商的
+吞吐（tokens/s）、请求延迟 p50/p95、重试率与 429 比例。这里维护一个进程内指标表：
+- llm_gateway 在每次请求结束时记录状态、延迟、首 token 时间与 token 用量（按 provider/model 分桶）
+- 抽取脚本在重试时调用 record_retry
+- 定期把快照以 Prometheus 文本格式原子写入本地文件（可被 node_exporter textfile collector 采集）
+- summary_line() 生成一行紧凑摘要，供进度条后缀显示
+
+环境变量：
+- LLM_METRICS: 设为 0 关闭记录与导出（默认开启）
+- LLM_METRICS_FILE: 快照文件路径（默认 paths.logs/metrics/<脚本名>.prom）
+- LLM_METRICS_INTERVAL: 快照写入间隔（秒，默认 15）
+"""
+import atexit
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from .config_loader import get_config_value, get_project_config
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+
+# 请求延迟桶（秒）：抽取请求从数秒到数分钟不等
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+# 首 token 时间桶（秒）
+TTFT_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 60)
+# 吞吐按最近窗口计算（秒），反映当前速率而不是全程平均
+RATE_WINDOW_SECS = 60.0
+DEFAULT_EXPORT_INTERVAL = 15.0
+
+HELP = {
+    "llm_requests_total": ("counter", "LLM 请求数（status: ok / error / rate_limited / cache_hit）"),
+    "llm_retries_total": ("counter", "抽取脚本发起的重试次数"),
+    "llm_tokens_total": ("counter", "usage 报告的 token 数（kind: prompt / completion / cached_prompt）"),
+    "llm_request_latency_seconds": ("histogram", "单次请求耗时（不含限流等待）"),
+    "llm_time_to_first_token_seconds": ("histogram", "流式请求首 token 时间"),
+    "llm_hedges_total": ("counter", "对冲请求数（outcome: won 对冲请求胜出 / lost 原请求胜出 / failed 两者均失败）"),
+    "llm_hedge_tokens_total": ("counter", "对冲多花的 token 数（落败请求被取消时按提示词估算）"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def metrics_enabled() -> bool:
+    return os.getenv("LLM_METRICS", "1").strip().lower() not in {"0", "false", "no", "n"}
+
+
+def _labels(**kwargs: Any) -> Labels:
+    return tuple(sorted((k, str(v) if v is not None else "") for k, v in kwargs.items()))
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    parts = []
+    for k, v in labels:
+        v = v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+class Histogram:
+    """累积直方图（Prometheus 语义：bucket 计数为 <= 上界的观测数）"""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: "Histogram"):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """按桶线性插值估算分位数（同 PromQL histogram_quantile）；无观测时返回 None"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, c in enumerate(self.counts):
+            if cumulative + c >= rank and c:
+                if i >= len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / c
+            cumulative += c
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """线程安全的计数器与直方图表；指标按 (名称, 标签) 存储"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._hists: Dict[Tuple[str, Labels], Histogram] = {}
+        self._recent_tokens: Dict[str, deque] = {}
+        self.started_at = time.time()
+        self._last_export = 0.0
+
+    def inc(self, name: str, labels: Labels, value: float = 1.0):
+        with self._lock:
+            key = (name, labels)
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, labels: Labels, value: float, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        with self._lock:
+            key = (name, labels)
+            hist = self._hists.get(key)
+            if hist is None:
+                hist = self._hists[key] = Histogram(buckets)
+            hist.observe(value)
+
+    def note_tokens(self, provider: str, tokens: int, now: Optional[float] = None):
+        """记录最近窗口内的 token 数，用于实时吞吐"""
+        now = time.time() if now is None else now
+        with self._lock:
+            window = self._recent_tokens.setdefault(provider, deque())
+            window.append((now, tokens))
+            while window and now - window[0][0] > RATE_WINDOW_SECS:
+                window.popleft()
+
+    # ---------- 查询 ----------
+    def counter_sum(self, name: str, **match: str) -> float:
+        with self._lock:
+            return sum(
+                v for (n, labels), v in self._counters.items()
+                if n == name and all(dict(labels).get(k) == val for k, val in match.items())
+            )
+
+    def merged_histogram(self, name: str, **match: str) -> Optional[Histogram]:
+        merged = None
+        with self._lock:
+            for (n, labels), hist in self._hists.items():
+                if n != name or not all(dict(labels).get(k) == val for k, val in match.items()):
+                    continue
+                if merged is None:
+                    merged = Histogram(hist.buckets)
+                merged.merge(hist)
+        return merged
+
+    def tokens_per_sec(self, provider: str) -> float:
+        now = time.time()
+        with self._lock:
+            window = self._recent_tokens.get(provider)
+            if not window:
+                return 0.0
+            recent = [(t, n) for t, n in window if now - t <= RATE_WINDOW_SECS]
+        if not recent:
+            return 0.0
+        span = max(min(RATE_WINDOW_SECS, now - self.started_at), 1.0)
+        return sum(n for _, n in recent) / span
+
+    def providers(self):
+        with self._lock:
+            names = {dict(labels).get("provider") for (n, labels) in self._counters if n == "llm_requests_total"}
+        return sorted(p for p in names if p)
+
+    # ---------- 导出 ----------
+    def render_prometheus(self) -> str:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            hists = sorted(self._hists.items(), key=lambda kv: kv[0])
+        lines = []
+        seen = set()
+
+        def _header(name):
+            if name not in seen:
+                seen.add(name)
+                kind, text = HELP.get(name, ("untyped", name))
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            _header(name)
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), hist in hists:
+            _header(name)
+            cumulative = 0
+            for bound, c in zip(list(hist.buckets) + [float("inf")], hist.counts):
+                cumulative += c
+                le = labels + (("le", _format_value(bound)),)
+                lines.append(f"{name}_bucket{_format_labels(le)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(round(hist.sum, 6))}")
+            lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: Optional[Path] = None) -> Optional[Path]:
+        """原子写入 Prometheus 文本格式快照；失败时只打印警告"""
+        path = Path(path) if path is not None else metrics_file()
+        self._last_export = time.time()
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(self.render_prometheus())
+            os.replace(tmp, path)
+            return path
+        except OSError as e:
+            print(f"⚠️  指标快照写入失败（不影响运行）：{e}")
+            return None
+
+    def maybe_export(self):
+        if time.time() - self._last_export >= export_interval():
+            self.export()
+
+
+def metrics_file() -> Path:
+    env_path = os.getenv("LLM_METRICS_FILE", "").strip()
+    if env_path:
+        return Path(env_path)
+    logs_root = Path(get_config_value(get_project_config(), "paths.logs", "logs"))
+    if not logs_root.is_absolute():
+        logs_root = REPO_ROOT / logs_root
+    stem = Path(sys.argv[0]).stem if sys.argv and sys.argv[0] else "python"
+    return logs_root / "metrics" / f"{stem or 'python'}.prom"
+
+
+def export_interval() -> float:
+    raw = os.getenv("LLM_METRICS_INTERVAL", "").strip()
+    try:
+        return float(raw) if raw else DEFAULT_EXPORT_INTERVAL
+    except ValueError:
+        return DEFAULT_EXPORT_INTERVAL
+
+
+_REGISTRY: Optional[MetricsRegistry] = None
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_registry() -> MetricsRegistry:
+    """进程内共享的指标表（首次使用时注册退出时的最终快照）"""
+    global _REGISTRY
+    with _REGISTRY_LOCK:
+        if _REGISTRY is None:
+            _REGISTRY = MetricsRegistry()
+            atexit.register(_final_export)
+        return _REGISTRY
+
+
+def _final_export():
+    if _REGISTRY is not None and metrics_enabled() and _REGISTRY.counter_sum("llm_requests_total"):
+        _REGISTRY.export()
+
+
+def _usage_value(usage: Any, key: str) -> int:
+    if usage is None:
+        return 0
+    value = usage.get(key) if isinstance(usage, dict) else getattr(usage, key, None)
+    return int(value or 0)
+
+
+def record_request(
+    provider: str,
+    model: Optional[str],
+    status: str,
+    latency: Optional[float] = None,
+    usage: Any = None,
+    ttft: Optional[float] = None,
+    cached_prompt_tokens: int = 0,
+):
+    """
+    记录一次请求结果
+
+    Args:
+        provider: 提供商（deepseek / gemini / kimi ...）
+        model: 模型名
+        status: ok / error / rate_limited / cache_hit
+        latency: 请求耗时（秒）；缓存命中时不记录
+        usage: 响应 usage（对象或 dict）
+        ttft: 流式请求的首 token 时间（秒）
+        cached_prompt_tokens: 命中服务端前缀缓存的提示词 token 数
+    """
+    if not metrics_enabled():
+        return
+    reg = get_registry()
+    model = model or ""
+    reg.inc("llm_requests_total", _labels(provider=provider, model=model, status=status))
+    if status != "cache_hit":
+        if latency is not None:
+            reg.observe("llm_request_latency_seconds", _labels(provider=provider, model=model), latency)
+        if ttft is not None:
+            reg.observe("llm_time_to_first_token_seconds", _labels(provider=provider, model=model), ttft, TTFT_BUCKETS)
+        prompt = _usage_value(usage, "prompt_tokens")
+        completion = _usage_value(usage, "completion_tokens")
+        for kind, n in (("prompt", prompt), ("completion", completion), ("cached_prompt", cached_prompt_tokens)):
+            if n:
+                reg.inc("llm_tokens_total", _labels(provider=provider, model=model, kind=kind), n)
+        if prompt or completion:
+            reg.note_tokens(provider, prompt + completion)
+    reg.maybe_export()
+
+
+def record_retry(provider: str, model: Optional[str] = None):
+    """抽取脚本每次决定重试时调用"""
+    if not metrics_enabled():
+        return
+    get_registry().inc("llm_retries_total", _labels(provider=provider, model=model or ""))
+
+
+def record_hedge(provider: str, model: Optional[str], outcome: str):
+    """记录一次已发出的对冲，outcome 为 won / lost / failed"""
+    if not metrics_enabled():
+        return
+    get_registry().inc("llm_hedges_total", _labels(provider=provider, model=model or "", outcome=outcome))
+
+
+def record_hedge_tokens(provider: str, model: Optional[str], tokens: int):
+    """记录对冲中落败一方消耗的 token"""
+    if not metrics_enabled() or not tokens:
+        return
+    get_registry().inc("llm_hedge_tokens_total", _labels(provider=provider, model=model or ""), tokens)
+
+
+def counter_ratio(numerator: str, denominator: str, provider: str) -> float:
+    """同一提供商两个计数器之比（分母不含缓存命中）；分母为 0 时返回 0"""
+    reg = get_registry()
+    sent = reg.counter_sum(denominator, provider=provider)
+    if denominator == "llm_requests_total":
+        sent -= reg.counter_sum(denominator, provider=provider, status="cache_hit")
+    return reg.counter_sum(numerator, provider=provider) / sent if sent > 0 else 0.0
+
+
+def latency_quantile(provider: str, q: float, model: Optional[str] = None) -> Tuple[Optional[float], int]:
+    """
+    从实时延迟直方图估算分位数，返回 (秒, 样本数)
+
+    指定 model 时优先用该模型的直方图；样本为 0 时退回该提供商所有模型的合并直方图。
+    """
+    reg = get_registry()
+    hist = reg.merged_histogram("llm_request_latency_seconds", provider=provider, model=model) if model else None
+    if hist is None or not hist.count:
+        hist = reg.merged_histogram("llm_request_latency_seconds", provider=provider)
+    if hist is None or not hist.count:
+        return None, 0
+    return hist.quantile(q), hist.count
+
+
+def _fmt_secs(v: Optional[float]) -> str:
+    return "-" if v is None else f"{v:.1f}s"
+
+
+def summary_line(provider: Optional[str] = None) -> str:
+    """
+    一行紧凑摘要，如 "deepseek 1.2k tok/s p50 4.1s p95 12.0s 重试 3.1% 429 0.8% (n=230)"
+
+    provider 为 None 时汇总所有提供商（每个提供商一段，以 " | " 分隔）；尚无请求时返回空串。
+    """
+    if not metrics_enabled():
+        return ""
+    reg = get_registry()
+    providers = [provider] if provider else reg.providers()
+    segments = []
+    for p in providers:
+        sent = reg.counter_sum("llm_requests_total", provider=p) - reg.counter_sum("llm_requests_total", provider=p, status="cache_hit")
+        if sent <= 0:
+            continue
+        hist = reg.merged_histogram("llm_request_latency_seconds", provider=p)
+        rate = reg.tokens_per_sec(p)
+        rate_text = f"{rate / 1000:.1f}k" if rate >= 1000 else f"{rate:.0f}"
+        retry_pct = reg.counter_sum("llm_retries_total", provider=p) * 100 / sent
+        limited_pct = reg.counter_sum("llm_requests_total", provider=p, status="rate_limited") * 100 / sent
+        hedges = reg.counter_sum("llm_hedges_total", provider=p)
+        hedge_text = ""
+        if hedges:
+            hedge_tokens = reg.counter_sum("llm_hedge_tokens_total", provider=p)
+            hedge_text = f" 对冲 {hedges * 100 / sent:.1f}%/{int(hedge_tokens)}tok"
+        segments.append(
+            f"{p} {rate_text} tok/s p50 {_fmt_secs(hist.quantile(0.5) if hist else None)} "
+            f"p95 {_fmt_secs(hist.quantile(0.95) if hist else None)} "
+            f"重试 {retry_pct:.1f}% 429 {limited_pct:.1f}%{hedge_text} (n={int(sent)})"
+        )
+    return " | ".join(segments)
@@ -0,0 +1,162 @@
+"""
+长论文按章节切分（map-reduce 抽取的 map 侧）
+
+MinerU 导出的 markdown 以 "# 标题" 行划分章节。切分规则：
+- 按标题行把全文拆成章节，再按顺序贪心装入 token 上限内的窗口
+- 单个章节超过上限时按段落（空行）继续拆分，续段保留章节标题
+- 首个章节（论文标题、作者、摘要）作为公共上下文附在每个窗口开头
+- 参考文献、作者简介等不含领域知识的章节默认跳过
+
+token 数沿用 rate_limiter.estimate_tokens 的粗略估算。各窗口的抽取结果由
+stream_json.merge_extractions 按实体/关系去重键合并（reduce 侧）。
+"""
+import re
+from typing import List, Tuple
+
+from .rate_limiter import estimate_tokens
+
+HEADING_RE = re.compile(r"^#{1,6}\s+\S")
+
+# 默认窗口 token 上限（仅论文部分，不含提示词指令）
+DEFAULT_WINDOW_TOKENS = 6000
+# 公共上下文（标题 + 摘要）的 token 上限，超出时只保留标题行
+HEADER_MAX_TOKENS = 1200
+# 切分时跳过的章节标题（去掉 # 与空白后完全匹配，或以其开头）
+SKIP_SECTION_TITLES = ("参考文献", "references", "作者简介", "致谢", "acknowledgement", "acknowledgment")
+
+# 每篇论文专属 prompt 中，论文原文位于该标题之后
+INPUT_SECTION_MARKER = "## 输入数据"
+
+
+def _heading_title(line: str) -> str:
+    return line.lstrip("#").strip().rstrip("：:").strip().lower()
+
+
+def split_markdown_sections(text: str) -> List[Tuple[str, str]]:
+    """
+    按 markdown 标题行拆分
+
+    Returns:
+        [(标题行, 章节全文含标题行), ...]；首个标题之前的内容标题行为 ""
+    """
+    sections: List[Tuple[str, str]] = []
+    heading = ""
+    lines: List[str] = []
+    in_fence = False
+    for line in (text or "").splitlines():
+        if line.lstrip().startswith("```"):
+            in_fence = not in_fence
+        if not in_fence and HEADING_RE.match(line):
+            if heading or "".join(lines).strip():
+                sections.append((heading, "\n".join(lines).strip()))
+            heading = line.strip()
+            lines = [line]
+        else:
+            lines.append(line)
+    if heading or "".join(lines).strip():
+        sections.append((heading, "\n".join(lines).strip()))
+    return sections
+
+
+def _split_oversized(heading: str, body: str, budget: int) -> List[str]:
+    """把超过 budget 的章节按段落拆分；单段仍超长时按字符硬切"""
+    if heading and body.startswith(heading):
+        body = body[len(heading):]
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", body) if p.strip()]
+    cont_heading = f"{heading}（续）" if heading else ""
+    pieces: List[str] = []
+    current: List[str] = [heading] if heading else []
+    current_tokens = estimate_tokens(heading)
+
+    def flush():
+        nonlocal current, current_tokens
+        if any(p for p in current if p not in (heading, cont_heading)):
+            pieces.append("\n\n".join(current))
+        current = [cont_heading] if cont_heading else []
+        current_tokens = estimate_tokens(cont_heading)
+
+    for para in paragraphs:
+        para_tokens = estimate_tokens(para)
+        if para_tokens > budget:
+            flush()
+            # 按 token 估算比例切成等长片段
+            n = para_tokens // budget + 1
+            size = len(para) // n + 1
+            for i in range(0, len(para), size):
+                pieces.append("\n\n".join(([cont_heading] if cont_heading else []) + [para[i:i + size]]))
+            continue
+        if current_tokens + para_tokens > budget:
+            flush()
+        current.append(para)
+        current_tokens += para_tokens
+    flush()
+    return pieces
+
+
+def chunk_paper(text: str, max_tokens: int = DEFAULT_WINDOW_TOKENS, skip_titles=SKIP_SECTION_TITLES) -> List[str]:
+    """
+    把论文切成不超过 max_tokens（估算）的窗口文本
+
+    全文不超过 max_tokens 时原样返回单个窗口，与整篇抽取完全一致。
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+    sections = split_markdown_sections(text)
+    if not sections:
+        return [text]
+
+    # 公共上下文：首个章节（标题/作者/摘要），过长时只保留首行
+    header = sections[0][1]
+    if estimate_tokens(header) > HEADER_MAX_TOKENS:
+        header = header.splitlines()[0]
+    body_sections = sections[1:]
+    budget = max(max_tokens - estimate_tokens(header), max_tokens // 2)
+
+    blocks: List[str] = []
+    for heading, section in body_sections:
+        title = _heading_title(heading)
+        if heading and any(title == s or title.startswith(s) for s in skip_titles):
+            continue
+        if estimate_tokens(section) > budget:
+            blocks.extend(_split_oversized(heading, section, budget))
+        else:
+            blocks.append(section)
+
+    windows: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for block in blocks:
+        block_tokens = estimate_tokens(block)
+        if current and current_tokens + block_tokens > budget:
+            windows.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(block)
+        current_tokens += block_tokens
+    if current:
+        windows.append("\n\n".join(current))
+    if not windows:
+        return [text]
+    return [f"{header}\n\n{w}" for w in windows]
+
+
+def strip_embedded_paper(prompt_template: str, marker: str = INPUT_SECTION_MARKER) -> str:
+    """
+    去掉专属 prompt 中内嵌的论文原文（"## 输入数据" 及其之后），只保留抽取指令
+
+    含 {full_text_placeholder} 或找不到该标题时原样返回。
+    """
+    if "{full_text_placeholder}" in prompt_template:
+        return prompt_template
+    idx = prompt_template.rfind("\n" + marker)
+    if idx < 0:
+        return prompt_template
+    return prompt_template[:idx].rstrip()
+
+
+def format_window(window: str, index: int, total: int) -> str:
+    """为窗口文本加上片段说明，提示模型只抽取本片段中出现的内容"""
+    return (
+        f"（以下为论文按章节切分后的第 {index + 1}/{total} 个片段，开头附有论文标题与摘要作为上下文；"
+        "请只抽取本片段中出现的实体和关系。）\n\n"
+        f"{window}"
+    )
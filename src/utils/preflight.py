@@ -0,0 +1,102 @@
+"""
+启动预检（GET /models）结果缓存
+
+各抽取/评分脚本启动时调用 /models 以提前发现 401 或 base_url 配置错误，每次运行都要多一次
+网络往返。预检通过的结果按 (base_url, Key 指纹) 缓存到 paths.cache/preflight.json，
+有效期内再次启动直接复用，不发请求；失败结果不缓存，下次启动会重新检查。
+
+环境变量：
+- EXTRACT_PREFLIGHT_TTL: 缓存有效期（秒，默认 21600 即 6 小时；0 表示不使用缓存）
+- PREFLIGHT_CACHE_FILE: 覆盖缓存文件路径
+"""
+import os
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from .config_loader import get_config_value, get_project_config
+from .rate_limiter import key_fingerprint
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+DEFAULT_TTL_SECS = 6 * 3600
+
+
+def preflight_ttl() -> float:
+    raw = os.getenv("EXTRACT_PREFLIGHT_TTL", "").strip()
+    try:
+        return float(raw) if raw else float(DEFAULT_TTL_SECS)
+    except ValueError:
+        print(f"⚠️  EXTRACT_PREFLIGHT_TTL={raw} 不是有效数字，已使用默认值 {DEFAULT_TTL_SECS}")
+        return float(DEFAULT_TTL_SECS)
+
+
+def preflight_cache_file() -> Path:
+    env_path = os.getenv("PREFLIGHT_CACHE_FILE", "").strip()
+    if env_path:
+        return Path(env_path)
+    cache_root = Path(get_config_value(get_project_config(), "paths.cache", "cache"))
+    if not cache_root.is_absolute():
+        cache_root = REPO_ROOT / cache_root
+    return cache_root / "preflight.json"
+
+
+def _cache_key(base_url: Optional[str], api_key: Optional[str]) -> str:
+    return f"{(base_url or '').rstrip('/')}|{key_fingerprint(api_key)}"
+
+
+def _load(path: Path) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def _save(path: Path, data: Dict[str, Any]) -> None:
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"⚠️  预检缓存写入失败（不影响运行）：{e}")
+
+
+def get_cached_preflight(base_url: Optional[str], api_key: Optional[str]) -> Optional[Dict[str, Any]]:
+    """返回有效期内的预检记录；无记录、已过期或禁用缓存时返回 None（不发请求）"""
+    ttl = preflight_ttl()
+    if ttl <= 0:
+        return None
+    entry = _load(preflight_cache_file()).get(_cache_key(base_url, api_key))
+    if not entry or time.time() - float(entry.get("checked_at", 0)) >= ttl:
+        return None
+    return entry
+
+
+def cached_preflight(client: Any, base_url: Optional[str], api_key: Optional[str]) -> Dict[str, Any]:
+    """
+    预检（带缓存）：有效期内直接返回缓存记录，否则调用 client.models.list() 并缓存成功结果
+
+    Returns:
+        {"models": 模型数, "checked_at": 检查时间戳, "cached": 是否来自缓存}
+
+    Raises:
+        client.models.list() 的原始异常（由调用方区分 401 与其他错误）
+    """
+    entry = get_cached_preflight(base_url, api_key)
+    if entry is not None:
+        return dict(entry, cached=True)
+    models_res = client.models.list()
+    entry = {
+        "models": len(getattr(models_res, "data", []) or []),
+        "checked_at": time.time(),
+    }
+    if preflight_ttl() > 0:
+        path = preflight_cache_file()
+        data = _load(path)
+        data[_cache_key(base_url, api_key)] = entry
+        _save(path, data)
+    return dict(entry, cached=False)
@@ -0,0 +1,104 @@
+"""
+面向服务端前缀缓存的提示词布局
+
+DeepSeek（硬盘缓存）、Kimi（上下文缓存）与 Gemini（隐式缓存）都按请求的 token 前缀命中：
+只有从第一个 token 起逐字相同的部分才会被复用。原有的填充方式把论文相关内容放在前面或中间
+（专属 prompt 中逐篇不同的输出示例、内嵌的论文原文、{full_text_placeholder}），
+schema 与 JSON 提示追加在论文之后，可复用的前缀很短；专属 prompt 还会在内嵌原文之后
+再追加一次【全文】，论文被发送两遍。
+
+缓存布局按“固定内容在前、可变内容在后”重排：
+    模板中的固定章节（含 schema） → JSON 输出提示 → 逐篇不同的章节（如输出示例） → 论文全文（仅一次）
+"""
+import re
+from typing import Any, Iterable, List, Tuple
+
+from .paper_chunker import strip_embedded_paper
+
+FULL_TEXT_PLACEHOLDER = "{full_text_placeholder}"
+SCHEMA_PLACEHOLDERS = ("{schema_placeholder}", "{schema_json_placeholder}")
+
+# 逐篇不同、需要后移的二级章节（按标题前缀匹配）；"输入数据" 之后的内嵌原文由 strip_embedded_paper 去掉
+DEFAULT_VARIABLE_SECTIONS = ("输出格式",)
+
+SECTION_RE = re.compile(r"^## ", re.MULTILINE)
+
+
+def split_sections(template: str) -> List[Tuple[str, str]]:
+    """按二级标题（"## "）切分模板，返回 [(标题, 章节全文), ...]；首个标题之前的部分标题为空"""
+    starts = [m.start() for m in SECTION_RE.finditer(template)]
+    if not starts or starts[0] != 0:
+        starts = [0] + starts
+    sections = []
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else len(template)
+        text = template[start:end]
+        title = text[3:].split("\n", 1)[0].strip() if text.startswith("## ") else ""
+        sections.append((title, text))
+    return sections
+
+
+def split_static_variable(template: str, variable_sections: Iterable[str] = DEFAULT_VARIABLE_SECTIONS) -> Tuple[str, str]:
+    """
+    把模板拆成 (固定部分, 可变部分)
+
+    内嵌的论文原文与 {full_text_placeholder} 都会被去掉，论文由调用方只追加一次。
+    """
+    variable_sections = tuple(variable_sections)
+    instructions = strip_embedded_paper(template).replace(FULL_TEXT_PLACEHOLDER, "")
+    static, variable = [], []
+    for title, text in split_sections(instructions):
+        (variable if title and title.startswith(variable_sections) else static).append(text.strip())
+    return "\n\n".join(s for s in static if s), "\n\n".join(v for v in variable if v)
+
+
+def assemble_cached_prompt(
+    template: str,
+    paper_text: str,
+    schema_text: str = "",
+    suffix: str = "",
+    variable_sections: Iterable[str] = DEFAULT_VARIABLE_SECTIONS,
+) -> str:
+    """
+    按缓存布局组装 prompt
+
+    Args:
+        template: 提示词模板（通用模板或专属 prompt）
+        paper_text: 论文全文或分段窗口文本
+        schema_text: 注入 schema 占位符的文本；模板无占位符时作为【Schema】附在固定部分末尾
+        suffix: 附在固定部分之后的固定说明（如 JSON 输出提示）
+        variable_sections: 需要后移的逐篇不同章节
+    """
+    static, variable = split_static_variable(template, variable_sections)
+    has_schema_slot = any(p in static for p in SCHEMA_PLACEHOLDERS)
+    for p in SCHEMA_PLACEHOLDERS:
+        static = static.replace(p, schema_text or "")
+    if schema_text and not has_schema_slot:
+        static = static + "\n\n【Schema】\n" + schema_text
+    parts = [static + (suffix or "")]
+    if variable:
+        parts.append(variable)
+    parts.append("【全文】\n" + paper_text)
+    return "\n\n".join(parts)
+
+
+def cached_prompt_tokens(usage: Any) -> int:
+    """
+    从响应 usage 中读取命中前缀缓存的提示词 token 数
+
+    兼容 OpenAI 风格 prompt_tokens_details.cached_tokens（Gemini 兼容接口同此）、
+    DeepSeek 的 prompt_cache_hit_tokens 与 Kimi 的 cached_tokens；usage 可为对象或 dict。
+    """
+    if usage is None:
+        return 0
+
+    def _get(obj, key):
+        return obj.get(key) if isinstance(obj, dict) else getattr(obj, key, None)
+
+    details = _get(usage, "prompt_tokens_details")
+    if details is not None and _get(details, "cached_tokens"):
+        return int(_get(details, "cached_tokens"))
+    for key in ("prompt_cache_hit_tokens", "cached_tokens"):
+        if _get(usage, key):
+            return int(_get(usage, key))
+    return 0
@@ -0,0 +1,192 @@
+"""
+提交时组装完整提示词（不再落盘）
+
+原流程由 clustering/第四步生成完整prompt.py 把“模板 + S 模块示例 + 论文全文”逐篇写成
+完整prompt/prompt_<论文>.txt，抽取脚本再读回：论文全文在磁盘上多存一份，模板一改就要全部重新生成。
+PromptRenderer 在提交时按同样的规则于内存中组装，输入各自只读一次（模板与 schema 进程内缓存）。
+
+组装规则与第四步脚本一致（同样输入得到逐字相同的提示词）：
+- 模板含 "## 输出格式" 标记时，把 Few-Shot 示例插在它之前，否则追加到末尾
+- {full_text_placeholder} 替换为论文全文
+- 提供 schema 时替换 {schema_placeholder} / {schema_json_placeholder}；模板没有占位符时以
+  "## Schema" 章节插在输出格式之前
+
+content_hash 由各组成部分的哈希与 RENDER_VERSION 计算，与文件路径、修改时间无关，
+可作为缓存键与审计字段（同一哈希 ⇔ 同一份提示词）。
+
+环境变量：
+- PROMPT_TEMPLATE_FILE: 覆盖模板路径（默认 <src>/prompt/prompt.txt）
+- PROMPT_S_MODULES_DIR: 覆盖 S 模块目录（默认 <src>/数据结果/s_modules）
+- PROMPT_SCHEMA_FILE: 注入的 schema JSON（默认不注入）
+- PROMPT_DUMP_DIR: 调试用，把组装结果写到该目录（prompt_<论文>.txt，内容不变时不重写）
+"""
+import hashlib
+import os
+import threading
+from typing import Any, Dict, Optional
+
+RENDER_VERSION = "1"
+
+OUTPUT_FORMAT_MARKER = "## 输出格式\n请严格按照以下JSON格式输出结果："
+FULL_TEXT_PLACEHOLDER = "{full_text_placeholder}"
+SCHEMA_PLACEHOLDERS = ("{schema_placeholder}", "{schema_json_placeholder}")
+FEW_SHOT_HEADER = "## Few-Shot示例\n以下是相关领域的标注示例，请参考这些示例的标注风格和粒度：\n\n"
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _sha(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def extract_examples(s_module_text: str) -> str:
+    """从 S 模块中提取示例内容：去掉标题和说明文字，从第一个以“示例”开头的行开始"""
+    lines = s_module_text.split("\n")
+    for i, line in enumerate(lines):
+        if line.strip().startswith("示例"):
+            return "\n".join(lines[i:]).strip()
+    return ""
+
+
+def _inject_schema(template: str, schema_text: str) -> str:
+    if not schema_text:
+        return template
+    if any(p in template for p in SCHEMA_PLACEHOLDERS):
+        for p in SCHEMA_PLACEHOLDERS:
+            template = template.replace(p, schema_text)
+        return template
+    section = f"## Schema\n```json\n{schema_text}\n```\n\n"
+    if OUTPUT_FORMAT_MARKER in template:
+        before, after = template.split(OUTPUT_FORMAT_MARKER, 1)
+        return before.rstrip() + "\n\n" + section + OUTPUT_FORMAT_MARKER + after
+    return template.rstrip() + "\n\n" + section.rstrip()
+
+
+def compose_prompt(template: str, examples: str, document_content: str, schema_text: str = "") -> str:
+    """组装完整提示词（规则见模块说明）"""
+    template = _inject_schema(template, schema_text)
+    if OUTPUT_FORMAT_MARKER in template:
+        before_output, after_output = template.split(OUTPUT_FORMAT_MARKER, 1)
+        complete_prompt = before_output.strip() + "\n\n"
+        if examples:
+            complete_prompt += FEW_SHOT_HEADER + examples + "\n\n"
+        complete_prompt += OUTPUT_FORMAT_MARKER + after_output
+    else:
+        complete_prompt = template
+        if examples:
+            complete_prompt += "\n\n" + FEW_SHOT_HEADER + examples
+    return complete_prompt.replace(FULL_TEXT_PLACEHOLDER, document_content)
+
+
+def _paper_stem(paper_file: str) -> str:
+    name = os.path.basename(paper_file)
+    return name[:-3] if name.endswith(".md") else name
+
+
+class PromptRenderer:
+    """
+    按论文组装提示词
+
+    Args:
+        template_path: 模板文件
+        s_modules_dir: S 模块目录（S_module_<论文>.txt；缺失时不加示例）
+        schema_text: 注入的 schema 文本（可为空）
+        dump_dir: 调试落盘目录（None 表示不落盘）
+    """
+
+    def __init__(
+        self,
+        template_path: str,
+        s_modules_dir: Optional[str] = None,
+        schema_text: str = "",
+        dump_dir: Optional[str] = None,
+    ):
+        self.template_path = template_path
+        self.s_modules_dir = s_modules_dir
+        self.schema_text = schema_text or ""
+        self.dump_dir = dump_dir
+        self._template: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @property
+    def template(self) -> str:
+        with self._lock:
+            if self._template is None:
+                with open(self.template_path, "r", encoding="utf-8") as f:
+                    self._template = f.read()
+            return self._template
+
+    def available(self) -> bool:
+        return os.path.isfile(self.template_path)
+
+    def s_module_path(self, paper_file: str) -> Optional[str]:
+        if not self.s_modules_dir:
+            return None
+        return os.path.join(self.s_modules_dir, f"S_module_{_paper_stem(paper_file)}.txt")
+
+    def load_examples(self, paper_file: str) -> str:
+        path = self.s_module_path(paper_file)
+        if not path or not os.path.exists(path):
+            return ""
+        with open(path, "r", encoding="utf-8") as f:
+            return extract_examples(f.read())
+
+    def content_hash(self, examples: str, paper_text: str) -> str:
+        """组成部分哈希的哈希（16 位十六进制）"""
+        parts = [RENDER_VERSION, _sha(self.template), _sha(examples), _sha(self.schema_text), _sha(paper_text)]
+        return hashlib.sha256("|".join(parts).encode("ascii")).hexdigest()[:16]
+
+    def render(self, paper_file: str, paper_text: str) -> Dict[str, Any]:
+        """
+        组装单篇论文的提示词
+
+        Args:
+            paper_file: 论文文件名（用于匹配 S 模块）
+            paper_text: 论文全文（与第四步脚本一致，会去掉首尾空白）
+
+        Returns:
+            {"prompt", "hash", "has_examples", "dump_path"}
+        """
+        document = (paper_text or "").strip()
+        examples = self.load_examples(paper_file)
+        prompt = compose_prompt(self.template, examples, document, self.schema_text)
+        result = {
+            "prompt": prompt,
+            "hash": self.content_hash(examples, document),
+            "has_examples": bool(examples),
+            "dump_path": None,
+        }
+        if self.dump_dir:
+            result["dump_path"] = self._dump(paper_file, prompt)
+        return result
+
+    def _dump(self, paper_file: str, prompt: str) -> str:
+        os.makedirs(self.dump_dir, exist_ok=True)
+        path = os.path.join(self.dump_dir, f"prompt_{_paper_stem(paper_file)}.txt")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                if f.read() == prompt:
+                    return path
+        except OSError:
+            pass
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(prompt)
+        os.replace(tmp, path)
+        return path
+
+
+def _read_optional(path: str) -> str:
+    if not path or not os.path.isfile(path):
+        return ""
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().strip()
+
+
+def default_renderer(base_dir: str = SRC_DIR, dump_dir: Optional[str] = None) -> PromptRenderer:
+    """按 <base_dir>/prompt/prompt.txt 与 <base_dir>/数据结果/s_modules 创建渲染器（可被环境变量覆盖）"""
+    template_path = os.getenv("PROMPT_TEMPLATE_FILE", "").strip() or os.path.join(base_dir, "prompt", "prompt.txt")
+    s_modules_dir = os.getenv("PROMPT_S_MODULES_DIR", "").strip() or os.path.join(base_dir, "数据结果", "s_modules")
+    schema_text = _read_optional(os.getenv("PROMPT_SCHEMA_FILE", "").strip())
+    dump_dir = os.getenv("PROMPT_DUMP_DIR", "").strip() or dump_dir
+    return PromptRenderer(template_path, s_modules_dir, schema_text, dump_dir or None)
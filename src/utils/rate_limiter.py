@@ -0,0 +1,281 @@
+"""
+自适应限流器
+
+按 (提供商, API Key 指纹) 维护令牌桶，同时约束：
+- 每分钟请求数（RPM）
+- 每分钟 token 数（TPM）
+
+限额来源（优先级从高到低）：
+1. 环境变量 <PROVIDER>_RPM / <PROVIDER>_TPM
+2. config/config.yaml 中的 rate_limits.<provider>
+3. config/config.yaml 中的 rate_limits.default
+
+遇到 429 / Retry-After 时立即暂停并按比例降低速率（乘性减），
+之后每次成功调用缓慢恢复（加性增），直至回到配置上限。
+"""
+import os
+import re
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from .config_loader import get_config_value, get_project_config
+
+# 未配置时的保守默认值
+FALLBACK_RPM = 60
+FALLBACK_TPM = 200000
+
+# 自适应参数：429 后速率乘以 DECREASE_FACTOR，成功后每次恢复上限的 INCREASE_RATIO
+DECREASE_FACTOR = 0.5
+INCREASE_RATIO = 0.05
+MIN_RATE_RATIO = 0.05
+
+# 无 Retry-After 时的退避上限（秒）
+MAX_BACKOFF_SECS = 60.0
+
+
+def key_fingerprint(api_key: Optional[str]) -> str:
+    """API Key 指纹（sha256 前 12 位），用于区分同一提供商下的多个 Key，且不落盘明文"""
+    if not api_key:
+        return "anonymous"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算 token 数：CJK 字符按 1 个 token，其余字符按 4 字符 1 个 token
+
+    仅用于限流预占，实际用量在响应返回后通过 usage 修正。
+    """
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if "一" <= ch <= "鿿" or "　" <= ch <= "ヿ")
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+def estimate_messages_tokens(messages: Iterable[Dict[str, Any]]) -> int:
+    """估算一组 chat messages 的 prompt token 数（每条消息额外计 4 个格式 token）"""
+    total = 0
+    for msg in messages or []:
+        content = msg.get("content") if isinstance(msg, dict) else None
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+        total += 4
+    return total
+
+
+def is_rate_limit_error(exc: BaseException) -> bool:
+    """判断异常是否为限流（HTTP 429）"""
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    if status == 429:
+        return True
+    msg = str(exc).lower()
+    return "429" in msg or "rate limit" in msg or "too many requests" in msg
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """从异常的响应头（Retry-After / retry-after-ms）或错误信息中解析建议等待秒数"""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if headers is not None:
+        try:
+            ms = headers.get("retry-after-ms")
+            if ms is not None:
+                return max(0.0, float(ms) / 1000.0)
+            ra = headers.get("retry-after")
+            if ra is not None:
+                return max(0.0, float(ra))
+        except (TypeError, ValueError):
+            pass
+    m = re.search(r"retry[- _]after[^0-9]{0,10}(\d+(?:\.\d+)?)\s*(ms|s)?", str(exc), re.IGNORECASE)
+    if m:
+        value = float(m.group(1))
+        return value / 1000.0 if (m.group(2) or "").lower() == "ms" else value
+    return None
+
+
+def backoff_delay(attempt: int, exc: Optional[BaseException] = None) -> float:
+    """
+    计算第 attempt 次（从 0 开始）失败后的等待秒数
+
+    优先使用服务端给出的 Retry-After；否则指数退避并加入抖动，避免并发任务同时重试。
+    """
+    if exc is not None:
+        ra = retry_after_seconds(exc)
+        if ra is not None:
+            return min(ra, MAX_BACKOFF_SECS)
+    base = min(2 ** attempt, MAX_BACKOFF_SECS)
+    return base * (0.5 + random.random() / 2)
+
+
+class _Bucket:
+    """单个令牌桶：容量为每分钟限额，按 rate/60 每秒匀速补充"""
+
+    def __init__(self, limit: float):
+        self.limit = float(limit)
+        self.rate = float(limit)          # 当前自适应速率（每分钟）
+        self.tokens = float(limit)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.limit, self.tokens + elapsed * self.rate / 60.0)
+            self.updated = now
+
+    def wait_for(self, amount: float) -> float:
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60.0 / self.rate
+
+
+class RateLimiter:
+    """
+    RPM + TPM 双令牌桶限流器（线程安全，同时支持同步与 asyncio 调用）
+
+    Example:
+        >>> limiter = get_limiter("deepseek", api_key)
+        >>> limiter.acquire(estimated_tokens)       # 同步
+        >>> await limiter.aacquire(estimated_tokens)  # 异步
+    """
+
+    def __init__(self, name: str, rpm: Optional[float], tpm: Optional[float]):
+        self.name = name
+        self._req = _Bucket(rpm) if rpm else None
+        self._tok = _Bucket(tpm) if tpm else None
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self.rate_limited_count = 0
+
+    # ---------- 预占 ----------
+    def _try_reserve(self, tokens: int) -> float:
+        """尝试预占 1 个请求与 tokens 个 token；成功返回 0，否则返回需等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            waits = [0.0]
+            if self._req is not None:
+                self._req.refill(now)
+                waits.append(self._req.wait_for(1))
+            if self._tok is not None:
+                self._tok.refill(now)
+                # 单次请求超过桶容量时按满桶计，避免永远等待
+                waits.append(self._tok.wait_for(min(tokens, self._tok.limit)))
+            wait = max(waits)
+            if wait > 0:
+                return wait
+            if self._req is not None:
+                self._req.tokens -= 1
+            if self._tok is not None:
+                self._tok.tokens -= min(tokens, self._tok.limit)
+            return 0.0
+
+    def acquire(self, tokens: int = 0) -> float:
+        """阻塞直到配额可用，返回累计等待秒数"""
+        waited = 0.0
+        while True:
+            wait = self._try_reserve(tokens)
+            if wait <= 0:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    async def aacquire(self, tokens: int = 0) -> float:
+        """acquire 的协程版本（等待期间让出事件循环）"""
+        waited = 0.0
+        while True:
+            wait = self._try_reserve(tokens)
+            if wait <= 0:
+                return waited
+            await asyncio.sleep(wait)
+            waited += wait
+
+    # ---------- 反馈 ----------
+    def record_usage(self, estimated: int, actual: Optional[int]):
+        """用响应中的实际 token 用量修正预占（多用则记为欠账，少用则退还）"""
+        if self._tok is None or not actual:
+            return
+        with self._lock:
+            self._tok.tokens = min(self._tok.limit, self._tok.tokens - (actual - min(estimated, self._tok.limit)))
+
+    def on_success(self):
+        """成功调用：速率加性恢复"""
+        with self._lock:
+            for bucket in (self._req, self._tok):
+                if bucket is not None and bucket.rate < bucket.limit:
+                    bucket.rate = min(bucket.limit, bucket.rate + bucket.limit * INCREASE_RATIO)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        """收到 429：暂停至 Retry-After，清空桶并乘性降低速率"""
+        with self._lock:
+            now = time.monotonic()
+            self.rate_limited_count += 1
+            pause = retry_after if retry_after is not None else 1.0
+            self._paused_until = max(self._paused_until, now + min(pause, MAX_BACKOFF_SECS))
+            for bucket in (self._req, self._tok):
+                if bucket is not None:
+                    bucket.rate = max(bucket.limit * MIN_RATE_RATIO, bucket.rate * DECREASE_FACTOR)
+                    bucket.tokens = min(bucket.tokens, 0.0)
+                    bucket.updated = now
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前限额与自适应速率（用于日志/监控）"""
+        with self._lock:
+            return {
+                "name": self.name,
+                "rpm_limit": self._req.limit if self._req else None,
+                "rpm_current": round(self._req.rate, 2) if self._req else None,
+                "tpm_limit": self._tok.limit if self._tok else None,
+                "tpm_current": round(self._tok.rate, 2) if self._tok else None,
+                "rate_limited_count": self.rate_limited_count,
+            }
+
+
+# ------------------------------
+# 全局注册表：同一进程内同一 (提供商, Key) 共享一个限流器
+# ------------------------------
+_LIMITERS: Dict[Tuple[str, str], RateLimiter] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def _env_number(name: str) -> Optional[float]:
+    raw = os.getenv(name, "").strip()
+    if not raw:
+        return None
+    try:
+        return float(raw)
+    except ValueError:
+        print(f"⚠️  {name}={raw} 不是有效数字，已忽略")
+        return None
+
+
+def resolve_limits(provider: str) -> Tuple[Optional[float], Optional[float]]:
+    """解析提供商的 (RPM, TPM)；值为 0 表示不限制该维度"""
+    config = get_project_config()
+    default = get_config_value(config, "rate_limits.default", {}) or {}
+    specific = get_config_value(config, f"rate_limits.{provider.lower()}", {}) or {}
+
+    rpm = _env_number(f"{provider.upper()}_RPM")
+    if rpm is None:
+        rpm = specific.get("rpm", default.get("rpm", FALLBACK_RPM))
+    tpm = _env_number(f"{provider.upper()}_TPM")
+    if tpm is None:
+        tpm = specific.get("tpm", default.get("tpm", FALLBACK_TPM))
+    return (float(rpm) or None, float(tpm) or None)
+
+
+def get_limiter(provider: str, api_key: Optional[str] = None) -> RateLimiter:
+    """获取 (provider, api_key) 对应的共享限流器"""
+    key = (provider.lower(), key_fingerprint(api_key))
+    with _REGISTRY_LOCK:
+        limiter = _LIMITERS.get(key)
+        if limiter is None:
+            rpm, tpm = resolve_limits(provider)
+            limiter = RateLimiter(f"{key[0]}:{key[1]}", rpm, tpm)
+            _LIMITERS[key] = limiter
+        return limiter
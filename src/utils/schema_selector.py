@@ -0,0 +1,238 @@
+"""
+按论文主题裁剪 schema
+
+_load_schema_text 把 phm_semantic_patterns.json 的全部实体类型与关系类型注入每篇论文的提示词，
+与论文主题无关的类型（及其示例）每次都要付 token。SchemaSelector 按论文保留相关部分：
+- 聚类信号：clustering/第三步few-shot动态抽取.py 写出的 paper_clusters.json 给出论文所属主题簇，
+  以及该簇标注中出现过的实体/关系类型
+- 关键词信号：类型名或其示例在论文中出现至少 min_hits 次
+- 核心类型：schema 中排在最前的 core 个实体/关系类型始终保留
+保留类型的示例最多 max_examples 个（优先论文中出现的）；列表字段（模式、负例）只保留关系被保留的条目。
+
+覆盖保护：以下情况改用全量 schema（与 _load_schema_text 逐字相同）：
+- 聚类与关键词命中的实体类型少于 min_evidence 个（论文主题不明确，裁剪容易漏类型）
+- 裁剪节省不足全量 schema 的 min_saving 比例（不值得改变提示词）
+- cluster 模式下论文不在聚类结果中
+
+注意：缓存布局（EXTRACT_PROMPT_LAYOUT=cache）下 schema 位于可复用前缀中，逐篇裁剪会让前缀
+各不相同；需要兼顾前缀缓存时用 cluster 模式，同簇论文得到相同的 schema。
+
+环境变量：
+- EXTRACT_SCHEMA_PRUNE: 0 关闭（默认）；1 / keyword 聚类 + 关键词；cluster 仅按聚类
+- EXTRACT_SCHEMA_CLUSTERS: paper_clusters.json 路径（未设置时只用关键词）
+- EXTRACT_SCHEMA_MIN_HITS（默认 2）/ EXTRACT_SCHEMA_CORE（默认 5）/ EXTRACT_SCHEMA_MAX_EXAMPLES（默认 2）
+- EXTRACT_SCHEMA_MIN_EVIDENCE（默认 3）/ EXTRACT_SCHEMA_MIN_SAVING（默认 0.15）
+"""
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+from .token_estimator import count_tokens
+
+DEFAULT_FIELDS = ("entity_types", "relation_types")
+
+
+def _env_number(name: str, default: float) -> float:
+    raw = os.getenv(name, "").strip()
+    try:
+        return float(raw) if raw else default
+    except ValueError:
+        print(f"⚠️  {name}={raw} 不是有效数字，已使用默认值 {default}")
+        return default
+
+
+def filter_fields(schema: Dict[str, Any], fields: Iterable[str]) -> Dict[str, Any]:
+    """按 EXTRACT_SCHEMA_FIELDS 的口径取字段；一个都没有时返回全量（与 _load_schema_text 一致）"""
+    filtered = {k: schema.get(k) for k in fields if k in schema}
+    return filtered or dict(schema)
+
+
+def schema_to_text(schema: Dict[str, Any]) -> str:
+    return json.dumps(schema, ensure_ascii=False, indent=2)
+
+
+def load_cluster_map(path: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    """读取 paper_clusters.json：{论文文件名: {"cluster", "entity_types", "relation_types"}}"""
+    if not path or not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError) as e:
+        print(f"⚠️  读取聚类结果失败（{path}），仅使用关键词：{e}")
+        return {}
+
+
+def _hits(text: str, terms: Iterable[str]) -> int:
+    return sum(text.count(t) for t in terms if t and len(t) >= 2)
+
+
+class SchemaSelector:
+    """
+    按论文裁剪 schema
+
+    Args:
+        schema: 完整 schema（phm_semantic_patterns.json）
+        fields: 注入提示词的字段（EXTRACT_SCHEMA_FIELDS）
+        mode: "keyword"（聚类 + 关键词）或 "cluster"（仅聚类）
+        cluster_map: load_cluster_map 的结果
+    """
+
+    def __init__(
+        self,
+        schema: Dict[str, Any],
+        fields: Iterable[str] = DEFAULT_FIELDS,
+        mode: str = "keyword",
+        cluster_map: Optional[Dict[str, Dict[str, Any]]] = None,
+        min_hits: int = 2,
+        core: int = 5,
+        max_examples: int = 2,
+        min_evidence: int = 3,
+        min_saving: float = 0.15,
+    ):
+        self.schema = filter_fields(schema, fields)
+        self.mode = mode
+        self.cluster_map = cluster_map or {}
+        self.min_hits = min_hits
+        self.core = core
+        self.max_examples = max_examples
+        self.min_evidence = min_evidence
+        self.min_saving = min_saving
+        self.full_text = schema_to_text(self.schema)
+        self.full_tokens = count_tokens(self.full_text)
+
+    def _full(self, reason: str) -> Dict[str, Any]:
+        return {
+            "text": self.full_text,
+            "mode": "full",
+            "reason": reason,
+            "cluster": None,
+            "entity_types": None,
+            "relation_types": None,
+            "tokens_full": self.full_tokens,
+            "tokens_selected": self.full_tokens,
+            "tokens_saved": 0,
+        }
+
+    def _matched_types(self, paper_text: str, cluster_info: Dict[str, Any]) -> tuple:
+        entity_types = self.schema.get("entity_types") or {}
+        relation_types = self.schema.get("relation_types") or {}
+        ents = {t for t in cluster_info.get("entity_types") or [] if t in entity_types}
+        rels = {t for t in cluster_info.get("relation_types") or [] if t in relation_types}
+        if self.mode != "cluster":
+            for name, spec in entity_types.items():
+                examples = spec.get("examples", []) if isinstance(spec, dict) else []
+                if _hits(paper_text, [name] + list(examples)) >= self.min_hits:
+                    ents.add(name)
+            for name in relation_types:
+                if _hits(paper_text, [name]) >= self.min_hits:
+                    rels.add(name)
+        return ents, rels
+
+    def _trim_examples(self, spec: Any, paper_text: str) -> Any:
+        if not isinstance(spec, dict) or not isinstance(spec.get("examples"), list):
+            return spec
+        examples = spec["examples"]
+        ordered = [e for e in examples if isinstance(e, str) and e in paper_text]
+        ordered += [e for e in examples if e not in ordered]
+        return dict(spec, examples=ordered[:self.max_examples])
+
+    def _prune(self, keep_ents: set, keep_rels: set, paper_text: str) -> Dict[str, Any]:
+        pruned: Dict[str, Any] = {}
+        for field, value in self.schema.items():
+            if field == "entity_types" and isinstance(value, dict):
+                pruned[field] = {k: self._trim_examples(v, paper_text) for k, v in value.items() if k in keep_ents}
+            elif field == "relation_types" and isinstance(value, dict):
+                pruned[field] = {k: v for k, v in value.items() if k in keep_rels}
+            elif isinstance(value, list):
+                pruned[field] = [
+                    item for item in value
+                    if not (isinstance(item, dict) and "relation" in item) or item["relation"] in keep_rels
+                ]
+            else:
+                pruned[field] = value
+        return pruned
+
+    def select(self, paper_file: str, paper_text: str) -> Dict[str, Any]:
+        """
+        为单篇论文选择 schema
+
+        Returns:
+            {"text", "mode": "pruned"|"full", "reason", "cluster", "entity_types", "relation_types",
+             "tokens_full", "tokens_selected", "tokens_saved"}
+        """
+        cluster_info = self.cluster_map.get(os.path.basename(paper_file)) or {}
+        if self.mode == "cluster" and not cluster_info:
+            return self._full("no_cluster")
+        ents, rels = self._matched_types(paper_text or "", cluster_info)
+        if len(ents) < self.min_evidence:
+            return self._full("low_evidence")
+        entity_types = list((self.schema.get("entity_types") or {}).keys())
+        relation_types = list((self.schema.get("relation_types") or {}).keys())
+        keep_ents = ents | set(entity_types[:self.core])
+        keep_rels = rels | set(relation_types[:self.core])
+        # cluster 模式下示例不按论文排序，保证同簇论文的 schema 逐字相同
+        text = schema_to_text(self._prune(keep_ents, keep_rels, "" if self.mode == "cluster" else paper_text or ""))
+        tokens = count_tokens(text)
+        saved = self.full_tokens - tokens
+        if self.full_tokens <= 0 or saved < self.full_tokens * self.min_saving:
+            return self._full("low_saving")
+        return {
+            "text": text,
+            "mode": "pruned",
+            "reason": "cluster" if self.mode == "cluster" else ("cluster+keyword" if cluster_info else "keyword"),
+            "cluster": cluster_info.get("cluster"),
+            "entity_types": [t for t in entity_types if t in keep_ents],
+            "relation_types": [t for t in relation_types if t in keep_rels],
+            "tokens_full": self.full_tokens,
+            "tokens_selected": tokens,
+            "tokens_saved": saved,
+        }
+
+
+def build_schema_selector(schema_file: str, fields: Optional[List[str]] = None) -> Optional[SchemaSelector]:
+    """按环境变量创建 SchemaSelector；未开启裁剪或 schema 缺失时返回 None（调用方使用全量 schema）"""
+    mode = os.getenv("EXTRACT_SCHEMA_PRUNE", "0").strip().lower()
+    if mode in {"", "0", "false", "no", "n"}:
+        return None
+    if mode in {"1", "true", "yes", "y"}:
+        mode = "keyword"
+    if mode not in {"keyword", "cluster"}:
+        raise ValueError(f"EXTRACT_SCHEMA_PRUNE 只能为 0 / 1 / keyword / cluster：{mode}")
+    if not os.path.isfile(schema_file):
+        return None
+    with open(schema_file, "r", encoding="utf-8") as f:
+        schema = json.load(f)
+    if fields is None:
+        wanted = os.getenv("EXTRACT_SCHEMA_FIELDS", ",".join(DEFAULT_FIELDS)).strip()
+        fields = [w.strip() for w in wanted.split(",") if w.strip()]
+    return SchemaSelector(
+        schema,
+        fields,
+        mode=mode,
+        cluster_map=load_cluster_map(os.getenv("EXTRACT_SCHEMA_CLUSTERS", "").strip()),
+        min_hits=int(_env_number("EXTRACT_SCHEMA_MIN_HITS", 2)),
+        core=int(_env_number("EXTRACT_SCHEMA_CORE", 5)),
+        max_examples=int(_env_number("EXTRACT_SCHEMA_MAX_EXAMPLES", 2)),
+        min_evidence=int(_env_number("EXTRACT_SCHEMA_MIN_EVIDENCE", 3)),
+        min_saving=_env_number("EXTRACT_SCHEMA_MIN_SAVING", 0.15),
+    )
+
+
+def format_schema_report(choices: List[Dict[str, Any]]) -> str:
+    """汇总一次运行的裁剪效果：裁剪篇数、回退篇数与节省 token"""
+    if not choices:
+        return ""
+    pruned = [c for c in choices if c["mode"] == "pruned"]
+    saved = sum(c["tokens_saved"] for c in choices)
+    reasons: Dict[str, int] = {}
+    for c in choices:
+        if c["mode"] == "full":
+            reasons[c["reason"]] = reasons.get(c["reason"], 0) + 1
+    fallback = "，".join(f"{k} {v}" for k, v in sorted(reasons.items()))
+    return (
+        f"裁剪 {len(pruned)}/{len(choices)} 篇，共节省约 {saved} tokens"
+        f"（平均 {saved / len(choices):.0f}/篇，全量 schema {choices[0]['tokens_full']} tokens）"
+        + (f"；回退全量：{fallback}" if fallback else "")
+    )
@@ -0,0 +1,161 @@
+"""
+流式抽取结果的增量 JSON 解析
+
+模型按 {"entities": [...], "relations": [...]} 输出时，边接收边解析两个数组中
+已完整输出的元素；输出被长度截断（finish_reason=length）时，已解析的元素仍可用，
+并可据此构造“续写”请求，只让模型补充尚未输出的部分。
+"""
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# 需要增量解析的顶层数组
+DEFAULT_ARRAY_KEYS = ("entities", "relations")
+
+
+class IncrementalExtractionParser:
+    """
+    增量解析器：feed() 任意切分的文本片段，实时得到顶层数组中已闭合的对象
+
+    Example:
+        >>> p = IncrementalExtractionParser()
+        >>> p.feed('{"entities": [{"name": "轴承", "ty')
+        >>> p.feed('pe": "设备"}, {"na')
+        >>> p.items["entities"]
+        [{'name': '轴承', 'type': '设备'}]
+    """
+
+    def __init__(self, array_keys: Tuple[str, ...] = DEFAULT_ARRAY_KEYS):
+        self.array_keys = tuple(array_keys)
+        self.items: Dict[str, List[Any]] = {k: [] for k in self.array_keys}
+        self.text = ""
+        self.first_item_ts: Optional[float] = None
+        self._pos = 0
+        self._depth = 0
+        self._in_str = False
+        self._escape = False
+        self._str_start = -1
+        self._last_key: Optional[str] = None   # 顶层对象中最近一个字符串（即将出现的键）
+        self._array_key: Optional[str] = None  # 当前所在的顶层数组
+        self._item_start = -1                  # 当前数组元素的起始位置
+        self._started = False
+
+    def feed(self, chunk: str) -> int:
+        """追加文本并解析，返回本次新增的完整元素数"""
+        if not chunk:
+            return 0
+        self.text += chunk
+        added = 0
+        s = self.text
+        i = self._pos
+        n = len(s)
+        while i < n:
+            ch = s[i]
+            if not self._started:
+                # 跳过代码围栏等前缀，直到顶层 '{'
+                if ch == "{":
+                    self._started = True
+                    self._depth = 1
+                i += 1
+                continue
+            if self._in_str:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_str = False
+                    if self._depth == 1:
+                        try:
+                            self._last_key = json.loads(s[self._str_start:i + 1])
+                        except ValueError:
+                            self._last_key = None
+                i += 1
+                continue
+            if ch == '"':
+                self._in_str = True
+                self._str_start = i
+            elif ch in "{[":
+                if self._depth == 1 and ch == "[" and self._last_key in self.items:
+                    self._array_key = self._last_key
+                elif self._depth == 2 and self._array_key is not None:
+                    self._item_start = i
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 2 and self._array_key is not None and self._item_start >= 0:
+                    try:
+                        self.items[self._array_key].append(json.loads(s[self._item_start:i + 1]))
+                        added += 1
+                        if self.first_item_ts is None:
+                            self.first_item_ts = time.time()
+                    except ValueError:
+                        pass
+                    self._item_start = -1
+                elif self._depth == 1:
+                    self._array_key = None
+            i += 1
+        self._pos = i
+        return added
+
+    @property
+    def item_count(self) -> int:
+        return sum(len(v) for v in self.items.values())
+
+    def result(self) -> Dict[str, List[Any]]:
+        """当前已解析的 {entities: [...], relations: [...]}"""
+        return {k: list(v) for k, v in self.items.items()}
+
+
+# ------------------------------
+# 合并与续写
+# ------------------------------
+def entity_key(e: Any) -> Tuple[str, str]:
+    """实体去重键：(名称小写, 类型)，兼容 name/text 两种字段"""
+    if not isinstance(e, dict):
+        return (str(e).strip().lower(), "")
+    name = str(e.get("name") or e.get("text") or "").strip().lower()
+    return (name, str(e.get("type") or "").strip())
+
+
+def relation_key(r: Any) -> Tuple[str, str, str]:
+    """关系去重键：(head, tail, 关系类型)，兼容 relation/type 两种字段"""
+    if not isinstance(r, dict):
+        return (str(r).strip(), "", "")
+    rel = r.get("relation") or r.get("type") or ""
+    return (str(r.get("head") or "").strip(), str(r.get("tail") or "").strip(), str(rel).strip())
+
+
+def merge_extractions(parts: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """按实体/关系去重键合并多段抽取结果（保持首次出现顺序）"""
+    merged: Dict[str, List[Any]] = {"entities": [], "relations": []}
+    seen_e, seen_r = set(), set()
+    for part in parts:
+        for e in part.get("entities") or []:
+            k = entity_key(e)
+            if k not in seen_e:
+                seen_e.add(k)
+                merged["entities"].append(e)
+        for r in part.get("relations") or []:
+            k = relation_key(r)
+            if k not in seen_r:
+                seen_r.add(k)
+                merged["relations"].append(r)
+    return merged
+
+
+def build_continuation_prompt(done: Dict[str, List[Any]]) -> str:
+    """
+    续写提示：列出已输出元素的紧凑标识（实体名、关系三元组），要求只补充剩余部分
+
+    只发送标识而非完整对象，可将续写请求的额外输入控制在很小的规模。
+    """
+    ent_ids = sorted({"|".join(k) for k in map(entity_key, done.get("entities") or [])})
+    rel_ids = sorted({"|".join(k) for k in map(relation_key, done.get("relations") or [])})
+    return (
+        "上一次输出因长度限制被截断。以下实体与关系已经输出（紧凑标识，实体为 名称|类型，关系为 头|尾|关系）：\n"
+        f"【已输出实体】{json.dumps(ent_ids, ensure_ascii=False)}\n"
+        f"【已输出关系】{json.dumps(rel_ids, ensure_ascii=False)}\n\n"
+        "请继续抽取：只输出尚未包含在上述列表中的实体和关系，格式与之前相同，"
+        "即一个完整、可解析的 JSON 对象 {\"entities\": [...], \"relations\": [...]}，不要重复已输出的内容。"
+    )
@@ -0,0 +1,366 @@
+"""
+token 计数与 max_tokens 规划
+
+- 提示词 token：优先使用本地分词器（tiktoken，或 EXTRACT_TOKENIZER_PATH 指定的 HF tokenizer.json），
+  均不可用时退回 rate_limiter.estimate_tokens 的粗略估算
+- 输出 token 预测：论文去空白字符数 × 实体/关系千字密度 × 每个实体/关系的平均输出 token
+  - 千字密度来自 density_生成统一千字密度表.py 生成的统一口径 CSV（按模型取加权均值）
+  - 每项 token 与密度兜底来自历史 ExtractionLogger 日志（completion_tokens / 实体关系数）
+- 规划：提交前为每篇选定 max_tokens；提示词超出上下文窗口时直接拒绝，并可汇总整次运行的预计 token
+
+环境变量：
+- EXTRACT_TOKENIZER: tiktoken 编码名（默认 cl100k_base）
+- EXTRACT_TOKENIZER_PATH: HF tokenizer.json 路径（设置后优先于 tiktoken）
+- EXTRACT_DENSITY_CSV: 覆盖千字密度表路径
+- <PROVIDER>_CONTEXT_WINDOW: 覆盖模型上下文窗口
+"""
+import os
+import re
+import csv
+import glob
+import json
+import math
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from .rate_limiter import estimate_tokens
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+
+# density_生成统一千字密度表.py 的默认输出位置（src/统计结果/按论文统计/）
+DEFAULT_DENSITY_CSV = REPO_ROOT / "src" / "统计结果" / "按论文统计" / "按论文模型_实体关系千字密度_统一口径.csv"
+
+# 没有任何历史数据时的兜底值（由实验三 DeepSeek 抽取日志粗略统计）
+DEFAULT_ENTITY_DENSITY = 2.1      # 每千字实体数
+DEFAULT_RELATION_DENSITY = 1.5    # 每千字关系数
+DEFAULT_TOKENS_PER_ITEM = 25.0    # 每个实体/关系的平均输出 token
+OUTPUT_OVERHEAD_TOKENS = 32       # JSON 外壳等固定开销
+
+# 各模型上下文窗口（token）；未列出的模型按 DEFAULT_CONTEXT_WINDOW
+CONTEXT_WINDOWS = {
+    "deepseek-chat": 65536,
+    "deepseek-reasoner": 65536,
+    "moonshot-v1-8k": 8192,
+    "moonshot-v1-32k": 32768,
+    "moonshot-v1-128k": 131072,
+    "gemini-2.5-pro": 1048576,
+    "gemini-2.5-flash": 1048576,
+}
+DEFAULT_CONTEXT_WINDOW = 32768
+
+
+# ------------------------------
+# 分词器
+# ------------------------------
+_COUNTER: Optional[Callable[[str], int]] = None
+_COUNTER_NAME = "estimate"
+_COUNTER_LOCK = threading.Lock()
+
+
+def _load_counter():
+    path = os.getenv("EXTRACT_TOKENIZER_PATH", "").strip()
+    if path:
+        try:
+            from tokenizers import Tokenizer
+            tok = Tokenizer.from_file(path)
+            return (lambda text: len(tok.encode(text).ids)), f"hf:{os.path.basename(path)}"
+        except Exception as e:
+            print(f"⚠️  加载 HF tokenizer 失败（{path}），改用 tiktoken/估算: {e}")
+    try:
+        import tiktoken
+        name = os.getenv("EXTRACT_TOKENIZER", "cl100k_base").strip() or "cl100k_base"
+        enc = tiktoken.get_encoding(name)
+        return (lambda text: len(enc.encode(text, disallowed_special=()))), f"tiktoken:{name}"
+    except Exception:
+        return estimate_tokens, "estimate"
+
+
+def count_tokens(text: str) -> int:
+    """用本地分词器计算 token 数（分词器不可用时为粗略估算）"""
+    global _COUNTER, _COUNTER_NAME
+    if _COUNTER is None:
+        with _COUNTER_LOCK:
+            if _COUNTER is None:
+                _COUNTER, _COUNTER_NAME = _load_counter()
+    return _COUNTER(text or "")
+
+
+def tokenizer_name() -> str:
+    """当前使用的分词器名称（用于日志）"""
+    count_tokens("")
+    return _COUNTER_NAME
+
+
+def count_messages_tokens(messages: Iterable[Dict[str, Any]]) -> int:
+    """计算一组 chat messages 的 prompt token 数（每条消息额外计 4 个格式 token）"""
+    total = 0
+    for msg in messages or []:
+        content = msg.get("content") if isinstance(msg, dict) else None
+        if isinstance(content, str):
+            total += count_tokens(content)
+        total += 4
+    return total
+
+
+# ------------------------------
+# 论文长度（与 density_生成统一千字密度表.py 的 clean_and_count 口径一致）
+# ------------------------------
+_CLEAN_PATTERNS = [
+    re.compile(r"```[\s\S]*?```", re.MULTILINE),
+    re.compile(r"`[^`]*`"),
+    re.compile(r"!\[[^\]]*\]\([^)]*\)"),
+    re.compile(r"\[[^\]]*\]\([^)]*\)"),
+    re.compile(r"^#+.*$", re.MULTILINE),
+    re.compile(r"^>.*$", re.MULTILINE),
+    re.compile(r"<[^>]+>"),
+    re.compile(r"[*_~]"),
+    re.compile(r"\s+"),
+]
+
+
+def clean_char_count(text: str) -> int:
+    """去 markdown 语法与全部空白后的字符数（千字密度的分母）"""
+    for pattern in _CLEAN_PATTERNS:
+        text = pattern.sub("", text or "")
+    return len(text)
+
+
+# ------------------------------
+# 输出 token 预测
+# ------------------------------
+def _to_float(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def load_density_table(csv_path: Optional[str] = None, model: Optional[str] = None) -> Optional[Dict[str, float]]:
+    """
+    读取统一口径千字密度表，返回按去空白字符数加权的 {entity_density, relation_density}
+
+    Args:
+        model: 仅统计该模型的行（CSV 的“模型”列，如 deepseek）；该模型无数据时用全部行
+    """
+    path = Path(csv_path or os.getenv("EXTRACT_DENSITY_CSV") or DEFAULT_DENSITY_CSV)
+    if not path.is_file():
+        return None
+    try:
+        with path.open("r", encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.DictReader(f))
+    except Exception as e:
+        print(f"⚠️  读取千字密度表失败（{path}）: {e}")
+        return None
+
+    def weighted(selected):
+        chars = ents = rels = 0.0
+        for row in selected:
+            n = _to_float(row.get("去空白字符数"))
+            e = _to_float(row.get("实体数量"))
+            r = _to_float(row.get("关系数量"))
+            if not n or e is None or r is None or (e == 0 and r == 0):
+                continue   # 未抽取成功的论文不计入
+            chars += n
+            ents += e
+            rels += r
+        if chars <= 0:
+            return None
+        return {"entity_density": ents * 1000 / chars, "relation_density": rels * 1000 / chars}
+
+    if model:
+        result = weighted([r for r in rows if (r.get("模型") or "").lower() == model.lower()])
+        if result:
+            return result
+    return weighted(rows)
+
+
+def load_usage_history(log_dir: str) -> List[Dict[str, Any]]:
+    """读取 ExtractionLogger 日志（extraction_log_*.json）中成功且非跳过/缓存命中的记录"""
+    records = []
+    for path in sorted(glob.glob(os.path.join(log_dir, "extraction_log_*.json"))):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            continue
+        for entry in data.get("logs") or []:
+            if not entry.get("success") or entry.get("skipped") or entry.get("cache_hit"):
+                continue
+            if not entry.get("completion_tokens"):
+                continue
+            records.append(entry)
+    return records
+
+
+class OutputTokenPredictor:
+    """
+    预测一篇论文的输出 token 数
+
+    预测值 = 去空白字符数 / 1000 × (实体千字密度 + 关系千字密度) × 每项平均 token + 固定开销
+    """
+
+    def __init__(
+        self,
+        entity_density: float = DEFAULT_ENTITY_DENSITY,
+        relation_density: float = DEFAULT_RELATION_DENSITY,
+        tokens_per_item: float = DEFAULT_TOKENS_PER_ITEM,
+        source: str = "default",
+    ):
+        self.entity_density = entity_density
+        self.relation_density = relation_density
+        self.tokens_per_item = tokens_per_item
+        self.source = source
+
+    @classmethod
+    def from_history(
+        cls,
+        log_dir: Optional[str] = None,
+        papers_dir: Optional[str] = None,
+        model: Optional[str] = None,
+        density_csv: Optional[str] = None,
+    ) -> "OutputTokenPredictor":
+        """
+        由千字密度表与历史抽取日志拟合参数；任一来源缺失时使用兜底值
+
+        Args:
+            log_dir: ExtractionLogger 日志目录（如 outputs/logs/deepseek）
+            papers_dir: 论文根目录（日志中的 paper 为相对其的路径），用于由日志反推千字密度
+            model: 千字密度表中的模型名
+        """
+        predictor = cls()
+        sources = []
+
+        records = load_usage_history(log_dir) if log_dir else []
+        items = sum((r.get("entity_count") or 0) + (r.get("relation_count") or 0) for r in records)
+        if items > 0:
+            completion = sum(r.get("completion_tokens") or 0 for r in records)
+            predictor.tokens_per_item = max(1.0, (completion - OUTPUT_OVERHEAD_TOKENS * len(records)) / items)
+            sources.append(f"logs({len(records)})")
+
+        density = load_density_table(density_csv, model)
+        if density is None and records and papers_dir:
+            # 无密度表时由日志中的实体/关系数与论文长度反推
+            chars = ents = rels = 0
+            for r in records:
+                paper_path = os.path.join(papers_dir, r.get("paper") or "")
+                if not os.path.isfile(paper_path):
+                    continue
+                with open(paper_path, "r", encoding="utf-8", errors="ignore") as f:
+                    chars += clean_char_count(f.read())
+                ents += r.get("entity_count") or 0
+                rels += r.get("relation_count") or 0
+            if chars > 0:
+                density = {"entity_density": ents * 1000 / chars, "relation_density": rels * 1000 / chars}
+        if density:
+            predictor.entity_density = density["entity_density"]
+            predictor.relation_density = density["relation_density"]
+            sources.append("density")
+
+        predictor.source = "+".join(sources) or "default"
+        return predictor
+
+    def predict(self, paper_text: str) -> int:
+        kchars = clean_char_count(paper_text) / 1000.0
+        items = kchars * (self.entity_density + self.relation_density)
+        return int(math.ceil(items * self.tokens_per_item)) + OUTPUT_OVERHEAD_TOKENS
+
+
+# ------------------------------
+# max_tokens 规划
+# ------------------------------
+def resolve_context_window(provider: str, model: str) -> int:
+    """模型上下文窗口：环境变量 <PROVIDER>_CONTEXT_WINDOW 优先，其次内置表"""
+    raw = os.getenv(f"{provider.upper()}_CONTEXT_WINDOW", "").strip()
+    if raw:
+        try:
+            return int(raw)
+        except ValueError:
+            print(f"⚠️  {provider.upper()}_CONTEXT_WINDOW={raw} 不是有效整数，已忽略")
+    return CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+
+
+class MaxTokensPlanner:
+    """
+    为每篇论文选定 max_tokens：预测输出 × margin，限制在 [floor, min(cap, 上下文剩余)] 内
+
+    Example:
+        >>> planner = MaxTokensPlanner("deepseek", "deepseek-chat", cap=8192,
+        ...                            predictor=OutputTokenPredictor.from_history(LOG_DIR, PAPERS_DIR, "deepseek"))
+        >>> plan = planner.plan(messages, paper_text)
+        >>> planner.check(plan)   # 超出上下文窗口时抛出 ValueError
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        model: str,
+        cap: int,
+        floor: int = 1024,
+        margin: float = 1.3,
+        predictor: Optional[OutputTokenPredictor] = None,
+    ):
+        self.provider = provider
+        self.model = model
+        self.cap = int(cap)
+        self.floor = int(floor)
+        self.margin = float(margin)
+        self.predictor = predictor or OutputTokenPredictor()
+        self.context_window = resolve_context_window(provider, model)
+
+    def plan(self, messages: List[Dict[str, Any]], paper_text: str, paper: str = "") -> Dict[str, Any]:
+        """
+        Returns:
+            {paper, prompt_tokens, predicted_output_tokens, max_tokens, max_allowed, context_window, fits}
+            max_allowed 为截断重试时 max_tokens 可放大到的上限（min(cap, 上下文剩余)）
+        """
+        prompt_tokens = count_messages_tokens(messages)
+        predicted = self.predictor.predict(paper_text)
+        room = self.context_window - prompt_tokens
+        max_allowed = min(self.cap, max(room, 0))
+        return {
+            "paper": paper,
+            "prompt_tokens": prompt_tokens,
+            "predicted_output_tokens": predicted,
+            "max_tokens": min(max(int(predicted * self.margin), self.floor), max_allowed),
+            "max_allowed": max_allowed,
+            "context_window": self.context_window,
+            "fits": room >= self.floor,
+        }
+
+    def check(self, plan: Dict[str, Any]) -> None:
+        """提示词（加最小输出预留）超出上下文窗口时抛出 ValueError，避免提交注定失败的请求"""
+        if not plan["fits"]:
+            raise ValueError(
+                f"提示词 {plan['prompt_tokens']} tokens + 最小输出 {self.floor} 超出 {self.model} 上下文窗口 "
+                f"{plan['context_window']}，已拒绝提交（可启用 EXTRACT_CHUNKED=1 分段抽取）"
+            )
+
+
+def summarize_plans(plans: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """汇总一次运行的预计 token（按 paper 归并分段窗口；任一窗口超窗的论文整篇不计入）"""
+    papers = {p["paper"] for p in plans}
+    rejected = {p["paper"] for p in plans if not p["fits"]}
+    ok = [p for p in plans if p["paper"] not in rejected]
+    prompt = sum(p["prompt_tokens"] for p in ok)
+    output = sum(p["predicted_output_tokens"] for p in ok)
+    return {
+        "papers": len(papers),
+        "rejected": len(rejected),
+        "rejected_papers": sorted(rejected),
+        "prompt_tokens": prompt,
+        "predicted_output_tokens": output,
+        "max_output_tokens": sum(p["max_tokens"] for p in ok),
+        "projected_total_tokens": prompt + output,
+    }
+
+
+def format_projection(summary: Dict[str, Any], name: str = "") -> str:
+    """把 summarize_plans 的结果格式化为一行摘要"""
+    prefix = f"{name} " if name else ""
+    return (
+        f"📐 {prefix}预计 token：{summary['papers']} 篇"
+        f"（拒绝 {summary['rejected']} 篇），提示词 {summary['prompt_tokens']:,}"
+        f" + 预计输出 {summary['predicted_output_tokens']:,}"
+        f" = {summary['projected_total_tokens']:,}（输出上限合计 {summary['max_output_tokens']:,}）"
+    )